@@ -0,0 +1,55 @@
+"""master_client_stats rollup table
+
+Агрегаты броней клиента у мастера (utils.master_client_stats). Таблица создаётся пустой:
+заполнить — python3 scripts/rebuild_master_client_stats.py --apply (до заполнения
+читатели считают по броням).
+
+Revision ID: 20260801_master_client_stats
+Revises: 20260721_account_deletion_fields
+Create Date: 2026-08-01
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "20260801_master_client_stats"
+down_revision: Union[str, None] = "20260721_account_deletion_fields"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    from sqlalchemy import inspect
+    conn = op.get_bind()
+    insp = inspect(conn)
+    if "master_client_stats" in insp.get_table_names():
+        return
+    op.create_table(
+        "master_client_stats",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("master_id", sa.Integer(), nullable=False),
+        sa.Column("client_id", sa.Integer(), nullable=False),
+        sa.Column("completed_count", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("cancelled_count", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("active_count", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("total_revenue", sa.Float(), nullable=False, server_default="0"),
+        sa.Column("last_visit_at", sa.DateTime(), nullable=True),
+        sa.Column("service_counts", sa.JSON(), nullable=True),
+        sa.Column("cancellation_counts", sa.JSON(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(["master_id"], ["masters.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["client_id"], ["users.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("master_id", "client_id", name="uq_master_client_stats_master_client"),
+    )
+    op.create_index(op.f("ix_master_client_stats_id"), "master_client_stats", ["id"], unique=False)
+    op.create_index("idx_master_client_stats_client", "master_client_stats", ["client_id"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index("idx_master_client_stats_client", table_name="master_client_stats")
+    op.drop_index(op.f("ix_master_client_stats_id"), table_name="master_client_stats")
+    op.drop_table("master_client_stats")
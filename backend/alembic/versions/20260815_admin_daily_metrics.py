@@ -0,0 +1,55 @@
+"""admin_daily_metrics rollup table
+
+Дневной rollup статистики админки (services.admin_daily_metrics). Таблица создаётся пустой:
+первое чтение статистики или фоновая задача при старте приложения заполняют её целиком.
+Индексы по updated_at нужны инкрементальному обновлению (изменения с прошлого прохода).
+
+Revision ID: 20260815_admin_daily_metrics
+Revises: 20260801_master_client_stats
+Create Date: 2026-08-15
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "20260815_admin_daily_metrics"
+down_revision: Union[str, None] = "20260801_master_client_stats"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    from sqlalchemy import inspect
+    conn = op.get_bind()
+    insp = inspect(conn)
+    if "admin_daily_metrics" not in insp.get_table_names():
+        op.create_table(
+            "admin_daily_metrics",
+            sa.Column("metric_date", sa.Date(), nullable=False),
+            sa.Column("users_created", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("users_active", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("users_by_role", sa.JSON(), nullable=True),
+            sa.Column("indie_masters", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("masters_created", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("bookings_total", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("bookings_by_status", sa.JSON(), nullable=True),
+            sa.Column("booking_duration_hours_sum", sa.Float(), nullable=False, server_default="0"),
+            sa.Column("bookings_with_duration", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("refreshed_at", sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint("metric_date"),
+        )
+    existing = {ix["name"] for ix in insp.get_indexes("bookings")}
+    if "ix_bookings_updated_at" not in existing:
+        op.create_index(op.f("ix_bookings_updated_at"), "bookings", ["updated_at"], unique=False)
+    existing = {ix["name"] for ix in insp.get_indexes("users")}
+    if "ix_users_updated_at" not in existing:
+        op.create_index(op.f("ix_users_updated_at"), "users", ["updated_at"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_users_updated_at"), table_name="users")
+    op.drop_index(op.f("ix_bookings_updated_at"), table_name="bookings")
+    op.drop_table("admin_daily_metrics")
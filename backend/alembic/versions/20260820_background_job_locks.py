@@ -0,0 +1,39 @@
+"""background_job_locks table
+
+Аренда фоновых задач между процессами uvicorn (services.job_runner).
+
+Revision ID: 20260820_background_job_locks
+Revises: 20260815_admin_daily_metrics
+Create Date: 2026-08-20
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "20260820_background_job_locks"
+down_revision: Union[str, None] = "20260815_admin_daily_metrics"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    from sqlalchemy import inspect
+    conn = op.get_bind()
+    insp = inspect(conn)
+    if "background_job_locks" in insp.get_table_names():
+        return
+    op.create_table(
+        "background_job_locks",
+        sa.Column("job_name", sa.String(length=64), nullable=False),
+        sa.Column("owner", sa.String(length=128), nullable=False),
+        sa.Column("locked_until", sa.DateTime(), nullable=False),
+        sa.Column("acquired_at", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("job_name"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("background_job_locks")
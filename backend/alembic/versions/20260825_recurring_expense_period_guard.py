@@ -0,0 +1,58 @@
+"""master_expenses: template_id + period_key for generated recurring expenses
+
+Разовый расход, порождённый циклическим шаблоном (services.recurring_expenses), хранит
+шаблон и начало периода; уникальный индекс не даёт создать второй расход за период.
+
+Revision ID: 20260825_recurring_expense_period_guard
+Revises: 20260820_background_job_locks
+Create Date: 2026-08-25
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "20260825_recurring_expense_period_guard"
+down_revision: Union[str, None] = "20260820_background_job_locks"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    is_sqlite = bind.dialect.name == "sqlite"
+    cols = {c["name"] for c in sa.inspect(bind).get_columns("master_expenses")}
+    # На SQLite без FK (ADD COLUMN, как в 20260219_master_restrict)
+    if "template_id" not in cols:
+        op.add_column("master_expenses", sa.Column("template_id", sa.Integer(), nullable=True))
+        if not is_sqlite:
+            op.create_foreign_key(
+                "fk_master_expenses_template_id",
+                "master_expenses",
+                "master_expenses",
+                ["template_id"],
+                ["id"],
+                ondelete="SET NULL",
+            )
+    if "period_key" not in cols:
+        op.add_column("master_expenses", sa.Column("period_key", sa.String(length=10), nullable=True))
+
+    indexes = {ix["name"] for ix in sa.inspect(bind).get_indexes("master_expenses")}
+    if "uq_master_expenses_template_period" not in indexes:
+        op.create_index(
+            "uq_master_expenses_template_period",
+            "master_expenses",
+            ["template_id", "period_key"],
+            unique=True,
+        )
+
+
+def downgrade() -> None:
+    bind = op.get_bind()
+    op.drop_index("uq_master_expenses_template_period", table_name="master_expenses")
+    if bind.dialect.name != "sqlite":
+        op.drop_constraint("fk_master_expenses_template_id", "master_expenses", type_="foreignkey")
+    op.drop_column("master_expenses", "period_key")
+    op.drop_column("master_expenses", "template_id")
@@ -0,0 +1,41 @@
+"""master_active_booking_counts: stored active future bookings per master
+
+Счётчик для лимита плана Free (utils.master_active_bookings). Таблица создаётся пустой:
+заполняется ежедневным мониторингом лимитов и при чтении (отсутствие строки — пересчёт).
+
+Revision ID: 20260901_master_active_booking_counts
+Revises: 20260825_recurring_expense_period_guard
+Create Date: 2026-09-01
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "20260901_master_active_booking_counts"
+down_revision: Union[str, None] = "20260825_recurring_expense_period_guard"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    from sqlalchemy import inspect
+    conn = op.get_bind()
+    insp = inspect(conn)
+    if "master_active_booking_counts" in insp.get_table_names():
+        return
+    op.create_table(
+        "master_active_booking_counts",
+        sa.Column("master_id", sa.Integer(), nullable=False),
+        sa.Column("active_future_bookings", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("next_start_time", sa.DateTime(), nullable=True),
+        sa.Column("refreshed_at", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(["master_id"], ["masters.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("master_id"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("master_active_booking_counts")
@@ -0,0 +1,44 @@
+"""bookings: composite indexes for owner/client + start_time access paths
+
+Почти все горячие запросы по броням фильтруют по владельцу (master_id | indie_master_id) и
+периоду start_time (+ status) или по клиенту и периоду: слоты, дашборд, будущие записи, клиенты,
+ограничения, лимиты. Без составных индексов это полный просмотр bookings.
+Проверка планов — scripts/benchmark_booking_queries.py.
+
+Revision ID: 20260910_booking_composite_indexes
+Revises: 20260901_master_active_booking_counts
+Create Date: 2026-09-10
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "20260910_booking_composite_indexes"
+down_revision: Union[str, None] = "20260901_master_active_booking_counts"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+_INDEXES = (
+    ("ix_bookings_master_start_status", ["master_id", "start_time", "status"]),
+    ("ix_bookings_indie_master_start_status", ["indie_master_id", "start_time", "status"]),
+    ("ix_bookings_client_start", ["client_id", "start_time"]),
+)
+
+
+def upgrade() -> None:
+    insp = sa.inspect(op.get_bind())
+    idx_names = {ix["name"] for ix in insp.get_indexes("bookings")}
+    for name, cols in _INDEXES:
+        if name not in idx_names:
+            op.create_index(name, "bookings", cols, unique=False)
+
+
+def downgrade() -> None:
+    insp = sa.inspect(op.get_bind())
+    idx_names = {ix["name"] for ix in insp.get_indexes("bookings")}
+    for name, _ in reversed(_INDEXES):
+        if name in idx_names:
+            op.drop_index(name, table_name="bookings")
@@ -4,13 +4,14 @@ from typing import Optional
 from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer, HTTPBearer, HTTPAuthorizationCredentials
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from sqlalchemy.orm import Session
 
 from database import get_db
 from models import User, UserRole
 from schemas import TokenData
 from settings import get_settings
+from utils.auth_user_cache import auth_user_cache
+from utils.password_hashing import PasswordHashingBusy, password_hasher
 
 _conf = get_settings()
 SECRET_KEY = _conf.JWT_SECRET_KEY
@@ -19,17 +20,47 @@ ACCESS_TOKEN_EXPIRE_DAYS = _conf.ACCESS_TOKEN_EXPIRE_DAYS
 REFRESH_TOKEN_EXPIRE_DAYS = _conf.REFRESH_TOKEN_EXPIRE_DAYS
 ACCESS_TOKEN_EXPIRE_MINUTES = ACCESS_TOKEN_EXPIRE_DAYS * 24 * 60
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = password_hasher.context
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 http_bearer_optional = HTTPBearer(auto_error=False)
 
 
+def _password_hashing_busy() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Сервер перегружен, повторите попытку через несколько секунд",
+        headers={"Retry-After": "1"},
+    )
+
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    try:
+        return password_hasher.verify(plain_password, hashed_password)
+    except PasswordHashingBusy:
+        raise _password_hashing_busy()
+
+
+def verify_password_and_update(plain_password: str, hashed_password: str) -> tuple[bool, Optional[str]]:
+    """Проверка пароля при входе; второй элемент — новый хэш, если сменилась стоимость bcrypt."""
+    try:
+        return password_hasher.verify_and_update(plain_password, hashed_password)
+    except PasswordHashingBusy:
+        raise _password_hashing_busy()
 
 
 def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+    try:
+        return password_hasher.hash(password)
+    except PasswordHashingBusy:
+        raise _password_hashing_busy()
+
+
+async def get_password_hash_async(password: str) -> str:
+    """Для async-эндпоинтов: хэш считается в пуле, event loop не блокируется."""
+    try:
+        return await password_hasher.hash_async(password)
+    except PasswordHashingBusy:
+        raise _password_hashing_busy()
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
@@ -67,6 +98,16 @@ def resolve_user_from_token_sub(db: Session, sub: Optional[str]) -> Optional[Use
     return db.query(User).filter((User.email == s) | (User.phone == s)).first()
 
 
+def resolve_user_from_token_sub_cached(db: Session, sub: Optional[str]) -> Optional[User]:
+    """
+    То же, что resolve_user_from_token_sub, через процессный кэш (utils.auth_user_cache):
+    повторные запросы с тем же sub не читают User из БД.
+    """
+    if not sub:
+        return None
+    return auth_user_cache.get_or_resolve(db, str(sub).strip(), lambda: resolve_user_from_token_sub(db, sub))
+
+
 def _reject_if_deleted_or_inactive(user: Optional[User]) -> User:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -80,7 +121,9 @@ def _reject_if_deleted_or_inactive(user: Optional[User]) -> User:
     return user
 
 
-async def get_current_user(
+# get_current_user, get_current_user_optional и permission_checker — обычные def: FastAPI выполняет
+# их в threadpool, запрос пользователя к БД не блокирует event loop
+def get_current_user(
     token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)
 ) -> User:
     credentials_exception = HTTPException(
@@ -96,11 +139,11 @@ async def get_current_user(
     except JWTError:
         raise credentials_exception
 
-    user = resolve_user_from_token_sub(db, sub)
+    user = resolve_user_from_token_sub_cached(db, sub)
     return _reject_if_deleted_or_inactive(user)
 
 
-async def get_current_user_optional(
+def get_current_user_optional(
     creds: Optional[HTTPAuthorizationCredentials] = Depends(http_bearer_optional),
     db: Session = Depends(get_db),
 ) -> Optional[User]:
@@ -112,7 +155,7 @@ async def get_current_user_optional(
         sub = payload.get("sub")
         if not sub:
             return None
-        user = resolve_user_from_token_sub(db, sub)
+        user = resolve_user_from_token_sub_cached(db, sub)
         if user is None or getattr(user, "deleted_at", None) is not None or not user.is_active:
             return None
         return user
@@ -172,7 +215,7 @@ def require_admin_or_moderator():
 
 
 def require_moderator_permission(permission_name: str):
-    async def permission_checker(
+    def permission_checker(
         current_user: User = Depends(get_current_active_user),
         db: Session = Depends(get_db)
     ):
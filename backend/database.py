@@ -1,21 +1,140 @@
+import logging
 from pathlib import Path
+from typing import Any, Dict, List
 
-from sqlalchemy import create_engine
+import sqlite3
+
+from fastapi import Depends
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 
+from db_pool import MeteredQueuePool
 from settings import get_settings
 
+logger = logging.getLogger(__name__)
+
 BASE_DIR = Path(__file__).resolve().parent
 SQLALCHEMY_DATABASE_URL = get_settings().DATABASE_URL
+SQLALCHEMY_READ_DATABASE_URL = get_settings().DATABASE_READ_URL.strip()
+
+@event.listens_for(Engine, "connect")
+def _sqlite_unicode_lower(dbapi_connection, connection_record):
+    """Встроенный lower() в SQLite меняет регистр только у ASCII — поиск по кириллице
+    (lower/ilike) вёл бы себя иначе, чем в PostgreSQL. Подменяем на str.lower."""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.create_function(
+            "lower", 1, lambda value: value.lower() if isinstance(value, str) else value, deterministic=True
+        )
+
+
+def _is_sqlite_memory(url) -> bool:
+    database = url.database or ""
+    return not database or database == ":memory:" or "mode=memory" in str(url)
+
 
-# Создаем движок SQLAlchemy
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+def _sqlite_pragmas(engine: Engine, *, wal: bool, busy_timeout_ms: int, read_only: bool = False) -> None:
+    """WAL: чтение не ждёт записи; synchronous=NORMAL безопасен в WAL и без fsync на каждый коммит."""
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            if wal:
+                cursor.execute("PRAGMA journal_mode=WAL")
+                cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute(f"PRAGMA busy_timeout={int(busy_timeout_ms)}")
+            if read_only:
+                cursor.execute("PRAGMA query_only=ON")
+        finally:
+            cursor.close()
+
+
+def create_app_engine(
+    database_url: str,
+    *,
+    pool_size: int,
+    max_overflow: int,
+    statement_timeout_ms: int = 0,
+    read_only: bool = False,
+) -> Engine:
+    """
+    Движок с явным пулом (MeteredQueuePool: метрики ожидания соединения) по настройкам DB_*.
+    PostgreSQL — statement_timeout на соединение; SQLite — WAL и busy_timeout
+    (in-memory SQLite остаётся на пуле SQLAlchemy по умолчанию).
+    read_only — для реплики: запись в сессии этого движка падает ошибкой, а не уходит молча.
+    """
+    s = get_settings()
+    url = make_url(database_url)
+    kwargs: Dict[str, Any] = {"pool_pre_ping": s.DB_POOL_PRE_PING}
+    connect_args: Dict[str, Any] = {}
+    is_sqlite = url.get_backend_name() == "sqlite"
+    if is_sqlite:
+        connect_args["check_same_thread"] = False
+    else:
+        options: List[str] = []
+        if statement_timeout_ms > 0:
+            options.append(f"-c statement_timeout={int(statement_timeout_ms)}")
+        if read_only:
+            options.append("-c default_transaction_read_only=on")
+        if options:
+            connect_args["options"] = " ".join(options)
+    if not (is_sqlite and _is_sqlite_memory(url)):
+        kwargs.update(
+            poolclass=MeteredQueuePool,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_timeout=s.DB_POOL_TIMEOUT_SECONDS,
+            pool_recycle=s.DB_POOL_RECYCLE_SECONDS,
+        )
+    engine = create_engine(database_url, connect_args=connect_args, **kwargs)
+    if is_sqlite:
+        _sqlite_pragmas(
+            engine,
+            wal=s.DB_SQLITE_WAL and not _is_sqlite_memory(url) and not read_only,
+            busy_timeout_ms=s.DB_SQLITE_BUSY_TIMEOUT_MS,
+            read_only=read_only,
+        )
+    return engine
+
+
+# Создаем движок SQLAlchemy: пул для HTTP-запросов
+engine = create_app_engine(
+    SQLALCHEMY_DATABASE_URL,
+    pool_size=get_settings().DB_POOL_SIZE,
+    max_overflow=get_settings().DB_MAX_OVERFLOW,
+    statement_timeout_ms=get_settings().DB_STATEMENT_TIMEOUT_MS,
+)
+# Отдельный пул фоновых задач (services/*): пакетная работа не забирает соединения HTTP
+background_engine = create_app_engine(
+    SQLALCHEMY_DATABASE_URL,
+    pool_size=get_settings().DB_BACKGROUND_POOL_SIZE,
+    max_overflow=get_settings().DB_BACKGROUND_MAX_OVERFLOW,
+    statement_timeout_ms=get_settings().DB_BACKGROUND_STATEMENT_TIMEOUT_MS,
+)
+
+# Реплика для отчётов (get_read_db); None — отчёты читают основную БД
+read_engine = (
+    create_app_engine(
+        SQLALCHEMY_READ_DATABASE_URL,
+        pool_size=get_settings().DB_POOL_SIZE,
+        max_overflow=get_settings().DB_MAX_OVERFLOW,
+        statement_timeout_ms=get_settings().DB_STATEMENT_TIMEOUT_MS,
+        read_only=True,
+    )
+    if SQLALCHEMY_READ_DATABASE_URL
+    else None
 )
 
 # Создаем фабрику сессий
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+BackgroundSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=background_engine)
+ReadSessionLocal = (
+    sessionmaker(autocommit=False, autoflush=False, bind=read_engine) if read_engine is not None else None
+)
 
 # Создаем базовый класс для моделей
 Base = declarative_base()
@@ -27,3 +146,39 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+def get_read_db(db: Session = Depends(get_db)):
+    """
+    Сессия только для чтения для статистики и отчётов: реплика (DATABASE_READ_URL), если настроена
+    и доступна, иначе — сессия основной БД этого запроса (та же, что у get_db).
+    Данные реплики могут отставать на время репликации; проверки доступа, которые могут писать
+    (например, автосоздание подписки), выполняются на основной БД.
+    """
+    if ReadSessionLocal is None:
+        yield db
+        return
+    read_db = ReadSessionLocal()
+    try:
+        read_db.connection()
+    except OperationalError as e:
+        logger.warning("Реплика для чтения недоступна, отчёт читает основную БД: %s", e)
+        read_db.close()
+        yield db
+        return
+    try:
+        yield read_db
+    finally:
+        read_db.close()
+
+
+def pool_metrics() -> Dict[str, Any]:
+    """Состояние пулов процесса и ожидание выдачи соединений (GET /api/admin/db-pool)."""
+    result = {}
+    engines = [("http", engine), ("background", background_engine)]
+    if read_engine is not None:
+        engines.append(("read", read_engine))
+    for name, eng in engines:
+        pool = eng.pool
+        result[name] = pool.snapshot() if isinstance(pool, MeteredQueuePool) else {"status": pool.status()}
+    return result
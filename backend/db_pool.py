@@ -0,0 +1,92 @@
+"""
+Пул соединений с метриками ожидания checkout.
+
+MeteredQueuePool — QueuePool, который замеряет, сколько поток ждал свободное соединение:
+при исчерпании pool_size + max_overflow запросы встают в очередь пула (до pool_timeout), и
+именно это ожидание выглядит снаружи как «медленная БД». PoolMetrics копит число выдач,
+ожиданий, таймаутов, суммарное/максимальное время ожидания; snapshot() добавляет текущее
+состояние пула (занято, overflow). Метрики пулов процесса отдаёт GET /api/admin/db-pool.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any, Dict
+
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+# Ожидание короче порога — обычная выдача из пула, не считается ожиданием
+_WAIT_THRESHOLD_SECONDS = 0.001
+
+
+class PoolMetrics:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def record(self, waited: float, timed_out: bool = False) -> None:
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            if waited >= _WAIT_THRESHOLD_SECONDS or timed_out:
+                self.waits += 1
+                self.wait_seconds_total += waited
+                self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.checkouts = self.waits = self.timeouts = 0
+            self.wait_seconds_total = self.wait_seconds_max = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "timeouts": self.timeouts,
+                "wait_ms_total": round(self.wait_seconds_total * 1000, 3),
+                "wait_ms_avg": round(self.wait_seconds_total * 1000 / self.waits, 3) if self.waits else 0.0,
+                "wait_ms_max": round(self.wait_seconds_max * 1000, 3),
+            }
+
+
+class MeteredQueuePool(QueuePool):
+    """QueuePool с замером ожидания соединения; метрики переживают recreate() пула."""
+
+    def __init__(self, *args: Any, metrics: PoolMetrics | None = None, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.metrics = metrics or PoolMetrics()
+
+    def _do_get(self) -> Any:
+        started = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except PoolTimeoutError:
+            self.metrics.record(time.perf_counter() - started, timed_out=True)
+            raise
+        self.metrics.record(time.perf_counter() - started)
+        return conn
+
+    def recreate(self) -> "MeteredQueuePool":
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "size": self.size(),
+            "checked_out": self.checkedout(),
+            "idle": self.checkedin(),
+            "overflow": max(0, self.overflow()),
+            "max_overflow": self._max_overflow,
+            "timeout_seconds": self.timeout(),
+            **self.metrics.as_dict(),
+        }
@@ -20,8 +20,12 @@ from services.recurring_expenses import run_recurring_expenses_task
 from services.bookings_limit_monitor import run_bookings_limit_monitor_task
 from services.temporary_bookings_cleanup import run_temporary_bookings_cleanup_task
 from services.expired_payments_cleanup import run_expired_payments_cleanup_task
+from services.admin_daily_metrics import run_admin_daily_metrics_task
+from services.job_runner import job_runner
+from utils.password_hashing import password_hasher
 from spa_catchall_route import SpaCatchAllAPIRoute
-from route_diagnostics import log_app_entrypoint_hint, log_route_diagnostics
+from route_diagnostics import log_app_entrypoint_hint, log_event_loop_db_routes, log_route_diagnostics
+from sql_instrumentation import SQLInstrumentationMiddleware
 
 # Создаем таблицы в базе данных
 Base.metadata.create_all(bind=engine)
@@ -148,6 +152,10 @@ else:
         allow_headers=["*"],
     )
 
+# Учёт SQL по запросам (Server-Timing, медленные запросы, GET /api/admin/sql-stats); внешний слой
+if get_settings().SQL_INSTRUMENTATION_ENABLED:
+    app.add_middleware(SQLInstrumentationMiddleware)
+
 # Загрузки: запись в master.py идёт в uploads/photos относительно cwd процесса — тот же каталог, что и mount
 os.makedirs(os.path.join("uploads", "photos"), exist_ok=True)
 os.makedirs(os.path.join("uploads", "logos"), exist_ok=True)
@@ -202,6 +210,7 @@ if _settings.dev_e2e:
 @app.on_event("startup")
 async def startup_event():
     log_route_diagnostics(app)
+    log_event_loop_db_routes(app)
     log_app_entrypoint_hint()
     # Лог конфигурации при старте (без секретов); legacy-предупреждения — один раз
     try:
@@ -224,6 +233,8 @@ async def startup_event():
     app.state.temporary_bookings_cleanup_task = asyncio.create_task(run_temporary_bookings_cleanup_task())
     # Запускаем фоновую задачу TTL cleanup брошенных Robokassa subscription payments
     app.state.expired_payments_cleanup_task = asyncio.create_task(run_expired_payments_cleanup_task())
+    # Запускаем фоновую задачу обновления дневного rollup статистики админки
+    app.state.admin_daily_metrics_task = asyncio.create_task(run_admin_daily_metrics_task())
 
 
 @app.on_event("shutdown")
@@ -269,6 +280,18 @@ async def shutdown_event():
         except asyncio.CancelledError:
             pass
 
+    admin_daily_metrics_task = getattr(app.state, "admin_daily_metrics_task", None)
+    if admin_daily_metrics_task:
+        admin_daily_metrics_task.cancel()
+        try:
+            await admin_daily_metrics_task
+        except asyncio.CancelledError:
+            pass
+
+    # Пул фоновых задач: новые не берём, идущие дорабатывают в своих потоках
+    job_runner.shutdown()
+    password_hasher.shutdown()
+
 
 @app.get("/")
 def read_root():
@@ -72,7 +72,7 @@ class User(Base):
     pending_email = Column(String, nullable=True)
     is_always_free = Column(Boolean, default=False)  # Всегда бесплатно - все платные функции доступны
     created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
 
     # Связи
     master_profile = relationship("Master", back_populates="user", uselist=False)
@@ -265,6 +265,80 @@ class MasterClientMetadata(Base):
     )
 
 
+class MasterClientStats(Base):
+    """
+    Агрегаты броней клиента у мастера (по Booking.master_id). Пересчитываются в транзакции
+    изменения брони (utils.master_client_stats); пересборка — scripts/rebuild_master_client_stats.py.
+    """
+    __tablename__ = "master_client_stats"
+
+    id = Column(Integer, primary_key=True, index=True)
+    master_id = Column(Integer, ForeignKey("masters.id", ondelete="CASCADE"), nullable=False)
+    client_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    completed_count = Column(Integer, nullable=False, default=0)
+    cancelled_count = Column(Integer, nullable=False, default=0)  # cancelled + cancelled_by_client_*
+    active_count = Column(Integer, nullable=False, default=0)  # все, кроме отменённых и payment_expired
+    total_revenue = Column(Float, nullable=False, default=0.0)  # деньги по completed (без баллов)
+    last_visit_at = Column(DateTime, nullable=True)  # max(start_time) completed
+    service_counts = Column(JSON, nullable=True)  # {"service_id": count} completed
+    cancellation_counts = Column(JSON, nullable=True)  # {status: {reason: count}}
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("master_id", "client_id", name="uq_master_client_stats_master_client"),
+        Index("idx_master_client_stats_client", "client_id"),
+    )
+
+
+class MasterActiveBookingCount(Base):
+    """
+    Число активных будущих записей мастера для лимита плана (utils.master_active_bookings).
+    Заполняется ежедневным мониторингом лимитов (services.bookings_limit_monitor) одним GROUP BY;
+    строка удаляется после коммита изменения брони мастера.
+    """
+    __tablename__ = "master_active_booking_counts"
+
+    master_id = Column(Integer, ForeignKey("masters.id", ondelete="CASCADE"), primary_key=True)
+    active_future_bookings = Column(Integer, nullable=False, default=0)
+    # Ближайшая активная будущая запись: после её начала счётчик устаревает
+    next_start_time = Column(DateTime, nullable=True)
+    refreshed_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+class AdminDailyMetrics(Base):
+    """
+    Дневной rollup для статистики админки (services.admin_daily_metrics): пользователи — по дню
+    created_at, брони — по дню start_time. Сумма строк = итоги по таблицам users/bookings;
+    записи без даты собираются в строку UNDATED (1970-01-01).
+    """
+    __tablename__ = "admin_daily_metrics"
+
+    metric_date = Column(Date, primary_key=True)
+    users_created = Column(Integer, nullable=False, default=0)
+    users_active = Column(Integer, nullable=False, default=0)
+    users_by_role = Column(JSON, nullable=True)  # {role: count}
+    indie_masters = Column(Integer, nullable=False, default=0)  # role=master + can_work_independently
+    masters_created = Column(Integer, nullable=False, default=0)
+    bookings_total = Column(Integer, nullable=False, default=0)
+    bookings_by_status = Column(JSON, nullable=True)  # {status: count}
+    booking_duration_hours_sum = Column(Float, nullable=False, default=0.0)
+    bookings_with_duration = Column(Integer, nullable=False, default=0)
+    refreshed_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class BackgroundJobLock(Base):
+    """
+    Аренда фоновой задачи между процессами (services.job_runner): задачу выполняет владелец
+    непросроченной аренды, остальные воркеры uvicorn пропускают запуск.
+    """
+    __tablename__ = "background_job_locks"
+
+    job_name = Column(String(64), primary_key=True)
+    owner = Column(String(128), nullable=False)
+    locked_until = Column(DateTime, nullable=False)
+    acquired_at = Column(DateTime, nullable=True)
+
+
 class IndieMaster(Base):
     __tablename__ = "indie_masters"
 
@@ -345,7 +419,15 @@ class Booking(Base):
     public_reference = Column(String(20), unique=True, index=True, nullable=False)
     
     created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+
+    # Горячие пути: слоты, дашборд, будущие записи, лимиты — владелец + период (+ статус);
+    # клиенты и ограничения — клиент + период (scripts/benchmark_booking_queries.py)
+    __table_args__ = (
+        Index('ix_bookings_master_start_status', 'master_id', 'start_time', 'status'),
+        Index('ix_bookings_indie_master_start_status', 'indie_master_id', 'start_time', 'status'),
+        Index('ix_bookings_client_start', 'client_id', 'start_time'),
+    )
 
     client = relationship("User", back_populates="bookings", foreign_keys=[client_id])
     service = relationship("Service", back_populates="bookings")
@@ -2067,6 +2149,10 @@ class MasterExpense(Base):
     
     # Для разовых расходов
     expense_date = Column(DateTime)
+
+    # Разовый расход, порождённый циклическим шаблоном: шаблон и начало периода (YYYY-MM-DD)
+    template_id = Column(Integer, ForeignKey("master_expenses.id", ondelete="SET NULL"), nullable=True)
+    period_key = Column(String(10), nullable=True)
     
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -2082,6 +2168,7 @@ class MasterExpense(Base):
         Index('idx_master_expenses_expense_type', 'expense_type'),
         Index('idx_master_expenses_expense_date', 'expense_date'),
         Index('idx_master_expenses_service_id', 'service_id'),
+        Index('uq_master_expenses_template_period', 'template_id', 'period_key', unique=True),
     )
 
 
@@ -4,14 +4,20 @@
 Включение: DEDATO_DEBUG_ROUTES=1 (по умолчанию выключено).
 
 Дополнительно: DEDATO_LOG_ENTRYPOINT=1 — одна строка с командой запуска uvicorn.
+
+Всегда: log_event_loop_db_routes — предупреждение об async-маршрутах с синхронной сессией БД,
+которые выполняются в event loop (см. threadpool_db_route.py).
 """
 
 from __future__ import annotations
 
+import asyncio
 import logging
 import os
 from typing import Any
 
+from fastapi.routing import APIRoute
+
 _log = logging.getLogger("uvicorn.error")
 
 
@@ -51,6 +57,47 @@ def log_route_diagnostics(app: Any) -> None:
     )
 
 
+def _event_loop_db_calls(dependant: Any) -> list[str]:
+    """async-вызовы в дереве зависимостей, которые напрямую получают синхронную сессию."""
+    from threadpool_db_route import SYNC_DB_DEPENDENCIES
+
+    found: list[str] = []
+    if asyncio.iscoroutinefunction(dependant.call) and any(
+        dep.call in SYNC_DB_DEPENDENCIES for dep in dependant.dependencies
+    ):
+        found.append(f"{dependant.call.__module__}.{dependant.call.__qualname__}")
+    for dep in dependant.dependencies:
+        found.extend(_event_loop_db_calls(dep))
+    return found
+
+
+def find_event_loop_db_routes(app: Any) -> list[tuple[str, list[str], list[str]]]:
+    """
+    Маршруты, где async-эндпоинт или async-зависимость напрямую получает синхронную сессию
+    (Depends(get_db)) и выполняется в event loop: роутер без ThreadpoolDBRoute, эндпоинт помечен
+    @keep_on_event_loop или async-зависимость делает запросы к БД.
+    """
+    found: list[tuple[str, list[str], list[str]]] = []
+    for route in app.routes:
+        if not isinstance(route, APIRoute):
+            continue
+        calls = _event_loop_db_calls(route.dependant)
+        if calls:
+            found.append((route.path, sorted(route.methods or []), sorted(set(calls))))
+    return found
+
+
+def log_event_loop_db_routes(app: Any) -> None:
+    routes = find_event_loop_db_routes(app)
+    if not routes:
+        return
+    _log.warning(
+        "Async routes run synchronous DB work on the event loop (use ThreadpoolDBRoute): %s [path, methods, callables]: %s",
+        len(routes),
+        routes,
+    )
+
+
 def log_app_entrypoint_hint() -> None:
     if os.environ.get("DEDATO_LOG_ENTRYPOINT", "").strip().lower() not in ("1", "true", "yes"):
         return
@@ -4,16 +4,17 @@
 import logging
 from datetime import datetime, timedelta, date
 from typing import Optional, List
-from io import BytesIO
-import csv
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font, PatternFill, Alignment
 
-from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import func, desc, and_, or_, case
+from sqlalchemy import Integer, String, func, desc, and_, or_, case, literal, select, union_all
 
-from database import get_db
+from database import get_db, get_read_db
+from threadpool_db_route import ThreadpoolDBRoute
 from models import (
     User, Master, IndieMaster, MasterExpense, BookingConfirmation, Booking, Income,
     Service, BookingStatus, TaxRate, MasterClientMetadata
@@ -23,8 +24,16 @@ from utils.booking_loyalty_reserve import clear_loyalty_points_reserve
 from utils.client_display_name import get_client_display_name, get_meta_for_client, strip_indie_service_prefix
 from utils.subscription_features import has_finance_access
 from utils.booking_real_money import booking_amount_to_pay, booking_money_api_fields, booking_real_money_sql
+from utils.streaming_export import (
+    CSV_MEDIA_TYPE,
+    EXPORT_YIELD_PER,
+    XLSX_MEDIA_TYPE,
+    close_session_after,
+    iter_csv,
+    iter_xlsx,
+)
 
-router = APIRouter(prefix="/api/master/accounting", tags=["accounting"])
+router = APIRouter(prefix="/api/master/accounting", tags=["accounting"], route_class=ThreadpoolDBRoute)
 
 
 def _ensure_finance_access(db: Session, user_id: int) -> None:
@@ -692,10 +701,12 @@ async def get_accounting_summary(
     window_before: Optional[int] = Query(None, ge=0, le=31),
     window_after: Optional[int] = Query(None, ge=0, le=31),
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db),
+    primary_db: Session = Depends(get_db),
 ):
-    """Получить сводку доходов/расходов с данными для графиков"""
-    _ensure_finance_access(db, current_user.id)
+    """Получить сводку доходов/расходов с данными для графиков (читает с реплики, если настроена)"""
+    # Проверка доступа — на основной БД: может создать подписку AlwaysFree
+    _ensure_finance_access(primary_db, current_user.id)
     try:
         had_explicit_date_range = start_date is not None and end_date is not None
         # Определяем даты периода (единый контракт с dashboard/stats)
@@ -1147,161 +1158,165 @@ async def cancel_all_bookings(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+_EXPORT_HEADERS = ["Дата", "Тип операции", "Название", "Доход", "Расход", "Баланс"]
+
+
+def _export_operations_stmt(master_id: int, start_date: datetime, end_date: datetime):
+    """
+    Доходы и расходы одним запросом: UNION ALL, порядок (новые сверху) — в БД.
+    При равном времени доход идёт раньше расхода, как было при сортировке в Python.
+    """
+    incomes = select(
+        BookingConfirmation.confirmed_at.label("at"),
+        literal(0).label("kind"),
+        BookingConfirmation.id.label("row_id"),
+        BookingConfirmation.booking_id.label("booking_id"),
+        literal(None, String).label("name"),
+        BookingConfirmation.confirmed_income.label("income"),
+        literal(0.0).label("expense"),
+    ).where(
+        BookingConfirmation.master_id == master_id,
+        BookingConfirmation.confirmed_at >= start_date,
+        BookingConfirmation.confirmed_at <= end_date,
+    )
+    expenses = select(
+        MasterExpense.expense_date.label("at"),
+        literal(1).label("kind"),
+        MasterExpense.id.label("row_id"),
+        literal(None, Integer).label("booking_id"),
+        MasterExpense.name.label("name"),
+        literal(0.0).label("income"),
+        MasterExpense.amount.label("expense"),
+    ).where(
+        MasterExpense.master_id == master_id,
+        MasterExpense.expense_date >= start_date,
+        MasterExpense.expense_date <= end_date,
+    )
+    operations = union_all(incomes, expenses).subquery()
+    return select(operations).order_by(
+        operations.c.at.desc(), operations.c.kind, operations.c.row_id
+    )
+
+
+def _export_total_balance(db: Session, master_id: int, start_date: datetime, end_date: datetime) -> float:
+    """Итоговый баланс периода — баланс самой новой строки выгрузки."""
+    income_total = db.query(func.coalesce(func.sum(BookingConfirmation.confirmed_income), 0.0)).filter(
+        BookingConfirmation.master_id == master_id,
+        BookingConfirmation.confirmed_at >= start_date,
+        BookingConfirmation.confirmed_at <= end_date
+    ).scalar()
+    expense_total = db.query(func.coalesce(func.sum(MasterExpense.amount), 0.0)).filter(
+        MasterExpense.master_id == master_id,
+        MasterExpense.expense_date >= start_date,
+        MasterExpense.expense_date <= end_date
+    ).scalar()
+    return float(income_total or 0) - float(expense_total or 0)
+
+
+def _iter_export_rows(db: Session, master_id: int, start_date: datetime, end_date: datetime):
+    """
+    Строки выгрузки (новые сверху) с накопительным балансом по хронологии: баланс строки —
+    итог периода минус всё, что новее неё. Итог считается агрегатом заранее, строки читаются
+    курсором — список в памяти не собирается.
+    """
+    balance = _export_total_balance(db, master_id, start_date, end_date)
+    result = db.execute(
+        _export_operations_stmt(master_id, start_date, end_date).execution_options(yield_per=EXPORT_YIELD_PER)
+    )
+    for op in result:
+        income = op.income or 0
+        expense = op.expense or 0
+        if op.kind == 0:
+            operation_type, name = "Доход", f"Услуга #{op.booking_id}"
+        else:
+            operation_type, name = "Расход", op.name
+        yield [
+            op.at.strftime("%Y-%m-%d %H:%M") if op.at else "",
+            operation_type,
+            name,
+            income,
+            expense,
+            round(balance, 2),
+        ]
+        balance -= income - expense
+
+
+def _fill_export_workbook(db: Session, master_id: int, start_date: datetime, end_date: datetime):
+    def fill(wb: Workbook) -> None:
+        ws = wb.create_sheet(title="Бухгалтерия")
+        # write_only: ширину колонок нужно задать до строк, авто-подбор по данным недоступен
+        for letter, width in zip("ABCDEF", (18, 14, 40, 14, 14, 14)):
+            ws.column_dimensions[letter].width = width
+
+        header_fill = PatternFill(start_color="4CAF50", end_color="4CAF50", fill_type="solid")
+        header_font = Font(bold=True, color="FFFFFF")
+        header_alignment = Alignment(horizontal="center", vertical="center")
+        header_cells = []
+        for title in _EXPORT_HEADERS:
+            cell = WriteOnlyCell(ws, value=title)
+            cell.fill = header_fill
+            cell.font = header_font
+            cell.alignment = header_alignment
+            header_cells.append(cell)
+        ws.append(header_cells)
+
+        income_font = Font(color="4CAF50")
+        expense_font = Font(color="F44336")
+        balance_font = Font(color="2196F3", bold=True)
+        negative_balance_font = Font(color="F44336", bold=True)
+        for date_str, operation_type, name, income, expense, balance in _iter_export_rows(
+            db, master_id, start_date, end_date
+        ):
+            income_cell = WriteOnlyCell(ws, value=income)
+            if income:
+                income_cell.font = income_font
+            expense_cell = WriteOnlyCell(ws, value=expense)
+            if expense:
+                expense_cell.font = expense_font
+            balance_cell = WriteOnlyCell(ws, value=balance)
+            if balance:
+                balance_cell.font = balance_font if balance >= 0 else negative_balance_font
+            ws.append([date_str, operation_type, name, income_cell, expense_cell, balance_cell])
+
+    return fill
+
+
 @router.get("/export")
 async def export_data(
     start_date: Optional[datetime] = None,
     end_date: Optional[datetime] = None,
     format: str = Query("csv", regex="^(csv|excel)$"),
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db),
+    primary_db: Session = Depends(get_db),
 ):
-    """Экспорт данных бухгалтерии в CSV или Excel"""
-    _ensure_finance_access(db, current_user.id)
-    try:
-        # Получаем данные
-        if not start_date:
-            start_date = datetime.now() - timedelta(days=30)
-        if not end_date:
-            end_date = datetime.now()
-        
-        # Доходы
-        incomes = db.query(BookingConfirmation).filter(
-            BookingConfirmation.master_id == current_user.id,
-            BookingConfirmation.confirmed_at >= start_date,
-            BookingConfirmation.confirmed_at <= end_date
-        ).all()
-        
-        # Расходы
-        expenses = db.query(MasterExpense).filter(
-            MasterExpense.master_id == current_user.id,
-            MasterExpense.expense_date >= start_date,
-            MasterExpense.expense_date <= end_date
-        ).all()
-        
-        # Формируем данные для экспорта
-        rows = []
-        
-        for income in incomes:
-            rows.append({
-                "Дата": income.confirmed_at.strftime("%Y-%m-%d %H:%M"),
-                "Тип операции": "Доход",
-                "Название": f"Услуга #{income.booking_id}",
-                "Доход": income.confirmed_income,
-                "Расход": 0,
-            })
-        
-        for expense in expenses:
-            rows.append({
-                "Дата": expense.expense_date.strftime("%Y-%m-%d %H:%M") if expense.expense_date else "",
-                "Тип операции": "Расход",
-                "Название": expense.name,
-                "Доход": 0,
-                "Расход": expense.amount,
-            })
-        
-        # Сортируем по дате
-        rows.sort(key=lambda x: x["Дата"], reverse=True)
-        
-        # Добавляем баланс
-        balance = 0
-        for row in reversed(rows):
-            balance += row["Доход"] - row["Расход"]
-            row["Баланс"] = balance
-        
-        if format == "csv":
-            # Создаем CSV
-            output = BytesIO()
-            output.write('\ufeff'.encode('utf-8'))  # BOM для корректного отображения кириллицы в Excel
-            
-            fieldnames = ["Дата", "Тип операции", "Название", "Доход", "Расход", "Баланс"]
-            writer = csv.DictWriter(output, fieldnames=fieldnames, delimiter=';')
-            writer.writeheader()
-            writer.writerows(rows)
-            
-            output.seek(0)
-            
-            return Response(
-                content=output.getvalue(),
-                media_type="text/csv; charset=utf-8",
-                headers={
-                    "Content-Disposition": f"attachment; filename=accounting_{start_date.strftime('%Y%m%d')}_{end_date.strftime('%Y%m%d')}.csv"
-                }
-            )
-        else:
-            # Создаем Excel
-            wb = Workbook()
-            ws = wb.active
-            ws.title = "Бухгалтерия"
-            
-            # Заголовки
-            headers = ["Дата", "Тип операции", "Название", "Доход", "Расход", "Баланс"]
-            ws.append(headers)
-            
-            # Стилизация заголовков
-            header_fill = PatternFill(start_color="4CAF50", end_color="4CAF50", fill_type="solid")
-            header_font = Font(bold=True, color="FFFFFF")
-            header_alignment = Alignment(horizontal="center", vertical="center")
-            
-            for cell in ws[1]:
-                cell.fill = header_fill
-                cell.font = header_font
-                cell.alignment = header_alignment
-            
-            # Данные
-            for row in rows:
-                ws.append([
-                    row["Дата"],
-                    row["Тип операции"],
-                    row["Название"],
-                    row["Доход"],
-                    row["Расход"],
-                    row["Баланс"]
-                ])
-            
-            # Автоматическая ширина колонок
-            for column in ws.columns:
-                max_length = 0
-                column_letter = column[0].column_letter
-                for cell in column:
-                    try:
-                        if len(str(cell.value)) > max_length:
-                            max_length = len(str(cell.value))
-                    except:
-                        pass
-                adjusted_width = min(max_length + 2, 50)
-                ws.column_dimensions[column_letter].width = adjusted_width
-            
-            # Форматирование чисел
-            for row in ws.iter_rows(min_row=2, max_row=ws.max_row):
-                # Доход (колонка 4)
-                if row[3].value and row[3].value != 0:
-                    row[3].font = Font(color="4CAF50")
-                # Расход (колонка 5)
-                if row[4].value and row[4].value != 0:
-                    row[4].font = Font(color="F44336")
-                # Баланс (колонка 6)
-                if row[5].value:
-                    if row[5].value >= 0:
-                        row[5].font = Font(color="2196F3", bold=True)
-                    else:
-                        row[5].font = Font(color="F44336", bold=True)
-            
-            # Сохраняем в BytesIO
-            output = BytesIO()
-            wb.save(output)
-            output.seek(0)
-            
-            return Response(
-                content=output.getvalue(),
-                media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                headers={
-                    "Content-Disposition": f"attachment; filename=accounting_{start_date.strftime('%Y%m%d')}_{end_date.strftime('%Y%m%d')}.xlsx"
-                }
-            )
-            
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Ошибка при экспорте данных: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    """
+    Экспорт данных бухгалтерии в CSV или Excel.
+    Ответ потоковый (utils/streaming_export.py): строки читаются курсором и сразу пишутся в ответ.
+    Выгрузка читает с реплики, если она настроена (database.get_read_db).
+    """
+    _ensure_finance_access(primary_db, current_user.id)
+    master_id = current_user.id
+    if not start_date:
+        start_date = datetime.now() - timedelta(days=30)
+    if not end_date:
+        end_date = datetime.now()
+    period = f"{start_date.strftime('%Y%m%d')}_{end_date.strftime('%Y%m%d')}"
+
+    if format == "csv":
+        chunks = iter_csv(
+            _EXPORT_HEADERS,
+            _iter_export_rows(db, master_id, start_date, end_date),
+            delimiter=";",
+        )
+        media_type, filename = CSV_MEDIA_TYPE, f"accounting_{period}.csv"
+    else:
+        chunks = iter_xlsx(_fill_export_workbook(db, master_id, start_date, end_date))
+        media_type, filename = XLSX_MEDIA_TYPE, f"accounting_{period}.xlsx"
+
+    return StreamingResponse(
+        close_session_after(db, chunks),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+    )
 
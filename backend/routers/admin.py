@@ -10,7 +10,8 @@ from sqlalchemy.exc import IntegrityError
 
 from auth import get_current_active_user, require_admin, require_admin_or_moderator, require_moderator_permission
 from utils.blog_import import parse_blog_import_markdown
-from database import get_db
+from database import get_db, get_read_db
+from threadpool_db_route import ThreadpoolDBRoute
 from models import (
     BlogPost as BlogPostModel,
     User,
@@ -18,7 +19,6 @@ from models import (
     Master,
     IndieMaster,
     Booking,
-    BookingStatus,
     BlogPostStatus,
     Payment,
     Subscription,
@@ -57,6 +57,7 @@ router = APIRouter(
     prefix="/admin",
     tags=["admin"],
     dependencies=[Depends(require_admin_or_moderator)],
+    route_class=ThreadpoolDBRoute,
 )
 
 
@@ -828,267 +829,91 @@ def get_user_stats(
     """
     Получение статистики по пользователям.
     """
-    now = datetime.utcnow()
-    today = now.date()
-    week_ago = today - timedelta(days=7)
-    month_ago = today - timedelta(days=30)
-
-    # Общая статистика
-    total_users = db.query(User).count()
-    active_users = db.query(User).filter(User.is_active == True).count()
-
-    # Пользователи по ролям
-    users_by_role = {}
-    for role in UserRole:
-        if role == UserRole.INDIE:
-            # Для независимых мастеров считаем как indie, так и master с can_work_independently=True
-            count = db.query(User).join(Master, User.id == Master.user_id, isouter=True).filter(
-                or_(
-                    User.role == UserRole.INDIE,
-                    and_(User.role == UserRole.MASTER, Master.can_work_independently == True)
-                )
-            ).count()
-        else:
-            count = db.query(User).filter(User.role == role).count()
-        users_by_role[role] = count
+    from services.admin_daily_metrics import admin_metrics_summary, ensure_admin_daily_metrics
 
-    # Новые пользователи
-    new_users_today = db.query(User).filter(User.created_at >= today).count()
-
-    new_users_this_week = db.query(User).filter(User.created_at >= week_ago).count()
-
-    new_users_this_month = db.query(User).filter(User.created_at >= month_ago).count()
+    ensure_admin_daily_metrics(db)
+    summary = admin_metrics_summary(db)
 
     return {
-        "total_users": total_users,
-        "active_users": active_users,
-        "users_by_role": users_by_role,
-        "new_users_today": new_users_today,
-        "new_users_this_week": new_users_this_week,
-        "new_users_this_month": new_users_this_month,
+        "total_users": summary["total_users"],
+        "active_users": summary["active_users"],
+        "users_by_role": {role: summary["users_by_role"][role.value] for role in UserRole},
+        "new_users_today": summary["new_users_today"],
+        "new_users_this_week": summary["new_users_this_week"],
+        "new_users_this_month": summary["new_users_this_month"],
     }
 
 
-@router.get("/stats")
-def get_admin_stats(
-    db: Session = Depends(get_db), current_user: User = Depends(require_moderator_permission("can_view_stats"))
-) -> Any:
+_WEEKDAY_NAMES = ['Понедельник', 'Вторник', 'Среда', 'Четверг', 'Пятница', 'Суббота', 'Воскресенье']
+
+
+def _admin_stats_from_rollup(db: Session, read_db: Session) -> dict:
     """
-    Получение статистики для админ панели.
+    Общая статистика админки (/stats и /dashboard/stats) из дневного rollup
+    services.admin_daily_metrics вместо COUNT(*) по users/bookings.
+    Досчёт rollup пишет — он на основной БД (db); итоги читаются из read_db (реплика, если есть).
     """
+    from services.admin_daily_metrics import admin_metrics_summary, ensure_admin_daily_metrics
+
     now = datetime.utcnow()
-    today = now.date()
-    week_ago = today - timedelta(days=7)
-    month_ago = today - timedelta(days=30)
+    ensure_admin_daily_metrics(db)
+    summary = admin_metrics_summary(read_db, now.date())
 
-    # Общая статистика
-    total_users = db.query(User).count()
+    total_bookings = summary["total_bookings"]
+    conversion_rate = round(
+        (summary["completed_bookings"] / total_bookings * 100) if total_bookings > 0 else 0, 1
+    )
     # Салонный контур заморожен: не дергаем ORM Salon (несовпадение схемы salons → 500 на SQLite).
     total_salons = 0
     top_salons: List[dict] = []
-    total_masters = db.query(Master).count()
-    total_bookings = db.query(Booking).count()
-    total_blog_posts = db.query(BlogPostModel).filter(BlogPostModel.status == BlogPostStatus.PUBLISHED).count()
-
-    # Новые пользователи
-    new_users_today = db.query(User).filter(User.created_at >= today).count()
-    new_users_this_week = db.query(User).filter(User.created_at >= week_ago).count()
-    new_users_this_month = db.query(User).filter(User.created_at >= month_ago).count()
-
-    # Бронирования
-    bookings_today = db.query(Booking).filter(Booking.start_time >= today).count()
-    bookings_this_week = db.query(Booking).filter(Booking.start_time >= week_ago).count()
-    bookings_this_month = db.query(Booking).filter(Booking.start_time >= month_ago).count()
-
-    # Средняя продолжительность записи
-    bookings_with_duration = db.query(Booking).filter(
-        Booking.start_time.isnot(None),
-        Booking.end_time.isnot(None),
-        Booking.end_time > Booking.start_time
-    ).all()
-    
-    if bookings_with_duration:
-        durations = []
-        for booking in bookings_with_duration:
-            duration_hours = (booking.end_time - booking.start_time).total_seconds() / 3600
-            if duration_hours > 0:
-                durations.append(duration_hours)
-        
-        average_booking_duration = round(sum(durations) / len(durations), 1) if durations else 0
-    else:
-        average_booking_duration = 0
-
-    # Конверсия (отношение завершенных записей к общему количеству)
-    total_completed = db.query(Booking).filter(Booking.status == BookingStatus.COMPLETED).count()
-    conversion_rate = round((total_completed / total_bookings * 100) if total_bookings > 0 else 0, 1)
-
-    # Пользователи по ролям
-    users_by_role = {}
-    for role in UserRole:
-        if role == UserRole.INDIE:
-            count = db.query(User).join(Master, User.id == Master.user_id, isouter=True).filter(
-                or_(
-                    User.role == UserRole.INDIE,
-                    and_(User.role == UserRole.MASTER, Master.can_work_independently == True)
-                )
-            ).count()
-        else:
-            count = db.query(User).filter(User.role == role).count()
-        users_by_role[role.value] = count
-
-    # Активность за неделю
-    weekly_activity = []
-    for i in range(7):
-        day_date = today - timedelta(days=i)
-        day_bookings = db.query(Booking).filter(
-            func.date(Booking.start_time) == day_date
-        ).count()
-        day_users = db.query(User).filter(
-            func.date(User.created_at) == day_date
-        ).count()
-        
-        day_names = ['Понедельник', 'Вторник', 'Среда', 'Четверг', 'Пятница', 'Суббота', 'Воскресенье']
-        day_name = day_names[day_date.weekday()]
-        
-        weekly_activity.append({
-            'day': day_name,
-            'bookings': day_bookings,
-            'users': day_users
-        })
-    
-    # Разворачиваем массив, чтобы показать неделю в правильном порядке
-    weekly_activity.reverse()
+    total_blog_posts = read_db.query(BlogPostModel).filter(BlogPostModel.status == BlogPostStatus.PUBLISHED).count()
 
     return {
-        "total_users": total_users,
+        "total_users": summary["total_users"],
         "total_salons": total_salons,
-        "total_masters": total_masters,
+        "total_masters": summary["total_masters"],
         "total_bookings": total_bookings,
         "total_blog_posts": total_blog_posts,
-        "new_users_today": new_users_today,
-        "new_users_this_week": new_users_this_week,
-        "new_users_this_month": new_users_this_month,
-        "bookings_today": bookings_today,
-        "bookings_this_week": bookings_this_week,
-        "bookings_this_month": bookings_this_month,
-        "average_booking_duration": average_booking_duration,
+        "new_users_today": summary["new_users_today"],
+        "new_users_this_week": summary["new_users_this_week"],
+        "new_users_this_month": summary["new_users_this_month"],
+        "bookings_today": summary["bookings_today"],
+        "bookings_this_week": summary["bookings_this_week"],
+        "bookings_this_month": summary["bookings_this_month"],
+        "average_booking_duration": summary["average_booking_duration"],
         "conversion_rate": conversion_rate,
-        "users_by_role": users_by_role,
-        "weekly_activity": weekly_activity,
+        "users_by_role": summary["users_by_role"],
+        "weekly_activity": [
+            {"day": _WEEKDAY_NAMES[item["date"].weekday()], "bookings": item["bookings"], "users": item["users"]}
+            for item in summary["weekly_activity"]
+        ],
         "top_salons": top_salons,
-        "last_updated": now
+        "last_updated": now,
     }
 
 
+@router.get("/stats")
+def get_admin_stats(
+    db: Session = Depends(get_db),
+    read_db: Session = Depends(get_read_db),
+    current_user: User = Depends(require_moderator_permission("can_view_stats")),
+) -> Any:
+    """
+    Получение статистики для админ панели.
+    """
+    return _admin_stats_from_rollup(db, read_db)
+
+
 @router.get("/dashboard/stats", response_model=AdminStats)
 def get_dashboard_stats(
-    db: Session = Depends(get_db), current_user: User = Depends(require_moderator_permission("can_view_stats"))
+    db: Session = Depends(get_db),
+    read_db: Session = Depends(get_read_db),
+    current_user: User = Depends(require_moderator_permission("can_view_stats")),
 ) -> Any:
     """
     Получение расширенной статистики для дашборда администратора.
     """
-    now = datetime.utcnow()
-    today = now.date()
-    week_ago = today - timedelta(days=7)
-    month_ago = today - timedelta(days=30)
-
-    # Общая статистика
-    total_users = db.query(User).count()
-    # Салонный контур заморожен: не дергаем ORM Salon (несовпадение схемы salons → 500 на SQLite).
-    total_salons = 0
-    top_salons: List[dict] = []
-    total_masters = db.query(Master).count()
-    total_bookings = db.query(Booking).count()
-    total_blog_posts = db.query(BlogPostModel).filter(BlogPostModel.status == BlogPostStatus.PUBLISHED).count()
-
-    # Новые пользователи
-    new_users_today = db.query(User).filter(User.created_at >= today).count()
-    new_users_this_week = db.query(User).filter(User.created_at >= week_ago).count()
-    new_users_this_month = db.query(User).filter(User.created_at >= month_ago).count()
-
-    # Бронирования
-    bookings_today = db.query(Booking).filter(Booking.start_time >= today).count()
-    bookings_this_week = db.query(Booking).filter(Booking.start_time >= week_ago).count()
-    bookings_this_month = db.query(Booking).filter(Booking.start_time >= month_ago).count()
-
-    # Средняя продолжительность записи
-    bookings_with_duration = db.query(Booking).filter(
-        Booking.start_time.isnot(None),
-        Booking.end_time.isnot(None),
-        Booking.end_time > Booking.start_time
-    ).all()
-    
-    if bookings_with_duration:
-        durations = []
-        for booking in bookings_with_duration:
-            duration_hours = (booking.end_time - booking.start_time).total_seconds() / 3600
-            if duration_hours > 0:
-                durations.append(duration_hours)
-        
-        average_booking_duration = round(sum(durations) / len(durations), 1) if durations else 0
-    else:
-        average_booking_duration = 0
-
-    # Конверсия (отношение завершенных записей к общему количеству)
-    total_completed = db.query(Booking).filter(Booking.status == BookingStatus.COMPLETED).count()
-    conversion_rate = round((total_completed / total_bookings * 100) if total_bookings > 0 else 0, 1)
-
-    # Пользователи по ролям
-    users_by_role = {}
-    for role in UserRole:
-        if role == UserRole.INDIE:
-            count = db.query(User).join(Master, User.id == Master.user_id, isouter=True).filter(
-                or_(
-                    User.role == UserRole.INDIE,
-                    and_(User.role == UserRole.MASTER, Master.can_work_independently == True)
-                )
-            ).count()
-        else:
-            count = db.query(User).filter(User.role == role).count()
-        users_by_role[role.value] = count
-
-    # Активность за неделю
-    weekly_activity = []
-    for i in range(7):
-        day_date = today - timedelta(days=i)
-        day_bookings = db.query(Booking).filter(
-            func.date(Booking.start_time) == day_date
-        ).count()
-        day_users = db.query(User).filter(
-            func.date(User.created_at) == day_date
-        ).count()
-        
-        day_names = ['Понедельник', 'Вторник', 'Среда', 'Четверг', 'Пятница', 'Суббота', 'Воскресенье']
-        day_name = day_names[day_date.weekday()]
-        
-        weekly_activity.append({
-            'day': day_name,
-            'bookings': day_bookings,
-            'users': day_users
-        })
-    
-    # Разворачиваем массив, чтобы показать неделю в правильном порядке
-    weekly_activity.reverse()
-
-    return {
-        "total_users": total_users,
-        "total_salons": total_salons,
-        "total_masters": total_masters,
-        "total_bookings": total_bookings,
-        "total_blog_posts": total_blog_posts,
-        "new_users_today": new_users_today,
-        "new_users_this_week": new_users_this_week,
-        "new_users_this_month": new_users_this_month,
-        "bookings_today": bookings_today,
-        "bookings_this_week": bookings_this_week,
-        "bookings_this_month": bookings_this_month,
-        "average_booking_duration": average_booking_duration,
-        "conversion_rate": conversion_rate,
-        "users_by_role": users_by_role,
-        "weekly_activity": weekly_activity,
-        "top_salons": top_salons,
-        "last_updated": now
-    }
+    return _admin_stats_from_rollup(db, read_db)
 
 
 from utils.seo import generate_slug, analyze_seo, generate_json_ld, ping_search_engines, generate_meta_tags
@@ -2202,6 +2027,54 @@ def get_global_settings(
     return result
 
 
+@router.get("/background-jobs", dependencies=[Depends(require_admin)])
+def get_background_jobs() -> dict[str, Any]:
+    """
+    Метрики фоновых задач этого процесса (services.job_runner): последний запуск,
+    длительность, статус, число обработанных строк.
+    Доступ: только админы.
+    """
+    from services.job_runner import job_runner
+
+    return {"owner": job_runner.owner, "jobs": job_runner.metrics()}
+
+
+@router.get("/password-hashing", dependencies=[Depends(require_admin)])
+def get_password_hashing_metrics() -> dict[str, Any]:
+    """
+    Метрики пула хэширования паролей этого процесса (utils.password_hashing): потоки,
+    занятость, глубина очереди, отказы при переполнении, среднее ожидание.
+    Доступ: только админы.
+    """
+    from utils.password_hashing import password_hasher
+
+    return password_hasher.metrics()
+
+
+@router.get("/db-pool", dependencies=[Depends(require_admin)])
+def get_db_pool_metrics() -> dict[str, Any]:
+    """
+    Пулы соединений этого процесса (database.engine / background_engine): размер, занято,
+    overflow, число выдач, ожиданий свободного соединения и таймаутов, время ожидания.
+    Доступ: только админы.
+    """
+    from database import pool_metrics
+
+    return pool_metrics()
+
+
+@router.get("/sql-stats", dependencies=[Depends(require_admin)])
+def get_sql_stats(limit: int = Query(50, ge=1, le=500)) -> dict[str, Any]:
+    """
+    SQL по маршрутам этого процесса (sql_instrumentation): p50/p95 длительности, числа запросов
+    и времени в БД по последним запросам; сортировка по p95 времени в БД.
+    Доступ: только админы.
+    """
+    from sql_instrumentation import route_sql_stats
+
+    return {"routes": route_sql_stats.summary()[:limit]}
+
+
 @router.put("/settings", dependencies=[Depends(require_admin)])
 def update_global_settings(
     settings_data: dict[str, Any],
@@ -1,11 +1,10 @@
-import csv
-import io
 import secrets
 import string
 from datetime import datetime
 from typing import Any, Dict, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field, field_validator
 from sqlalchemy import func
 from sqlalchemy.exc import IntegrityError
@@ -39,6 +38,7 @@ from services.promo_engine import (
     normalize_promo_code,
     PromoEngineError,
 )
+from utils.streaming_export import CSV_MEDIA_TYPE, EXPORT_YIELD_PER, close_session_after, iter_csv
 
 
 router = APIRouter(
@@ -245,6 +245,20 @@ def _csv_escape(value: Any) -> Any:
     return value
 
 
+def _iter_code_export_rows(query):
+    # Генератор: запрос выполняется при первой итерации, уже во время отдачи ответа
+    for code, campaign_name, code_status, current_redemptions, max_redemptions, assigned_to_user_id, created_at in query:
+        yield [
+            _csv_escape(code),
+            _csv_escape(campaign_name),
+            _csv_escape(_enum_value(code_status)),
+            _csv_escape(current_redemptions),
+            _csv_escape(max_redemptions),
+            _csv_escape(assigned_to_user_id),
+            _csv_escape(created_at),
+        ]
+
+
 def _campaign_stats(db: Session, campaign_id: int) -> dict:
     redemptions_count = db.query(func.count(PromoRedemption.id)).filter(
         PromoRedemption.campaign_id == campaign_id
@@ -688,8 +702,18 @@ def export_codes_csv(
     search: Optional[str] = None,
     q: Optional[str] = None,
     db: Session = Depends(get_db),
-) -> Response:
-    query = db.query(PromoEngineCode).join(PromoCampaign)
+) -> StreamingResponse:
+    # Только нужные колонки (название кампании — из JOIN, без ленивой загрузки на строку),
+    # строки читаются курсором и сразу пишутся в ответ (utils/streaming_export.py)
+    query = db.query(
+        PromoEngineCode.code,
+        PromoCampaign.name,
+        PromoEngineCode.status,
+        PromoEngineCode.current_redemptions,
+        PromoEngineCode.max_redemptions,
+        PromoEngineCode.assigned_to_user_id,
+        PromoEngineCode.created_at,
+    ).join(PromoCampaign, PromoEngineCode.campaign_id == PromoCampaign.id)
     if campaign_id:
         query = query.filter(PromoEngineCode.campaign_id == campaign_id)
     if status:
@@ -697,11 +721,9 @@ def export_codes_csv(
     search_value = search or q
     if search_value:
         query = query.filter(PromoEngineCode.code.ilike(f"%{search_value}%"))
-    codes = query.order_by(PromoEngineCode.created_at.desc(), PromoEngineCode.id.desc()).all()
+    query = query.order_by(PromoEngineCode.created_at.desc(), PromoEngineCode.id.desc()).yield_per(EXPORT_YIELD_PER)
 
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow([
+    header = [
         "Промокод",
         "Кампания",
         "Статус",
@@ -709,22 +731,10 @@ def export_codes_csv(
         "Лимит",
         "Персональный пользователь",
         "Дата создания",
-    ])
-    for code in codes:
-        writer.writerow([
-            _csv_escape(code.code),
-            _csv_escape(code.campaign.name if code.campaign else code.campaign_id),
-            _csv_escape(_enum_value(code.status)),
-            _csv_escape(code.current_redemptions),
-            _csv_escape(code.max_redemptions),
-            _csv_escape(code.assigned_to_user_id),
-            _csv_escape(code.created_at),
-        ])
-
-    content = "\ufeff" + output.getvalue()
-    return Response(
-        content=content,
-        media_type="text/csv; charset=utf-8",
+    ]
+    return StreamingResponse(
+        close_session_after(db, iter_csv(header, _iter_code_export_rows(query))),
+        media_type=CSV_MEDIA_TYPE,
         headers={"Content-Disposition": 'attachment; filename="promo-engine-codes.csv"'},
     )
 
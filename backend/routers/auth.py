@@ -22,10 +22,13 @@ from auth import (
     create_refresh_token,
     get_current_active_user,
     get_password_hash,
+    get_password_hash_async,
     resolve_user_from_token_sub,
     verify_password,
+    verify_password_and_update,
 )
 from database import get_db
+from threadpool_db_route import ThreadpoolDBRoute
 from models import User, Master, Booking, UserRole, EmailVerification, UserOAuthAccount
 from schemas import LoginRequest, Token, ChangePasswordRequest, SetPasswordRequest, MessageOut
 from schemas import User as UserSchema
@@ -57,6 +60,7 @@ router = APIRouter(
     prefix="/auth",
     tags=["auth"],
     responses={401: {"description": "Unauthorized"}},
+    route_class=ThreadpoolDBRoute,
 )
 
 YANDEX_PROVIDER = "yandex"
@@ -1251,7 +1255,12 @@ def login(login_data: LoginRequest, db: Session = Depends(get_db)) -> Any:
     - **password**: Пароль
     """
     user = db.query(User).filter(User.phone == login_data.phone).first()
-    if not user or not user.hashed_password or not verify_password(login_data.password, user.hashed_password):
+    password_ok, rehashed = (
+        verify_password_and_update(login_data.password, user.hashed_password)
+        if user and user.hashed_password
+        else (False, None)
+    )
+    if not password_ok:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Неверный номер телефона или пароль",
@@ -1263,6 +1272,10 @@ def login(login_data: LoginRequest, db: Session = Depends(get_db)) -> Any:
             detail="Неверный номер телефона или пароль",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    if rehashed:
+        # Хэш посчитан с другой стоимостью bcrypt (PASSWORD_BCRYPT_ROUNDS) — сохраняем новый
+        user.hashed_password = rehashed
+        db.commit()
 
     # sub = user.id: безопасно при повторной регистрации на тот же phone после удаления
     token_sub = str(user.id)
@@ -1659,8 +1672,8 @@ async def reset_password(request: ResetPasswordRequest, db: Session = Depends(ge
                 success=False
             )
         
-        # Хешируем новый пароль
-        hashed_password = get_password_hash(request.new_password)
+        # Хешируем новый пароль (в пуле хэширования, event loop не блокируется)
+        hashed_password = await get_password_hash_async(request.new_password)
         user.hashed_password = hashed_password
         db.commit()
         
@@ -1670,6 +1683,8 @@ async def reset_password(request: ResetPasswordRequest, db: Session = Depends(ge
             user_id=user.id
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Ошибка сброса пароля: {e}")
         return ResetPasswordResponse(
@@ -1691,12 +1706,14 @@ async def reset_password_by_phone(request: ResetPasswordByPhoneRequest, db: Sess
                 message=verification_result.get("message", "Неверный код верификации"),
                 success=False
             )
-        hashed_password = get_password_hash(request.new_password)
+        hashed_password = await get_password_hash_async(request.new_password)
         user.hashed_password = hashed_password
         user.password_reset_code = None
         user.password_reset_expires = None
         db.commit()
         return ResetPasswordResponse(message="Пароль успешно изменен", success=True, user_id=user.id)
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Ошибка сброса пароля по телефону: {e}")
         return ResetPasswordResponse(message="Внутренняя ошибка сервера", success=False)
@@ -5,6 +5,7 @@ from sqlalchemy.orm import Session
 from sqlalchemy import and_
 
 from database import get_db
+from threadpool_db_route import ThreadpoolDBRoute
 from models import User, UserBalance, BalanceTransaction, Subscription, SubscriptionType, SubscriptionStatus
 from schemas import (
     BalanceOut, 
@@ -20,7 +21,7 @@ from utils.balance_utils import (
     get_user_reserved_total,
 )
 
-router = APIRouter(prefix="/balance", tags=["balance"])
+router = APIRouter(prefix="/balance", tags=["balance"], route_class=ThreadpoolDBRoute)
 
 
 @router.get("/", response_model=BalanceOut)
@@ -6,6 +6,7 @@ from sqlalchemy.orm import Session, joinedload
 
 from auth import get_current_user
 from database import get_db
+from threadpool_db_route import ThreadpoolDBRoute
 from models import (
     Booking,
     BookingEditRequest,
@@ -37,6 +38,7 @@ router = APIRouter(
     prefix="/bookings",
     tags=["bookings"],
     responses={401: {"description": "Требуется авторизация"}},
+    route_class=ThreadpoolDBRoute,
 )
 
 
@@ -30,6 +30,7 @@ from services.account_deletion import MASTER_ACCOUNT_DELETED_REASON, is_master_d
 from auth import get_current_active_user, require_client
 from utils.booking_loyalty_reserve import clear_loyalty_points_reserve
 from database import get_db
+from threadpool_db_route import ThreadpoolDBRoute
 from models import (
     User, Salon, SalonBranch, Master, IndieMaster, Service, Booking,
     BookingStatus, ClientNote, ClientMasterNote, ClientSalonNote, UserRole, ClientFavorite,
@@ -63,12 +64,14 @@ router = APIRouter(
     prefix="/client/bookings",
     tags=["client_bookings"],
     dependencies=[Depends(require_client)],
+    route_class=ThreadpoolDBRoute,
 )
 
 profile_router = APIRouter(
     prefix="/client",
     tags=["client"],
     dependencies=[Depends(require_client)],
+    route_class=ThreadpoolDBRoute,
 )
 
 
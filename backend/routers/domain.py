@@ -2,16 +2,19 @@ from fastapi import APIRouter, HTTPException, Depends, Query
 from sqlalchemy.orm import Session, contains_eager
 from sqlalchemy import func, or_
 from database import get_db
+from threadpool_db_route import ThreadpoolDBRoute
 from models import Salon, IndieMaster, Master, MasterPageModule, Booking, BookingStatus, Subscription, SubscriptionPlan, SubscriptionType, SubscriptionStatus, User, MasterService, MasterServiceCategory
 from typing import Optional
 from datetime import datetime
 from schemas import ServicePublicOut, ServicesPublicResponse, DomainSubdomainInfoOut
+from utils.master_active_bookings import active_future_bookings_count
 from utils.master_domain_lookup import get_master_by_domain_slug
 
 router = APIRouter(
     prefix="/api/domain",
     tags=["domain"],
     responses={404: {"description": "Поддомен не найден"}},
+    route_class=ThreadpoolDBRoute,
 )
 
 
@@ -279,22 +282,17 @@ async def get_subdomain_bookings_limit(subdomain: str, db: Session = Depends(get
         is_indie = False
     
     # Активные будущие записи: start_time > now (UTC), без отменённых и completed — как у мастерского /bookings/limit
-    from utils.master_future_bookings_query import active_future_core
-
-    now_u = datetime.utcnow()
-    core = active_future_core(now_u)
+    # (для мастера — сохранённый счётчик, без подсчёта записей на каждую загрузку страницы)
     if is_indie:
+        from utils.master_future_bookings_query import active_future_core
+
         active_bookings_count = (
             db.query(func.count(Booking.id))
-            .filter(Booking.indie_master_id == master_id, core)
+            .filter(Booking.indie_master_id == master_id, active_future_core(datetime.utcnow()))
             .scalar() or 0
         )
     else:
-        active_bookings_count = (
-            db.query(func.count(Booking.id))
-            .filter(Booking.master_id == master_id, core)
-            .scalar() or 0
-        )
+        active_bookings_count = active_future_bookings_count(db, master)
     
     # Получаем план подписки
     subscription = db.query(Subscription).filter(
@@ -4,7 +4,7 @@ from typing import List, Optional
 from datetime import datetime, date
 from decimal import Decimal
 
-from database import get_db
+from database import get_db, get_read_db
 from models import (
     ExpenseType, Expense, ExpenseTemplate, Salon, SalonBranch, IndieMaster, User, Income, MissedRevenue, Booking
 )
@@ -438,7 +438,7 @@ def create_master_expense_template(
 @router.get("/salon/stats", response_model=ExpenseStats, dependencies=[Depends(require_salon)])
 def get_salon_expense_stats(
     branch_id: Optional[int] = None,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """Получение статистики расходов салона"""
@@ -835,7 +835,7 @@ def create_master_missed_revenue(
 @router.get("/salon/accounting/stats", response_model=AccountingStats, dependencies=[Depends(require_salon)])
 def get_salon_accounting_stats(
     branch_id: Optional[int] = None,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """Получение общей статистики бухгалтерии салона"""
@@ -889,7 +889,7 @@ def get_salon_accounting_stats(
 
 @router.get("/master/accounting/stats", response_model=AccountingStats)
 def get_master_accounting_stats(
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """Получение общей статистики бухгалтерии мастера-индивидуала"""
@@ -934,7 +934,7 @@ def get_master_accounting_stats(
 
 @router.get("/master/stats", response_model=ExpenseStats)
 def get_master_expense_stats(
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """Получение статистики расходов мастера-индивидуала"""
@@ -8,6 +8,7 @@ from datetime import datetime, date, time
 import json
 
 from database import get_db
+from threadpool_db_route import ThreadpoolDBRoute
 from models import (
     LoyaltyDiscount, PersonalDiscount, AppliedDiscount, Salon, User, Booking, Master,
     Service,
@@ -44,6 +45,7 @@ from utils.loyalty_discounts import evaluate_discount_candidates
 router = APIRouter(
     prefix="/loyalty",
     tags=["loyalty"],
+    route_class=ThreadpoolDBRoute,
 )
 
 logger = logging.getLogger(__name__)
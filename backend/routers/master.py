@@ -11,7 +11,8 @@ from sqlalchemy import case, desc, or_
 
 from auth import get_current_active_user, require_master
 import models
-from database import get_db
+from database import get_db, get_read_db
+from threadpool_db_route import ThreadpoolDBRoute
 from utils.booking_status import get_effective_booking_status, apply_effective_status_to_bookings
 from utils.client_display_name import get_client_display_name, get_meta_for_client, strip_indie_service_prefix
 
@@ -87,6 +88,7 @@ router = APIRouter(
     prefix="/master",
     tags=["master"],
     responses={401: {"description": "Требуется авторизация"}},
+    route_class=ThreadpoolDBRoute,
 )
 
 
@@ -862,22 +864,17 @@ def get_master_bookings_limit(
     Получить информацию о лимите активных записей мастера.
     Возвращает текущее количество активных записей и лимит из плана подписки.
     """
-    from sqlalchemy import func, or_
     from models import Subscription, SubscriptionPlan, SubscriptionType, SubscriptionStatus
     
     master = db.query(Master).filter(Master.user_id == current_user.id).first()
     if not master:
         raise HTTPException(status_code=404, detail="Master profile not found")
     
-    # Активные будущие записи: та же семантика, что GET /bookings/future (без отменённых и completed)
-    from utils.master_future_bookings_query import active_future_bookings_sql_filter
+    # Активные будущие записи: та же семантика, что GET /bookings/future (без отменённых и completed);
+    # счётчик из master_active_booking_counts, подсчёт одного мастера — только если строка устарела
+    from utils.master_active_bookings import active_future_bookings_count
 
-    _now_lim = datetime.utcnow()
-    active_bookings_count = (
-        db.query(func.count(Booking.id))
-        .filter(active_future_bookings_sql_filter(master, _now_lim))
-        .scalar() or 0
-    )
+    active_bookings_count = active_future_bookings_count(db, master)
     
     # Получаем план подписки
     subscription = db.query(Subscription).filter(
@@ -3458,7 +3455,7 @@ def get_master_dashboard_stats(
     anchor_date: Optional[str] = Query(None, description="YYYY-MM-DD, for day period window"),
     window_before: Optional[int] = Query(None, ge=0, le=31, description="Days before anchor for day period"),
     window_after: Optional[int] = Query(None, ge=0, le=31, description="Days after anchor for day period"),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_user: User = Depends(get_current_active_user)
 ) -> Any:
     """
@@ -3549,68 +3546,41 @@ def get_master_dashboard_stats(
 
         _real_money_line = booking_real_money_sql(Booking, Service, func, case, and_)
 
-        # Статистика за текущий период
+        # Все KPI и столбики графика — одним сгруппированным запросом по bucket'ам периодов
+        from utils.master_stats_buckets import aggregate_status_buckets, amount_of, count_of
+
+        _kpi_ranges = [(p["start"], p["end"]) for p in periods]
+        _current_idx = _previous_idx = _future_idx = None
+        if current_period:
+            _current_idx = len(_kpi_ranges)
+            _kpi_ranges.append((current_period["start"], current_period["end"]))
+        if previous_period:
+            _previous_idx = len(_kpi_ranges)
+            _kpi_ranges.append((previous_period["start"], previous_period["end"]))
+        _last_end = max((e for _, e in _kpi_ranges), default=None)
+        if current_period and _last_end > current_period["end"]:
+            _future_idx = len(_kpi_ranges)
+            _kpi_ranges.append((current_period["end"] + timedelta(days=1), _last_end))
+        _bucket_totals, _tail_totals = aggregate_status_buckets(
+            db,
+            or_(Booking.master_id == master.id, Booking.indie_master_id == master.id),
+            _kpi_ranges,
+            _real_money_line,
+            tail_after=_last_end if current_period else None,
+        )
+
         current_bookings = 0
         current_income = 0
-        if current_period:
-            # Конвертируем date в datetime для сравнения
-            period_start_dt = datetime.combine(current_period['start'], datetime.min.time())
-            period_end_dt = datetime.combine(current_period['end'], datetime.max.time())
-            
-            current_bookings = (
-                db.query(func.count(Booking.id))
-                .filter(
-                    or_(Booking.master_id == master.id, Booking.indie_master_id == master.id),
-                    Booking.start_time >= period_start_dt,
-                    Booking.start_time <= period_end_dt
-                )
-                .scalar() or 0
-            )
-            
-            current_income = (
-                db.query(func.sum(_real_money_line))
-                .outerjoin(Service, Booking.service_id == Service.id)
-                .filter(
-                    or_(Booking.master_id == master.id, Booking.indie_master_id == master.id),
-                    Booking.start_time >= period_start_dt,
-                    Booking.start_time <= period_end_dt,
-                    Booking.status == BookingStatus.COMPLETED.value,
-                )
-                .scalar()
-                or 0
-            )
-        
-        # Статистика за предыдущий период
+        if _current_idx is not None:
+            current_bookings = count_of(_bucket_totals[_current_idx])
+            current_income = amount_of(_bucket_totals[_current_idx], (BookingStatus.COMPLETED.value,))
+
         previous_bookings = 0
         previous_income = 0
-        if previous_period:
-            # Конвертируем date в datetime для сравнения
-            prev_period_start_dt = datetime.combine(previous_period['start'], datetime.min.time())
-            prev_period_end_dt = datetime.combine(previous_period['end'], datetime.max.time())
-            
-            previous_bookings = (
-                db.query(func.count(Booking.id))
-                .filter(
-                    or_(Booking.master_id == master.id, Booking.indie_master_id == master.id),
-                    Booking.start_time >= prev_period_start_dt,
-                    Booking.start_time <= prev_period_end_dt
-                )
-                .scalar() or 0
-            )
-            
-            previous_income = (
-                db.query(func.sum(_real_money_line))
-                .outerjoin(Service, Booking.service_id == Service.id)
-                .filter(
-                    or_(Booking.master_id == master.id, Booking.indie_master_id == master.id),
-                    Booking.start_time >= prev_period_start_dt,
-                    Booking.start_time <= prev_period_end_dt,
-                    Booking.status == BookingStatus.COMPLETED.value,
-                )
-                .scalar()
-                or 0
-            )
-        
+        if _previous_idx is not None:
+            previous_bookings = count_of(_bucket_totals[_previous_idx])
+            previous_income = amount_of(_bucket_totals[_previous_idx], (BookingStatus.COMPLETED.value,))
+
         # Расчет динамики
         income_dynamics = 0
         if previous_income and previous_income > 0:
@@ -3626,20 +3596,10 @@ def get_master_dashboard_stats(
         
         # Будущие записи (все после текущего периода)
         future_bookings = 0
-        if current_period and 'end' in current_period:
-            try:
-                period_end_dt = datetime.combine(current_period['end'], datetime.max.time())
-                future_bookings = (
-                    db.query(func.count(Booking.id))
-                    .filter(
-                        or_(Booking.master_id == master.id, Booking.indie_master_id == master.id),
-                        Booking.start_time > period_end_dt
-                    )
-                    .scalar() or 0
-                )
-            except Exception as e:
-                logger.error(f"Ошибка при расчете будущих записей: {e}")
-                future_bookings = 0
+        if current_period:
+            future_bookings = count_of(_tail_totals)
+            if _future_idx is not None:
+                future_bookings += count_of(_bucket_totals[_future_idx])
         
         logger.debug("dashboard/stats: next bookings")
         # Дашборд: 3 ближайшие — та же семантика, что активные в GET /bookings/future (start_time > now, без cancelled/completed)
@@ -3752,14 +3712,8 @@ def get_master_dashboard_stats(
             }
         
         logger.debug("dashboard/stats: periods data")
-        # Статусы для stacked charts (единый источник правды для web/mobile)
-        _dash_excluded_statuses = (
-            BookingStatus.CANCELLED.value,
-            BookingStatus.CANCELLED_BY_CLIENT_EARLY.value,
-            BookingStatus.CANCELLED_BY_CLIENT_LATE.value,
-            BookingStatus.PAYMENT_EXPIRED.value,
-            BookingStatus.AWAITING_PAYMENT.value,
-        )
+        # Статусы для stacked charts (единый источник правды для web/mobile); отменённые и
+        # неоплаченные в стек не попадают
         _dash_pending_statuses = (
             BookingStatus.CREATED.value,
             BookingStatus.CONFIRMED.value,
@@ -3767,44 +3721,12 @@ def get_master_dashboard_stats(
         )
         # Расчет данных для периодов (для гистограмм)
         periods_data = []
-        for period_data in periods:
-            # Конвертируем date в datetime для сравнения
-            period_start_dt = datetime.combine(period_data['start'], datetime.min.time())
-            period_end_dt = datetime.combine(period_data['end'], datetime.max.time())
-
-            row = (
-                db.query(
-                    func.coalesce(
-                        func.sum(case((Booking.status == BookingStatus.COMPLETED.value, 1), else_=0)),
-                        0,
-                    ).label("bookings_confirmed"),
-                    func.coalesce(
-                        func.sum(case((Booking.status.in_(_dash_pending_statuses), 1), else_=0)),
-                        0,
-                    ).label("bookings_pending"),
-                    func.coalesce(
-                        func.sum(case((Booking.status == BookingStatus.COMPLETED.value, _real_money_line), else_=0)),
-                        0,
-                    ).label("income_confirmed_rub"),
-                    func.coalesce(
-                        func.sum(case((Booking.status.in_(_dash_pending_statuses), _real_money_line), else_=0)),
-                        0,
-                    ).label("income_pending_rub"),
-                )
-                .outerjoin(Service, Booking.service_id == Service.id)
-                .filter(
-                    or_(Booking.master_id == master.id, Booking.indie_master_id == master.id),
-                    Booking.start_time >= period_start_dt,
-                    Booking.start_time <= period_end_dt,
-                    ~Booking.status.in_(_dash_excluded_statuses),
-                )
-                .one()
-            )
-
-            bc = int(row.bookings_confirmed or 0)
-            bp = int(row.bookings_pending or 0)
-            ic = float(row.income_confirmed_rub or 0)
-            ip = float(row.income_pending_rub or 0)
+        for period_idx, period_data in enumerate(periods):
+            totals = _bucket_totals[period_idx]
+            bc = count_of(totals, (BookingStatus.COMPLETED.value,))
+            bp = count_of(totals, _dash_pending_statuses)
+            ic = amount_of(totals, (BookingStatus.COMPLETED.value,))
+            ip = amount_of(totals, _dash_pending_statuses)
             bookings_total = bc + bp
             income_total_rub = ic + ip
 
@@ -4136,7 +4058,8 @@ def get_master_extended_stats(
     anchor_date: Optional[str] = Query(None, description="YYYY-MM-DD для period=day + day-window"),
     window_before: Optional[int] = Query(None, ge=0, le=31),
     window_after: Optional[int] = Query(None, ge=0, le=31),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
+    primary_db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ) -> Any:
     """
@@ -4144,13 +4067,16 @@ def get_master_extended_stats(
     """
     from utils.subscription_features import has_extended_stats
     from fastapi import status
-    from sqlalchemy import or_, and_
+    from sqlalchemy import and_, case, func, or_
     from models import IndieMaster
-    from datetime import timedelta, date
+    from datetime import timedelta
+    from utils.booking_real_money import booking_gross_amount_sql
+    from utils.master_stats_buckets import aggregate_status_buckets
     from utils.master_stats_periods import build_stats_periods_bundle, get_period_dates
-    from utils.master_stats_summary import aggregate_extended_period_summary
+    from utils.master_stats_summary import extended_period_summary_from_totals
 
-    if not has_extended_stats(db, current_user.id):
+    # Проверка доступа — на основной БД: может создать подписку AlwaysFree
+    if not has_extended_stats(primary_db, current_user.id):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Расширенная статистика доступна только на плане Premium. Обновите подписку для доступа к этой функции."
@@ -4180,28 +4106,56 @@ def get_master_extended_stats(
         if not cur_pd:
             raise HTTPException(status_code=400, detail="Не удалось вычислить период для статистики")
 
-        def _load_range(start_d: date, end_d: date):
-            sdt = datetime.combine(start_d, datetime.min.time())
-            edt = datetime.combine(end_d, datetime.max.time())
-            return (
-                db.query(Booking)
-                .options(joinedload(Booking.service))
-                .filter(
-                    and_(booking_filter, Booking.start_time >= sdt, Booking.start_time <= edt),
-                )
-                .all()
-            )
+        cs, ce = cur_pd["start"], cur_pd["end"]
+        with_prev = bool(compare_period and prev_pd)
+
+        # Календарные диапазоны всех блоков ответа; считаются одним запросом
+        trend_ranges = []
+        if period == "day" and (window_before is not None or window_after is not None):
+            for rel in range(-5, 1):
+                d = cs + timedelta(days=rel)
+                trend_ranges.append((rel, d, d))
+        else:
+            for rel in range(-5, 1):
+                plist = get_period_dates(period, offset + rel)
+                mid = next((p for p in plist if p["is_current"]), None)
+                if mid:
+                    trend_ranges.append((rel, mid["start"], mid["end"]))
+
+        detail_ranges = []
+        if period == "week":
+            for i in range(7):
+                day = cs + timedelta(days=i)
+                if day > ce:
+                    break
+                detail_ranges.append((day, day))
+        elif period == "month":
+            week_start = cs
+            while week_start <= ce:
+                week_end = min(week_start + timedelta(days=6), ce)
+                detail_ranges.append((week_start, week_end))
+                week_start = week_end + timedelta(days=1)
+
+        ranges = [(cs, ce)]
+        if with_prev:
+            ranges.append((prev_pd["start"], prev_pd["end"]))
+        trend_offset = len(ranges)
+        ranges.extend((s, e) for _, s, e in trend_ranges)
+        detail_offset = len(ranges)
+        ranges.extend(detail_ranges)
 
         now_utc = datetime.utcnow()
-        cs, ce = cur_pd["start"], cur_pd["end"]
-        current_bookings = _load_range(cs, ce)
-        cur_agg = aggregate_extended_period_summary(current_bookings, now_utc)
+        bucket_totals, _ = aggregate_status_buckets(
+            db,
+            booking_filter,
+            ranges,
+            booking_gross_amount_sql(Booking, Service, func, case, and_),
+            now_utc=now_utc,
+        )
+        summaries = [extended_period_summary_from_totals(t) for t in bucket_totals]
 
-        prev_agg = None
-        if compare_period and prev_pd:
-            ps, pe = prev_pd["start"], prev_pd["end"]
-            prev_bookings = _load_range(ps, pe)
-            prev_agg = aggregate_extended_period_summary(prev_bookings, now_utc)
+        cur_agg = summaries[0]
+        prev_agg = summaries[1] if with_prev else None
 
         pt = cur_agg["period_total"]
         pt_prev = prev_agg["period_total"] if prev_agg else {"revenue": 0.0, "bookings_count": 0}
@@ -4216,38 +4170,17 @@ def get_master_extended_stats(
             count_change = 0.0
 
         trends = []
-        if period == "day" and (window_before is not None or window_after is not None):
-            anchor_d = cs
-            for rel in range(-5, 1):
-                d = anchor_d + timedelta(days=rel)
-                tb = _load_range(d, d)
-                agg = aggregate_extended_period_summary(tb, now_utc)
-                trends.append(
-                    {
-                        "period": rel,
-                        "start_date": d.isoformat(),
-                        "end_date": d.isoformat(),
-                        "revenue": float(agg["period_total"]["revenue"]),
-                        "bookings_count": int(agg["period_total"]["bookings_count"]),
-                    }
-                )
-        else:
-            for rel in range(-5, 1):
-                plist = get_period_dates(period, offset + rel)
-                mid = next((p for p in plist if p["is_current"]), None)
-                if not mid:
-                    continue
-                tb = _load_range(mid["start"], mid["end"])
-                agg = aggregate_extended_period_summary(tb, now_utc)
-                trends.append(
-                    {
-                        "period": rel,
-                        "start_date": mid["start"].isoformat(),
-                        "end_date": mid["end"].isoformat(),
-                        "revenue": float(agg["period_total"]["revenue"]),
-                        "bookings_count": int(agg["period_total"]["bookings_count"]),
-                    }
-                )
+        for i, (rel, start_d, end_d) in enumerate(trend_ranges):
+            agg = summaries[trend_offset + i]
+            trends.append(
+                {
+                    "period": rel,
+                    "start_date": start_d.isoformat(),
+                    "end_date": end_d.isoformat(),
+                    "revenue": float(agg["period_total"]["revenue"]),
+                    "bookings_count": int(agg["period_total"]["bookings_count"]),
+                }
+            )
 
         forecast = {
             "predicted_revenue": float(pt["revenue"]),
@@ -4256,38 +4189,18 @@ def get_master_extended_stats(
         }
 
         daily_stats = []
-        if period == "week":
-            for i in range(7):
-                day = cs + timedelta(days=i)
-                if day > ce:
-                    break
-                dbk = _load_range(day, day)
-                agg = aggregate_extended_period_summary(dbk, now_utc)
-                daily_stats.append(
-                    {
-                        "date": day.isoformat(),
-                        "revenue": float(agg["period_total"]["revenue"]),
-                        "bookings_count": int(agg["period_total"]["bookings_count"]),
-                    }
-                )
-        elif period == "month":
-            week_start = cs
-            week_num = 0
-            while week_start <= ce:
-                week_end = min(week_start + timedelta(days=6), ce)
-                wb = _load_range(week_start, week_end)
-                agg = aggregate_extended_period_summary(wb, now_utc)
+        for i, (start_d, end_d) in enumerate(detail_ranges):
+            agg = summaries[detail_offset + i]
+            row = {
+                "revenue": float(agg["period_total"]["revenue"]),
+                "bookings_count": int(agg["period_total"]["bookings_count"]),
+            }
+            if period == "week":
+                daily_stats.append({"date": start_d.isoformat(), **row})
+            else:
                 daily_stats.append(
-                    {
-                        "week": week_num + 1,
-                        "start_date": week_start.isoformat(),
-                        "end_date": week_end.isoformat(),
-                        "revenue": float(agg["period_total"]["revenue"]),
-                        "bookings_count": int(agg["period_total"]["bookings_count"]),
-                    }
+                    {"week": i + 1, "start_date": start_d.isoformat(), "end_date": end_d.isoformat(), **row}
                 )
-                week_start = week_end + timedelta(days=1)
-                week_num += 1
 
         resp = {
             "period": period,
@@ -2,17 +2,20 @@
 API раздела «Клиенты» для мастера.
 Список клиентов: все, у кого есть ≥1 запись (future/past, любой статус). Карточка, метаданные, ограничения.
 """
+import base64
+import json
 import re
 from datetime import datetime
 from typing import Any, Dict, List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
 from sqlalchemy.orm import Session
-from sqlalchemy import func, desc, or_, and_
+from sqlalchemy import func, desc, or_, and_, case
 from pydantic import BaseModel, Field
 
 from database import get_db
 from utils.subscription_features import has_clients_access
+from utils.master_client_stats import cancellations_by_reason, get_client_stats
 from models import (
     Booking,
     BookingStatus,
@@ -24,7 +27,6 @@ from models import (
     IndieMaster,
 )
 from auth import get_current_active_user
-from utils.booking_real_money import booking_amount_to_pay
 
 router = APIRouter(prefix="/api/master/clients", tags=["master-clients"])
 
@@ -96,63 +98,106 @@ def _get_booking_crit(db: Session, master_id: int):
     return Booking.master_id == master_id
 
 
-def _get_clients_with_completed(db: Session, master_id: int) -> List[Dict[str, Any]]:
-    """Клиенты с ≥1 completed booking. Список/поиск показывают только completed-клиентов."""
-    crit = _get_booking_crit(db, master_id)
+def _amount_to_pay_sql():
+    """SQL-аналог booking_amount_to_pay(payment_amount, loyalty_points_used) без цены услуги."""
+    gross = case((Booking.payment_amount > 0, Booking.payment_amount), else_=0)
+    net = gross - func.coalesce(Booking.loyalty_points_used, 0)
+    return case((net > 0, net), else_=0)
+
+
+def _phone_digits_sql(column):
+    """Телефон без типичных разделителей — SQL-аналог _normalize_phone для поиска."""
+    expr = func.coalesce(column, "")
+    for ch in ("+", " ", "-", "(", ")"):
+        expr = func.replace(expr, ch, "")
+    return expr
+
 
+def _clients_rows_subquery(db: Session, master_id: int):
+    """
+    Строка на клиента с ≥1 completed booking: агрегаты по броням (GROUP BY client_id),
+    профиль User и MasterClientMetadata мастера — одним запросом.
+    """
+    crit = _get_booking_crit(db, master_id)
     completed = (
-        db.query(Booking)
+        db.query(
+            Booking.client_id.label("client_id"),
+            func.count(Booking.id).label("completed_count"),
+            func.sum(_amount_to_pay_sql()).label("total_revenue"),
+            func.max(Booking.start_time).label("last_visit_at"),
+        )
         .filter(crit, Booking.status == BookingStatus.COMPLETED, Booking.client_id.isnot(None))
-        .all()
+        .group_by(Booking.client_id)
+        .subquery()
     )
-
-    by_client: Dict[int, Dict[str, Any]] = {}
-    for b in completed:
-        if not b.client_id:
-            continue
-        cid = b.client_id
-        if cid not in by_client:
-            user = db.query(User).filter(User.id == cid).first()
-            by_client[cid] = {
-                "client_id": cid,
-                "client_phone": user.phone if user else "",
-                "full_name": (user.full_name if user and user.full_name else None) or None,
-                "completed_count": 0,
-                "cancelled_count": 0,
-                "last_visit_at": None,
-                "total_revenue": 0.0,
-                "has_note": False,
-            }
-        by_client[cid]["completed_count"] += 1
-        by_client[cid]["total_revenue"] += booking_amount_to_pay(b.payment_amount, b.loyalty_points_used)
-        if b.start_time and (by_client[cid]["last_visit_at"] is None or b.start_time > by_client[cid]["last_visit_at"]):
-            by_client[cid]["last_visit_at"] = b.start_time
-
-    cancelled_all = (
-        db.query(Booking.client_id, func.count(Booking.id).label("cnt"))
+    cancelled = (
+        db.query(Booking.client_id.label("client_id"), func.count(Booking.id).label("cnt"))
         .filter(crit, Booking.status.in_(CANCELLED_STATUSES), Booking.client_id.isnot(None))
         .group_by(Booking.client_id)
-        .all()
+        .subquery()
+    )
+    return (
+        db.query(
+            completed.c.client_id.label("client_id"),
+            func.coalesce(User.phone, "").label("client_phone"),
+            User.full_name.label("full_name"),
+            completed.c.completed_count.label("completed_count"),
+            func.coalesce(cancelled.c.cnt, 0).label("cancelled_count"),
+            func.coalesce(completed.c.total_revenue, 0).label("total_revenue"),
+            completed.c.last_visit_at.label("last_visit_at"),
+            MasterClientMetadata.alias_name.label("master_client_name"),
+            MasterClientMetadata.note.label("note"),
+        )
+        .select_from(completed)
+        .outerjoin(User, User.id == completed.c.client_id)
+        .outerjoin(cancelled, cancelled.c.client_id == completed.c.client_id)
+        .outerjoin(
+            MasterClientMetadata,
+            and_(
+                MasterClientMetadata.master_id == master_id,
+                MasterClientMetadata.client_phone == User.phone,
+            ),
+        )
+        .subquery()
     )
-    for cid, cnt in cancelled_all:
-        if cid and cid in by_client:
-            by_client[cid]["cancelled_count"] = cnt
 
-    metadata_map = {}
-    for m in db.query(MasterClientMetadata).filter(MasterClientMetadata.master_id == master_id).all():
-        metadata_map[(master_id, m.client_phone)] = m
 
-    for cid, row in by_client.items():
-        user = db.query(User).filter(User.id == cid).first()
-        phone = user.phone if user else ""
-        meta = metadata_map.get((master_id, phone))
-        row["master_client_name"] = meta.alias_name if meta and meta.alias_name else None
-        row["note"] = meta.note if meta and meta.note else None
-        row["has_note"] = bool(meta and meta.note)
-        row["client_key"] = f"user:{cid}" if cid else f"phone:{phone}"
-        row["full_name"] = (user.full_name if user and user.full_name else None) or None
+def _client_row_to_dict(r) -> Dict[str, Any]:
+    cid = r.client_id
+    phone = r.client_phone or ""
+    return {
+        "client_id": cid,
+        "client_phone": phone,
+        "full_name": r.full_name or None,
+        "completed_count": int(r.completed_count or 0),
+        "cancelled_count": int(r.cancelled_count or 0),
+        "last_visit_at": r.last_visit_at,
+        "total_revenue": float(r.total_revenue or 0),
+        "master_client_name": r.master_client_name or None,
+        "note": r.note or None,
+        "has_note": bool(r.note),
+        "client_key": f"user:{cid}" if cid else f"phone:{phone}",
+    }
+
 
-    return list(by_client.values())
+def _get_clients_with_completed(
+    db: Session,
+    master_id: int,
+    client_id: Optional[int] = None,
+    client_phone: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """Клиенты с ≥1 completed booking. Список/поиск показывают только completed-клиентов.
+    client_id/client_phone — сузить выборку до одного клиента (карточка)."""
+    rows = _clients_rows_subquery(db, master_id)
+    query = db.query(rows)
+    if client_id or client_phone:
+        conds = []
+        if client_id:
+            conds.append(rows.c.client_id == client_id)
+        if client_phone:
+            conds.append(rows.c.client_phone == client_phone)
+        query = query.filter(or_(*conds))
+    return [_client_row_to_dict(r) for r in query.order_by(rows.c.client_id).all()]
 
 
 # --- Schemas ---
@@ -198,24 +243,6 @@ class MasterClientDetail(MasterClientListItem):
 # --- Endpoints ---
 
 
-def _apply_sort(rows: List[Dict[str, Any]], sort_by: str, sort_dir: str) -> List[Dict[str, Any]]:
-    """Сортировка с NULLS LAST для last_visit_at."""
-    rev = sort_dir.lower() == "desc"
-
-    if sort_by == "completed_count":
-        return sorted(rows, key=lambda x: (x.get("completed_count") or 0), reverse=rev)
-    if sort_by == "total_revenue":
-        return sorted(rows, key=lambda x: float(x.get("total_revenue") or 0), reverse=rev)
-    if sort_by == "last_visit_at":
-        # NULLS LAST: (0, dt) для real, (1, min) для null; при reverse (0, newest) > (0, oldest) > (1, min)
-        def _key(r):
-            lv = r.get("last_visit_at")
-            return (1 if lv is None else 0, lv or datetime.min)
-
-        return sorted(rows, key=_key, reverse=rev)
-    return rows
-
-
 def _ensure_clients_access(db: Session, user_id: int) -> None:
     """Проверка доступа к разделу «Клиенты»; 403 при отсутствии."""
     if not has_clients_access(db, user_id):
@@ -226,41 +253,96 @@ def _ensure_clients_access(db: Session, user_id: int) -> None:
         )
 
 
+_SORT_COLUMNS = ("completed_count", "total_revenue", "last_visit_at")
+# NULLS LAST для last_visit_at в обоих направлениях: NULL заменяется крайним значением
+_NULL_VISIT_DESC = datetime(1, 1, 1)
+_NULL_VISIT_ASC = datetime(9999, 12, 31)
+
+
+def _encode_cursor(sort_value: Any, client_id: int) -> str:
+    if isinstance(sort_value, datetime):
+        sort_value = sort_value.isoformat()
+    raw = json.dumps([sort_value, client_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor: str, sort_by: str) -> tuple[Any, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        sort_value, client_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8"))
+        if sort_by == "last_visit_at":
+            sort_value = datetime.fromisoformat(sort_value)
+        elif sort_by == "completed_count":
+            sort_value = int(sort_value)
+        else:
+            sort_value = float(sort_value)
+        return sort_value, int(client_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Неверный cursor")
+
+
 @router.get("", response_model=List[MasterClientListItem])
 def list_clients(
+    response: Response,
     q: Optional[str] = Query(None, description="Поиск по телефону, alias или full_name"),
     sort_by: Optional[str] = Query(
         "last_visit_at",
         description="Сортировка: completed_count, total_revenue, last_visit_at",
     ),
     sort_dir: Optional[str] = Query("desc", description="Направление: asc, desc"),
+    limit: Optional[int] = Query(None, ge=1, le=500, description="Размер страницы; без limit — весь список"),
+    cursor: Optional[str] = Query(None, description="Курсор следующей страницы (заголовок X-Next-Cursor)"),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user),
 ):
-    """Список клиентов мастера (≥1 completed booking). Поиск q, сортировка sort_by/sort_dir."""
+    """Список клиентов мастера (≥1 completed booking). Поиск q, сортировка sort_by/sort_dir,
+    keyset-пагинация limit/cursor. Агрегация, поиск и сортировка выполняются в БД."""
     _ensure_clients_access(db, current_user.id)
     master = _get_master(db, current_user.id)
-    rows = _get_clients_with_completed(db, master.id)
+    rows = _clients_rows_subquery(db, master.id)
+    query = db.query(rows)
 
     if q:
-        qn = q.strip().lower()
+        qn = q.strip()
         qn_digits = _normalize_phone(q)
-        if qn or qn_digits:
-            filtered = []
-            for r in rows:
-                phone_digits = _normalize_phone(r.get("client_phone") or "")
-                if qn_digits and qn_digits in phone_digits:
-                    filtered.append(r)
-                elif qn and r.get("master_client_name") and qn in (r["master_client_name"] or "").lower():
-                    filtered.append(r)
-                elif qn and r.get("full_name") and qn in (r["full_name"] or "").lower():
-                    filtered.append(r)
-            rows = filtered
-
-    sort_col = sort_by if sort_by in ("completed_count", "total_revenue", "last_visit_at") else "last_visit_at"
+        conds = []
+        if qn_digits:
+            conds.append(_phone_digits_sql(rows.c.client_phone).contains(qn_digits, autoescape=True))
+        if qn:
+            pattern = qn.lower()
+            conds.append(func.lower(rows.c.master_client_name).contains(pattern, autoescape=True))
+            conds.append(func.lower(rows.c.full_name).contains(pattern, autoescape=True))
+        if conds:
+            query = query.filter(or_(*conds))
+
+    sort_col = sort_by if sort_by in _SORT_COLUMNS else "last_visit_at"
     sort_d = sort_dir if sort_dir in ("asc", "desc") else "desc"
-    rows = _apply_sort(rows, sort_col, sort_d)
-    return rows
+    is_desc = sort_d == "desc"
+    sort_expr = rows.c[sort_col]
+    if sort_col == "last_visit_at":
+        sort_expr = func.coalesce(sort_expr, _NULL_VISIT_DESC if is_desc else _NULL_VISIT_ASC)
+
+    if cursor:
+        after_value, after_id = _decode_cursor(cursor, sort_col)
+        if is_desc:
+            query = query.filter(or_(sort_expr < after_value, and_(sort_expr == after_value, rows.c.client_id < after_id)))
+        else:
+            query = query.filter(or_(sort_expr > after_value, and_(sort_expr == after_value, rows.c.client_id > after_id)))
+
+    if is_desc:
+        query = query.order_by(sort_expr.desc(), rows.c.client_id.desc())
+    else:
+        query = query.order_by(sort_expr.asc(), rows.c.client_id.asc())
+
+    if limit is None:
+        return [_client_row_to_dict(r) for r in query.all()]
+
+    page = query.add_columns(sort_expr.label("_sort_value")).limit(limit + 1).all()
+    if len(page) > limit:
+        page = page[:limit]
+        last = page[-1]
+        response.headers["X-Next-Cursor"] = _encode_cursor(last._sort_value, last.client_id)
+    return [_client_row_to_dict(r) for r in page]
 
 
 def _client_has_any_booking(db: Session, master_id: int, client_id: Optional[int], client_phone: Optional[str]) -> bool:
@@ -306,21 +388,43 @@ def get_client_detail(
         user = db.query(User).filter(User.id == client_id).first()
         client_phone = user.phone if user else ""
 
-    has_booking = _client_has_any_booking(db, master.id, client_id, client_phone)
+    uid = client_id
+    if not uid and client_phone:
+        uid = db.query(User.id).filter(User.phone == client_phone).scalar()
+    indie = db.query(IndieMaster).filter(IndieMaster.user_id == master.user_id).first()
+    # Агрегаты из master_client_stats; legacy-брони по indie_master_id в ней не учтены — тогда считаем по броням
+    stats = get_client_stats(db, master.id, uid) if not indie else None
+
+    has_booking = stats is not None or _client_has_any_booking(db, master.id, client_id, client_phone)
     has_metadata = _client_has_metadata(db, master.id, client_phone)
     if not has_booking and not has_metadata:
         raise HTTPException(status_code=404, detail="Клиент не найден")
 
-    rows = _get_clients_with_completed(db, master.id)
-    row = next((r for r in rows if r["client_key"] == client_key or (r.get("client_phone") == client_phone) or (r.get("client_id") == client_id)), None)
+    row = None
+    if stats is not None:
+        if stats.completed_count:
+            row = {
+                "client_id": uid,
+                "client_phone": client_phone or "",
+                "client_key": f"user:{uid}",
+                "completed_count": stats.completed_count,
+                "cancelled_count": stats.cancelled_count,
+                "last_visit_at": stats.last_visit_at,
+                "total_revenue": float(stats.total_revenue or 0),
+                "master_client_name": None,
+                "note": None,
+                "has_note": False,
+            }
+    else:
+        rows = _get_clients_with_completed(db, master.id, client_id=client_id, client_phone=client_phone)
+        row = next((r for r in rows if r["client_key"] == client_key or (r.get("client_phone") == client_phone) or (r.get("client_id") == client_id)), None)
 
+    meta = db.query(MasterClientMetadata).filter(
+        MasterClientMetadata.master_id == master.id,
+        MasterClientMetadata.client_phone == client_phone,
+    ).first()
     if not row:
-        # Только metadata, нет бронирований — собираем минимальную карточку
-        user = db.query(User).filter(User.id == client_id).first() if client_id else db.query(User).filter(User.phone == client_phone).first()
-        meta = db.query(MasterClientMetadata).filter(
-            MasterClientMetadata.master_id == master.id,
-            MasterClientMetadata.client_phone == client_phone,
-        ).first()
+        # Только metadata, нет завершённых визитов — собираем минимальную карточку
         row = {
             "client_id": client_id,
             "client_phone": client_phone or "",
@@ -333,22 +437,28 @@ def get_client_detail(
             "last_visit_at": None,
             "total_revenue": 0.0,
         }
-    meta = db.query(MasterClientMetadata).filter(
-        MasterClientMetadata.master_id == master.id,
-        MasterClientMetadata.client_phone == client_phone,
-    ).first()
     if meta:
         row["note"] = meta.note
         row["master_client_name"] = meta.alias_name
+        row["has_note"] = bool(meta.note)
 
     # Top services
-    uid = client_id
-    if not uid and client_phone:
-        uid = db.query(User.id).filter(User.phone == client_phone).scalar()
     if not uid:
         row["top_services"] = []
+    elif stats is not None:
+        top_counts = sorted(
+            ((int(sid), int(cnt)) for sid, cnt in (stats.service_counts or {}).items()),
+            key=lambda item: (-item[1], item[0]),
+        )[:5]
+        names = dict(
+            db.query(Service.id, Service.name).filter(Service.id.in_([sid for sid, _ in top_counts])).all()
+        ) if top_counts else {}
+        row["top_services"] = [
+            {"service_id": sid, "service_name": names[sid], "count": cnt}
+            for sid, cnt in top_counts
+            if sid in names
+        ]
     else:
-        indie = db.query(IndieMaster).filter(IndieMaster.user_id == master.user_id).first()
         bc = or_(Booking.master_id == master.id, Booking.indie_master_id == indie.id) if indie else (Booking.master_id == master.id)
         top_svc = (
             db.query(Service.id, Service.name, func.count(Booking.id).label("cnt"))
@@ -365,9 +475,10 @@ def get_client_detail(
     from utils.booking_status import get_cancellation_reasons
     reasons_map = get_cancellation_reasons()
     cb = []
-    if uid:
-        indie2 = db.query(IndieMaster).filter(IndieMaster.user_id == master.user_id).first()
-        bc2 = or_(Booking.master_id == master.id, Booking.indie_master_id == indie2.id) if indie2 else (Booking.master_id == master.id)
+    if uid and stats is not None:
+        cb = list(cancellations_by_reason(stats, CANCELLED_STATUSES).items())
+    elif uid:
+        bc2 = or_(Booking.master_id == master.id, Booking.indie_master_id == indie.id) if indie else (Booking.master_id == master.id)
         cb = (
             db.query(Booking.cancellation_reason, func.count(Booking.id).label("cnt"))
             .filter(bc2, Booking.client_id == uid, Booking.status.in_(CANCELLED_STATUSES), Booking.cancellation_reason.isnot(None))
@@ -9,6 +9,7 @@ from sqlalchemy import func, desc, and_, or_
 
 from fastapi import APIRouter, Depends, HTTPException, Query
 from database import get_db
+from threadpool_db_route import ThreadpoolDBRoute
 from models import (
     User, Master, LoyaltySettings, LoyaltyTransaction, Booking, Service
 )
@@ -19,7 +20,7 @@ from auth import get_current_active_user
 from utils.subscription_features import has_loyalty_access
 from routers.accounting import get_master_id_from_user
 
-router = APIRouter(prefix="/api/master/loyalty", tags=["master_loyalty"])
+router = APIRouter(prefix="/api/master/loyalty", tags=["master_loyalty"], route_class=ThreadpoolDBRoute)
 logger = logging.getLogger(__name__)
 
 
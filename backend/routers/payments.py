@@ -10,6 +10,7 @@ from sqlalchemy.orm import Session
 from sqlalchemy import and_
 
 from database import get_db
+from threadpool_db_route import ThreadpoolDBRoute
 from models import (
     User,
     Payment,
@@ -62,6 +63,7 @@ router = APIRouter(
     prefix="/payments",
     tags=["payments"],
     responses={401: {"description": "Требуется авторизация"}},
+    route_class=ThreadpoolDBRoute,
 )
 
 import logging
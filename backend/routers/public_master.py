@@ -3,7 +3,7 @@
 Master-only. Slug = masters.domain.
 """
 import logging
-from datetime import datetime, timedelta, time
+from datetime import datetime, time
 from zoneinfo import ZoneInfo
 from typing import Any, List, Optional
 
@@ -30,10 +30,11 @@ from utils.public_booking_loyalty import (
     effective_available_points,
 )
 from utils.loyalty import get_loyalty_settings
-from services.scheduling import get_available_slots, check_master_working_hours, check_booking_conflicts
+from services.scheduling import get_available_slots_for_range, check_master_working_hours, check_booking_conflicts
 from utils.loyalty_discounts import (
     evaluate_and_prepare_applied_discount,
     evaluate_discount_candidates,
+    evaluate_for_services,
     get_master_local_now,
     _master_local_to_utc,
     build_public_loyalty_visual_hints,
@@ -183,6 +184,16 @@ class BookingPricePreviewOut(BaseModel):
     )
 
 
+class ServicePricePreviewOut(BaseModel):
+    master_service_id: int
+    base_price: float
+    discount_percent: Optional[float] = None
+    discount_amount: float = 0.0
+    discounted_price: float
+    rule_name: Optional[str] = None
+    condition_type: Optional[str] = None
+
+
 def _get_master_by_slug(db: Session, slug: str) -> Optional[Master]:
     """Resolve slug (masters.domain) to Master. Master-only, case-insensitive."""
     return get_master_by_domain_slug(db, slug)
@@ -344,7 +355,7 @@ def get_public_availability(
     service_id: int,
     db: Session = Depends(get_db),
 ) -> Any:
-    """Доступные слоты в диапазоне дат. Единый источник: get_available_slots."""
+    """Доступные слоты в диапазоне дат. Единый источник: get_available_slots_for_range."""
     master = _get_master_by_slug(db, slug)
     if not master:
         raise HTTPException(status_code=404, detail="Мастер не найден")
@@ -367,14 +378,11 @@ def get_public_availability(
     slots_out: List[PublicSlotOut] = []
     tz = _master_zoneinfo(master)
     now_master = datetime.now(tz)
-    current = from_dt.date()
-    end = to_dt.date()
-    while current <= end:
-        day_dt = datetime.combine(current, datetime.min.time())
-        day_slots = get_available_slots(
-            db, OwnerType.MASTER, master.id, day_dt, duration, branch_id=None
-        )
-        for s in day_slots:
+    slots_by_day = get_available_slots_for_range(
+        db, OwnerType.MASTER, master.id, from_dt.date(), to_dt.date(), duration, branch_id=None
+    )
+    for day in sorted(slots_by_day):
+        for s in slots_by_day[day]:
             st = s.get("start_time")
             et = s.get("end_time")
             if st and et:
@@ -390,7 +398,6 @@ def get_public_availability(
                         end_time=et_a.isoformat(),
                     )
                 )
-        current = current + timedelta(days=1)
 
     return PublicAvailabilityOut(
         slots=slots_out,
@@ -698,3 +705,72 @@ def get_booking_price_preview(
         loyalty_points_to_use=int(loyalty.get("loyalty_points_to_use") or 0),
         loyalty_program_enabled=bool(loyalty.get("loyalty_program_enabled")),
     )
+
+
+@router.get(
+    "/{slug}/booking-price-previews",
+    response_model=List[ServicePricePreviewOut],
+    summary="Цены со скидкой для списка услуг на выбранное время",
+    responses={404: {"description": "Мастер не найден"}},
+)
+def get_booking_price_previews(
+    slug: str,
+    start_time: datetime = Query(..., description="Начало выбранного слота (ISO)"),
+    service_ids: Optional[List[int]] = Query(None, description="ID MasterService; по умолчанию — все услуги мастера"),
+    db: Session = Depends(get_db),
+    current_user: Optional[User] = Depends(get_current_user_optional),
+) -> Any:
+    """
+    Скидка по каждой услуге, как в booking-price-preview, но одним расчётом: правила мастера
+    и история клиента загружаются один раз на весь список. Без баллов.
+    """
+    master = _get_master_by_slug(db, slug)
+    if not master:
+        raise HTTPException(status_code=404, detail="Мастер не найден")
+    _ensure_master_timezone(master)
+
+    query = db.query(MasterService).filter(MasterService.master_id == master.id)
+    if service_ids:
+        query = query.filter(MasterService.id.in_(service_ids))
+    master_services = query.order_by(MasterService.id).all()
+
+    canonical = {
+        ms.id: _resolve_canonical_service_for_master_service(db, master, ms) for ms in master_services
+    }
+
+    client_id: Optional[int] = None
+    client_phone: Optional[str] = None
+    if current_user and current_user.role == UserRole.CLIENT and current_user.id:
+        client_id = current_user.id
+        client_phone = current_user.phone or ""
+
+    evaluated = evaluate_for_services(
+        master.id,
+        client_id,
+        client_phone,
+        sorted({svc.id for svc in canonical.values()}),
+        start_time,
+        db,
+    )
+
+    out: List[ServicePricePreviewOut] = []
+    for ms in master_services:
+        service = canonical[ms.id]
+        base_price = float(service.price or 0)
+        discounted_amount, applied = evaluated.get(service.id, (None, None))
+        if not applied or discounted_amount is None:
+            out.append(ServicePricePreviewOut(master_service_id=ms.id, base_price=base_price, discounted_price=base_price))
+            continue
+        disc_pct = applied.get("discount_percent")
+        out.append(
+            ServicePricePreviewOut(
+                master_service_id=ms.id,
+                base_price=base_price,
+                discount_percent=float(disc_pct) if disc_pct is not None else None,
+                discount_amount=float(applied.get("discount_amount") or 0),
+                discounted_price=float(discounted_amount),
+                rule_name=_sanitize_public_loyalty_rule_name(applied.get("rule_name")),
+                condition_type=applied.get("condition_type"),
+            )
+        )
+    return out
@@ -7,6 +7,7 @@ import os
 import uuid
 
 from database import get_db
+from threadpool_db_route import ThreadpoolDBRoute
 from models import (
     Salon, Service, ServiceCategory, Master, User, Booking, SalonMasterInvitation, SalonMasterInvitationStatus, MasterScheduleSettings, SalonMasterServiceSettings, SalonBranch, SalonPlace, MasterSchedule, BranchManagerInvitation as BranchManagerInvitationModel, ClientRestriction, ExpenseType, Expense, ExpenseTemplate
 )
@@ -62,6 +63,7 @@ from auth import require_salon, get_current_active_user
 router = APIRouter(
     prefix="/salon",
     tags=["salon"],
+    route_class=ThreadpoolDBRoute,
 )
 
 
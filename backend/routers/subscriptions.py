@@ -7,6 +7,7 @@ import math
 import logging
 
 from database import get_db
+from threadpool_db_route import ThreadpoolDBRoute
 from models import (
     User,
     Subscription,
@@ -64,6 +65,7 @@ router = APIRouter(
     prefix="/subscriptions",
     tags=["subscriptions"],
     responses={401: {"description": "Требуется авторизация"}},
+    route_class=ThreadpoolDBRoute,
 )
 logger = logging.getLogger(__name__)
 
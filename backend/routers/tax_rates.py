@@ -10,10 +10,11 @@ from sqlalchemy.orm import Session
 from sqlalchemy import desc, and_
 
 from database import get_db
+from threadpool_db_route import ThreadpoolDBRoute
 from models import User, TaxRate, BookingConfirmation
 from auth import get_current_active_user
 
-router = APIRouter(prefix="/api/master/tax-rates", tags=["tax-rates"])
+router = APIRouter(prefix="/api/master/tax-rates", tags=["tax-rates"], route_class=ThreadpoolDBRoute)
 logger = logging.getLogger(__name__)
 
 
@@ -0,0 +1,481 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк горячих запросов по броням: EXPLAIN-планы и время на SQLite и PostgreSQL.
+
+Засевает реалистичный набор данных генераторами scripts/reseed_local_test_data.py (недельный
+сценарий дашборда smoke-мастера — статусы, часы, клиенты — размноженный на всех мастеров и на
+историю; ФИО/email клиентов; услуги), затем для запросов, стоящих за главными эндпоинтами
+(слоты, дашборд, будущие записи, лимиты, клиенты, ограничения), записывает план и время.
+Код выхода 1 — план какого-либо запроса стал полным просмотром таблицы bookings.
+
+Запуск (из корня проекта):
+  python backend/scripts/benchmark_booking_queries.py
+  python backend/scripts/benchmark_booking_queries.py --database-url postgresql://u:p@localhost/bench \\
+      --masters 500 --output bench-postgres.json
+
+По умолчанию — временный файл SQLite. --database-url должен указывать на пустую отдельную БД:
+таблицы создаются по models (Base.metadata), данные вставляются напрямую.
+"""
+
+from __future__ import annotations
+
+import argparse
+import enum
+import json
+import os
+import re
+import statistics
+import sys
+import tempfile
+import time as time_module
+from collections import Counter
+from dataclasses import asdict, dataclass, field
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional
+
+_BACKEND_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, _BACKEND_ROOT)
+sys.path.insert(0, _SCRIPTS_DIR)
+
+from sqlalchemy import create_engine, func, insert, or_, text  # noqa: E402
+from sqlalchemy.engine import Engine  # noqa: E402
+from sqlalchemy.orm import Session, sessionmaker  # noqa: E402
+
+from database import Base  # noqa: E402
+from models import Booking, BookingStatus, IndieMaster, Master, Service, User, UserRole  # noqa: E402
+from services.scheduling import _master_bookings_query  # noqa: E402
+from utils.master_future_bookings_query import (  # noqa: E402
+    active_future_bookings_sql_filter,
+    future_bookings_sql_filter,
+)
+
+import reseed_local_test_data as reseed  # noqa: E402
+
+_INSERT_CHUNK = 2000
+_SEEDED_TABLES = ("users", "masters", "indie_masters", "services", "bookings")
+_PLACEHOLDER_PASSWORD_HASH = "!benchmark"
+
+# Полный просмотр bookings в строке плана (SQLite EXPLAIN QUERY PLAN / PostgreSQL EXPLAIN)
+_FULL_SCAN_PATTERNS = {
+    "sqlite": re.compile(r"^SCAN bookings(_\d+)?\b"),
+    "postgresql": re.compile(r"Seq Scan on bookings\b"),
+}
+
+
+@dataclass
+class BenchContext:
+    """Идентификаторы, на которых выполняются запросы (типичный мастер, инди-мастер, клиент)."""
+
+    now: datetime
+    master_id: int
+    indie_master_id: int
+    client_id: int
+    counts: Dict[str, int] = field(default_factory=dict)
+
+
+@dataclass
+class BenchQuery:
+    name: str
+    endpoint: str
+    build: Callable[[Session, BenchContext], Any]
+
+
+# --- Данные ---
+
+
+def _template_rows(today: date) -> List[Dict[str, Any]]:
+    """Недельный сценарий smoke-мастера (5 недель вокруг today) из reseed_local_test_data."""
+    rows = []
+    for row in reseed.build_smoke_master0_dashboard_bookings(today, service_id=0):
+        rows.append({
+            "client_idx": int(row["client_phone"][-6:]) % reseed.CLIENTS_PER_MASTER,
+            "on_date": date.fromisoformat(row["on_date"]),
+            "hour": row["hour"],
+            "minute": row["minute"],
+            "status": row["status"],
+            "cancellation_reason": row.get("cancellation_reason"),
+        })
+    return rows
+
+
+def _regular_client_idx(template: List[Dict[str, Any]]) -> int:
+    """Клиент с наибольшим числом броней в сценарии — для клиентских запросов."""
+    return Counter(row["client_idx"] for row in template).most_common(1)[0][0]
+
+
+def _insert_chunked(conn, table, rows: List[Dict[str, Any]]) -> None:
+    for i in range(0, len(rows), _INSERT_CHUNK):
+        conn.execute(insert(table), rows[i:i + _INSERT_CHUNK])
+
+
+def seed_dataset(
+    engine: Engine,
+    *,
+    masters: int = 200,
+    history_cycles: int = 12,
+    indie_every: int = 4,
+    now: Optional[datetime] = None,
+) -> BenchContext:
+    """
+    Засеять пустую БД: masters мастеров (каждый indie_every-й — инди), по CLIENTS_PER_MASTER
+    клиентов у каждого; брони — сценарий дашборда, повторённый history_cycles раз в прошлое
+    (по 5 недель). Прошлые pending в истории становятся completed.
+    """
+    now = now or datetime.utcnow().replace(second=0, microsecond=0)
+    template = _template_rows(now.date())
+    cycle_days = 35
+
+    users: List[Dict[str, Any]] = []
+    master_rows: List[Dict[str, Any]] = []
+    indie_rows: List[Dict[str, Any]] = []
+    owners: List[tuple] = []  # (master_id | None, indie_master_id | None, first_client_user_id)
+    service_rows = [
+        {"id": i + 1, "name": s["name"], "duration": s["duration"], "price": s["price"]}
+        for i, s in enumerate(reseed.SERVICES)
+    ]
+
+    user_id = 0
+    for m in range(masters):
+        user_id += 1
+        master_user_id = user_id
+        users.append({
+            "id": master_user_id,
+            "phone": f"+7997{m:07d}",
+            "email": f"bench.master.{m}@example.com",
+            "full_name": f"Мастер {m}",
+            "role": UserRole.INDIE if indie_every and m % indie_every == indie_every - 1 else UserRole.MASTER,
+            "hashed_password": _PLACEHOLDER_PASSWORD_HASH,
+            "is_active": True,
+        })
+        master_rows.append({"id": m + 1, "user_id": master_user_id, "bio": "", "experience_years": 1})
+        indie_id = None
+        if users[-1]["role"] == UserRole.INDIE:
+            indie_id = len(indie_rows) + 1
+            indie_rows.append({"id": indie_id, "user_id": master_user_id, "master_id": m + 1})
+        first_client = user_id + 1
+        for c in range(reseed.CLIENTS_PER_MASTER):
+            user_id += 1
+            phone = f"+7998{m:03d}{c:04d}"
+            body = reseed.client_register_body(m * reseed.CLIENTS_PER_MASTER + c, phone)
+            users.append({
+                "id": user_id,
+                "phone": phone,
+                "email": f"bench.{body['email']}",
+                "full_name": body["full_name"],
+                "role": UserRole.CLIENT,
+                "hashed_password": _PLACEHOLDER_PASSWORD_HASH,
+                "is_active": True,
+            })
+        owners.append((None if indie_id else m + 1, indie_id, first_client))
+
+    bookings: List[Dict[str, Any]] = []
+    for m, (master_id, indie_master_id, first_client) in enumerate(owners):
+        for cycle in range(history_cycles):
+            shift = timedelta(days=cycle_days * cycle)
+            for i, row in enumerate(template):
+                service = service_rows[(i + m) % len(service_rows)]
+                start = datetime.combine(row["on_date"], datetime.min.time()).replace(
+                    hour=row["hour"], minute=row["minute"]
+                ) - shift
+                status = row["status"]
+                if start < now and status in (BookingStatus.CREATED.value, BookingStatus.AWAITING_CONFIRMATION.value):
+                    status = BookingStatus.COMPLETED.value if cycle else status
+                created = start - timedelta(days=3)
+                bookings.append({
+                    "id": len(bookings) + 1,
+                    "client_id": first_client + row["client_idx"],
+                    "service_id": service["id"],
+                    "master_id": master_id,
+                    "indie_master_id": indie_master_id,
+                    "start_time": start,
+                    "end_time": start + timedelta(minutes=service["duration"]),
+                    "status": status,
+                    "cancellation_reason": row["cancellation_reason"],
+                    "payment_amount": service["price"],
+                    "is_paid": status == BookingStatus.COMPLETED.value,
+                    "loyalty_points_used": 0,
+                    "public_reference": f"BENCH{len(bookings) + 1:010d}",
+                    "created_at": created,
+                    "updated_at": created,
+                })
+
+    with engine.begin() as conn:
+        _insert_chunked(conn, User.__table__, users)
+        _insert_chunked(conn, Master.__table__, master_rows)
+        _insert_chunked(conn, IndieMaster.__table__, indie_rows)
+        _insert_chunked(conn, Service.__table__, service_rows)
+        _insert_chunked(conn, Booking.__table__, bookings)
+        if engine.dialect.name == "postgresql":
+            # id заданы явно — сдвигаем последовательности
+            for table in _SEEDED_TABLES:
+                conn.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE(MAX(id), 1)) FROM {table}"
+                ))
+    with engine.connect() as conn:
+        conn.execute(text("ANALYZE"))
+        conn.commit()
+
+    # Типичные владельцы — из середины набора
+    master_idx = next(i for i in range(len(owners) // 2, len(owners)) if owners[i][0])
+    indie_idx = next((i for i in range(len(owners) // 2, len(owners)) if owners[i][1]), None)
+    if indie_idx is None:
+        indie_idx = next((i for i in range(len(owners)) if owners[i][1]), master_idx)
+    return BenchContext(
+        now=now,
+        master_id=owners[master_idx][0],
+        indie_master_id=owners[indie_idx][1] or owners[indie_idx][0],
+        client_id=owners[master_idx][2] + _regular_client_idx(template),
+        counts={
+            "users": len(users),
+            "masters": len(master_rows),
+            "indie_masters": len(indie_rows),
+            "bookings": len(bookings),
+        },
+    )
+
+
+# --- Запросы ---
+
+
+def _period_bounds(ctx: BenchContext, days_back: int, days_forward: int) -> tuple:
+    start = datetime.combine(ctx.now.date() - timedelta(days=days_back), datetime.min.time())
+    end = datetime.combine(ctx.now.date() + timedelta(days=days_forward), datetime.max.time())
+    return start, end
+
+
+def _owner_filter(master_id: int):
+    return or_(Booking.master_id == master_id, Booking.indie_master_id == master_id)
+
+
+def _slots_master_day(db: Session, ctx: BenchContext):
+    day_start = datetime.combine(ctx.now.date() + timedelta(days=1), datetime.min.time())
+    return _master_bookings_query(db, ctx.master_id, day_start, day_start + timedelta(days=1))
+
+
+def _conflicts_indie_day(db: Session, ctx: BenchContext):
+    day_start = datetime.combine(ctx.now.date() + timedelta(days=1), datetime.min.time())
+    return db.query(Booking).filter(
+        Booking.indie_master_id == ctx.indie_master_id,
+        Booking.status != "cancelled",
+        Booking.status != "rejected",
+        Booking.start_time < day_start + timedelta(days=1),
+        Booking.end_time > day_start,
+    )
+
+
+def _dashboard_period(db: Session, ctx: BenchContext):
+    start, end = _period_bounds(ctx, 14, 14)
+    return (
+        db.query(Booking.status, Booking.start_time, Booking.payment_amount, Service.price)
+        .outerjoin(Service, Booking.service_id == Service.id)
+        .filter(_owner_filter(ctx.master_id), Booking.start_time >= start, Booking.start_time <= end)
+    )
+
+
+def _future_bookings(db: Session, ctx: BenchContext):
+    master = SimpleNamespace(id=ctx.master_id)
+    return db.query(Booking).filter(future_bookings_sql_filter(master, ctx.now)).order_by(Booking.start_time)
+
+
+def _active_future_count(db: Session, ctx: BenchContext):
+    master = SimpleNamespace(id=ctx.master_id)
+    return db.query(func.count(Booking.id)).filter(active_future_bookings_sql_filter(master, ctx.now))
+
+
+def _monthly_limit_count(db: Session, ctx: BenchContext):
+    month_start = ctx.now.date().replace(day=1)
+    month_end = (month_start + timedelta(days=32)).replace(day=1)
+    return db.query(func.count(Booking.id)).filter(
+        Booking.master_id == ctx.master_id,
+        Booking.start_time >= month_start,
+        Booking.start_time < month_end,
+    )
+
+
+def _master_clients(db: Session, ctx: BenchContext):
+    return (
+        db.query(Booking.client_id, func.count(Booking.id), func.max(Booking.start_time))
+        .filter(Booking.master_id == ctx.master_id)
+        .group_by(Booking.client_id)
+    )
+
+
+def _client_future_bookings(db: Session, ctx: BenchContext):
+    return (
+        db.query(Booking)
+        .filter(Booking.client_id == ctx.client_id, Booking.start_time >= ctx.now)
+        .order_by(Booking.start_time)
+    )
+
+
+def _client_past_bookings(db: Session, ctx: BenchContext):
+    return (
+        db.query(Booking)
+        .filter(Booking.client_id == ctx.client_id, Booking.start_time < ctx.now)
+        .order_by(Booking.start_time.desc())
+        .limit(50)
+    )
+
+
+def _client_restriction_cancellations(db: Session, ctx: BenchContext):
+    return db.query(func.count(Booking.id)).filter(
+        Booking.master_id == ctx.master_id,
+        Booking.client_id == ctx.client_id,
+        Booking.status == BookingStatus.CANCELLED.value,
+        Booking.cancellation_reason == "client_no_show",
+    )
+
+
+BENCH_QUERIES: List[BenchQuery] = [
+    BenchQuery("slots_master_day", "GET /api/bookings/available-slots (мастер)", _slots_master_day),
+    BenchQuery("conflicts_indie_day", "POST /api/bookings (проверка пересечений, инди)", _conflicts_indie_day),
+    BenchQuery("dashboard_period", "GET /api/master/dashboard/stats", _dashboard_period),
+    BenchQuery("future_bookings", "GET /api/master/bookings/future", _future_bookings),
+    BenchQuery("active_future_count", "GET /api/master/bookings/limit", _active_future_count),
+    BenchQuery("monthly_limit_count", "лимит записей в месяц (utils.subscription_limits)", _monthly_limit_count),
+    BenchQuery("master_clients", "GET /api/master/clients", _master_clients),
+    BenchQuery("client_future_bookings", "GET /api/client/bookings/", _client_future_bookings),
+    BenchQuery("client_past_bookings", "GET /api/client/bookings/past", _client_past_bookings),
+    BenchQuery("client_restriction_cancellations", "ограничения клиента (utils.client_restrictions)",
+               _client_restriction_cancellations),
+]
+
+
+# --- EXPLAIN и время ---
+
+
+def _driver_value(value: Any, dialect_name: str) -> Any:
+    if isinstance(value, enum.Enum):
+        return value.value
+    if dialect_name == "sqlite" and isinstance(value, datetime):
+        # Формат хранения DateTime в SQLAlchemy для SQLite
+        return value.strftime("%Y-%m-%d %H:%M:%S.%f")
+    if dialect_name == "sqlite" and isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def _statement(query: Any) -> Any:
+    return getattr(query, "statement", query)
+
+
+def explain(db: Session, query: Any) -> List[str]:
+    """Строки плана запроса: SQLite — EXPLAIN QUERY PLAN, PostgreSQL — EXPLAIN."""
+    dialect = db.get_bind().dialect
+    compiled = _statement(query).compile(dialect=dialect, compile_kwargs={"render_postcompile": True})
+    values = {k: _driver_value(v, dialect.name) for k, v in compiled.params.items()}
+    params: Any = tuple(values[k] for k in compiled.positiontup) if compiled.positiontup else values
+    conn = db.connection()
+    if dialect.name == "sqlite":
+        return [row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", params).all()]
+    if dialect.name == "postgresql":
+        return [row[0] for row in conn.exec_driver_sql(f"EXPLAIN {compiled}", params).all()]
+    raise ValueError(f"EXPLAIN не поддержан для {dialect.name}")
+
+
+def is_full_table_scan(dialect_name: str, plan: List[str]) -> bool:
+    pattern = _FULL_SCAN_PATTERNS[dialect_name]
+    return any(pattern.search(line.strip()) for line in plan)
+
+
+def time_query(db: Session, query: Any, repeat: int) -> Dict[str, Any]:
+    statement = _statement(query)
+    samples = []
+    rows = 0
+    for _ in range(repeat):
+        started = time_module.perf_counter()
+        rows = len(db.execute(statement).all())
+        samples.append((time_module.perf_counter() - started) * 1000)
+    return {
+        "rows": rows,
+        "min_ms": round(min(samples), 3),
+        "median_ms": round(statistics.median(samples), 3),
+    }
+
+
+def run_benchmark(db: Session, ctx: BenchContext, *, repeat: int = 5) -> Dict[str, Any]:
+    dialect_name = db.get_bind().dialect.name
+    results = []
+    for bench in BENCH_QUERIES:
+        query = bench.build(db, ctx)
+        plan = explain(db, query)
+        results.append({
+            "name": bench.name,
+            "endpoint": bench.endpoint,
+            "plan": plan,
+            "full_table_scan": is_full_table_scan(dialect_name, plan),
+            **(time_query(db, query, repeat) if repeat else {}),
+        })
+    return {
+        "dialect": dialect_name,
+        "generated_at": datetime.utcnow().isoformat(),
+        "dataset": ctx.counts,
+        "context": {k: v for k, v in asdict(ctx).items() if k != "counts"},
+        "queries": results,
+    }
+
+
+def plan_regressions(report: Dict[str, Any]) -> List[str]:
+    return [q["name"] for q in report["queries"] if q["full_table_scan"]]
+
+
+def _print_report(report: Dict[str, Any]) -> None:
+    print(f"dialect={report['dialect']} dataset={report['dataset']}")
+    for q in report["queries"]:
+        flag = "FULL SCAN" if q["full_table_scan"] else "ok"
+        timing = f"{q['median_ms']:>9.2f} ms  rows={q['rows']}" if "median_ms" in q else ""
+        print(f"  {q['name']:<34} {flag:<9} {timing}")
+        for line in q["plan"]:
+            print(f"      {line}")
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="EXPLAIN-планы и время горячих запросов по броням")
+    ap.add_argument("--database-url", help="Пустая БД для бенчмарка (по умолчанию — временный SQLite)")
+    ap.add_argument("--masters", type=int, default=200, help="Число мастеров")
+    ap.add_argument("--history-cycles", type=int, default=12, help="Сколько 5-недельных циклов броней в прошлом")
+    ap.add_argument("--indie-every", type=int, default=4, help="Каждый N-й мастер — инди (0 — нет)")
+    ap.add_argument("--repeat", type=int, default=5, help="Повторов каждого запроса для времени")
+    ap.add_argument("--output", help="Записать отчёт (JSON) в файл")
+    args = ap.parse_args()
+
+    tmp_dir = None
+    url = args.database_url
+    if not url:
+        tmp_dir = tempfile.mkdtemp(prefix="booking-bench-")
+        url = f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}"
+    engine = create_engine(url)
+    if engine.dialect.name not in _FULL_SCAN_PATTERNS:
+        print(f"Неподдерживаемая БД: {engine.dialect.name}", file=sys.stderr)
+        return 2
+
+    Base.metadata.create_all(bind=engine)
+    with engine.connect() as conn:
+        if conn.execute(text("SELECT COUNT(*) FROM bookings")).scalar():
+            print("bookings не пустая — нужна отдельная пустая БД", file=sys.stderr)
+            return 2
+
+    started = time_module.perf_counter()
+    ctx = seed_dataset(
+        engine, masters=args.masters, history_cycles=args.history_cycles, indie_every=args.indie_every
+    )
+    print(f"seeded {ctx.counts} in {time_module.perf_counter() - started:.1f}s")
+
+    with sessionmaker(bind=engine)() as db:
+        report = run_benchmark(db, ctx, repeat=args.repeat)
+    _print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, ensure_ascii=False, indent=2, default=str)
+
+    regressions = plan_regressions(report)
+    if regressions:
+        print(f"Полный просмотр bookings: {', '.join(regressions)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Прогон ежедневных списаний без записи в БД — проверка результатов и пропускной способности.
+
+  python3 scripts/daily_charges_dry_run.py
+  python3 scripts/daily_charges_dry_run.py --date 2026-03-10 --chunk-size 1000
+
+Считает всё как process_all_daily_charges (пакетно, services.daily_charge_batch),
+но транзакции чанков откатываются; EXPIRED/PENDING-активация не выполняются.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Dry-run daily subscription charges")
+    parser.add_argument("--date", type=date.fromisoformat, default=None, help="Дата списания (YYYY-MM-DD), по умолчанию сегодня")
+    parser.add_argument("--chunk-size", type=int, default=None)
+    args = parser.parse_args()
+
+    from database import SessionLocal
+    from services.daily_charges import process_all_daily_charges
+
+    db = SessionLocal()
+    try:
+        result = process_all_daily_charges(args.date, db=db, dry_run=True, chunk_size=args.chunk_size)
+        throughput = result.get("throughput") or {}
+        chunks = throughput.get("chunks") or []
+        print(
+            {
+                "date": result.get("date"),
+                "total_subscriptions": result.get("total_subscriptions"),
+                "successful_charges": result.get("successful_charges"),
+                "failed_charges": result.get("failed_charges"),
+                "deactivated_subscriptions": result.get("deactivated_subscriptions"),
+                "chunks": len(chunks),
+                "max_chunk_seconds": max((c["seconds"] for c in chunks), default=0),
+                "elapsed_seconds": throughput.get("elapsed_seconds"),
+                "subscriptions_per_second": throughput.get("subscriptions_per_second"),
+            }
+        )
+        return 0 if not result.get("error") else 1
+    finally:
+        db.rollback()
+        db.close()
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Заполнить/пересобрать master_client_stats по всем броням (utils.master_client_stats).
+
+  python3 scripts/rebuild_master_client_stats.py --dry-run
+  python3 scripts/rebuild_master_client_stats.py --apply
+  python3 scripts/rebuild_master_client_stats.py --apply --master-id 42
+
+--dry-run: пересборка в транзакции с откатом, только отчёт.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Rebuild master_client_stats")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--dry-run", action="store_true", help="Отчёт без изменений")
+    group.add_argument("--apply", action="store_true", help="Записать изменения")
+    parser.add_argument("--master-id", type=int, default=None, help="Только один мастер (masters.id)")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    from database import SessionLocal
+    from utils.master_client_stats import rebuild_all
+
+    db = SessionLocal()
+    try:
+        started = time.monotonic()
+        result = rebuild_all(db, master_id=args.master_id, chunk_size=args.chunk_size)
+        if args.apply:
+            db.commit()
+        else:
+            db.rollback()
+        print({"dry_run": bool(args.dry_run), **result, "seconds": round(time.monotonic() - started, 2)})
+        return 0
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
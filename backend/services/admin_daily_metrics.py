@@ -0,0 +1,503 @@
+"""
+Дневной rollup статистики админки (таблица admin_daily_metrics).
+
+Строка на день: пользователи по дню created_at (по ролям, активные, indie-мастера), мастера
+по дню Master.created_at, брони по дню start_time (по статусам, суммарная длительность).
+Эндпоинты /api/admin/stats, /stats/users, /dashboard/stats суммируют строки вместо COUNT(*)
+по users/bookings — стоимость не зависит от размера таблиц.
+
+Актуальность:
+- события сессии SQLAlchemy помечают затронутые дни (создание/удаление/смена статуса,
+  времени, роли); после commit дни попадают в очередь процесса и пересчитываются при
+  ближайшем чтении статистики или тике фоновой задачи;
+- фоновая задача раз в ADMIN_METRICS_REFRESH_SECONDS добирает изменения других процессов
+  по updated_at (watermark в GlobalSettings), раз в сутки пересобирает таблицу целиком —
+  это же исправляет массовые UPDATE/DELETE, после которых дни неизвестны.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, Optional, Set
+
+from sqlalchemy import and_, case, delete, event, false, func, insert, inspect, or_, true
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import AdminDailyMetrics, Booking, BookingStatus, GlobalSettings, Master, User, UserRole
+from settings import get_settings
+from services.job_runner import job_runner
+
+logger = logging.getLogger(__name__)
+
+# День для записей без created_at / start_time: сумма строк остаётся равной итогам таблиц
+UNDATED = date(1970, 1, 1)
+WATERMARK_KEY = "admin_daily_metrics_watermark"
+# Запас на рассинхрон часов/транзакций, перекрывающий предыдущий watermark
+_WATERMARK_OVERLAP = timedelta(seconds=5)
+
+_PENDING_DAYS_KEY = "admin_metrics_pending_days"
+_PENDING_USERS_KEY = "admin_metrics_pending_users"
+_PENDING_FULL_KEY = "admin_metrics_pending_full"
+
+_BOOKING_FIELDS = ("start_time", "end_time", "status")
+_USER_FIELDS = ("created_at", "role", "is_active")
+_MASTER_FIELDS = ("created_at", "can_work_independently", "user_id")
+
+
+class _DirtyQueue:
+    """Дни (и user_id для индивидуальных мастеров), изменённые закоммиченными транзакциями процесса."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.days: Set[date] = set()
+        self.user_ids: Set[int] = set()
+        self.full = False
+
+    def add(self, days: Iterable[date] = (), user_ids: Iterable[int] = (), full: bool = False) -> None:
+        with self._lock:
+            self.days.update(days)
+            self.user_ids.update(user_ids)
+            self.full = self.full or full
+
+    def drain(self):
+        with self._lock:
+            out = (self.days, self.user_ids, self.full)
+            self.days, self.user_ids, self.full = set(), set(), False
+        return out
+
+    def reset(self) -> None:
+        self.drain()
+
+
+dirty_queue = _DirtyQueue()
+
+
+def _as_date(value: Any) -> date:
+    if value is None:
+        return UNDATED
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    # SQLite: func.date() возвращает строку YYYY-MM-DD
+    return date.fromisoformat(str(value)[:10])
+
+
+def _enum_value(value: Any) -> Optional[str]:
+    return getattr(value, "value", value)
+
+
+def _day_filter(column, days: Optional[Set[date]]):
+    """Диапазонный фильтр по дням (использует индекс по колонке); None — без ограничения."""
+    if days is None:
+        return true()
+    conds = [
+        and_(
+            column >= datetime.combine(d, datetime.min.time()),
+            column < datetime.combine(d + timedelta(days=1), datetime.min.time()),
+        )
+        for d in days
+        if d != UNDATED
+    ]
+    if UNDATED in days:
+        conds.append(column.is_(None))
+    return or_(*conds) if conds else false()
+
+
+def _duration_hours_expr(db: Session):
+    if db.get_bind().dialect.name == "sqlite":
+        return (func.julianday(Booking.end_time) - func.julianday(Booking.start_time)) * 24.0
+    return func.extract("epoch", Booking.end_time - Booking.start_time) / 3600.0
+
+
+def _empty_row(day: date) -> Dict[str, Any]:
+    return {
+        "metric_date": day,
+        "users_created": 0,
+        "users_active": 0,
+        "users_by_role": {},
+        "indie_masters": 0,
+        "masters_created": 0,
+        "bookings_total": 0,
+        "bookings_by_status": {},
+        "booking_duration_hours_sum": 0.0,
+        "bookings_with_duration": 0,
+    }
+
+
+def compute_daily_metrics(db: Session, days: Optional[Set[date]] = None) -> Dict[date, Dict[str, Any]]:
+    """Строки rollup по текущим данным — за указанные дни или (days=None) за всё время."""
+    rows: Dict[date, Dict[str, Any]] = {}
+
+    def _row(day_value: Any) -> Dict[str, Any]:
+        day = _as_date(day_value)
+        if day not in rows:
+            rows[day] = _empty_row(day)
+        return rows[day]
+
+    user_day = func.date(User.created_at)
+    for day_value, role, is_active, count in (
+        db.query(user_day, User.role, User.is_active, func.count(User.id))
+        .filter(_day_filter(User.created_at, days))
+        .group_by(user_day, User.role, User.is_active)
+    ):
+        row = _row(day_value)
+        row["users_created"] += count
+        if is_active:
+            row["users_active"] += count
+        key = _enum_value(role) or "unknown"
+        row["users_by_role"][key] = row["users_by_role"].get(key, 0) + count
+
+    for day_value, count in (
+        db.query(user_day, func.count(User.id))
+        .join(Master, Master.user_id == User.id)
+        .filter(
+            _day_filter(User.created_at, days),
+            User.role == UserRole.MASTER,
+            Master.can_work_independently == True,
+        )
+        .group_by(user_day)
+    ):
+        _row(day_value)["indie_masters"] += count
+
+    master_day = func.date(Master.created_at)
+    for day_value, count in (
+        db.query(master_day, func.count(Master.id))
+        .filter(_day_filter(Master.created_at, days))
+        .group_by(master_day)
+    ):
+        _row(day_value)["masters_created"] += count
+
+    booking_day = func.date(Booking.start_time)
+    has_duration = and_(
+        Booking.start_time.isnot(None),
+        Booking.end_time.isnot(None),
+        Booking.end_time > Booking.start_time,
+    )
+    for day_value, status, count, hours, with_duration in (
+        db.query(
+            booking_day,
+            Booking.status,
+            func.count(Booking.id),
+            func.coalesce(func.sum(case((has_duration, _duration_hours_expr(db)), else_=0.0)), 0.0),
+            func.coalesce(func.sum(case((has_duration, 1), else_=0)), 0),
+        )
+        .filter(_day_filter(Booking.start_time, days))
+        .group_by(booking_day, Booking.status)
+    ):
+        row = _row(day_value)
+        row["bookings_total"] += count
+        key = _enum_value(status) or "unknown"
+        row["bookings_by_status"][key] = row["bookings_by_status"].get(key, 0) + count
+        row["booking_duration_hours_sum"] += float(hours or 0)
+        row["bookings_with_duration"] += int(with_duration or 0)
+
+    return rows
+
+
+def _write_rows(db: Session, days: Optional[Set[date]], rows: Dict[date, Dict[str, Any]]) -> None:
+    stmt = delete(AdminDailyMetrics)
+    if days is not None:
+        stmt = stmt.where(AdminDailyMetrics.metric_date.in_(days))
+    db.execute(stmt)
+    if rows:
+        now = datetime.utcnow()
+        db.execute(insert(AdminDailyMetrics), [{**r, "refreshed_at": now} for r in rows.values()])
+
+
+def _user_days(db: Session, user_ids: Set[int]) -> Set[date]:
+    if not user_ids:
+        return set()
+    return {
+        _as_date(created_at)
+        for (created_at,) in db.query(User.created_at).filter(User.id.in_(user_ids))
+    }
+
+
+def refresh_days(db: Session, days: Set[date], *, commit: bool = True) -> int:
+    """
+    Пересчитать указанные дни. Возвращает число дней.
+    commit=False — транзакция вызывающего: конфликт с параллельным пересчётом пробрасывается,
+    чтобы вызывающий не сдвинул watermark и вернул дни в очередь.
+    """
+    if not days:
+        return 0
+    days = set(days)
+    rows = compute_daily_metrics(db, days)
+    try:
+        _write_rows(db, days, rows)
+        if commit:
+            db.commit()
+    except IntegrityError:
+        if not commit:
+            raise
+        # Тот же день параллельно пересчитал другой процесс — его значения не хуже наших
+        db.rollback()
+        logger.debug("admin_daily_metrics: concurrent refresh of %s days", len(days))
+    return len(days)
+
+
+def rebuild_admin_daily_metrics(db: Session) -> int:
+    """Полная пересборка таблицы. Возвращает число строк."""
+    started = datetime.utcnow()
+    rows = compute_daily_metrics(db, None)
+    _write_rows(db, None, rows)
+    _set_watermark(db, started)
+    db.commit()
+    return len(rows)
+
+
+def _get_watermark(db: Session) -> Optional[datetime]:
+    row = db.query(GlobalSettings).filter(GlobalSettings.key == WATERMARK_KEY).first()
+    value = row.value if row is not None and isinstance(row.value, dict) else {}
+    raw = value.get("updated_since")
+    return datetime.fromisoformat(raw) if raw else None
+
+
+def _set_watermark(db: Session, moment: datetime) -> None:
+    row = db.query(GlobalSettings).filter(GlobalSettings.key == WATERMARK_KEY).first()
+    value = {"updated_since": moment.isoformat()}
+    if row is None:
+        db.add(
+            GlobalSettings(
+                key=WATERMARK_KEY,
+                value=value,
+                description="Граница инкрементального обновления admin_daily_metrics (служебное)",
+            )
+        )
+    else:
+        row.value = value
+
+
+def apply_pending_admin_metrics(db: Session) -> int:
+    """Пересчитать дни, изменённые закоммиченными транзакциями этого процесса."""
+    days, user_ids, full = dirty_queue.drain()
+    if full:
+        # Массовые изменения без известных дней — ждут полной пересборки фоновой задачей
+        dirty_queue.add(full=True)
+    try:
+        return refresh_days(db, days | _user_days(db, user_ids))
+    except Exception:
+        db.rollback()
+        dirty_queue.add(days, user_ids)
+        raise
+
+
+def refresh_admin_daily_metrics(db: Session) -> Dict[str, Any]:
+    """Инкрементальное обновление: очередь процесса + изменения по updated_at с прошлого прохода."""
+    started = datetime.utcnow()
+    since = _get_watermark(db)
+    if since is None:
+        return {"mode": "full", "rows": rebuild_admin_daily_metrics(db)}
+
+    days, user_ids, full = dirty_queue.drain()
+    if full:
+        return {"mode": "full", "rows": rebuild_admin_daily_metrics(db)}
+    since = since - _WATERMARK_OVERLAP
+    days |= {
+        _as_date(created_at) for (created_at,) in db.query(User.created_at).filter(User.updated_at >= since)
+    }
+    days |= {_as_date(start) for (start,) in db.query(Booking.start_time).filter(Booking.updated_at >= since)}
+    masters = db.query(Master.created_at, Master.user_id).filter(Master.created_at >= since).all()
+    days |= {_as_date(created_at) for created_at, _ in masters}
+    user_ids |= {user_id for _, user_id in masters if user_id is not None}
+    days |= _user_days(db, user_ids)
+
+    try:
+        refreshed = refresh_days(db, days, commit=False)
+        _set_watermark(db, started)
+        db.commit()
+    except Exception:
+        db.rollback()
+        dirty_queue.add(days)
+        raise
+    return {"mode": "incremental", "days": refreshed}
+
+
+def ensure_admin_daily_metrics(db: Session) -> None:
+    """Перед чтением статистики: первичное заполнение пустой таблицы и дни из очереди процесса."""
+    if db.query(AdminDailyMetrics.metric_date).first() is None:
+        dirty_queue.drain()
+        rebuild_admin_daily_metrics(db)
+        return
+    apply_pending_admin_metrics(db)
+
+
+def admin_metrics_summary(db: Session, today: Optional[date] = None) -> Dict[str, Any]:
+    """Итоги для эндпоинтов статистики админки из rollup (вызывать после ensure_admin_daily_metrics)."""
+    today = today or datetime.utcnow().date()
+    week_ago = today - timedelta(days=7)
+    month_ago = today - timedelta(days=30)
+    activity_from = today - timedelta(days=6)
+
+    out: Dict[str, Any] = {
+        "total_users": 0,
+        "active_users": 0,
+        "total_masters": 0,
+        "total_bookings": 0,
+        "new_users_today": 0,
+        "new_users_this_week": 0,
+        "new_users_this_month": 0,
+        "bookings_today": 0,
+        "bookings_this_week": 0,
+        "bookings_this_month": 0,
+        "completed_bookings": 0,
+    }
+    by_role: Dict[str, int] = defaultdict(int)
+    indie_masters = 0
+    hours_sum = 0.0
+    with_duration = 0
+    activity: Dict[date, Dict[str, int]] = {}
+
+    for row in db.query(AdminDailyMetrics):
+        d = row.metric_date
+        out["total_users"] += row.users_created
+        out["active_users"] += row.users_active
+        out["total_masters"] += row.masters_created
+        out["total_bookings"] += row.bookings_total
+        out["completed_bookings"] += int((row.bookings_by_status or {}).get(BookingStatus.COMPLETED.value, 0))
+        for role, count in (row.users_by_role or {}).items():
+            by_role[role] += int(count)
+        indie_masters += row.indie_masters
+        hours_sum += row.booking_duration_hours_sum or 0.0
+        with_duration += row.bookings_with_duration
+        for key, since in (("today", today), ("this_week", week_ago), ("this_month", month_ago)):
+            if d >= since:
+                out[f"new_users_{key}"] += row.users_created
+                out[f"bookings_{key}"] += row.bookings_total
+        if activity_from <= d <= today:
+            activity[d] = {"bookings": row.bookings_total, "users": row.users_created}
+
+    out["users_by_role"] = {
+        role.value: by_role.get(role.value, 0) + (indie_masters if role == UserRole.INDIE else 0)
+        for role in UserRole
+    }
+    out["average_booking_duration"] = round(hours_sum / with_duration, 1) if with_duration else 0
+    out["weekly_activity"] = [
+        {"date": d, **activity.get(d, {"bookings": 0, "users": 0})}
+        for d in (activity_from + timedelta(days=i) for i in range(7))
+    ]
+    return out
+
+
+# --- события сессии ---
+
+
+def _changed(obj: Any, fields: Iterable[str]) -> bool:
+    state = inspect(obj)
+    return any(state.attrs[f].history.has_changes() for f in fields)
+
+
+def _history_days(obj: Any, field: str) -> Set[date]:
+    hist = inspect(obj).attrs[field].history
+    values = list(hist.added or ()) + list(hist.deleted or ()) + list(hist.unchanged or ())
+    return {_as_date(v) for v in values} or {_as_date(getattr(obj, field, None))}
+
+
+def _now_day(value: Any) -> date:
+    # default=datetime.utcnow ещё не применён до flush
+    return _as_date(value) if value is not None else datetime.utcnow().date()
+
+
+@event.listens_for(Session, "before_flush")
+def _collect_before_flush(session, flush_context, instances):
+    days: Set[date] = set()
+    user_ids: Set[int] = set()
+    for obj in list(session.new) + list(session.deleted):
+        if isinstance(obj, Booking):
+            days.add(_as_date(obj.start_time))
+        elif isinstance(obj, User):
+            days.add(_now_day(obj.created_at))
+        elif isinstance(obj, Master):
+            days.add(_now_day(obj.created_at))
+            if obj.user_id is not None:
+                user_ids.add(obj.user_id)
+    for obj in session.dirty:
+        if isinstance(obj, Booking) and _changed(obj, _BOOKING_FIELDS):
+            days |= _history_days(obj, "start_time")
+        elif isinstance(obj, User) and _changed(obj, _USER_FIELDS):
+            days |= _history_days(obj, "created_at")
+        elif isinstance(obj, Master) and _changed(obj, _MASTER_FIELDS):
+            days |= _history_days(obj, "created_at")
+            user_ids.update(u for u in (obj.user_id,) if u is not None)
+    if days:
+        session.info.setdefault(_PENDING_DAYS_KEY, set()).update(days)
+    if user_ids:
+        session.info.setdefault(_PENDING_USERS_KEY, set()).update(user_ids)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _collect_bulk_writes(orm_execute_state):
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is not None and mapper.class_ in (Booking, User, Master):
+        orm_execute_state.session.info[_PENDING_FULL_KEY] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_after_commit(session):
+    days = session.info.pop(_PENDING_DAYS_KEY, None) or ()
+    user_ids = session.info.pop(_PENDING_USERS_KEY, None) or ()
+    full = session.info.pop(_PENDING_FULL_KEY, False)
+    if days or user_ids or full:
+        dirty_queue.add(days, user_ids, full)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session):
+    session.info.pop(_PENDING_DAYS_KEY, None)
+    session.info.pop(_PENDING_USERS_KEY, None)
+    session.info.pop(_PENDING_FULL_KEY, None)
+
+
+# --- фоновая задача ---
+
+
+def _run_once(full: bool) -> Dict[str, Any]:
+    from database import BackgroundSessionLocal
+
+    db = BackgroundSessionLocal()
+    try:
+        if full:
+            return {"mode": "full", "rows": rebuild_admin_daily_metrics(db)}
+        return refresh_admin_daily_metrics(db)
+    finally:
+        db.close()
+
+
+async def run_admin_daily_metrics_task():
+    """
+    Фоновое обслуживание rollup: полная пересборка при старте и раз в сутки,
+    между ними — инкрементальное обновление каждые ADMIN_METRICS_REFRESH_SECONDS.
+    """
+    last_full_day: Optional[date] = None
+    while True:
+        interval = max(30, get_settings().ADMIN_METRICS_REFRESH_SECONDS)
+        try:
+            today = date.today()
+            full = last_full_day != today
+            result = await job_runner.run(
+                "admin_daily_metrics",
+                lambda: _run_once(full),
+                timeout=1800,
+                rows=lambda r: r.get("rows", r.get("days")),
+            )
+            # None — пропуск (аренда у другого процесса), таймаут или ошибка: полная пересборка
+            # повторится на следующем тике
+            if result is not None and full:
+                last_full_day = today
+                logger.info("admin_daily_metrics: полная пересборка, строк %s", result.get("rows"))
+            elif result is not None:
+                logger.debug("admin_daily_metrics: %s", result)
+            await asyncio.sleep(interval)
+        except asyncio.CancelledError:
+            logger.info("Задача admin_daily_metrics остановлена")
+            break
+        except Exception as e:
+            logger.error("Ошибка в фоновой задаче admin_daily_metrics: %s", e)
+            await asyncio.sleep(interval)
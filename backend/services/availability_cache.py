@@ -0,0 +1,197 @@
+"""
+Кэш свободного времени мастера по дням: (master_id, date, branch_id) → DayAvailability.
+
+DayAvailability хранит нормализованные входы расчёта слотов одного дня — окна
+расписания в минутах и битовую маску занятых минут (бит m — минута m от полуночи).
+Свободные слоты для любой длительности услуги считаются сдвигом и AND по маске,
+без запросов к БД; результат совпадает с services.scheduling.get_available_slots.
+
+Инвалидация — после commit (utils.generational_cache.CommitInvalidation): изменения
+Booking (время, статус, мастер, филиал), MasterSchedule и AvailabilitySlot мастера
+сбрасывают его записи. Массовые UPDATE/DELETE через Query по этим таблицам очищают кэш целиком.
+Кэш локален для процесса: при нескольких воркерах uvicorn чужие изменения видны
+не позже AVAILABILITY_CACHE_TTL_SECONDS (0 — кэш выключен).
+"""
+from __future__ import annotations
+
+import logging
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from typing import Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import Session
+
+from models import AvailabilitySlot, Booking, MasterSchedule, OwnerType
+from utils.generational_cache import CommitInvalidation, GenerationalCache, GenerationToken, attr_values
+
+logger = logging.getLogger(__name__)
+
+MINUTES_PER_DAY = 24 * 60
+SLOT_STEP_MINUTES = 30
+
+# Поля брони, от которых зависит занятость
+_BOOKING_AVAILABILITY_FIELDS = ("master_id", "branch_id", "start_time", "end_time", "status")
+
+
+def _time_to_minutes(value: time) -> Optional[int]:
+    """Минуты от полуночи; None — если есть секунды (такое окно кэш не представляет точно)."""
+    if value.second or value.microsecond:
+        return None
+    return value.hour * 60 + value.minute
+
+
+def _span_mask(start: int, end: int) -> int:
+    """Маска минут [start, end)."""
+    if end <= start:
+        return 0
+    return ((1 << (end - start)) - 1) << start
+
+
+@dataclass(frozen=True)
+class DayAvailability:
+    """Окна доступности одного дня и занятые минуты."""
+
+    from_schedule: bool  # True — строки MasterSchedule (склейка подряд идущих), False — AvailabilitySlot
+    windows: Tuple[Tuple[int, int], ...]  # (start, end) в минутах от полуночи, в порядке загрузки
+    busy: int
+
+    @classmethod
+    def build(
+        cls,
+        day: date,
+        master_schedule: list,
+        base_slots: list,
+        bookings: Iterable[Booking],
+    ) -> Optional["DayAvailability"]:
+        """
+        Собирает запись из тех же данных, что использует get_available_slots.
+        None — день нельзя представить точно (секунды в окнах, брони нулевой длины); такие дни не кэшируются.
+        """
+        rows = master_schedule if master_schedule else base_slots
+        windows: List[Tuple[int, int]] = []
+        for row in rows:
+            start = _time_to_minutes(row.start_time)
+            end = _time_to_minutes(row.end_time)
+            if start is None or end is None:
+                return None
+            windows.append((start, end))
+
+        day_start = datetime.combine(day, time.min)
+        day_end = day_start + timedelta(days=1)
+        busy = 0
+        for booking in bookings:
+            if booking.start_time is None or booking.end_time is None:
+                continue
+            b_start = booking.start_time.replace(tzinfo=None)
+            b_end = booking.end_time.replace(tzinfo=None)
+            if b_start >= day_end or b_end <= day_start:
+                continue
+            if b_end <= b_start:
+                # Пустой интервал конфликтует только с внутренней точкой слота — маской минут не выразить
+                return None
+            # Границы слотов — целые минуты, поэтому floor/ceil по краям брони точны
+            start_min = max(0, int((b_start - day_start).total_seconds() // 60))
+            end_seconds = (b_end - day_start).total_seconds()
+            end_min = min(MINUTES_PER_DAY, int(-(-end_seconds // 60)))
+            busy |= _span_mask(start_min, end_min)
+        return cls(from_schedule=bool(master_schedule), windows=tuple(windows), busy=busy)
+
+    def _windows_for_duration(self, service_duration: int) -> List[Tuple[int, int]]:
+        """То же, что scheduling._master_schedule_windows, но на минутах."""
+        if not self.from_schedule:
+            return list(self.windows)
+        required_slots = service_duration // 30
+        if service_duration % 30 != 0:
+            required_slots += 1
+        rows = self.windows
+        windows: List[Tuple[int, int]] = []
+        for i in range(len(rows) - required_slots + 1):
+            chain = rows[i:i + required_slots]
+            if all(chain[j][1] == chain[j + 1][0] for j in range(len(chain) - 1)):
+                windows.append((chain[0][0], chain[-1][1]))
+        return windows
+
+    def free_slots(self, day: date, service_duration: int) -> List[dict]:
+        """Свободные слоты дня для услуги service_duration минут (формат get_available_slots)."""
+        day_start = datetime.combine(day, time.min)
+        duration_mask = (1 << service_duration) - 1 if service_duration > 0 else 0
+        slots: List[dict] = []
+        seen = set()
+        for window_start, window_end in self._windows_for_duration(service_duration):
+            current = window_start
+            while current + SLOT_STEP_MINUTES <= window_end:
+                if (
+                    current % SLOT_STEP_MINUTES == 0
+                    and current not in seen
+                    and current + service_duration <= window_end
+                    and not (self.busy >> current) & duration_mask
+                ):
+                    seen.add(current)
+                    slot_start = day_start + timedelta(minutes=current)
+                    slots.append({
+                        "start_time": slot_start,
+                        "end_time": slot_start + timedelta(minutes=service_duration),
+                    })
+                current += SLOT_STEP_MINUTES
+        return slots
+
+
+class AvailabilityCache(GenerationalCache):
+    """Дни мастера (владелец — master_id, подключ — (день, филиал))."""
+
+    def __init__(self, max_entries: int = 20000):
+        super().__init__("AVAILABILITY_CACHE_TTL_SECONDS", max_entries)
+
+    def get(self, master_id: int, day: date, branch_id: Optional[int] = None) -> Optional[DayAvailability]:
+        if not self.enabled():
+            return None
+        return self.lookup(master_id, (day, branch_id))[1]
+
+    def store(
+        self,
+        master_id: int,
+        day: date,
+        branch_id: Optional[int],
+        value: Optional[DayAvailability],
+        token: GenerationToken,
+    ) -> None:
+        if value is not None:
+            self.put(master_id, (day, branch_id), value, token)
+
+
+availability_cache = AvailabilityCache()
+
+
+# --- Инвалидация по событиям сессии ---
+
+
+def _booking_changed(obj) -> bool:
+    state = inspect(obj)
+    return any(state.attrs[name].history.has_changes() for name in _BOOKING_AVAILABILITY_FIELDS)
+
+
+def _affected_masters(session: Session) -> Tuple[Set[int], bool]:
+    masters: Set[int] = set()
+    dirty = set(session.dirty)
+    for obj in list(session.new) + list(dirty) + list(session.deleted):
+        if isinstance(obj, Booking):
+            if obj in dirty and not _booking_changed(obj):
+                continue
+            masters.update(attr_values(obj, "master_id"))
+        elif isinstance(obj, MasterSchedule):
+            masters.update(attr_values(obj, "master_id"))
+        elif isinstance(obj, AvailabilitySlot):
+            owner_types = {getattr(v, "value", v) for v in attr_values(obj, "owner_type")}
+            if OwnerType.MASTER.value in owner_types:
+                masters.update(attr_values(obj, "owner_id"))
+    return masters, False
+
+
+availability_invalidation = CommitInvalidation(
+    "availability_cache",
+    _affected_masters,
+    availability_cache.invalidate,
+    availability_cache.clear,
+    clear_on_bulk=(Booking, MasterSchedule, AvailabilitySlot),
+)
@@ -5,29 +5,37 @@
 import asyncio
 import logging
 from datetime import datetime, timedelta
+from typing import Optional
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import select
 
-from database import SessionLocal
-from models import Master, Booking, BookingStatus, Subscription, SubscriptionPlan, SubscriptionType, SubscriptionStatus
+from database import BackgroundSessionLocal
+from models import Master, Subscription, SubscriptionPlan, SubscriptionType, SubscriptionStatus
+from services.job_runner import job_runner
+from utils.master_active_bookings import grouped_active_future_counts, store_counts
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def check_masters_bookings_limits() -> dict:
+def check_masters_bookings_limits(db: Optional[Session] = None) -> dict:
     """
     Проверить лимиты активных записей для всех мастеров с планом Free.
+    Счётчики всех мастеров — один GROUP BY (utils.master_active_bookings); результат
+    сохраняется в master_active_booking_counts, откуда его читают эндпоинты лимита.
     Логирует информацию о мастерах, у которых достигнут или превышен лимит.
     """
-    db = SessionLocal()
+    own_session = db is None
+    if own_session:
+        db = BackgroundSessionLocal()
     
     try:
         # Получаем текущую дату с 00:00
         today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        now_utc = datetime.utcnow()
         
-        # Находим всех мастеров с планом Free
+        # Находим план Free
         free_plan = db.query(SubscriptionPlan).filter(
             SubscriptionPlan.name == "Free",
             SubscriptionPlan.subscription_type == SubscriptionType.MASTER
@@ -41,71 +49,57 @@ def check_masters_bookings_limits() -> dict:
                 "masters_checked": 0
             }
         
-        # Получаем все активные подписки на план Free
-        free_subscriptions = db.query(Subscription).filter(
+        limits = free_plan.limits or {}
+        max_future_bookings = limits.get("max_future_bookings") or 30
+        
+        # Мастера с активной подпиской на план Free и их активные будущие записи — одним запросом
+        free_users = select(Subscription.user_id).where(
             Subscription.plan_id == free_plan.id,
             Subscription.status == SubscriptionStatus.ACTIVE,
-            Subscription.end_date > datetime.utcnow()
-        ).all()
+            Subscription.end_date > now_utc
+        )
+        counts = grouped_active_future_counts(db, now_utc, Master.user_id.in_(free_users))
+        store_counts(db, counts, now_utc)
+        db.commit()
         
-        logger.info(f"Проверяем лимиты для {len(free_subscriptions)} мастеров с планом Free")
+        logger.info(f"Проверяем лимиты для {len(counts)} мастеров с планом Free")
         
         results = {
             "date": today_start.isoformat(),
-            "masters_checked": len(free_subscriptions),
+            "masters_checked": len(counts),
             "masters_at_limit": 0,
             "masters_over_limit": 0,
             "masters_under_limit": 0,
             "details": []
         }
         
-        for subscription in free_subscriptions:
-            try:
-                # Находим мастера
-                master = db.query(Master).filter(Master.user_id == subscription.user_id).first()
-                if not master:
-                    continue
-                
-                # Подсчитываем активные записи
-                from utils.master_future_bookings_query import active_future_bookings_sql_filter
-
-                active_bookings_count = (
-                    db.query(func.count(Booking.id))
-                    .filter(active_future_bookings_sql_filter(master, datetime.utcnow()))
-                    .scalar() or 0
+        for row in counts:
+            active_bookings_count = row.active_future_bookings
+            is_at_limit = active_bookings_count >= max_future_bookings
+            is_over_limit = active_bookings_count > max_future_bookings
+            
+            if is_over_limit:
+                results["masters_over_limit"] += 1
+                logger.warning(
+                    f"Мастер {row.master_id} (user_id: {row.user_id}): "
+                    f"превышен лимит - {active_bookings_count}/{max_future_bookings}"
                 )
-                
-                limits = free_plan.limits or {}
-                max_future_bookings = limits.get("max_future_bookings", 30)
-                
-                is_at_limit = active_bookings_count >= max_future_bookings
-                is_over_limit = active_bookings_count > max_future_bookings
-                
-                if is_over_limit:
-                    results["masters_over_limit"] += 1
-                    logger.warning(
-                        f"Мастер {master.id} (user_id: {subscription.user_id}): "
-                        f"превышен лимит - {active_bookings_count}/{max_future_bookings}"
-                    )
-                elif is_at_limit:
-                    results["masters_at_limit"] += 1
-                    logger.info(
-                        f"Мастер {master.id} (user_id: {subscription.user_id}): "
-                        f"достигнут лимит - {active_bookings_count}/{max_future_bookings}"
-                    )
-                else:
-                    results["masters_under_limit"] += 1
-                
-                results["details"].append({
-                    "master_id": master.id,
-                    "user_id": subscription.user_id,
-                    "active_bookings": active_bookings_count,
-                    "limit": max_future_bookings,
-                    "status": "over" if is_over_limit else ("at_limit" if is_at_limit else "under")
-                })
-                
-            except Exception as e:
-                logger.error(f"Ошибка при проверке мастера {subscription.user_id}: {str(e)}")
+            elif is_at_limit:
+                results["masters_at_limit"] += 1
+                logger.info(
+                    f"Мастер {row.master_id} (user_id: {row.user_id}): "
+                    f"достигнут лимит - {active_bookings_count}/{max_future_bookings}"
+                )
+            else:
+                results["masters_under_limit"] += 1
+            
+            results["details"].append({
+                "master_id": row.master_id,
+                "user_id": row.user_id,
+                "active_bookings": active_bookings_count,
+                "limit": max_future_bookings,
+                "status": "over" if is_over_limit else ("at_limit" if is_at_limit else "under")
+            })
         
         logger.info(
             f"Проверка лимитов завершена. "
@@ -117,6 +111,7 @@ def check_masters_bookings_limits() -> dict:
         return results
         
     except Exception as e:
+        db.rollback()
         error_msg = f"Критическая ошибка при проверке лимитов: {str(e)}"
         logger.error(error_msg)
         return {
@@ -125,7 +120,11 @@ def check_masters_bookings_limits() -> dict:
             "masters_checked": 0
         }
     finally:
-        db.close()
+        if own_session:
+            db.close()
+
+
+BOOKINGS_LIMIT_JOB_TIMEOUT_SECONDS = 1800
 
 
 async def run_bookings_limit_monitor_task():
@@ -144,9 +143,15 @@ async def run_bookings_limit_monitor_task():
             
             await asyncio.sleep(wait_seconds)
             
-            # Выполняем проверку
-            result = check_masters_bookings_limits()
-            logger.info(f"Проверка лимитов выполнена: {result}")
+            # Выполняем проверку (в пуле job_runner, один воркер на все процессы)
+            result = await job_runner.run(
+                "bookings_limit_monitor",
+                check_masters_bookings_limits,
+                timeout=BOOKINGS_LIMIT_JOB_TIMEOUT_SECONDS,
+                rows=lambda r: r.get("masters_checked"),
+            )
+            if result is not None:
+                logger.info(f"Проверка лимитов выполнена: {result}")
             
         except asyncio.CancelledError:
             logger.info("Задача мониторинга лимитов отменена")
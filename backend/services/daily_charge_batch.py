@@ -0,0 +1,449 @@
+"""
+Пакетные ежедневные списания по подпискам.
+
+Та же бизнес-логика, что utils.balance_utils.process_daily_charge, но по чанкам:
+подписки, существующие списания за дату, заморозки, балансы и резервы читаются
+несколькими запросами на чанк, суммы считаются в памяти, а DailySubscriptionCharge /
+BalanceTransaction / AdminOperation пишутся bulk insert; балансы и резервы — bulk update по PK.
+Одна транзакция на чанк. Идемпотентность по (subscription_id, charge_date): подписки,
+у которых уже есть запись за дату, не списываются повторно.
+
+Балансы пользователей чанка блокируются при чтении (SELECT ... FOR UPDATE): проверка нехватки
+средств и balance_before/after идут от актуального значения. Баланс админа общий для всех
+чанков (параллельный catch-up), поэтому его не держим весь чанк: он блокируется при записи,
+от текущего значения заново считаются balance_before/after транзакций админа — цепочка
+его BalanceTransaction непрерывна при любом порядке коммитов чанков.
+
+Если чанк падает целиком (ошибка БД), он откатывается и проходится по одной подписке
+через process_daily_charge — ошибка одной подписки не теряет остальные.
+dry_run: всё считается, ничего не пишется; в ответе — время и пропускная способность.
+"""
+from __future__ import annotations
+
+import logging
+import time as time_module
+from dataclasses import dataclass
+from datetime import date, datetime, time
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import and_, bindparam, insert, update
+from sqlalchemy.orm import Session
+
+from models import (
+    AdminOperation,
+    BalanceTransaction,
+    DailyChargeStatus,
+    DailySubscriptionCharge,
+    Subscription,
+    SubscriptionFreeze,
+    SubscriptionReservation,
+    TransactionType,
+    UserBalance,
+)
+from settings import get_settings
+from utils.balance_utils import get_admin_user_id, process_daily_charge
+from utils.subscription_billing_calc import (
+    compute_daily_charge_amount,
+    subscription_charge_day_index,
+    subscription_period_days,
+)
+
+logger = logging.getLogger(__name__)
+
+ALREADY_CHARGED_ERROR = "Списание за эту дату уже произведено"
+INACTIVE_ERROR = "Подписка не активна в указанную дату"
+
+
+@dataclass
+class _SubscriptionRow:
+    id: int
+    user_id: int
+    is_active: bool
+    start_date: datetime
+    end_date: datetime
+    daily_rate: float
+    price: float
+
+
+def _chunks(ids: List[int], size: int) -> Iterable[List[int]]:
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+
+class _ChunkLedger:
+    """Балансы, резервы и строки для bulk-записи в пределах одного чанка."""
+
+    def __init__(self):
+        self.balances: Dict[int, Dict[str, Any]] = {}  # user_id -> {"id", "balance", "delta"}
+        self.reservations: Dict[int, Dict[str, Any]] = {}  # subscription_id -> {"id", "reserved_amount", "changed"}
+        self.charges: List[Dict[str, Any]] = []
+        self.transactions: List[Dict[str, Any]] = []
+        self.admin_operations: List[Dict[str, Any]] = []
+        self.deactivate_ids: List[int] = []
+
+    def balance(self, user_id: int) -> float:
+        return float(self.balances[user_id]["balance"] or 0)
+
+    def add_transaction(self, user_id: int, amount: float, description: str, subscription_id: int) -> float:
+        entry = self.balances[user_id]
+        before = entry["balance"]
+        entry["balance"] = before + amount
+        entry["delta"] += amount
+        self.transactions.append(
+            {
+                "user_id": user_id,
+                "amount": amount,
+                "transaction_type": TransactionType.SUB_DAILY_FEE,
+                "description": description,
+                "subscription_id": subscription_id,
+                "balance_before": before,
+                "balance_after": entry["balance"],
+            }
+        )
+        return float(entry["balance"])
+
+
+def _load_chunk(db: Session, ids: List[int], charge_date: date, admin_user_id: Optional[int], dry_run: bool):
+    subs = {
+        int(r.id): _SubscriptionRow(
+            id=int(r.id),
+            user_id=int(r.user_id),
+            is_active=bool(r.is_active),
+            start_date=r.start_date,
+            end_date=r.end_date,
+            daily_rate=float(r.daily_rate or 0),
+            price=float(r.price or 0),
+        )
+        for r in db.query(
+            Subscription.id,
+            Subscription.user_id,
+            Subscription.is_active,
+            Subscription.start_date,
+            Subscription.end_date,
+            Subscription.daily_rate,
+            Subscription.price,
+        ).filter(Subscription.id.in_(ids))
+    }
+    already_charged = {
+        int(r[0])
+        for r in db.query(DailySubscriptionCharge.subscription_id).filter(
+            DailySubscriptionCharge.subscription_id.in_(ids),
+            DailySubscriptionCharge.charge_date == charge_date,
+        )
+    }
+    charge_datetime = datetime.combine(charge_date, time.min)
+    freezes: Dict[int, int] = {}
+    for sid, freeze_id in (
+        db.query(SubscriptionFreeze.subscription_id, SubscriptionFreeze.id)
+        .filter(
+            and_(
+                SubscriptionFreeze.subscription_id.in_(ids),
+                SubscriptionFreeze.is_cancelled == False,
+                SubscriptionFreeze.start_date <= charge_datetime,
+                SubscriptionFreeze.end_date >= charge_datetime,
+            )
+        )
+        .order_by(SubscriptionFreeze.id)
+    ):
+        freezes.setdefault(int(sid), int(freeze_id))
+
+    ledger = _ChunkLedger()
+    user_ids = {s.user_id for s in subs.values()}
+    locked_query = db.query(UserBalance.id, UserBalance.user_id, UserBalance.balance).filter(
+        UserBalance.user_id.in_(user_ids - {admin_user_id})
+    )
+    if not dry_run:
+        locked_query = locked_query.order_by(UserBalance.id).with_for_update()
+    rows = locked_query.all()
+    if admin_user_id:
+        user_ids.add(admin_user_id)
+        # Админ — без блокировки: актуальный баланс берёт _write_chunk
+        rows += db.query(UserBalance.id, UserBalance.user_id, UserBalance.balance).filter(
+            UserBalance.user_id == admin_user_id
+        ).all()
+    for bid, uid, balance in rows:
+        ledger.balances[int(uid)] = {"id": int(bid), "balance": balance, "delta": 0.0}
+    missing = sorted(user_ids - set(ledger.balances))
+    if missing and not dry_run:
+        # Как get_or_create_user_balance: баланса ещё нет — создаём нулевой
+        db.execute(insert(UserBalance), [{"user_id": uid, "balance": 0, "currency": "RUB"} for uid in missing])
+        for bid, uid in db.query(UserBalance.id, UserBalance.user_id).filter(UserBalance.user_id.in_(missing)):
+            ledger.balances[int(uid)] = {"id": int(bid), "balance": 0.0, "delta": 0.0}
+    for uid in missing:
+        ledger.balances.setdefault(uid, {"id": None, "balance": 0.0, "delta": 0.0})
+
+    for rid, sid, reserved in (
+        db.query(SubscriptionReservation.id, SubscriptionReservation.subscription_id, SubscriptionReservation.reserved_amount)
+        .filter(SubscriptionReservation.subscription_id.in_(ids))
+        .order_by(SubscriptionReservation.id)
+    ):
+        ledger.reservations.setdefault(int(sid), {"id": int(rid), "reserved_amount": reserved, "changed": False})
+    return subs, already_charged, freezes, ledger
+
+
+def _charge_one(
+    sub: _SubscriptionRow,
+    charge_date: date,
+    ledger: _ChunkLedger,
+    already_charged: bool,
+    freeze_id: Optional[int],
+    admin_user_id: Optional[int],
+) -> Dict[str, Any]:
+    """Одна подписка в памяти чанка; ветки и тексты ошибок — как в process_daily_charge."""
+    sid = sub.id
+    if not sub.is_active or charge_date < sub.start_date.date() or charge_date >= sub.end_date.date():
+        return {"success": False, "error": INACTIVE_ERROR}
+    if already_charged:
+        return {"success": False, "error": ALREADY_CHARGED_ERROR}
+
+    balance_before = ledger.balance(sub.user_id)
+    if freeze_id is not None:
+        ledger.charges.append(
+            {
+                "subscription_id": sid,
+                "charge_date": charge_date,
+                "amount": 0.0,
+                "daily_rate": sub.daily_rate,
+                "balance_before": balance_before,
+                "balance_after": balance_before,
+                "status": DailyChargeStatus.PENDING,
+            }
+        )
+        return {"success": True, "skipped": True, "reason": "Подписка заморожена", "freeze_id": freeze_id}
+
+    reservation = ledger.reservations.get(sid)
+    reserved_before = float(reservation["reserved_amount"] or 0) if reservation else 0.0
+    period_days = subscription_period_days(sub.start_date, sub.end_date)
+    chargeable_total = int(round(sub.price))
+    day_index = subscription_charge_day_index(sub.start_date, charge_date)
+    charge_amount = compute_daily_charge_amount(chargeable_total, period_days, day_index)
+
+    if chargeable_total <= 0:
+        ledger.charges.append(
+            {
+                "subscription_id": sid,
+                "charge_date": charge_date,
+                "amount": 0.0,
+                "daily_rate": sub.daily_rate,
+                "balance_before": balance_before,
+                "balance_after": balance_before,
+                "status": DailyChargeStatus.SUCCESS,
+            }
+        )
+        return {
+            "success": True,
+            "daily_rate": sub.daily_rate,
+            "charge_amount": 0,
+            "balance_before": balance_before,
+            "balance_after": balance_before,
+            "zero_chargeable": True,
+        }
+
+    if charge_amount <= 0:
+        return {"success": False, "error": "charge_amount is zero for positive chargeable subscription"}
+
+    if reserved_before > 0:
+        insufficient = reserved_before < charge_amount
+        reason = "daily_rate > reserved_amount (недостаточно зарезервированных средств)"
+    else:
+        insufficient = balance_before < charge_amount
+        reason = "daily_rate > balance (недостаточно средств на депозите)"
+
+    if insufficient:
+        ledger.charges.append(
+            {
+                "subscription_id": sid,
+                "charge_date": charge_date,
+                "amount": charge_amount,
+                "daily_rate": sub.daily_rate,
+                "balance_before": balance_before,
+                "balance_after": balance_before,
+                "status": DailyChargeStatus.FAILED,
+                "reason": reason,
+            }
+        )
+        ledger.deactivate_ids.append(sid)
+        if get_settings().DAILY_CHARGE_DEBUG.strip() == "1":
+            logger.info(
+                "DAILY_CHARGE_DEBUG deactivated sub_id=%s user_id=%s balance_before=%.2f daily_rate=%.2f "
+                "charge_amount=%s is_active_before=%s batch=True",
+                sid, sub.user_id, balance_before, sub.daily_rate, charge_amount, sub.is_active,
+            )
+        return {
+            "success": False,
+            "error": reason,
+            "daily_rate": sub.daily_rate,
+            "balance": balance_before,
+            "subscription_deactivated": True,
+        }
+
+    balance_after = ledger.add_transaction(
+        sub.user_id, -charge_amount, f"Ежедневное списание за подписку {sid}", sid
+    )
+    if reservation:
+        reservation["reserved_amount"] = max(0.0, reserved_before - float(charge_amount))
+        reservation["changed"] = True
+    ledger.charges.append(
+        {
+            "subscription_id": sid,
+            "charge_date": charge_date,
+            "amount": charge_amount,
+            "daily_rate": sub.daily_rate,
+            "balance_before": balance_before,
+            "balance_after": balance_after,
+            "status": DailyChargeStatus.SUCCESS,
+        }
+    )
+    if admin_user_id:
+        ledger.add_transaction(
+            admin_user_id,
+            charge_amount,
+            f"Ежедневная плата за подписку от пользователя {sub.user_id}",
+            sid,
+        )
+        ledger.admin_operations.append(
+            {
+                "admin_user_id": admin_user_id,
+                "from_user_id": sub.user_id,
+                "amount_rubles": charge_amount,
+                "operation_type": "SUB_DAILY_FEE",
+                "service_description": f"Ежедневная плата за подписку {sid}",
+            }
+        )
+    return {
+        "success": True,
+        "daily_rate": sub.daily_rate,
+        "charge_amount": charge_amount,
+        "balance_before": balance_before,
+        "balance_after": balance_after,
+        "reserved_before": reserved_before,
+        "reserved_after": float(reservation["reserved_amount"]) if reservation else 0.0,
+    }
+
+
+def _apply_admin_balance(db: Session, ledger: _ChunkLedger, admin_user_id: Optional[int], now: datetime) -> None:
+    """
+    Баланс админа: блокировка строки до коммита чанка, balance_before/after его транзакций
+    заново от текущего значения, запись итога. Вызывать после первой записи чанка — на SQLite
+    к этому моменту транзакция уже держит блокировку записи.
+    """
+    entry = ledger.balances.get(admin_user_id) if admin_user_id else None
+    if entry is None or not entry["delta"] or entry["id"] is None:
+        return
+    current = db.query(UserBalance.balance).filter(UserBalance.id == entry["id"]).with_for_update().scalar()
+    running = float(current or 0)
+    for row in ledger.transactions:
+        if row["user_id"] == admin_user_id:
+            row["balance_before"] = running
+            running = running + row["amount"]
+            row["balance_after"] = running
+    balances = UserBalance.__table__
+    db.execute(update(balances).where(balances.c.id == entry["id"]).values(balance=running, updated_at=now))
+    entry["balance"] = running
+    entry["delta"] = 0.0
+
+
+def _write_chunk(db: Session, ledger: _ChunkLedger, admin_user_id: Optional[int] = None) -> None:
+    now = datetime.utcnow()
+    if ledger.charges:
+        db.execute(insert(DailySubscriptionCharge), ledger.charges)
+    _apply_admin_balance(db, ledger, admin_user_id, now)
+    if ledger.transactions:
+        db.execute(insert(BalanceTransaction), ledger.transactions)
+    if ledger.admin_operations:
+        db.execute(insert(AdminOperation), ledger.admin_operations)
+    # Балансы пользователей заблокированы с чтения чанка; пишем приращением
+    balance_rows = [{"b_id": e["id"], "b_delta": e["delta"]} for e in ledger.balances.values() if e["delta"]]
+    if balance_rows:
+        balances = UserBalance.__table__
+        db.execute(
+            update(balances)
+            .where(balances.c.id == bindparam("b_id"))
+            .values(balance=balances.c.balance + bindparam("b_delta"), updated_at=now),
+            balance_rows,
+        )
+    reservation_rows = [
+        {"id": e["id"], "reserved_amount": e["reserved_amount"], "updated_at": now}
+        for e in ledger.reservations.values()
+        if e["changed"]
+    ]
+    if reservation_rows:
+        db.execute(update(SubscriptionReservation), reservation_rows)
+    if ledger.deactivate_ids:
+        db.query(Subscription).filter(Subscription.id.in_(ledger.deactivate_ids)).update(
+            {Subscription.is_active: False}, synchronize_session=False
+        )
+
+
+def charge_subscriptions_batch(
+    db: Session,
+    subscription_ids: Iterable[int],
+    charge_date: date,
+    *,
+    chunk_size: Optional[int] = None,
+    dry_run: bool = False,
+) -> Dict[str, Any]:
+    """
+    Списать за charge_date по подпискам чанками.
+
+    Возвращает {"results": {subscription_id: результат как у process_daily_charge},
+    "user_ids": {subscription_id: user_id}, "chunks": [...], "elapsed_seconds", "subscriptions_per_second", "dry_run"}.
+    """
+    ids = sorted({int(i) for i in subscription_ids})
+    chunk_size = max(1, int(chunk_size or get_settings().DAILY_CHARGE_CHUNK_SIZE))
+    results: Dict[int, Dict[str, Any]] = {}
+    user_ids: Dict[int, int] = {}
+    chunks: List[Dict[str, Any]] = []
+    admin_user_id = get_admin_user_id(db)
+    started = time_module.monotonic()
+
+    for chunk_ids in _chunks(ids, chunk_size):
+        chunk_started = time_module.monotonic()
+        fallback = False
+        try:
+            subs, already_charged, freezes, ledger = _load_chunk(db, chunk_ids, charge_date, admin_user_id, dry_run)
+            chunk_results: Dict[int, Dict[str, Any]] = {}
+            for sid in chunk_ids:
+                sub = subs.get(sid)
+                if sub is None:
+                    chunk_results[sid] = {"success": False, "error": "Подписка не найдена"}
+                    continue
+                user_ids[sid] = sub.user_id
+                chunk_results[sid] = _charge_one(
+                    sub, charge_date, ledger, sid in already_charged, freezes.get(sid), admin_user_id
+                )
+            if dry_run:
+                db.rollback()
+            else:
+                _write_chunk(db, ledger, admin_user_id)
+                db.commit()
+            results.update(chunk_results)
+        except Exception as e:
+            db.rollback()
+            if dry_run:
+                raise
+            logger.error("Пакет ежедневных списаний упал (%s подписок), обрабатываем по одной: %s", len(chunk_ids), e)
+            fallback = True
+            for sid in chunk_ids:
+                try:
+                    results[sid] = process_daily_charge(db, sid, charge_date)
+                except Exception as exc:
+                    db.rollback()
+                    results[sid] = {"success": False, "error": str(exc), "exception": True}
+        chunks.append(
+            {
+                "size": len(chunk_ids),
+                "seconds": round(time_module.monotonic() - chunk_started, 4),
+                "fallback": fallback,
+            }
+        )
+
+    elapsed = time_module.monotonic() - started
+    return {
+        "results": results,
+        "user_ids": user_ids,
+        "chunks": chunks,
+        "elapsed_seconds": round(elapsed, 4),
+        "subscriptions_per_second": round(len(ids) / elapsed, 1) if elapsed > 0 else None,
+        "dry_run": dry_run,
+    }
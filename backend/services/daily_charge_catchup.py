@@ -0,0 +1,262 @@
+"""
+Доначисление пропущенных ежедневных списаний после простоя — параллельно по чанкам.
+
+Подписки группируются по пользователю (баланс общий для всех подписок пользователя),
+пользователи режутся на чанки по ~chunk_size подписок. Каждый чанк целиком обрабатывает
+один воркер в своей сессии (session_factory, по умолчанию BackgroundSessionLocal): даты идут
+строго по порядку, на каждую дату — одно пакетное списание (services.daily_charge_batch)
+по всем подпискам чанка, которым нужна эта дата. После ошибки подписка в этом прогоне
+дальше не списывается (как раньше).
+
+Прогресс сохраняется в GlobalSettings (CHECKPOINT_KEY): диапазоны user_id завершённых
+чанков для up_to_date. Перезапуск после падения с тем же up_to_date пропускает их;
+после полного прохода checkpoint удаляется. Повторное списание исключено и без него —
+идемпотентность по (subscription_id, charge_date) в самом ledger.
+"""
+from __future__ import annotations
+
+import logging
+import time as time_module
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from models import DailyChargeStatus, DailySubscriptionCharge, GlobalSettings, Subscription
+from services.daily_charge_batch import ALREADY_CHARGED_ERROR, charge_subscriptions_batch
+from settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_KEY = "daily_charges_catch_up_checkpoint"
+
+
+@dataclass
+class _PendingSubscription:
+    id: int
+    user_id: int
+    next_date: date
+    end_exclusive: date
+
+
+@dataclass
+class _Chunk:
+    user_range: Tuple[int, int]
+    subscriptions: List[_PendingSubscription]
+
+
+def _plan(db: Session, up_to_date: date, chunk_size: int, done_ranges: List[Tuple[int, int]]) -> List[_Chunk]:
+    """Активные подписки, которым есть что доначислить, порезанные на чанки по пользователям."""
+    rows = (
+        db.query(Subscription.id, Subscription.user_id, Subscription.start_date, Subscription.end_date)
+        .filter(Subscription.is_active == True)
+        .all()
+    )
+    last_success = dict(
+        db.query(DailySubscriptionCharge.subscription_id, func.max(DailySubscriptionCharge.charge_date))
+        .filter(DailySubscriptionCharge.status == DailyChargeStatus.SUCCESS)
+        .group_by(DailySubscriptionCharge.subscription_id)
+        .all()
+    )
+
+    by_user: Dict[int, List[_PendingSubscription]] = {}
+    for sid, user_id, start_dt, end_dt in rows:
+        if start_dt is None or end_dt is None:
+            continue
+        if any(lo <= int(user_id) <= hi for lo, hi in done_ranges):
+            continue
+        last = last_success.get(sid)
+        if isinstance(last, datetime):
+            last = last.date()
+        next_date = max(start_dt.date(), last + timedelta(days=1)) if last else start_dt.date()
+        if next_date > up_to_date or next_date >= end_dt.date():
+            continue
+        by_user.setdefault(int(user_id), []).append(
+            _PendingSubscription(int(sid), int(user_id), next_date, end_dt.date())
+        )
+
+    chunks: List[_Chunk] = []
+    current: List[_PendingSubscription] = []
+    first_user: Optional[int] = None
+    for user_id in sorted(by_user):
+        if first_user is None:
+            first_user = user_id
+        current.extend(sorted(by_user[user_id], key=lambda s: s.id))
+        if len(current) >= chunk_size:
+            chunks.append(_Chunk((first_user, user_id), current))
+            current, first_user = [], None
+    if current:
+        chunks.append(_Chunk((first_user, max(s.user_id for s in current)), current))
+    return chunks
+
+
+def _run_chunk(db: Session, chunk: _Chunk, up_to_date: date) -> Dict[str, Any]:
+    """Все пропущенные даты подписок чанка: по возрастанию даты, пакетом на дату."""
+    started = time_module.monotonic()
+    out = {"charges_applied": 0, "charges_skipped": 0, "errors": [], "batches": 0}
+    pending = {s.id: s for s in chunk.subscriptions}
+    while pending:
+        charge_date = min(s.next_date for s in pending.values())
+        ids = [sid for sid, s in pending.items() if s.next_date == charge_date]
+        batch = charge_subscriptions_batch(db, ids, charge_date, chunk_size=len(ids))
+        out["batches"] += 1
+        for sid in ids:
+            result = batch["results"].get(sid) or {}
+            if result.get("success"):
+                out["charges_skipped" if result.get("skipped") else "charges_applied"] += 1
+            elif result.get("error") == ALREADY_CHARGED_ERROR:
+                out["charges_skipped"] += 1
+            else:
+                out["errors"].append(
+                    {
+                        "subscription_id": sid,
+                        "charge_date": charge_date.isoformat(),
+                        "error": result.get("error") or "unknown",
+                    }
+                )
+                pending.pop(sid)
+                continue
+            sub = pending[sid]
+            sub.next_date = charge_date + timedelta(days=1)
+            if sub.next_date > up_to_date or sub.next_date >= sub.end_exclusive:
+                pending.pop(sid)
+    out["seconds"] = round(time_module.monotonic() - started, 4)
+    return out
+
+
+def _load_checkpoint(db: Session, up_to_date: date) -> List[Tuple[int, int]]:
+    row = db.query(GlobalSettings).filter(GlobalSettings.key == CHECKPOINT_KEY).first()
+    value = row.value if row is not None and isinstance(row.value, dict) else {}
+    if value.get("up_to_date") != up_to_date.isoformat():
+        return []
+    return [(int(lo), int(hi)) for lo, hi in value.get("done_user_ranges") or []]
+
+
+def _save_checkpoint(db: Session, up_to_date: date, done_ranges: List[Tuple[int, int]]) -> None:
+    row = db.query(GlobalSettings).filter(GlobalSettings.key == CHECKPOINT_KEY).first()
+    value = {
+        "up_to_date": up_to_date.isoformat(),
+        "done_user_ranges": [list(r) for r in done_ranges],
+        "updated_at": datetime.utcnow().isoformat(),
+    }
+    if row is None:
+        db.add(
+            GlobalSettings(
+                key=CHECKPOINT_KEY,
+                value=value,
+                description="Прогресс доначисления ежедневных списаний (служебное)",
+            )
+        )
+    else:
+        row.value = value
+    db.commit()
+
+
+def _clear_checkpoint(db: Session) -> None:
+    db.query(GlobalSettings).filter(GlobalSettings.key == CHECKPOINT_KEY).delete(synchronize_session=False)
+    db.commit()
+
+
+def _default_workers(db: Session) -> int:
+    # SQLite пишет одним писателем — параллельные воркеры только ждут блокировку
+    if db.get_bind().dialect.name == "sqlite":
+        return 1
+    return max(1, get_settings().DAILY_CHARGE_CATCHUP_WORKERS)
+
+
+def run_catch_up(
+    db: Session,
+    up_to_date: date,
+    *,
+    workers: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+    session_factory: Optional[Callable[[], Session]] = None,
+) -> Dict[str, Any]:
+    """
+    Доначислить пропущенные дни до up_to_date включительно.
+
+    db — сессия планировщика (план, checkpoint). При workers=1 чанки идут в ней же,
+    иначе каждый воркер открывает свою сессию через session_factory.
+    """
+    chunk_size = max(1, int(chunk_size or get_settings().DAILY_CHARGE_CHUNK_SIZE))
+    if workers is None:
+        workers = _default_workers(db)
+    started = time_module.monotonic()
+
+    done_ranges = _load_checkpoint(db, up_to_date)
+    resumed = bool(done_ranges)
+    chunks = _plan(db, up_to_date, chunk_size, done_ranges)
+    results: Dict[str, Any] = {
+        "up_to_date": up_to_date.isoformat(),
+        "subscriptions_processed": sum(len(c.subscriptions) for c in chunks),
+        "charges_applied": 0,
+        "charges_skipped": 0,
+        "errors": [],
+        "resumed_from_checkpoint": resumed,
+        "workers": workers,
+        "chunks": [],
+    }
+    if not chunks:
+        if resumed:
+            _clear_checkpoint(db)
+        return results
+
+    def _merge(chunk: _Chunk, out: Dict[str, Any]) -> None:
+        results["charges_applied"] += out["charges_applied"]
+        results["charges_skipped"] += out["charges_skipped"]
+        results["errors"].extend(out["errors"])
+        results["chunks"].append(
+            {
+                "user_range": list(chunk.user_range),
+                "subscriptions": len(chunk.subscriptions),
+                "batches": out["batches"],
+                "seconds": out["seconds"],
+            }
+        )
+        done_ranges.append(chunk.user_range)
+        _save_checkpoint(db, up_to_date, done_ranges)
+
+    if workers <= 1:
+        for chunk in chunks:
+            _merge(chunk, _run_chunk(db, chunk, up_to_date))
+    else:
+        if session_factory is None:
+            from database import BackgroundSessionLocal
+
+            session_factory = BackgroundSessionLocal
+
+        def _worker(chunk: _Chunk) -> Dict[str, Any]:
+            worker_db = session_factory()
+            try:
+                return _run_chunk(worker_db, chunk, up_to_date)
+            finally:
+                worker_db.close()
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="daily-charge-catch-up") as pool:
+            futures = {pool.submit(_worker, chunk): chunk for chunk in chunks}
+            for future in as_completed(futures):
+                chunk = futures[future]
+                try:
+                    out = future.result()
+                except Exception as e:
+                    # Чанк не отмечается в checkpoint — следующий запуск пройдёт его заново
+                    logger.error("Catch-up чанк пользователей %s упал: %s", chunk.user_range, e)
+                    results["errors"].append({"user_range": list(chunk.user_range), "error": str(e)})
+                    continue
+                _merge(chunk, out)
+
+    if not any("user_range" in e for e in results["errors"]):
+        _clear_checkpoint(db)
+    results["elapsed_seconds"] = round(time_module.monotonic() - started, 4)
+    logger.info(
+        "Catch-up до %s: подписок %s, чанков %s, воркеров %s, %.2f с",
+        up_to_date,
+        results["subscriptions_processed"],
+        len(chunks),
+        workers,
+        results["elapsed_seconds"],
+    )
+    return results
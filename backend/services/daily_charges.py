@@ -7,8 +7,11 @@ from typing import List, Optional, Sequence, Tuple
 from sqlalchemy.orm import Session
 from sqlalchemy import and_, or_, cast, String
 
-from database import get_db
+from database import BackgroundSessionLocal
 from models import Subscription, DailySubscriptionCharge, DailyChargeStatus, SubscriptionStatus
+from services.daily_charge_batch import charge_subscriptions_batch
+from services.daily_charge_catchup import run_catch_up
+from services.job_runner import job_runner
 from utils.balance_utils import process_daily_charge
 
 # Настройка логирования
@@ -46,100 +49,31 @@ def get_active_subscription_ids_for_date(db: Session, charge_date: date) -> List
     return [int(r[0]) for r in rows]
 
 
-def _active_subscription_id_rows(db: Session) -> List[Tuple[int, datetime, datetime]]:
-    """(id, start_date, end_date) для is_active — без колонки status."""
-    rows = (
-        db.query(Subscription.id, Subscription.start_date, Subscription.end_date)
-        .filter(Subscription.is_active == True)
-        .all()
-    )
-    return [(int(r[0]), r[1], r[2]) for r in rows if r[1] is not None and r[2] is not None]
-
-
 def catch_up_missed_daily_charges(
     up_to_date: date = None,
     db: Optional[Session] = None,
+    *,
+    workers: Optional[int] = None,
+    chunk_size: Optional[int] = None,
 ) -> dict:
     """
     Доначислить пропущенные daily charges: от последнего SUCCESS (или start_date)
     до up_to_date включительно. Идемпотентно — уже списанные даты пропускаются.
+    Чанки подписок (по пользователям) обрабатываются пулом воркеров со своими сессиями,
+    прогресс сохраняется в checkpoint — см. services.daily_charge_catchup.
+    Если передан db — по умолчанию всё выполняется в нём последовательно.
     """
     if up_to_date is None:
         up_to_date = date.today()
 
     own_db = db is None
     if own_db:
-        db = next(get_db())
-
-    results = {
-        "up_to_date": up_to_date.isoformat(),
-        "subscriptions_processed": 0,
-        "charges_applied": 0,
-        "charges_skipped": 0,
-        "errors": [],
-    }
+        db = BackgroundSessionLocal()
+    elif workers is None:
+        workers = 1
 
     try:
-        subscription_rows = _active_subscription_id_rows(db)
-        results["subscriptions_processed"] = len(subscription_rows)
-
-        for subscription_id, start_dt, end_dt in subscription_rows:
-            start_d = start_dt.date()
-            end_exclusive = end_dt.date()
-
-            last_success = (
-                db.query(DailySubscriptionCharge)
-                .filter(
-                    DailySubscriptionCharge.subscription_id == subscription_id,
-                    DailySubscriptionCharge.status == DailyChargeStatus.SUCCESS,
-                )
-                .order_by(DailySubscriptionCharge.charge_date.desc())
-                .first()
-            )
-
-            cur = (last_success.charge_date + timedelta(days=1)) if last_success else start_d
-
-            while cur <= up_to_date:
-                if cur < start_d:
-                    cur += timedelta(days=1)
-                    continue
-                if cur >= end_exclusive:
-                    break
-
-                try:
-                    result = process_daily_charge(db, subscription_id, cur)
-                except Exception as e:
-                    results["errors"].append(
-                        {
-                            "subscription_id": subscription_id,
-                            "charge_date": cur.isoformat(),
-                            "error": str(e),
-                        }
-                    )
-                    break
-
-                if result.get("success"):
-                    if result.get("skipped"):
-                        results["charges_skipped"] += 1
-                    else:
-                        results["charges_applied"] += 1
-                else:
-                    err = result.get("error") or "unknown"
-                    if err == "Списание за эту дату уже произведено":
-                        results["charges_skipped"] += 1
-                    else:
-                        results["errors"].append(
-                            {
-                                "subscription_id": subscription_id,
-                                "charge_date": cur.isoformat(),
-                                "error": err,
-                            }
-                        )
-                        break
-
-                cur += timedelta(days=1)
-
-        return results
+        return run_catch_up(db, up_to_date, workers=workers, chunk_size=chunk_size)
     finally:
         if own_db:
             db.close()
@@ -206,17 +140,25 @@ def _activate_due_pending_subscriptions(db: Session, charge_date: date) -> int:
     return len(due_ids)
 
 
-def process_all_daily_charges(charge_date: date = None, db: Optional[Session] = None) -> dict:
+def process_all_daily_charges(
+    charge_date: date = None,
+    db: Optional[Session] = None,
+    *,
+    dry_run: bool = False,
+    chunk_size: Optional[int] = None,
+) -> dict:
     """Обработать ежедневные списания для всех активных подписок.
     MVP: списание идёт из UserBalance.balance (остаток депозита подписки), не «общий кошелёк».
     Если передан db (напр. из run_daily_charges endpoint) — используем его, иначе создаём свою сессию.
+    Списания идут чанками (services.daily_charge_batch). dry_run: без записи в БД (и без
+    пометки EXPIRED / активации PENDING), в results["throughput"] — время и подписок/сек.
     """
     if charge_date is None:
         charge_date = date.today()
 
     own_db = db is None
     if own_db:
-        db = next(get_db())
+        db = BackgroundSessionLocal()
 
     logger.info(f"Начинаем обработку ежедневных списаний за {charge_date}")
 
@@ -224,20 +166,21 @@ def process_all_daily_charges(charge_date: date = None, db: Optional[Session] =
     renewal_results = check_subscription_renewals(charge_date)
 
     try:
-        try:
-            now_utc = datetime.utcnow()
-            marked = _mark_expired_subscriptions(db, now_utc)
-            if marked:
-                logger.warning("Помечено EXPIRED подписок по end_date<=now_utc: %s", marked)
-        except Exception as e:
-            logger.warning("Не удалось пометить истекшие подписки как EXPIRED: %s", e)
+        if not dry_run:
+            try:
+                now_utc = datetime.utcnow()
+                marked = _mark_expired_subscriptions(db, now_utc)
+                if marked:
+                    logger.warning("Помечено EXPIRED подписок по end_date<=now_utc: %s", marked)
+            except Exception as e:
+                logger.warning("Не удалось пометить истекшие подписки как EXPIRED: %s", e)
 
-        try:
-            activated = _activate_due_pending_subscriptions(db, charge_date)
-            if activated:
-                logger.info("Активировано подписок к старту: %s", activated)
-        except Exception as e:
-            logger.warning("Не удалось активировать подписки к старту: %s", e)
+            try:
+                activated = _activate_due_pending_subscriptions(db, charge_date)
+                if activated:
+                    logger.info("Активировано подписок к старту: %s", activated)
+            except Exception as e:
+                logger.warning("Не удалось активировать подписки к старту: %s", e)
 
         active_subscription_ids = get_active_subscription_ids_for_date(db, charge_date)
 
@@ -253,47 +196,51 @@ def process_all_daily_charges(charge_date: date = None, db: Optional[Session] =
             "errors": [],
             "affected_user_ids": [],
         }
+
+        batch = charge_subscriptions_batch(
+            db, active_subscription_ids, charge_date, chunk_size=chunk_size, dry_run=dry_run
+        )
         affected_users: List[int] = []
 
         for subscription_id in active_subscription_ids:
-            uid = (
-                db.query(Subscription.user_id)
-                .filter(Subscription.id == subscription_id)
-                .scalar()
-            )
+            uid = batch["user_ids"].get(subscription_id)
             if uid is not None:
                 affected_users.append(int(uid))
-            try:
-                result = process_daily_charge(db, subscription_id, charge_date)
+            result = batch["results"].get(subscription_id) or {}
 
-                if result.get("success"):
-                    results["successful_charges"] += 1
-                    logger.info(
-                        "Успешное списание для подписки %s: %s руб.",
-                        subscription_id,
-                        result.get("daily_rate"),
-                    )
-                else:
-                    results["failed_charges"] += 1
-                    logger.warning(
-                        "Неуспешное списание для подписки %s: %s",
-                        subscription_id,
-                        result.get("error"),
-                    )
-
-                    if result.get("subscription_deactivated"):
-                        results["deactivated_subscriptions"] += 1
-                        logger.warning(
-                            "Подписка %s деактивирована из-за недостатка средств",
-                            subscription_id,
-                        )
-
-            except Exception as e:
+            if result.get("exception"):
                 results["failed_charges"] += 1
-                error_msg = f"Ошибка при обработке подписки {subscription_id}: {str(e)}"
+                error_msg = f"Ошибка при обработке подписки {subscription_id}: {result.get('error')}"
                 results["errors"].append(error_msg)
                 logger.error(error_msg)
+            elif result.get("success"):
+                results["successful_charges"] += 1
+                logger.debug(
+                    "Успешное списание для подписки %s: %s руб.",
+                    subscription_id,
+                    result.get("charge_amount"),
+                )
+            else:
+                results["failed_charges"] += 1
+                logger.warning(
+                    "Неуспешное списание для подписки %s: %s",
+                    subscription_id,
+                    result.get("error"),
+                )
+
+                if result.get("subscription_deactivated"):
+                    results["deactivated_subscriptions"] += 1
+                    logger.warning(
+                        "Подписка %s деактивирована из-за недостатка средств",
+                        subscription_id,
+                    )
 
+        results["throughput"] = {
+            "dry_run": dry_run,
+            "elapsed_seconds": batch["elapsed_seconds"],
+            "subscriptions_per_second": batch["subscriptions_per_second"],
+            "chunks": batch["chunks"],
+        }
         results["affected_user_ids"] = list(dict.fromkeys(affected_users))
         logger.info(
             "Обработка завершена. Успешно: %s, Неуспешно: %s, Деактивировано: %s",
@@ -325,7 +272,7 @@ def process_all_daily_charges(charge_date: date = None, db: Optional[Session] =
 def get_charge_statistics(start_date: date, end_date: date) -> dict:
     """Получить статистику списаний за период"""
 
-    db = next(get_db())
+    db = BackgroundSessionLocal()
 
     try:
         charges = db.query(DailySubscriptionCharge).filter(
@@ -368,7 +315,7 @@ def retry_failed_charges(charge_date: date = None) -> dict:
 
     logger.info(f"Повторяем попытку списания за {charge_date}")
 
-    db = next(get_db())
+    db = BackgroundSessionLocal()
 
     try:
         failed_charges = db.query(DailySubscriptionCharge).filter(
@@ -428,16 +375,34 @@ def retry_failed_charges(charge_date: date = None) -> dict:
         db.close()
 
 
+# Таймаут одного прохода в фоновой задаче (services.job_runner)
+DAILY_CHARGES_JOB_TIMEOUT_SECONDS = 3 * 3600
+
+
 async def run_daily_charges_task():
     """Фоновая задача для ежедневного списания"""
 
     while True:
         try:
-            catch_result = catch_up_missed_daily_charges()
-            logger.info("Catch-up ежедневных списаний: %s", catch_result)
-
-            result = process_all_daily_charges()
-            logger.info("Ежедневные списания выполнены: %s", result)
+            # Синхронная работа с БД — в пуле job_runner: event loop не блокируется,
+            # при нескольких воркерах uvicorn списывает только один
+            catch_result = await job_runner.run(
+                "daily_charges_catch_up",
+                catch_up_missed_daily_charges,
+                timeout=DAILY_CHARGES_JOB_TIMEOUT_SECONDS,
+                rows=lambda r: r.get("charges_applied"),
+            )
+            if catch_result is not None:
+                logger.info("Catch-up ежедневных списаний: %s", catch_result)
+
+            result = await job_runner.run(
+                "daily_charges",
+                process_all_daily_charges,
+                timeout=DAILY_CHARGES_JOB_TIMEOUT_SECONDS,
+                rows=lambda r: r.get("successful_charges"),
+            )
+            if result is not None:
+                logger.info("Ежедневные списания выполнены: %s", result)
 
             now = datetime.now()
             next_run = now.replace(hour=0, minute=1, second=0, microsecond=0) + timedelta(days=1)
@@ -473,7 +438,7 @@ def check_subscription_renewals(charge_date: date = None) -> dict:
 
     logger.info(f"Проверяем подписки на автопродление за {charge_date}")
 
-    db = next(get_db())
+    db = BackgroundSessionLocal()
 
     try:
         renew_window_days = 3
@@ -10,8 +10,9 @@ from typing import Any, Dict, Optional
 
 from sqlalchemy.orm import Session
 
-from database import get_db
+from database import BackgroundSessionLocal
 from models import Payment
+from services.job_runner import job_runner
 
 logger = logging.getLogger(__name__)
 
@@ -43,7 +44,7 @@ def expire_stale_pending_subscription_payments(
     """
     own_db = db is None
     if own_db:
-        db = next(get_db())
+        db = BackgroundSessionLocal()
 
     if now is None:
         now = datetime.utcnow()
@@ -107,7 +108,13 @@ async def run_expired_payments_cleanup_task():
     """
     while True:
         try:
-            result = expire_stale_pending_subscription_payments()
+            # В пуле job_runner: не блокирует event loop, при нескольких воркерах — один запуск
+            result = await job_runner.run(
+                "expired_payments_cleanup",
+                expire_stale_pending_subscription_payments,
+                timeout=CLEANUP_INTERVAL_SECONDS - 60,
+                rows=lambda r: r.get("expired"),
+            )
             expired = result.get("expired", 0) if isinstance(result, dict) else 0
             if expired:
                 logger.info("Expired payments cleanup done: %s", result)
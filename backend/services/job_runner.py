@@ -0,0 +1,245 @@
+"""
+Запуск синхронных фоновых задач вне event loop.
+
+Задачи (ежедневные списания, циклические расходы, мониторинг лимитов, очистки, rollup
+статистики) — синхронная работа с БД через SQLAlchemy. JobRunner выполняет их в общем
+ограниченном пуле потоков (BACKGROUND_JOB_WORKERS), чтобы event loop uvicorn продолжал
+обслуживать запросы:
+
+- одна задача не запускается повторно, пока предыдущий запуск ещё идёт (в т.ч. после таймаута:
+  поток нельзя прервать, запуск считается завершённым, когда поток реально вернулся);
+- таймаут на задачу: по истечении await возвращает управление, запуск помечается timeout;
+- межпроцессная блокировка — строка background_job_locks с арендой до locked_until: при
+  нескольких воркерах uvicorn задачу выполняет тот, кто первым взял аренду, остальные пропускают;
+- метрики по задаче (последний запуск, длительность, статус, число строк) — metrics(),
+  отдаются в GET /api/admin/background-jobs.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import socket
+import threading
+import time as time_module
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional
+
+from sqlalchemy import insert, or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import BackgroundJobLock
+from settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Запас аренды сверх таймаута: поток после таймаута ещё может дорабатывать
+_LEASE_GRACE = timedelta(minutes=5)
+
+
+@dataclass
+class JobMetrics:
+    runs: int = 0
+    failures: int = 0
+    timeouts: int = 0
+    skipped: int = 0
+    running: bool = False
+    last_status: Optional[str] = None  # ok | error | timeout | skipped_overlap | skipped_locked
+    last_started_at: Optional[str] = None
+    last_finished_at: Optional[str] = None
+    last_duration_seconds: Optional[float] = None
+    last_rows: Optional[int] = None
+    last_error: Optional[str] = None
+
+
+def _process_owner() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def acquire_job_lease(db: Session, job_name: str, owner: str, ttl: timedelta) -> bool:
+    """Взять (или продлить свою) аренду задачи. Атомарно: условный UPDATE, иначе INSERT."""
+    now = datetime.utcnow()
+    table = BackgroundJobLock.__table__
+    taken = db.execute(
+        update(table)
+        .where(
+            table.c.job_name == job_name,
+            or_(table.c.locked_until < now, table.c.owner == owner),
+        )
+        .values(owner=owner, locked_until=now + ttl, acquired_at=now)
+    ).rowcount
+    if not taken:
+        try:
+            db.execute(insert(table).values(job_name=job_name, owner=owner, locked_until=now + ttl, acquired_at=now))
+            taken = 1
+        except IntegrityError:
+            db.rollback()
+            return False
+    db.commit()
+    return bool(taken)
+
+
+def release_job_lease(db: Session, job_name: str, owner: str) -> None:
+    table = BackgroundJobLock.__table__
+    db.execute(
+        update(table)
+        .where(table.c.job_name == job_name, table.c.owner == owner)
+        .values(locked_until=datetime.utcnow())
+    )
+    db.commit()
+
+
+class JobRunner:
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        session_factory: Optional[Callable[[], Session]] = None,
+    ) -> None:
+        self._max_workers = max_workers
+        self._session_factory = session_factory
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._running: set = set()
+        self._metrics: Dict[str, JobMetrics] = {}
+        self.owner = _process_owner()
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                workers = self._max_workers or max(1, get_settings().BACKGROUND_JOB_WORKERS)
+                self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bg-job")
+            return self._executor
+
+    def _sessions(self) -> Callable[[], Session]:
+        if self._session_factory is None:
+            from database import BackgroundSessionLocal
+
+            return BackgroundSessionLocal
+        return self._session_factory
+
+    def _metric(self, job_name: str) -> JobMetrics:
+        with self._lock:
+            return self._metrics.setdefault(job_name, JobMetrics())
+
+    def _execute(
+        self,
+        job_name: str,
+        fn: Callable[[], Any],
+        lease_ttl: timedelta,
+        rows: Optional[Callable[[Any], Optional[int]]],
+    ) -> Dict[str, Any]:
+        """Тело в потоке пула: аренда → задача → освобождение аренды."""
+        session_factory = self._sessions()
+        db = session_factory()
+        try:
+            if not acquire_job_lease(db, job_name, self.owner, lease_ttl):
+                return {"status": "skipped_locked"}
+        finally:
+            db.close()
+        try:
+            result = fn()
+            return {"status": "ok", "result": result, "rows": rows(result) if rows else None}
+        finally:
+            db = session_factory()
+            try:
+                release_job_lease(db, job_name, self.owner)
+            except Exception as e:
+                logger.warning("Не удалось освободить аренду задачи %s: %s", job_name, e)
+            finally:
+                db.close()
+
+    def _finish(self, job_name: str, started: float, outcome: Dict[str, Any]) -> None:
+        m = self._metric(job_name)
+        with self._lock:
+            self._running.discard(job_name)
+            m.running = False
+            status = outcome["status"]
+            if status == "skipped_locked":
+                m.skipped += 1
+                m.last_status = status
+                return
+            m.last_finished_at = datetime.utcnow().isoformat()
+            m.last_duration_seconds = round(time_module.monotonic() - started, 4)
+            if m.last_status != "timeout":
+                m.last_status = status
+            if status == "ok":
+                m.last_rows = outcome.get("rows")
+                m.last_error = None
+            else:
+                m.failures += 1
+                m.last_error = outcome.get("error")
+
+    async def run(
+        self,
+        job_name: str,
+        fn: Callable[[], Any],
+        *,
+        timeout: float,
+        rows: Optional[Callable[[Any], Optional[int]]] = None,
+    ) -> Any:
+        """
+        Выполнить fn в пуле. Возвращает результат fn или None, если запуск пропущен
+        (предыдущий ещё идёт / аренду держит другой процесс), упал или превысил timeout.
+        """
+        m = self._metric(job_name)
+        with self._lock:
+            if job_name in self._running:
+                m.skipped += 1
+                m.last_status = "skipped_overlap"
+                logger.warning("Задача %s ещё выполняется — запуск пропущен", job_name)
+                return None
+            self._running.add(job_name)
+            m.running = True
+            m.runs += 1
+            m.last_started_at = datetime.utcnow().isoformat()
+            m.last_status = "running"
+
+        started = time_module.monotonic()
+        lease_ttl = timedelta(seconds=timeout) + _LEASE_GRACE
+        future = self._pool().submit(self._execute, job_name, fn, lease_ttl, rows)
+
+        def _done(f) -> None:
+            try:
+                outcome = f.result()
+            except Exception as e:
+                outcome = {"status": "error", "error": str(e)}
+            self._finish(job_name, started, outcome)
+
+        future.add_done_callback(_done)
+        # asyncio.wait, а не wait_for: wait_for (Python < 3.12) может «проглотить» отмену задачи,
+        # если поток завершился одновременно с cancel() — и цикл не остановится на shutdown.
+        # Отмена await не отменяет сам future: поток дорабатывает, _done запишет метрики.
+        waiter = asyncio.wrap_future(future)
+        done, _ = await asyncio.wait({waiter}, timeout=timeout)
+        if not done:
+            with self._lock:
+                m.timeouts += 1
+                m.last_status = "timeout"
+            logger.error("Задача %s превысила таймаут %.0f с (поток дорабатывает в фоне)", job_name, timeout)
+            return None
+        try:
+            outcome = waiter.result()
+        except Exception as e:
+            logger.error("Задача %s завершилась с ошибкой: %s", job_name, e)
+            return None
+        if outcome["status"] == "skipped_locked":
+            logger.debug("Задача %s выполняется другим процессом — пропуск", job_name)
+            return None
+        return outcome.get("result")
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {name: asdict(m) for name, m in sorted(self._metrics.items())}
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+job_runner = JobRunner()
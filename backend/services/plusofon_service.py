@@ -14,8 +14,14 @@ class PlusofonService:
         self.user_id = s.PLUSOFON_USER_ID or "3545"
         self.access_token = s.PLUSOFON_ACCESS_TOKEN
         self.base_url = 'https://restapi.plusofon.ru'
-        self.client = httpx.AsyncClient(timeout=30.0)
+        self._timeout = 30.0
         self._stub_mode = s.plusofon_stub
+
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        # Клиент на вызов: эндпоинты выполняются и в event loop рабочих потоков
+        # (threadpool_db_route), а общий AsyncClient привязан к одному loop
+        async with httpx.AsyncClient(timeout=self._timeout) as client:
+            return await client.request(method, url, **kwargs)
     
     async def initiate_call(self, phone: str, code: str) -> Dict[str, Any]:
         """
@@ -51,7 +57,8 @@ class PlusofonService:
                 "repeat": 2,   # Количество повторов кода
             }
             
-            response = await self.client.post(
+            response = await self._request(
+                "POST",
                 f"{self.base_url}/api/v1/flash-call/call",
                 headers=headers,
                 json=payload
@@ -109,7 +116,8 @@ class PlusofonService:
                 "call_id": call_id
             }
             
-            response = await self.client.post(
+            response = await self._request(
+                "POST",
                 f"{self.base_url}/api/v1/flash-call/status",
                 headers=headers,
                 json=payload
@@ -158,7 +166,8 @@ class PlusofonService:
                 "Authorization": f"Bearer {self.access_token}"
             }
             
-            response = await self.client.get(
+            response = await self._request(
+                "GET",
                 f"{self.base_url}/api/v1/flash-call",
                 headers=headers
             )
@@ -231,7 +240,8 @@ class PlusofonService:
                 "reverse": True,  # Флаг для обратного FlashCall
             }
             
-            response = await self.client.post(
+            response = await self._request(
+                "POST",
                 f"{self.base_url}/api/v1/flash-call/reverse",
                 headers=headers,
                 json=payload
@@ -288,7 +298,8 @@ class PlusofonService:
                 "call_id": call_id
             }
             
-            response = await self.client.post(
+            response = await self._request(
+                "POST",
                 f"{self.base_url}/api/v1/flash-call/reverse/status",
                 headers=headers,
                 json=payload
@@ -321,8 +332,7 @@ class PlusofonService:
             }
     
     async def close(self):
-        """Закрывает HTTP клиент"""
-        await self.client.aclose()
+        """Совместимость: клиент создаётся на каждый вызов, закрывать нечего"""
 
 # Глобальный экземпляр сервиса
 plusofon_service = PlusofonService() 
\ No newline at end of file
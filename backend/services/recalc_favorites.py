@@ -2,11 +2,11 @@ import sys
 from collections import Counter, defaultdict
 from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
-from database import SessionLocal
+from database import BackgroundSessionLocal
 from models import User, Booking, Salon, Master, IndieMaster, ClientFavorites
 
 def recalc_favorites():
-    db: Session = SessionLocal()
+    db: Session = BackgroundSessionLocal()
     try:
         # Только бронирования за последний год
         one_year_ago = datetime.utcnow() - timedelta(days=365)
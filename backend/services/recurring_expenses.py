@@ -1,128 +1,154 @@
 """
 Сервис для автоматического создания циклических расходов
+
+Шаблоны (expense_type="recurring") порождают разовые расходы: daily — каждый день,
+weekly/monthly — раз в неделю/месяц, conditional — в день с записями (has_bookings) или с
+открытым расписанием (schedule_open). Порождённый расход хранит template_id и period_key
+(начало периода, YYYY-MM-DD); уникальный индекс по этой паре не даёт создать второй расход
+за период даже при повторном или параллельном запуске.
+
+Шаблоны, которым сегодня нужен расход, выбираются одним запросом (anti-join по уже
+созданным за период), недостающие расходы вставляются пачкой.
 """
 import logging
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 import asyncio
+from typing import Any, Dict, Optional
 
-from sqlalchemy.orm import Session
-from database import SessionLocal
-from models import MasterExpense, Booking, MasterSchedule, BookingStatus
+from sqlalchemy import and_, case, exists, insert, literal, or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, aliased
+from database import BackgroundSessionLocal
+from models import MasterExpense, Booking, Master, MasterSchedule
+from services.job_runner import job_runner
 
 logger = logging.getLogger(__name__)
 
 
-def create_recurring_expenses():
+def _due_templates_query(db: Session, today: date):
+    """Шаблоны, которым нужен расход за текущий период: (id, master_id, name, amount, period_key)."""
+    day_start = datetime.combine(today, datetime.min.time())
+    day_end = datetime.combine(today, datetime.max.time())
+    week_start = today - timedelta(days=today.weekday())
+    month_start = today.replace(day=1)
+
+    t = MasterExpense
+    period_start = case(
+        (t.recurrence_type == "weekly", literal(datetime.combine(week_start, datetime.min.time()))),
+        (t.recurrence_type == "monthly", literal(datetime.combine(month_start, datetime.min.time()))),
+        else_=literal(day_start),
+    )
+    period_key = case(
+        (t.recurrence_type == "weekly", literal(week_start.isoformat())),
+        (t.recurrence_type == "monthly", literal(month_start.isoformat())),
+        else_=literal(today.isoformat()),
+    )
+
+    master_ids = select(Master.id).where(Master.user_id == t.master_id)
+    has_bookings_today = exists().where(
+        Booking.master_id.in_(master_ids),
+        Booking.start_time >= day_start,
+        Booking.start_time <= day_end,
+    )
+    schedule_open_today = exists().where(
+        MasterSchedule.master_id.in_(master_ids),
+        MasterSchedule.date == today,
+        MasterSchedule.start_time.isnot(None),
+    )
+
+    generated = aliased(MasterExpense)
+    already_generated = exists().where(generated.template_id == t.id, generated.period_key == period_key)
+    # Расходы, созданные до появления template_id: совпадение по мастеру и названию в периоде
+    legacy = aliased(MasterExpense)
+    legacy_generated = exists().where(
+        legacy.template_id.is_(None),
+        legacy.master_id == t.master_id,
+        legacy.name == t.name,
+        legacy.expense_type == "one_time",
+        legacy.expense_date >= period_start,
+        legacy.expense_date <= day_end,
+    )
+
+    return (
+        db.query(t.id, t.master_id, t.name, t.amount, period_key)
+        .filter(
+            t.expense_type == "recurring",
+            t.is_active == True,
+            or_(
+                t.recurrence_type.in_(("daily", "weekly", "monthly")),
+                and_(
+                    t.recurrence_type == "conditional",
+                    or_(
+                        and_(t.condition_type == "has_bookings", has_bookings_today),
+                        and_(t.condition_type == "schedule_open", schedule_open_today),
+                    ),
+                ),
+            ),
+            ~already_generated,
+            or_(t.recurrence_type == "daily", ~legacy_generated),
+        )
+    )
+
+
+def _insert_expenses(db: Session, rows: list) -> int:
+    """Пачкой; при гонке с другим запуском — по одной, пропуская уже созданные за период."""
+    if not rows:
+        return 0
+    try:
+        with db.begin_nested():
+            db.execute(insert(MasterExpense), rows)
+        return len(rows)
+    except IntegrityError:
+        created = 0
+        for row in rows:
+            try:
+                with db.begin_nested():
+                    db.execute(insert(MasterExpense), [row])
+                created += 1
+            except IntegrityError:
+                continue
+        return created
+
+
+def create_recurring_expenses(db: Optional[Session] = None, today: Optional[date] = None) -> Dict[str, Any]:
     """Создание записей циклических расходов"""
-    db = SessionLocal()
+    own_db = db is None
+    if own_db:
+        db = BackgroundSessionLocal()
+    today = today or datetime.now().date()
     try:
-        today = datetime.now().date()
-        
-        # Получаем активные шаблоны циклических расходов
-        recurring_templates = db.query(MasterExpense).filter(
-            MasterExpense.expense_type == "recurring",
-            MasterExpense.is_active == True
-        ).all()
-        
-        logger.info(f"Найдено {len(recurring_templates)} шаблонов циклических расходов")
-        
-        for template in recurring_templates:
-            should_create = False
-            
-            # Проверяем, нужно ли создать расход сегодня
-            if template.recurrence_type == "daily":
-                should_create = True
-            
-            elif template.recurrence_type == "weekly":
-                # Проверяем, был ли создан расход на этой неделе
-                week_start = today - timedelta(days=today.weekday())
-                existing = db.query(MasterExpense).filter(
-                    MasterExpense.master_id == template.master_id,
-                    MasterExpense.name == template.name,
-                    MasterExpense.expense_type == "one_time",
-                    MasterExpense.expense_date >= datetime.combine(week_start, datetime.min.time()),
-                    MasterExpense.expense_date <= datetime.combine(today, datetime.max.time())
-                ).first()
-                
-                if not existing:
-                    should_create = True
-            
-            elif template.recurrence_type == "monthly":
-                # Проверяем, был ли создан расход в этом месяце
-                month_start = today.replace(day=1)
-                existing = db.query(MasterExpense).filter(
-                    MasterExpense.master_id == template.master_id,
-                    MasterExpense.name == template.name,
-                    MasterExpense.expense_type == "one_time",
-                    MasterExpense.expense_date >= datetime.combine(month_start, datetime.min.time()),
-                    MasterExpense.expense_date <= datetime.combine(today, datetime.max.time())
-                ).first()
-                
-                if not existing:
-                    should_create = True
-            
-            elif template.recurrence_type == "conditional":
-                if template.condition_type == "has_bookings":
-                    # Проверяем, есть ли запись на сегодня
-                    bookings = db.query(Booking).filter(
-                        Booking.master_id == template.master_id,
-                        Booking.date == today
-                    ).first()
-                    
-                    if bookings:
-                        # Проверяем, был ли уже создан расход на сегодня
-                        existing = db.query(MasterExpense).filter(
-                            MasterExpense.master_id == template.master_id,
-                            MasterExpense.name == template.name,
-                            MasterExpense.expense_type == "one_time",
-                            MasterExpense.expense_date >= datetime.combine(today, datetime.min.time()),
-                            MasterExpense.expense_date <= datetime.combine(today, datetime.max.time())
-                        ).first()
-                        
-                        if not existing:
-                            should_create = True
-                
-                elif template.condition_type == "schedule_open":
-                    # Проверяем, открыто ли расписание на сегодня (есть ли запись в расписании)
-                    weekday = today.weekday()
-                    schedule = db.query(MasterSchedule).filter(
-                        MasterSchedule.master_id == template.master_id,
-                        MasterSchedule.day_of_week == weekday
-                    ).first()
-                    
-                    if schedule and schedule.start_time:  # Если расписание есть и не None
-                        # Проверяем, был ли уже создан расход на сегодня
-                        existing = db.query(MasterExpense).filter(
-                            MasterExpense.master_id == template.master_id,
-                            MasterExpense.name == template.name,
-                            MasterExpense.expense_type == "one_time",
-                            MasterExpense.expense_date >= datetime.combine(today, datetime.min.time()),
-                            MasterExpense.expense_date <= datetime.combine(today, datetime.max.time())
-                        ).first()
-                        
-                        if not existing:
-                            should_create = True
-            
-            # Создаем разовый расход на основе шаблона
-            if should_create:
-                expense = MasterExpense(
-                    master_id=template.master_id,
-                    name=template.name,
-                    expense_type="one_time",
-                    amount=template.amount,
-                    expense_date=datetime.combine(today, datetime.now().time())
-                )
-                db.add(expense)
-                logger.info(f"Создан циклический расход '{template.name}' для мастера {template.master_id}")
-        
+        due = _due_templates_query(db, today).all()
+        expense_date = datetime.combine(today, datetime.now().time())
+        created_at = datetime.utcnow()
+        rows = [
+            {
+                "master_id": master_id,
+                "name": name,
+                "expense_type": "one_time",
+                "amount": amount,
+                "expense_date": expense_date,
+                "template_id": template_id,
+                "period_key": period_key,
+                "is_active": True,
+                "created_at": created_at,
+            }
+            for template_id, master_id, name, amount, period_key in due
+        ]
+        created = _insert_expenses(db, rows)
         db.commit()
-        logger.info("Обработка циклических расходов завершена")
-        
+        logger.info("Циклические расходы за %s: к созданию %s, создано %s", today, len(rows), created)
+        return {"date": today.isoformat(), "due": len(rows), "created": created}
+
     except Exception as e:
         logger.error(f"Ошибка при создании циклических расходов: {e}")
         db.rollback()
+        return {"date": today.isoformat(), "error": str(e), "due": 0, "created": 0}
     finally:
-        db.close()
+        if own_db:
+            db.close()
+
+
+RECURRING_EXPENSES_JOB_TIMEOUT_SECONDS = 1800
 
 
 async def run_recurring_expenses_task():
@@ -139,8 +165,13 @@ async def run_recurring_expenses_task():
             
             await asyncio.sleep(wait_seconds)
             
-            # Запускаем создание расходов
-            create_recurring_expenses()
+            # Запускаем создание расходов (в пуле job_runner, один воркер на все процессы)
+            await job_runner.run(
+                "recurring_expenses",
+                create_recurring_expenses,
+                timeout=RECURRING_EXPENSES_JOB_TIMEOUT_SECONDS,
+                rows=lambda r: r.get("created"),
+            )
             
         except asyncio.CancelledError:
             logger.info("Задача создания циклических расходов остановлена")
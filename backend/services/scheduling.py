@@ -1,12 +1,15 @@
 import logging
-from datetime import datetime, timedelta, time
-from typing import List, Optional
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import date, datetime, timedelta, time
+from typing import Dict, Iterable, List, Optional, Tuple
 from zoneinfo import ZoneInfo
 
 from sqlalchemy import and_, or_
 from sqlalchemy.orm import Session
 
 from models import AvailabilitySlot, Booking, OwnerType
+from services.availability_cache import DayAvailability, availability_cache
 
 logger = logging.getLogger(__name__)
 
@@ -64,6 +67,53 @@ def _check_time_overlap(
     )
 
 
+class OccupiedIntervals:
+    """
+    Занятые интервалы владельца: отсортированные массивы начал и концов.
+
+    Пересекающиеся брони сливаются при построении, поэтому проверка слота —
+    один bisect (O(log n)) вместо перебора всех броней. Семантика совпадает с
+    _check_time_overlap: интервалы полуоткрытые, касание концами — не конфликт.
+    Строится один раз на запрос и используется и при выдаче слотов, и в
+    check_booking_conflicts.
+    """
+
+    __slots__ = ("_starts", "_ends")
+
+    def __init__(self, intervals: Iterable[Tuple[datetime, datetime]] = ()):
+        starts: List[datetime] = []
+        ends: List[datetime] = []
+        for start, end in sorted((_to_naive(st), _to_naive(et)) for st, et in intervals):
+            if starts and start < ends[-1]:
+                # Пересечение с предыдущим — расширяем его
+                if end > ends[-1]:
+                    ends[-1] = end
+                continue
+            starts.append(start)
+            ends.append(end)
+        self._starts = starts
+        self._ends = ends
+
+    @classmethod
+    def from_bookings(cls, bookings: Iterable[Booking]) -> "OccupiedIntervals":
+        return cls(
+            (b.start_time, b.end_time)
+            for b in bookings
+            if b.start_time is not None and b.end_time is not None
+        )
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def overlaps(self, start: datetime, end: datetime) -> bool:
+        """Пересекается ли [start, end) хотя бы с одним занятым интервалом."""
+        start = _to_naive(start)
+        end = _to_naive(end)
+        # Первый интервал, который заканчивается позже начала запроса
+        i = bisect_right(self._ends, start)
+        return i < len(self._starts) and self._starts[i] < end
+
+
 def _get_slots_for_duration(start_time: time, end_time: time, service_duration_minutes: int) -> List[time]:
     """
     Генерирует список начальных времен слотов для услуги заданной длительности
@@ -90,7 +140,7 @@ def _get_slots_for_duration(start_time: time, end_time: time, service_duration_m
     return slots
 
 
-def _is_slot_available(slot_start: time, service_duration_minutes: int, existing_bookings: List[Booking], target_date) -> bool:
+def _is_slot_available(slot_start: time, service_duration_minutes: int, occupied: OccupiedIntervals, target_date) -> bool:
     """
     Проверяет, доступен ли слот для бронирования
     """
@@ -99,11 +149,7 @@ def _is_slot_available(slot_start: time, service_duration_minutes: int, existing
     slot_end_dt = slot_start_dt + timedelta(minutes=service_duration_minutes)
     
     # Проверяем пересечение с существующими бронированиями
-    for booking in existing_bookings:
-        if _check_time_overlap(slot_start_dt, slot_end_dt, booking.start_time, booking.end_time):
-            return False
-    
-    return True
+    return not occupied.overlaps(slot_start_dt, slot_end_dt)
 
 
 def check_booking_conflicts(
@@ -117,10 +163,12 @@ def check_booking_conflicts(
     """
     Проверяет наличие конфликтов для нового бронирования
     """
-    # Получаем ВСЕ активные бронирования для данного владельца
+    # Активные бронирования владельца, пересекающиеся с интервалом (naive — как в _check_time_overlap)
     query = db.query(Booking).filter(
         Booking.status != "cancelled",
-        Booking.status != "rejected"
+        Booking.status != "rejected",
+        Booking.start_time < _to_naive(end_time),
+        Booking.end_time > _to_naive(start_time),
     )
 
     if owner_type == OwnerType.MASTER:
@@ -155,16 +203,155 @@ def check_booking_conflicts(
     for booking in existing_bookings:
         logger.debug(f"sched: Бронирование {booking.id}: {booking.start_time} - {booking.end_time}, статус: {booking.status}")
 
-    # Проверяем пересечение с каждым существующим бронированием
-    for booking in existing_bookings:
-        if _check_time_overlap(start_time, end_time, booking.start_time, booking.end_time):
-            logger.debug(f"sched: КОНФЛИКТ! Новое бронирование {start_time} - {end_time} пересекается с {booking.start_time} - {booking.end_time}")
-            return True
+    # Та же структура, что и при выдаче слотов — оба пути дают одинаковый ответ
+    if OccupiedIntervals.from_bookings(existing_bookings).overlaps(start_time, end_time):
+        logger.debug(f"sched: КОНФЛИКТ! Новое бронирование {start_time} - {end_time} пересекается с существующим")
+        return True
 
     logger.debug(f"sched: Конфликтов не найдено")
     return False
 
 
+def _day_of_week(day) -> int:
+    """Python weekday() 0=Пн..6=Вс → наша схема 1=Пн..7=Вс."""
+    return day.weekday() + 1
+
+
+def _as_date(value) -> date:
+    return value.date() if isinstance(value, datetime) else value
+
+
+def _bookings_window(first_day: date, last_day: date, service_duration: int) -> tuple[datetime, datetime]:
+    """
+    Окно броней, способных пересечься со слотами дней first_day..last_day.
+    Слоты дня не выходят за полночь, но проверка пересечения идёт на всю длительность услуги.
+    """
+    window_start = datetime.combine(first_day, time.min)
+    window_end = datetime.combine(last_day + timedelta(days=1), time.min) + timedelta(
+        minutes=max(service_duration, 0)
+    )
+    return window_start, window_end
+
+
+def _master_schedule_windows(master_schedule: list, service_duration: int) -> List[dict]:
+    """
+    Окна доступности из строк MasterSchedule одного дня (отсортированы по start_time):
+    required_slots последовательных 30-минутных строк без разрывов.
+    """
+    windows: List[dict] = []
+    # Вычисляем количество необходимых 30-минутных слотов
+    required_slots = service_duration // 30
+    if service_duration % 30 != 0:
+        required_slots += 1
+
+    logger.debug(f"sched: Требуется {required_slots} последовательных 30-минутных слотов")
+
+    # Проверяем каждую возможную начальную позицию
+    for i in range(len(master_schedule) - required_slots + 1):
+        # Проверяем, есть ли достаточно последовательных слотов
+        consecutive_slots = master_schedule[i:i + required_slots]
+
+        # Проверяем, что слоты идут последовательно
+        is_consecutive = True
+        for j in range(len(consecutive_slots) - 1):
+            current_end = consecutive_slots[j].end_time
+            next_start = consecutive_slots[j + 1].start_time
+            if current_end != next_start:
+                is_consecutive = False
+                break
+
+        if is_consecutive:
+            # Создаем слот доступности
+            start_time = consecutive_slots[0].start_time
+            end_time = consecutive_slots[-1].end_time
+            windows.append({
+                'start_time': start_time,
+                'end_time': end_time
+            })
+            logger.debug(f"sched: Найден доступный слот: {start_time} - {end_time}")
+    return windows
+
+
+def _master_bookings_query(
+    db: Session,
+    master_id: int,
+    window_start: datetime,
+    window_end: datetime,
+    branch_id: Optional[int] = None,
+):
+    """Активные брони мастера, пересекающиеся с [window_start, window_end)."""
+    query = db.query(Booking).filter(
+        Booking.master_id == master_id,
+        Booking.status != "cancelled",
+        Booking.status != "rejected",
+        Booking.start_time < window_end,
+        Booking.end_time > window_start,
+    )
+    # Если указан филиал, фильтруем по нему
+    if branch_id:
+        query = query.filter(Booking.branch_id == branch_id)
+    return query
+
+
+def _collect_available_slots(
+    date,
+    availability_slots: list,
+    occupied: OccupiedIntervals,
+    service_duration: int,
+) -> List[dict]:
+    """
+    Формирует свободные слоты дня: 30-минутная сетка внутри окон доступности,
+    без пересечений с occupied и без выхода за конец окна.
+    """
+    available_slots = []
+    seen_slots = set()  # Для отслеживания уже добавленных слотов
+
+    for availability_slot in availability_slots:
+        start_time = availability_slot.start_time if hasattr(availability_slot, 'start_time') else availability_slot['start_time']
+        end_time = availability_slot.end_time if hasattr(availability_slot, 'end_time') else availability_slot['end_time']
+
+        logger.debug(f"sched: Проверяем слот доступности: {start_time} - {end_time}")
+
+        # Генерируем 30-минутные слоты внутри доступного времени
+        time_slots = _get_slots_for_duration(start_time, end_time, 30)
+
+        for slot_start in time_slots:
+            # Проверяем доступность слота
+            if _is_slot_available(slot_start, service_duration, occupied, date):
+                # Создаем datetime для начала и конца слота
+                slot_start_dt = datetime.combine(date, slot_start)
+                slot_end_dt = slot_start_dt + timedelta(minutes=service_duration)
+
+                # Конец окна доступности: слот с услугой не должен вылезать за рамку
+                if isinstance(end_time, time):
+                    window_end_dt = datetime.combine(date, end_time)
+                else:
+                    window_end_dt = _to_naive(end_time) if end_time is not None else None
+                if window_end_dt is not None and _to_naive(slot_end_dt) > _to_naive(window_end_dt):
+                    logger.debug(
+                        f"sched: ⏱️ Слот {slot_start} не помещается (конец {slot_end_dt} > окно {window_end_dt})"
+                    )
+                    continue
+
+                # Создаем уникальный ключ для слота
+                slot_key = slot_start_dt.isoformat()
+
+                if slot_key not in seen_slots:
+                    available_slots.append({
+                        "start_time": slot_start_dt,
+                        "end_time": slot_end_dt
+                    })
+                    seen_slots.add(slot_key)
+                    logger.debug(f"sched: ✅ Слот {slot_start} доступен")
+                else:
+                    logger.debug(f"sched: 🔄 Слот {slot_start} уже добавлен, пропускаем")
+            else:
+                logger.debug(f"sched: ❌ Слот {slot_start} занят")
+
+    logger.debug(f"sched: Итого доступных слотов: {len(available_slots)}")
+    return available_slots
+
+
 def get_available_slots(
     db: Session,
     owner_type: OwnerType,
@@ -181,12 +368,17 @@ def get_available_slots(
     
     # Получаем слоты доступности
     availability_slots = []
+    _date = _as_date(date)
+    use_cache = owner_type == OwnerType.MASTER and service_duration > 0
+    if use_cache:
+        cached_day = availability_cache.get(owner_id, _date, branch_id or None)
+        if cached_day is not None:
+            return cached_day.free_slots(_date, service_duration)
+        cache_token = availability_cache.generation(owner_id)
     
     if owner_type == OwnerType.MASTER:
         # Для мастера используем индивидуальное расписание
-        # Python weekday(): 0=Понедельник, 1=Вторник, 2=Среда, 3=Четверг, 4=Пятница, 5=Суббота, 6=Воскресенье
-        # Наша схема: 1=Понедельник, 2=Вторник, 3=Среда, 4=Четверг, 5=Пятница, 6=Суббота, 7=Воскресенье
-        day_of_week = date.weekday() + 1
+        day_of_week = _day_of_week(date)
         
         # Сначала проверяем базовые слоты доступности
         base_slots = (
@@ -201,7 +393,6 @@ def get_available_slots(
         
         # Затем проверяем индивидуальное расписание мастера
         from models import MasterSchedule
-        _date = date.date() if isinstance(date, datetime) else date
         master_schedule = (
             db.query(MasterSchedule)
             .filter(
@@ -216,50 +407,21 @@ def get_available_slots(
         if master_schedule:
             # Используем индивидуальное расписание мастера
             logger.debug(f"sched: Найдено {len(master_schedule)} слотов индивидуального расписания")
-            
-            # Вычисляем количество необходимых 30-минутных слотов
-            required_slots = service_duration // 30
-            if service_duration % 30 != 0:
-                required_slots += 1
-            
-            logger.debug(f"sched: Требуется {required_slots} последовательных 30-минутных слотов")
-            
-            # Проверяем каждую возможную начальную позицию
-            for i in range(len(master_schedule) - required_slots + 1):
-                # Проверяем, есть ли достаточно последовательных слотов
-                consecutive_slots = master_schedule[i:i + required_slots]
-                
-                # Проверяем, что слоты идут последовательно
-                is_consecutive = True
-                for j in range(len(consecutive_slots) - 1):
-                    current_end = consecutive_slots[j].end_time
-                    next_start = consecutive_slots[j + 1].start_time
-                    if current_end != next_start:
-                        is_consecutive = False
-                        break
-                
-                if is_consecutive:
-                    # Создаем слот доступности
-                    start_time = consecutive_slots[0].start_time
-                    end_time = consecutive_slots[-1].end_time
-                    availability_slots.append({
-                        'start_time': start_time,
-                        'end_time': end_time
-                    })
-                    logger.debug(f"sched: Найден доступный слот: {start_time} - {end_time}")
-            
+            availability_slots = _master_schedule_windows(master_schedule, service_duration)
         elif base_slots:
             # Используем базовые слоты доступности
             logger.debug(f"sched: Используем базовые слоты доступности")
             availability_slots = base_slots
         else:
             logger.debug(f"sched: Нет слотов доступности для мастера {owner_id} в день {day_of_week}")
+            if use_cache:
+                availability_cache.store(
+                    owner_id, _date, branch_id or None, DayAvailability.build(_date, [], [], []), cache_token
+                )
             return []
     elif owner_type == OwnerType.INDIE_MASTER:
         # Для индивидуального мастера используем его расписание
-        # Python weekday(): 0=Понедельник, 1=Вторник, 2=Среда, 3=Четверг, 4=Пятница, 5=Суббота, 6=Воскресенье
-        # Наша схема: 1=Понедельник, 2=Вторник, 3=Среда, 4=Четверг, 5=Пятница, 6=Суббота, 7=Воскресенье
-        day_of_week = date.weekday() + 1
+        day_of_week = _day_of_week(date)
         
         # Проверяем слоты доступности для индивидуального мастера
         base_slots = (
@@ -332,9 +494,7 @@ def get_available_slots(
             return []
     else:
         # Для салона используем базовые слоты доступности
-        # Python weekday(): 0=Понедельник, 1=Вторник, 2=Среда, 3=Четверг, 4=Пятница, 5=Суббота, 6=Воскресенье
-        # Наша схема: 1=Понедельник, 2=Вторник, 3=Среда, 4=Четверг, 5=Пятница, 6=Суббота, 7=Воскресенье
-        day_of_week = date.weekday() + 1
+        day_of_week = _day_of_week(date)
         availability_slots = (
             db.query(AvailabilitySlot)
             .filter(
@@ -349,39 +509,42 @@ def get_available_slots(
             logger.debug(f"sched: Нет слотов доступности для {owner_type} ID {owner_id} в день {day_of_week}")
             return []
 
-    # Получаем ВСЕ активные бронирования для данного владельца
-    existing_bookings_query = db.query(Booking).filter(
-        Booking.status != "cancelled",
-        Booking.status != "rejected"
-    )
+    # Активные бронирования владельца, способные пересечься со слотами этого дня
+    window_start, window_end = _bookings_window(_date, _date, service_duration)
 
     # Фильтруем по владельцу и филиалу
     if owner_type == OwnerType.MASTER:
-        existing_bookings_query = existing_bookings_query.filter(Booking.master_id == owner_id)
-        # Если указан филиал, фильтруем по нему
-        if branch_id:
-            existing_bookings_query = existing_bookings_query.filter(Booking.branch_id == branch_id)
-    elif owner_type == OwnerType.INDIE_MASTER:
-        existing_bookings_query = existing_bookings_query.filter(Booking.indie_master_id == owner_id)
+        existing_bookings_query = _master_bookings_query(
+            db, owner_id, window_start, window_end, branch_id
+        )
     else:
-        # Для салона учитываем как бронирования самого салона, так и всех его мастеров
-        from models import Master, salon_masters
-        master_ids = db.query(salon_masters.c.master_id).filter(salon_masters.c.salon_id == owner_id).all()
-        master_id_list = [m[0] for m in master_ids]
-        
-        if master_id_list:
-            existing_bookings_query = existing_bookings_query.filter(
-                or_(
-                    Booking.salon_id == owner_id,
-                    Booking.master_id.in_(master_id_list)
-                )
-            )
+        existing_bookings_query = db.query(Booking).filter(
+            Booking.status != "cancelled",
+            Booking.status != "rejected",
+            Booking.start_time < window_end,
+            Booking.end_time > window_start,
+        )
+        if owner_type == OwnerType.INDIE_MASTER:
+            existing_bookings_query = existing_bookings_query.filter(Booking.indie_master_id == owner_id)
         else:
-            existing_bookings_query = existing_bookings_query.filter(Booking.salon_id == owner_id)
-        
-        # Если указан филиал, фильтруем по нему
-        if branch_id:
-            existing_bookings_query = existing_bookings_query.filter(Booking.branch_id == branch_id)
+            # Для салона учитываем как бронирования самого салона, так и всех его мастеров
+            from models import Master, salon_masters
+            master_ids = db.query(salon_masters.c.master_id).filter(salon_masters.c.salon_id == owner_id).all()
+            master_id_list = [m[0] for m in master_ids]
+
+            if master_id_list:
+                existing_bookings_query = existing_bookings_query.filter(
+                    or_(
+                        Booking.salon_id == owner_id,
+                        Booking.master_id.in_(master_id_list)
+                    )
+                )
+            else:
+                existing_bookings_query = existing_bookings_query.filter(Booking.salon_id == owner_id)
+
+            # Если указан филиал, фильтруем по нему
+            if branch_id:
+                existing_bookings_query = existing_bookings_query.filter(Booking.branch_id == branch_id)
 
     existing_bookings = existing_bookings_query.all()
     
@@ -393,204 +556,262 @@ def get_available_slots(
     for booking in existing_bookings:
         logger.debug(f"sched: Бронирование {booking.id}: {booking.start_time} - {booking.end_time}, статус: {booking.status}")
 
-    # Формируем список доступных слотов
-    available_slots = []
-    seen_slots = set()  # Для отслеживания уже добавленных слотов
-    
-    for availability_slot in availability_slots:
-        start_time = availability_slot.start_time if hasattr(availability_slot, 'start_time') else availability_slot['start_time']
-        end_time = availability_slot.end_time if hasattr(availability_slot, 'end_time') else availability_slot['end_time']
-        
-        logger.debug(f"sched: Проверяем слот доступности: {start_time} - {end_time}")
-        
-        # Генерируем 30-минутные слоты внутри доступного времени
-        time_slots = _get_slots_for_duration(start_time, end_time, 30)
-        
-        for slot_start in time_slots:
-            # Проверяем доступность слота
-            if _is_slot_available(slot_start, service_duration, existing_bookings, date):
-                # Создаем datetime для начала и конца слота
-                slot_start_dt = datetime.combine(date, slot_start)
-                slot_end_dt = slot_start_dt + timedelta(minutes=service_duration)
+    if use_cache:
+        availability_cache.store(
+            owner_id,
+            _date,
+            branch_id or None,
+            DayAvailability.build(_date, master_schedule, base_slots, existing_bookings),
+            cache_token,
+        )
 
-                # Конец окна доступности: слот с услугой не должен вылезать за рамку
-                if isinstance(end_time, time):
-                    window_end_dt = datetime.combine(date, end_time)
-                else:
-                    window_end_dt = _to_naive(end_time) if end_time is not None else None
-                if window_end_dt is not None and _to_naive(slot_end_dt) > _to_naive(window_end_dt):
-                    logger.debug(
-                        f"sched: ⏱️ Слот {slot_start} не помещается (конец {slot_end_dt} > окно {window_end_dt})"
-                    )
-                    continue
+    occupied = OccupiedIntervals.from_bookings(existing_bookings)
+    return _collect_available_slots(date, availability_slots, occupied, service_duration)
 
-                # Создаем уникальный ключ для слота
-                slot_key = slot_start_dt.isoformat()
 
-                if slot_key not in seen_slots:
-                    available_slots.append({
-                        "start_time": slot_start_dt,
-                        "end_time": slot_end_dt
-                    })
-                    seen_slots.add(slot_key)
-                    logger.debug(f"sched: ✅ Слот {slot_start} доступен")
-                else:
-                    logger.debug(f"sched: 🔄 Слот {slot_start} уже добавлен, пропускаем")
-            else:
-                logger.debug(f"sched: ❌ Слот {slot_start} занят")
+def get_available_slots_for_range(
+    db: Session,
+    owner_type: OwnerType,
+    owner_id: int,
+    from_date,
+    to_date,
+    service_duration: int,  # в минутах
+    branch_id: Optional[int] = None,
+) -> Dict[date, List[dict]]:
+    """
+    Доступные слоты на каждый день диапазона from_date..to_date (включительно).
 
-    logger.debug(f"sched: Итого доступных слотов: {len(available_slots)}")
-    return available_slots
+    Для мастера расписание (AvailabilitySlot, MasterSchedule) и брони всего окна
+    загружаются одним запросом каждое, дальше дни считаются в памяти — результат
+    совпадает с get_available_slots по каждому дню. Дни, уже лежащие в
+    availability_cache, в БД не ходят. Для прочих типов владельца —
+    по-дневной вызов get_available_slots.
+    """
+    first_day = _as_date(from_date)
+    last_day = _as_date(to_date)
+    days: List[date] = []
+    current = first_day
+    while current <= last_day:
+        days.append(current)
+        current += timedelta(days=1)
+    if not days:
+        return {}
+
+    if owner_type != OwnerType.MASTER:
+        return {
+            day: get_available_slots(
+                db, owner_type, owner_id, datetime.combine(day, time.min), service_duration, branch_id
+            )
+            for day in days
+        }
+
+    result: Dict[date, List[dict]] = {}
+    use_cache = service_duration > 0
+    if use_cache:
+        for day in days:
+            cached_day = availability_cache.get(owner_id, day, branch_id or None)
+            if cached_day is not None:
+                result[day] = cached_day.free_slots(day, service_duration)
+        if len(result) == len(days):
+            return result
+        cache_token = availability_cache.generation(owner_id)
+    # Из БД грузим только отрезок с днями, которых нет в кэше
+    missing_days = [day for day in days if day not in result]
+    load_from, load_to = missing_days[0], missing_days[-1]
+
+    from models import MasterSchedule
+
+    base_slots_by_dow: Dict[int, list] = defaultdict(list)
+    for slot in (
+        db.query(AvailabilitySlot)
+        .filter(
+            AvailabilitySlot.owner_type == owner_type,
+            AvailabilitySlot.owner_id == owner_id,
+        )
+        .all()
+    ):
+        base_slots_by_dow[slot.day_of_week].append(slot)
+
+    schedule_by_date: Dict[date, list] = defaultdict(list)
+    for row in (
+        db.query(MasterSchedule)
+        .filter(
+            MasterSchedule.master_id == owner_id,
+            MasterSchedule.date >= load_from,
+            MasterSchedule.date <= load_to,
+            MasterSchedule.is_available == True
+        )
+        .order_by(MasterSchedule.date, MasterSchedule.start_time)
+        .all()
+    ):
+        schedule_by_date[row.date].append(row)
+
+    window_start, window_end = _bookings_window(load_from, load_to, service_duration)
+    bookings = _master_bookings_query(db, owner_id, window_start, window_end, branch_id).all()
+    logger.debug(
+        f"sched: Диапазон {load_from}..{load_to} мастера {owner_id}: "
+        f"{len(schedule_by_date)} дней с расписанием, {len(bookings)} броней в окне"
+    )
+
+    # Один индекс занятости на всё окно: поиск логарифмический, делить брони по дням не нужно
+    occupied = OccupiedIntervals.from_bookings(bookings)
+
+    for day in missing_days:
+        master_schedule = schedule_by_date.get(day)
+        base_slots = base_slots_by_dow.get(_day_of_week(day), [])
+        if use_cache:
+            availability_cache.store(
+                owner_id,
+                day,
+                branch_id or None,
+                DayAvailability.build(day, master_schedule or [], base_slots, bookings),
+                cache_token,
+            )
+        if master_schedule:
+            availability_slots = _master_schedule_windows(master_schedule, service_duration)
+        else:
+            availability_slots = base_slots
+        if not availability_slots:
+            result[day] = []
+            continue
+        result[day] = _collect_available_slots(
+            datetime.combine(day, time.min),
+            availability_slots,
+            occupied,
+            service_duration,
+        )
+    return {day: result[day] for day in days}
 
 
-def get_available_slots_any_master_logic(
+def _load_any_master_day(
     db: Session,
     salon_id: int,
     service_id: int,
-    date: datetime,
-    service_duration: int,
+    day,
     branch_id: Optional[int] = None,
-) -> List[dict]:
+) -> Optional[List[dict]]:
     """
-    Получает доступные слоты для "Любого мастера" в салоне
+    Кандидаты «Любого мастера» на день одним набором запросов: мастера салона с услугой
+    (вместе с именем — без lazy-load master.user), их AvailabilitySlot на день недели и
+    активные брони за день. Число запросов не зависит от числа мастеров.
+
+    None — услуга не найдена. Мастера без слотов доступности в этот день не попадают в список.
     """
-    logger.debug(f"sched: Получение слотов 'Любой мастер' для салона {salon_id}, услуги {service_id} на {date}")
-    
-    # Получаем всех мастеров салона, которые оказывают данную услугу
-    from models import Master, salon_masters, Service
-    from sqlalchemy import and_
-    
+    from models import Master, salon_masters, Service, User
+
     # Получаем информацию об услуге
     service = db.query(Service).filter(Service.id == service_id).first()
     if not service:
         logger.debug(f"sched: Услуга {service_id} не найдена")
-        return []
-    
-    # Получаем мастеров салона, которые оказывают данную услугу
-    masters_query = db.query(Master).join(
-        salon_masters, Master.id == salon_masters.c.master_id
-    ).filter(
-        and_(
-            salon_masters.c.salon_id == salon_id,
-            Master.services.any(Service.id == service_id)
+        return None
+
+    # Мастера салона, которые оказывают данную услугу
+    masters_query = (
+        db.query(Master.id, User.full_name)
+        .join(salon_masters, Master.id == salon_masters.c.master_id)
+        .outerjoin(User, User.id == Master.user_id)
+        .filter(
+            and_(
+                salon_masters.c.salon_id == salon_id,
+                Master.services.any(Service.id == service_id)
+            )
         )
     )
-    
     if branch_id:
         masters_query = masters_query.filter(Master.branch_id == branch_id)
-    
     masters = masters_query.all()
     logger.debug(f"sched: Найдено {len(masters)} мастеров для услуги {service_id} в салоне {salon_id}")
-    
     if not masters:
-        logger.debug(f"sched: Нет мастеров для услуги {service_id} в салоне {salon_id}")
         return []
-    
-    # Получаем день недели
-    day_of_week = date.weekday() + 1  # 1=Понедельник, 2=Вторник, etc.
-    
-    # Собираем все доступные слоты от всех мастеров
-    all_available_slots = []
-    master_slot_counts = {}  # Количество занятых слотов у каждого мастера в день
-    
-    for master in masters:
-        logger.debug(f"sched: Проверяем мастера {master.id} ({master.user.full_name if master.user else 'Без имени'})")
-        
-        # Получаем слоты доступности мастера
-        availability_slots = (
-            db.query(AvailabilitySlot)
-            .filter(
-                and_(
-                    AvailabilitySlot.owner_type == OwnerType.MASTER,
-                    AvailabilitySlot.owner_id == master.id,
-                    AvailabilitySlot.day_of_week == day_of_week
-                )
+
+    master_ids = [m_id for m_id, _ in masters]
+    day_of_week = _day_of_week(day)
+
+    windows_by_master: Dict[int, list] = defaultdict(list)
+    for slot in (
+        db.query(AvailabilitySlot)
+        .filter(
+            and_(
+                AvailabilitySlot.owner_type == OwnerType.MASTER,
+                AvailabilitySlot.owner_id.in_(master_ids),
+                AvailabilitySlot.day_of_week == day_of_week
             )
-            .all()
         )
-        
-        if not availability_slots:
-            logger.debug(f"sched: Мастер {master.id} не работает в день {day_of_week}")
-            continue
-        
-        # Получаем существующие бронирования мастера на эту дату
-        existing_bookings = (
-            db.query(Booking)
-            .filter(
-                and_(
-                    Booking.master_id == master.id,
-                    Booking.start_time >= date.replace(hour=0, minute=0, second=0, microsecond=0),
-                    Booking.start_time < date.replace(hour=23, minute=59, second=59, microsecond=999999),
-                    Booking.status != "cancelled",
-                    Booking.status != "rejected"
-                )
+        .all()
+    ):
+        windows_by_master[slot.owner_id].append(slot)
+
+    bookings_by_master: Dict[int, list] = defaultdict(list)
+    for booking in (
+        db.query(Booking)
+        .filter(
+            and_(
+                Booking.master_id.in_(master_ids),
+                Booking.start_time >= day.replace(hour=0, minute=0, second=0, microsecond=0),
+                Booking.start_time < day.replace(hour=23, minute=59, second=59, microsecond=999999),
+                Booking.status != "cancelled",
+                Booking.status != "rejected"
             )
-            .all()
         )
-        
-        # Подсчитываем количество занятых слотов у мастера в день
-        occupied_slots_count = len(existing_bookings)
-        master_slot_counts[master.id] = occupied_slots_count
-        
-        logger.debug(f"sched: Мастер {master.id} имеет {occupied_slots_count} занятых слотов в день")
-        
-        # Генерируем доступные слоты для мастера
-        for availability_slot in availability_slots:
-            start_time = availability_slot.start_time
-            end_time = availability_slot.end_time
-            
+        .all()
+    ):
+        bookings_by_master[booking.master_id].append(booking)
+
+    candidates = []
+    for master_id, full_name in masters:
+        windows = windows_by_master.get(master_id)
+        if not windows:
+            logger.debug(f"sched: Мастер {master_id} не работает в день {day_of_week}")
+            continue
+        bookings = bookings_by_master.get(master_id, [])
+        candidates.append({
+            "id": master_id,
+            "name": full_name or f"Мастер {master_id}",
+            "windows": windows,
+            # Количество занятых слотов у мастера в день
+            "occupied_slots": len(bookings),
+            "occupied": OccupiedIntervals.from_bookings(bookings),
+        })
+    return candidates
+
+
+def get_available_slots_any_master_logic(
+    db: Session,
+    salon_id: int,
+    service_id: int,
+    date: datetime,
+    service_duration: int,
+    branch_id: Optional[int] = None,
+) -> List[dict]:
+    """
+    Получает доступные слоты для "Любого мастера" в салоне
+    """
+    logger.debug(f"sched: Получение слотов 'Любой мастер' для салона {salon_id}, услуги {service_id} на {date}")
+
+    candidates = _load_any_master_day(db, salon_id, service_id, date, branch_id)
+    if not candidates:
+        logger.debug(f"sched: Нет мастеров для услуги {service_id} в салоне {salon_id}")
+        return []
+
+    # Слот свободен, если свободен хоть у одного мастера — объединяем свободное время всех
+    free_starts = set()
+    for candidate in candidates:
+        for availability_slot in candidate["windows"]:
             # Генерируем 30-минутные слоты внутри доступного времени
-            time_slots = _get_slots_for_duration(start_time, end_time, 30)
-            
-            for slot_start in time_slots:
-                # Проверяем доступность слота
-                if _is_slot_available(slot_start, service_duration, existing_bookings, date):
-                    # Создаем datetime для начала и конца слота
-                    slot_start_dt = datetime.combine(date, slot_start)
-                    slot_end_dt = slot_start_dt + timedelta(minutes=service_duration)
-                    
-                    all_available_slots.append({
-                        "start_time": slot_start_dt,
-                        "end_time": slot_end_dt,
-                        "master_id": master.id,
-                        "master_name": master.user.full_name if master.user else f"Мастер {master.id}",
-                        "occupied_slots": occupied_slots_count
-                    })
-    
-    if not all_available_slots:
+            for slot_start in _get_slots_for_duration(availability_slot.start_time, availability_slot.end_time, 30):
+                if _is_slot_available(slot_start, service_duration, candidate["occupied"], date):
+                    free_starts.add(datetime.combine(date, slot_start))
+
+    if not free_starts:
         logger.debug(f"sched: Нет доступных слотов у мастеров")
         return []
-    
-    # Убираем дубли слотов и выбираем лучшего мастера для каждого слота
-    unique_slots = {}
-    
-    for slot in all_available_slots:
-        slot_key = slot["start_time"].isoformat()
-        
-        if slot_key not in unique_slots:
-            # Первый слот с таким временем
-            unique_slots[slot_key] = slot
-        else:
-            # Выбираем мастера с меньшим количеством занятых слотов
-            current_slot = unique_slots[slot_key]
-            if slot["occupied_slots"] < current_slot["occupied_slots"]:
-                unique_slots[slot_key] = slot
-            elif slot["occupied_slots"] == current_slot["occupied_slots"]:
-                # Если количество занятых слотов одинаковое, выбираем мастера с более старым последним бронированием
-                # (это упрощенная логика, можно доработать)
-                unique_slots[slot_key] = slot
-    
-    # Формируем финальный список слотов (без информации о мастере для клиента)
-    final_slots = []
-    for slot in unique_slots.values():
-        final_slots.append({
-            "start_time": slot["start_time"],
-            "end_time": slot["end_time"]
-        })
-    
-    # Сортируем по времени
-    final_slots.sort(key=lambda x: x["start_time"])
-    
+
+    # Формируем финальный список слотов (без информации о мастере для клиента), по времени
+    final_slots = [
+        {"start_time": slot_start_dt, "end_time": slot_start_dt + timedelta(minutes=service_duration)}
+        for slot_start_dt in sorted(free_starts)
+    ]
+
     logger.debug(f"sched: Итого уникальных слотов: {len(final_slots)}")
     return final_slots
 
@@ -604,122 +825,50 @@ def get_best_master_for_slot(
     branch_id: Optional[int] = None,
 ) -> Optional[dict]:
     """
-    Выбирает лучшего мастера для конкретного времени
+    Выбирает лучшего мастера для конкретного времени: среди мастеров, у которых интервал
+    попадает в окно доступности и не пересекается с бронями, — с наименьшей загрузкой за день.
     """
     logger.debug(f"sched: Выбор лучшего мастера для салона {salon_id}, услуги {service_id}")
     logger.debug(f"sched: Время: {start_time} - {end_time}")
-    
-    # Получаем всех мастеров салона, которые оказывают данную услугу
-    from models import Master, salon_masters, Service
-    from sqlalchemy import and_
-    
-    # Получаем информацию об услуге
-    service = db.query(Service).filter(Service.id == service_id).first()
-    if not service:
-        logger.debug(f"sched: Услуга {service_id} не найдена")
-        return None
-    
-    # Получаем мастеров салона, которые оказывают данную услугу
-    masters_query = db.query(Master).join(
-        salon_masters, Master.id == salon_masters.c.master_id
-    ).filter(
-        and_(
-            salon_masters.c.salon_id == salon_id,
-            Master.services.any(Service.id == service_id)
-        )
-    )
-    
-    if branch_id:
-        masters_query = masters_query.filter(Master.branch_id == branch_id)
-    
-    masters = masters_query.all()
-    logger.debug(f"sched: Найдено {len(masters)} мастеров для услуги {service_id} в салоне {salon_id}")
-    
-    if not masters:
+
+    candidates = _load_any_master_day(db, salon_id, service_id, start_time, branch_id)
+    if not candidates:
         logger.debug(f"sched: Нет мастеров для услуги {service_id} в салоне {salon_id}")
         return None
-    
-    # Получаем день недели
-    day_of_week = start_time.weekday() + 1  # 1=Понедельник, 2=Вторник, etc.
-    
-    # Проверяем каждого мастера
+
     available_masters = []
-    
-    for master in masters:
-        logger.debug(f"sched: Проверяем мастера {master.id} ({master.user.full_name if master.user else 'Без имени'})")
-        
-        # Получаем слоты доступности мастера
-        availability_slots = (
-            db.query(AvailabilitySlot)
-            .filter(
-                and_(
-                    AvailabilitySlot.owner_type == OwnerType.MASTER,
-                    AvailabilitySlot.owner_id == master.id,
-                    AvailabilitySlot.day_of_week == day_of_week
-                )
-            )
-            .all()
+    for candidate in candidates:
+        # Проверяем, покрывает ли слот доступности запрашиваемое время
+        is_available = any(
+            start_time >= datetime.combine(start_time.date(), slot.start_time)
+            and end_time <= datetime.combine(start_time.date(), slot.end_time)
+            for slot in candidate["windows"]
         )
-        
-        if not availability_slots:
-            logger.debug(f"sched: Мастер {master.id} не работает в день {day_of_week}")
-            continue
-        
-        # Проверяем, доступен ли мастер в указанное время
-        is_available = False
-        for availability_slot in availability_slots:
-            slot_start = availability_slot.start_time
-            slot_end = availability_slot.end_time
-            
-            # Проверяем, покрывает ли слот доступности запрашиваемое время
-            slot_start_dt = datetime.combine(start_time.date(), slot_start)
-            slot_end_dt = datetime.combine(start_time.date(), slot_end)
-            
-            if start_time >= slot_start_dt and end_time <= slot_end_dt:
-                is_available = True
-                break
-        
         if not is_available:
-            logger.debug(f"sched: Мастер {master.id} недоступен в указанное время")
+            logger.debug(f"sched: Мастер {candidate['id']} недоступен в указанное время")
             continue
-        
-        # Получаем существующие бронирования мастера на эту дату
-        existing_bookings = (
-            db.query(Booking)
-            .filter(
-                and_(
-                    Booking.master_id == master.id,
-                    Booking.start_time >= start_time.replace(hour=0, minute=0, second=0, microsecond=0),
-                    Booking.start_time < start_time.replace(hour=23, minute=59, second=59, microsecond=999999),
-                    Booking.status != "cancelled",
-                    Booking.status != "rejected"
-                )
-            )
-            .all()
-        )
-        
-        # Подсчитываем количество занятых слотов у мастера в день
-        occupied_slots_count = len(existing_bookings)
-        
-        logger.debug(f"sched: Мастер {master.id} имеет {occupied_slots_count} занятых слотов в день")
-        
+        if candidate["occupied"].overlaps(start_time, end_time):
+            logger.debug(f"sched: Мастер {candidate['id']} занят в указанное время")
+            continue
+
+        logger.debug(f"sched: Мастер {candidate['id']} имеет {candidate['occupied_slots']} занятых слотов в день")
         available_masters.append({
-            "id": master.id,
-            "name": master.user.full_name if master.user else f"Мастер {master.id}",
-            "occupied_slots": occupied_slots_count,
+            "id": candidate["id"],
+            "name": candidate["name"],
+            "occupied_slots": candidate["occupied_slots"],
             "last_booking_time": None  # Можно доработать для более точного выбора
         })
-    
+
     if not available_masters:
         logger.debug(f"sched: Нет доступных мастеров для указанного времени")
         return None
-    
+
     # Выбираем лучшего мастера по количеству занятых слотов
     best_master = min(available_masters, key=lambda x: x["occupied_slots"])
-    
+
     logger.debug(f"sched: Выбран лучший мастер: {best_master['id']} ({best_master['name']})")
     logger.debug(f"sched: Количество занятых слотов: {best_master['occupied_slots']}")
-    
+
     return best_master
 
 
@@ -4,8 +4,9 @@
 import asyncio
 import logging
 from datetime import datetime, timedelta
-from database import get_db
+from database import BackgroundSessionLocal
 from models import TemporaryBooking
+from services.job_runner import job_runner
 
 logger = logging.getLogger(__name__)
 
@@ -15,7 +16,7 @@ def cleanup_expired_temporary_bookings():
     Удаляет просроченные временные брони (expires_at < now).
     Обновляет статус просроченных броней на 'expired'.
     """
-    db = next(get_db())
+    db = BackgroundSessionLocal()
     
     try:
         now = datetime.utcnow()
@@ -57,8 +58,13 @@ async def run_temporary_bookings_cleanup_task():
     """
     while True:
         try:
-            # Выполняем очистку
-            result = cleanup_expired_temporary_bookings()
+            # Выполняем очистку (в пуле job_runner, один воркер на все процессы)
+            result = await job_runner.run(
+                "temporary_bookings_cleanup",
+                cleanup_expired_temporary_bookings,
+                timeout=240,
+                rows=lambda r: r.get("cleaned"),
+            )
             cleaned = result.get("cleaned", 0) if isinstance(result, dict) else 0
             if cleaned:
                 logger.info("Задача очистки временных броней выполнена: %s", result)
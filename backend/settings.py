@@ -34,6 +34,27 @@ class Settings(BaseSettings):
 
     # --- Database ---
     DATABASE_URL: str = ""
+    # Пул соединений HTTP-запросов (database.engine): постоянные + временные сверх размера,
+    # ожидание свободного соединения, проверка перед выдачей, пересоздание старых соединений
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT_SECONDS: int = 30
+    DB_POOL_PRE_PING: bool = True
+    DB_POOL_RECYCLE_SECONDS: int = 1800
+    # statement_timeout PostgreSQL для запросов HTTP, мс; 0 — без ограничения
+    DB_STATEMENT_TIMEOUT_MS: int = 30000
+    # Отдельный пул фоновых задач (database.background_engine): ночные пакеты не занимают
+    # соединения HTTP-трафика; statement_timeout по умолчанию не ограничен.
+    # Размер не задан — считается из воркеров (background_pool_required); задан меньше — ошибка старта
+    DB_BACKGROUND_POOL_SIZE: Optional[int] = None
+    DB_BACKGROUND_MAX_OVERFLOW: int = 2
+    DB_BACKGROUND_STATEMENT_TIMEOUT_MS: int = 0
+    # SQLite: журнал WAL + synchronous=NORMAL; ожидание снятия блокировки записи, мс
+    DB_SQLITE_WAL: bool = True
+    DB_SQLITE_BUSY_TIMEOUT_MS: int = 5000
+    # Реплика только для чтения (database.get_read_db): статистика и отчёты; пусто — основная БД.
+    # Пул и statement_timeout — как у HTTP (DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_STATEMENT_TIMEOUT_MS)
+    DATABASE_READ_URL: str = ""
 
     # --- Feature flags / business ---
     SALONS_ENABLED: str = ""
@@ -50,6 +71,20 @@ class Settings(BaseSettings):
     SUBSCRIPTION_PAYMENT_DEBUG: str = ""
     PAYMENT_URL_DEBUG: str = ""
     DAILY_CHARGE_DEBUG: str = ""
+    # Размер чанка пакетных ежедневных списаний (services/daily_charge_batch)
+    DAILY_CHARGE_CHUNK_SIZE: int = 500
+    # Воркеры доначисления пропущенных дней (services/daily_charge_catchup); на SQLite всегда 1
+    DAILY_CHARGE_CATCHUP_WORKERS: int = 4
+    # Инкрементальное обновление rollup статистики админки (services/admin_daily_metrics), сек;
+    # полная пересборка — раз в сутки
+    ADMIN_METRICS_REFRESH_SECONDS: int = 300
+    # Потоки пула фоновых задач (services/job_runner); синхронная работа с БД не блокирует event loop
+    BACKGROUND_JOB_WORKERS: int = 2
+    # Хэширование паролей (utils/password_hashing): стоимость bcrypt, потоки пула и длина очереди;
+    # при смене PASSWORD_BCRYPT_ROUNDS хэш пересчитывается при следующем входе
+    PASSWORD_BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 2
+    PASSWORD_HASH_MAX_QUEUE: int = 32
 
     # --- URLs ---
     FRONTEND_URL: str = "http://localhost:5175"
@@ -107,6 +142,25 @@ class Settings(BaseSettings):
     REDIS_HOST: str = "localhost"
     REDIS_PORT: str = "6379"
 
+    # --- Performance / in-process caches ---
+    # Кэш свободного времени мастера по дням (services/availability_cache); 0 — выключен
+    AVAILABILITY_CACHE_TTL_SECONDS: int = 60
+    # Кэш скомпилированных правил скидок мастера (utils/loyalty_rule_cache); 0 — выключен
+    LOYALTY_RULE_CACHE_TTL_SECONDS: int = 300
+    # Кэш разрешённого плана пользователя для проверок функций (utils/subscription_feature_cache); 0 — выключен
+    PLAN_FEATURE_CACHE_TTL_SECONDS: int = 60
+    # Кэш пользователя по JWT sub для авторизации запросов (utils/auth_user_cache); 0 — выключен
+    AUTH_USER_CACHE_TTL_SECONDS: int = 30
+    # Максимальный возраст сохранённого счётчика активных записей (utils/master_active_bookings)
+    BOOKING_LIMIT_COUNT_MAX_AGE_SECONDS: int = 600
+    # Учёт SQL по HTTP-запросам (sql_instrumentation): Server-Timing, лог медленных запросов
+    # (дольше SQL_SLOW_REQUEST_MS или больше SQL_MANY_QUERIES_WARN запросов; 0 — порог выключен),
+    # выборка для p50/p95 по маршруту
+    SQL_INSTRUMENTATION_ENABLED: bool = True
+    SQL_SLOW_REQUEST_MS: int = 1000
+    SQL_MANY_QUERIES_WARN: int = 100
+    SQL_ROUTE_STATS_SAMPLES: int = 500
+
     @model_validator(mode="before")
     @classmethod
     def default_database_url(cls, data: object) -> object:
@@ -117,6 +171,28 @@ class Settings(BaseSettings):
                 data = {**data, "DATABASE_URL": f"sqlite:///{base_dir}/bookme.db"}
         return data
 
+    def background_pool_required(self) -> int:
+        """
+        Соединений фонового пула, нужных одновременно: catch-up ежедневных списаний
+        (сессия планировщика + DAILY_CHARGE_CATCHUP_WORKERS) и на каждый поток
+        BACKGROUND_JOB_WORKERS — сессия задачи и сессия аренды (services/job_runner).
+        """
+        catch_up = max(1, self.DAILY_CHARGE_CATCHUP_WORKERS) + 1
+        return catch_up + 2 * max(1, self.BACKGROUND_JOB_WORKERS)
+
+    @model_validator(mode="after")
+    def validate_background_pool(self) -> "Settings":
+        required = self.background_pool_required()
+        if self.DB_BACKGROUND_POOL_SIZE is None:
+            self.DB_BACKGROUND_POOL_SIZE = required
+        elif self.DB_BACKGROUND_POOL_SIZE + self.DB_BACKGROUND_MAX_OVERFLOW < required:
+            raise ValueError(
+                f"DB_BACKGROUND_POOL_SIZE + DB_BACKGROUND_MAX_OVERFLOW must be at least {required} "
+                "(DAILY_CHARGE_CATCHUP_WORKERS + 1 + 2 * BACKGROUND_JOB_WORKERS), otherwise "
+                "background jobs wait for a connection and fail with a pool timeout."
+            )
+        return self
+
     @model_validator(mode="after")
     def validate_jwt_secret_in_production(self) -> "Settings":
         if self.ENVIRONMENT.strip().lower() != "production":
@@ -265,6 +341,9 @@ class Settings(BaseSettings):
         return {
             "ENVIRONMENT": self.ENVIRONMENT,
             "DATABASE": "sqlite" if "sqlite" in self.DATABASE_URL else "postgres",
+            "DB_POOL": f"{self.DB_POOL_SIZE}+{self.DB_MAX_OVERFLOW}",
+            "DB_BACKGROUND_POOL": f"{self.DB_BACKGROUND_POOL_SIZE}+{self.DB_BACKGROUND_MAX_OVERFLOW}",
+            "DB_READ_REPLICA": bool(self.DATABASE_READ_URL.strip()),
             "ROBOKASSA_MODE": self.ROBOKASSA_MODE or "(empty)",
             "ROBOKASSA_IS_TEST": self.robokassa_is_test,
             "ROBOKASSA_ALLOW_INSECURE_PROD_PASSWORDS_IN_TEST": self.robokassa_allow_insecure_prod_passwords_in_test,
@@ -0,0 +1,233 @@
+"""
+Учёт SQL по HTTP-запросам: число запросов, время в БД, медленные запросы, p50/p95 по маршрутам.
+
+SQLInstrumentationMiddleware (чистый ASGI) создаёт на каждый HTTP-запрос RequestSQLStats и
+кладёт в contextvar; события движка SQLAlchemy (before/after_cursor_execute, на всех Engine)
+записывают туда каждый выполненный statement. contextvar доходит и до threadpool (sync-эндпоинты,
+ThreadpoolDBRoute), и до фоновых потоков без запроса — там статистики нет, события ничего не делают.
+
+По запросу:
+- заголовок Server-Timing: db (время в БД и число запросов к моменту начала ответа) и app;
+- лог предупреждения, если запрос дольше SQL_SLOW_REQUEST_MS или выполнил больше
+  SQL_MANY_QUERIES_WARN запросов, с самыми повторяющимися statement (N+1 видно сразу);
+- выборка в route_sql_stats: последние SQL_ROUTE_STATS_SAMPLES запросов на маршрут,
+  p50/p95 времени, числа запросов и времени в БД — GET /api/admin/sql-stats.
+
+Выключение: SQL_INSTRUMENTATION_ENABLED=false.
+"""
+from __future__ import annotations
+
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Различных statement, которые помним в пределах одного запроса
+_MAX_DISTINCT_STATEMENTS = 200
+_TOP_STATEMENTS = 5
+_STATEMENT_LOG_CHARS = 300
+_UNMATCHED_ROUTE = "<unmatched>"
+
+_current_stats: contextvars.ContextVar[Optional["RequestSQLStats"]] = contextvars.ContextVar(
+    "request_sql_stats", default=None
+)
+
+
+class RequestSQLStats:
+    """SQL одного HTTP-запроса; пишется из потоков threadpool, поэтому под блокировкой."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.query_count = 0
+        self.db_seconds = 0.0
+        self._statements: Dict[str, List[float]] = {}
+
+    def record(self, statement: str, seconds: float) -> None:
+        with self._lock:
+            self.query_count += 1
+            self.db_seconds += seconds
+            entry = self._statements.get(statement)
+            if entry is not None:
+                entry[0] += 1
+                entry[1] += seconds
+            elif len(self._statements) < _MAX_DISTINCT_STATEMENTS:
+                self._statements[statement] = [1, seconds]
+
+    def top_statements(self, limit: int = _TOP_STATEMENTS) -> List[Dict[str, Any]]:
+        """Самые повторяющиеся statement (при равенстве — по суммарному времени)."""
+        with self._lock:
+            items = sorted(self._statements.items(), key=lambda kv: (kv[1][0], kv[1][1]), reverse=True)
+        return [
+            {"count": int(count), "db_ms": round(seconds * 1000, 3), "statement": statement[:_STATEMENT_LOG_CHARS]}
+            for statement, (count, seconds) in items[:limit]
+        ]
+
+
+def current_request_sql_stats() -> Optional[RequestSQLStats]:
+    return _current_stats.get()
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_stats.get() is not None:
+        conn.info.setdefault("sql_instrumentation_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current_stats.get()
+    if stats is None:
+        return
+    started = conn.info.get("sql_instrumentation_started")
+    if not started:
+        return
+    stats.record(statement, time.perf_counter() - started.pop())
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(exception_context):
+    # Ошибочный statement не доходит до after_cursor_execute — снимаем его отметку времени
+    conn = exception_context.connection
+    if conn is not None and _current_stats.get() is not None:
+        started = conn.info.get("sql_instrumentation_started")
+        if started:
+            started.pop()
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+class RouteSQLStats:
+    """Последние замеры по маршрутам «METHOD /path/{param}» для p50/p95."""
+
+    def __init__(self, max_samples: Optional[int] = None) -> None:
+        self._max_samples = max_samples
+        self._lock = threading.Lock()
+        self._samples: Dict[str, Deque[Tuple[float, int, float]]] = {}
+        self._totals: Dict[str, int] = {}
+
+    def record(self, route_key: str, duration_ms: float, query_count: int, db_ms: float) -> None:
+        max_samples = self._max_samples or max(1, get_settings().SQL_ROUTE_STATS_SAMPLES)
+        with self._lock:
+            samples = self._samples.get(route_key)
+            if samples is None:
+                samples = self._samples[route_key] = deque(maxlen=max_samples)
+            samples.append((duration_ms, query_count, db_ms))
+            self._totals[route_key] = self._totals.get(route_key, 0) + 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._samples.clear()
+            self._totals.clear()
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """Маршруты по убыванию p95 времени в БД."""
+        with self._lock:
+            snapshot = {key: list(samples) for key, samples in self._samples.items()}
+            totals = dict(self._totals)
+        rows = []
+        for route_key, samples in snapshot.items():
+            durations = [s[0] for s in samples]
+            queries = [float(s[1]) for s in samples]
+            db_times = [s[2] for s in samples]
+            rows.append({
+                "route": route_key,
+                "requests": totals.get(route_key, len(samples)),
+                "samples": len(samples),
+                "duration_ms_p50": round(_percentile(durations, 0.5), 3),
+                "duration_ms_p95": round(_percentile(durations, 0.95), 3),
+                "queries_p50": _percentile(queries, 0.5),
+                "queries_p95": _percentile(queries, 0.95),
+                "queries_max": max(queries),
+                "db_ms_p50": round(_percentile(db_times, 0.5), 3),
+                "db_ms_p95": round(_percentile(db_times, 0.95), 3),
+            })
+        rows.sort(key=lambda row: row["db_ms_p95"], reverse=True)
+        return rows
+
+
+route_sql_stats = RouteSQLStats()
+
+
+def _route_key(scope: Dict[str, Any]) -> str:
+    route = scope.get("route")
+    path = getattr(route, "path_format", None) or getattr(route, "path", None)
+    if not path:
+        return _UNMATCHED_ROUTE
+    return f"{scope.get('method', '')} {path}"
+
+
+def _server_timing(stats: RequestSQLStats, app_seconds: float) -> bytes:
+    return (
+        f'db;dur={stats.db_seconds * 1000:.2f};desc="{stats.query_count} queries", '
+        f"app;dur={app_seconds * 1000:.2f}"
+    ).encode("latin-1")
+
+
+class SQLInstrumentationMiddleware:
+    """ASGI-middleware: статистика SQL на HTTP-запрос, Server-Timing, лог медленных, агрегаты."""
+
+    def __init__(
+        self,
+        app: Any,
+        *,
+        slow_request_ms: Optional[int] = None,
+        many_queries: Optional[int] = None,
+        route_stats: Optional[RouteSQLStats] = None,
+    ) -> None:
+        self.app = app
+        s = get_settings()
+        self.slow_request_ms = s.SQL_SLOW_REQUEST_MS if slow_request_ms is None else slow_request_ms
+        self.many_queries = s.SQL_MANY_QUERIES_WARN if many_queries is None else many_queries
+        self.route_stats = route_stats or route_sql_stats
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestSQLStats()
+        token = _current_stats.set(stats)
+        started = time.perf_counter()
+
+        async def send_with_timing(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers") or [])
+                headers.append((b"server-timing", _server_timing(stats, time.perf_counter() - started)))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current_stats.reset(token)
+            self._finish(scope, stats, (time.perf_counter() - started) * 1000)
+
+    def _finish(self, scope: Dict[str, Any], stats: RequestSQLStats, duration_ms: float) -> None:
+        route_key = _route_key(scope)
+        db_ms = stats.db_seconds * 1000
+        self.route_stats.record(route_key, duration_ms, stats.query_count, db_ms)
+        too_slow = 0 < self.slow_request_ms <= duration_ms
+        too_many = 0 < self.many_queries < stats.query_count
+        if too_slow or too_many:
+            logger.warning(
+                "Медленный запрос %s %s: %.1f мс, SQL: %d запросов, %.1f мс; чаще всего: %s",
+                route_key,
+                scope.get("path", ""),
+                duration_ms,
+                stats.query_count,
+                db_ms,
+                stats.top_statements(),
+            )
@@ -20,6 +20,28 @@ engine = create_engine(
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
+@pytest.fixture(autouse=True)
+def _reset_process_caches():
+    # Таблицы пересоздаются на каждый тест, id повторяются — процессные кэши не должны переживать тест
+    from services.admin_daily_metrics import dirty_queue as admin_metrics_dirty_queue
+    from services.availability_cache import availability_cache
+    from utils.auth_user_cache import auth_user_cache
+    from utils.loyalty_rule_cache import loyalty_rule_cache
+    from utils.subscription_feature_cache import plan_feature_cache
+
+    availability_cache.clear()
+    loyalty_rule_cache.clear()
+    plan_feature_cache.clear()
+    auth_user_cache.clear()
+    admin_metrics_dirty_queue.reset()
+    yield
+    availability_cache.clear()
+    loyalty_rule_cache.clear()
+    plan_feature_cache.clear()
+    auth_user_cache.clear()
+    admin_metrics_dirty_queue.reset()
+
+
 @pytest.fixture(scope="function")
 def db():
     # Создаем таблицы перед каждым тестом
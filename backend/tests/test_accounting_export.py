@@ -0,0 +1,151 @@
+"""
+Потоковый экспорт бухгалтерии (GET /api/master/accounting/export): порядок строк, накопительный
+баланс, CSV и XLSX (write-only openpyxl).
+"""
+import csv
+import io
+from datetime import datetime, timedelta
+
+from openpyxl import load_workbook
+
+from auth import get_password_hash
+from models import (
+    Booking,
+    BookingConfirmation,
+    BookingStatus,
+    Master,
+    MasterExpense,
+    Service,
+    Subscription,
+    SubscriptionPlan,
+    SubscriptionStatus,
+    SubscriptionType,
+    User,
+    UserRole,
+)
+
+
+def _finance_master(db, phone="+79005550101"):
+    user = User(
+        email=f"{phone}@example.com",
+        hashed_password=get_password_hash("testpassword"),
+        phone=phone,
+        full_name="Export Master",
+        role=UserRole.MASTER,
+        is_active=True,
+        is_verified=True,
+    )
+    db.add(user)
+    db.commit()
+    db.refresh(user)
+    master = Master(user_id=user.id, bio="", experience_years=1)
+    plan = SubscriptionPlan(
+        name="FinanceExport",
+        subscription_type=SubscriptionType.MASTER,
+        price_1month=1000.0,
+        price_3months=900.0,
+        price_6months=800.0,
+        price_12months=700.0,
+        features={"service_functions": [1, 2, 3, 4, 5, 6], "max_page_modules": 1},
+        limits={},
+        is_active=True,
+        display_order=0,
+    )
+    db.add_all([master, plan])
+    db.commit()
+    db.add(Subscription(
+        user_id=user.id,
+        subscription_type=SubscriptionType.MASTER,
+        status=SubscriptionStatus.ACTIVE,
+        plan_id=plan.id,
+        start_date=datetime.utcnow(),
+        end_date=datetime.utcnow() + timedelta(days=30),
+        price=1000.0,
+        daily_rate=1000.0 / 30,
+        is_active=True,
+        auto_renewal=False,
+        salon_branches=0,
+        salon_employees=0,
+        master_bookings=0,
+    ))
+    db.commit()
+    return user, master
+
+
+def _seed_operations(db):
+    user, master = _finance_master(db)
+    service = Service(name="Стрижка", price=1000, duration=60, salon_id=None)
+    db.add(service)
+    db.commit()
+    now = datetime.now().replace(second=0, microsecond=0)
+    booking_ids = []
+    for days_ago in (5, 1):
+        booking = Booking(
+            client_id=user.id,
+            service_id=service.id,
+            master_id=master.id,
+            start_time=now - timedelta(days=days_ago, hours=2),
+            end_time=now - timedelta(days=days_ago, hours=1),
+            status=BookingStatus.COMPLETED,
+            payment_amount=1000,
+            loyalty_points_used=0,
+        )
+        db.add(booking)
+        db.commit()
+        booking_ids.append(booking.id)
+    db.add_all([
+        BookingConfirmation(booking_id=booking_ids[0], master_id=user.id,
+                            confirmed_at=now - timedelta(days=5), confirmed_income=1000.0),
+        BookingConfirmation(booking_id=booking_ids[1], master_id=user.id,
+                            confirmed_at=now - timedelta(days=1), confirmed_income=1500.0),
+        MasterExpense(master_id=user.id, name="Аренда", expense_type="one_time",
+                      amount=400.0, expense_date=now - timedelta(days=3)),
+        # Вне периода — в выгрузку не попадает
+        MasterExpense(master_id=user.id, name="Старый расход", expense_type="one_time",
+                      amount=999.0, expense_date=now - timedelta(days=60)),
+    ])
+    db.commit()
+    return user, booking_ids
+
+
+def _auth_headers(client, phone):
+    response = client.post("/api/auth/login", json={"phone": phone, "password": "testpassword"})
+    assert response.status_code == 200, response.text
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def test_export_csv_streams_rows_newest_first_with_running_balance(client, db):
+    user, booking_ids = _seed_operations(db)
+    headers = _auth_headers(client, user.phone)
+
+    response = client.get("/api/master/accounting/export?format=csv", headers=headers)
+
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"].startswith("text/csv")
+    assert response.headers["content-disposition"].endswith(".csv")
+    assert response.content.startswith("\ufeff".encode("utf-8"))
+    rows = list(csv.reader(io.StringIO(response.content.decode("utf-8-sig")), delimiter=";"))
+    assert rows[0] == ["Дата", "Тип операции", "Название", "Доход", "Расход", "Баланс"]
+    body = [(r[1], r[2], float(r[3]), float(r[4]), float(r[5])) for r in rows[1:]]
+    assert body == [
+        ("Доход", f"Услуга #{booking_ids[1]}", 1500.0, 0.0, 2100.0),
+        ("Расход", "Аренда", 0.0, 400.0, 600.0),
+        ("Доход", f"Услуга #{booking_ids[0]}", 1000.0, 0.0, 1000.0),
+    ]
+
+
+def test_export_excel_uses_same_rows(client, db):
+    user, _ = _seed_operations(db)
+    headers = _auth_headers(client, user.phone)
+
+    response = client.get("/api/master/accounting/export?format=excel", headers=headers)
+
+    assert response.status_code == 200, response.text
+    assert response.headers["content-disposition"].endswith(".xlsx")
+    ws = load_workbook(io.BytesIO(response.content)).active
+    assert ws.title == "Бухгалтерия"
+    values = [list(row) for row in ws.iter_rows(values_only=True)]
+    assert values[0] == ["Дата", "Тип операции", "Название", "Доход", "Расход", "Баланс"]
+    assert [(r[1], r[5]) for r in values[1:]] == [("Доход", 2100), ("Расход", 600), ("Доход", 1000)]
+    assert ws["A1"].font.bold
+    assert ws["F2"].font.color.rgb.endswith("2196F3")
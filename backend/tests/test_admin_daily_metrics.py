@@ -0,0 +1,151 @@
+"""Статистика админки из дневного rollup: совпадение с прямыми COUNT и обновление по событиям."""
+from datetime import datetime, timedelta
+
+import pytest
+
+from models import AdminDailyMetrics, Booking, BookingStatus, Master, User, UserRole
+from services.admin_daily_metrics import (
+    admin_metrics_summary,
+    dirty_queue,
+    ensure_admin_daily_metrics,
+    rebuild_admin_daily_metrics,
+    refresh_admin_daily_metrics,
+)
+
+
+def _auth_admin(client, test_admin):
+    r = client.post("/api/auth/login", json={"phone": test_admin.phone, "password": "testpassword"})
+    assert r.status_code == 200, r.text
+    return {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+
+def _seed(db):
+    now = datetime.utcnow()
+    users = []
+    for i, (role, days_ago) in enumerate(
+        [(UserRole.CLIENT, 0), (UserRole.CLIENT, 3), (UserRole.MASTER, 10), (UserRole.MASTER, 40)]
+    ):
+        user = User(
+            email=f"rollup{i}@test.com",
+            phone=f"+7900555000{i}",
+            hashed_password="x",
+            role=role,
+            is_active=i != 1,
+            created_at=now - timedelta(days=days_ago),
+        )
+        db.add(user)
+        users.append(user)
+    db.flush()
+    master = Master(user_id=users[2].id, can_work_independently=True, created_at=now - timedelta(days=10))
+    db.add(master)
+    db.flush()
+    for i, (status, days) in enumerate(
+        [
+            (BookingStatus.COMPLETED.value, -2),
+            (BookingStatus.COMPLETED.value, -20),
+            (BookingStatus.CANCELLED.value, 0),
+            (BookingStatus.CONFIRMED.value, 5),
+        ]
+    ):
+        start = now + timedelta(days=days)
+        db.add(
+            Booking(
+                master_id=master.id,
+                client_id=users[0].id,
+                start_time=start,
+                end_time=start + timedelta(minutes=30 * (i + 1)),
+                status=status,
+            )
+        )
+    db.commit()
+
+
+def _direct_counts(db):
+    return {
+        "total_users": db.query(User).count(),
+        "active_users": db.query(User).filter(User.is_active == True).count(),
+        "total_masters": db.query(Master).count(),
+        "total_bookings": db.query(Booking).count(),
+        "completed_bookings": db.query(Booking).filter(Booking.status == BookingStatus.COMPLETED.value).count(),
+    }
+
+
+def test_rollup_matches_direct_counts_and_tracks_changes(db, test_admin):
+    _seed(db)
+    ensure_admin_daily_metrics(db)
+    summary = admin_metrics_summary(db)
+    assert {k: summary[k] for k in _direct_counts(db)} == _direct_counts(db)
+    assert summary["users_by_role"]["indie"] == 1
+    assert summary["users_by_role"]["master"] == 2
+    assert summary["average_booking_duration"] == pytest.approx((0.5 + 1.0 + 1.5 + 2.0) / 4, abs=0.06)
+    assert summary["new_users_this_week"] == 3  # два клиента + админ из фикстуры
+
+    # Перенос брони на другой день и удаление пользователя — пересчёт по дням из очереди
+    booking = db.query(Booking).filter(Booking.status == BookingStatus.CONFIRMED.value).one()
+    booking.start_time = booking.start_time + timedelta(days=30)
+    booking.end_time = booking.end_time + timedelta(days=30)
+    booking.status = BookingStatus.COMPLETED.value
+    db.delete(db.query(User).filter(User.phone == "+79005550001").one())
+    db.commit()
+    assert dirty_queue.days
+
+    ensure_admin_daily_metrics(db)
+    summary = admin_metrics_summary(db)
+    assert not dirty_queue.days
+    assert {k: summary[k] for k in _direct_counts(db)} == _direct_counts(db)
+    assert sum(r.bookings_total for r in db.query(AdminDailyMetrics)) == db.query(Booking).count()
+
+
+def test_incremental_refresh_picks_up_changes_from_other_processes(db, test_admin):
+    _seed(db)
+    rebuild_admin_daily_metrics(db)
+    # Изменение «другим процессом»: очередь этого процесса о нём не знает
+    db.add(User(email="late@test.com", phone="+79005550099", hashed_password="x", role=UserRole.CLIENT))
+    db.commit()
+    dirty_queue.reset()
+
+    assert refresh_admin_daily_metrics(db)["mode"] == "incremental"
+    assert admin_metrics_summary(db)["total_users"] == db.query(User).count()
+
+
+def test_incremental_refresh_conflict_keeps_watermark_and_requeues_days(db, test_admin, monkeypatch):
+    import services.admin_daily_metrics as metrics_module
+    from sqlalchemy.exc import IntegrityError
+
+    _seed(db)
+    rebuild_admin_daily_metrics(db)
+    watermark = metrics_module._get_watermark(db)
+    db.add(User(email="late@test.com", phone="+79005550099", hashed_password="x", role=UserRole.CLIENT))
+    db.commit()
+    dirty_queue.reset()
+
+    # Тот же день параллельно вставил ensure_admin_daily_metrics другого воркера
+    def _conflict(*args, **kwargs):
+        raise IntegrityError("INSERT INTO admin_daily_metrics", {}, Exception("duplicate metric_date"))
+
+    monkeypatch.setattr(metrics_module, "_write_rows", _conflict)
+    with pytest.raises(IntegrityError):
+        refresh_admin_daily_metrics(db)
+
+    assert metrics_module._get_watermark(db) == watermark
+    days, _, _ = dirty_queue.drain()
+    assert datetime.utcnow().date() in days
+
+
+def test_admin_dashboard_stats_reads_rollup(client, db, test_admin):
+    _seed(db)
+    headers = _auth_admin(client, test_admin)
+
+    r = client.get("/api/admin/dashboard/stats", headers=headers)
+    assert r.status_code == 200, r.text
+    data = r.json()
+    direct = _direct_counts(db)
+    assert data["total_users"] == direct["total_users"]
+    assert data["total_bookings"] == direct["total_bookings"]
+    assert data["conversion_rate"] == round(direct["completed_bookings"] / direct["total_bookings"] * 100, 1)
+    assert [d["users"] for d in data["weekly_activity"]][-1] == 2  # клиент и админ созданы сегодня
+    assert len(data["weekly_activity"]) == 7
+
+    r = client.get("/api/admin/stats/users", headers=headers)
+    assert r.status_code == 200, r.text
+    assert r.json()["active_users"] == direct["active_users"]
@@ -0,0 +1,68 @@
+"""Резолв пользователя по токену из кэша и инвалидация при деактивации, смене роли и удалении."""
+from sqlalchemy import event
+
+from models import User, UserRole
+
+
+def _headers(token_data):
+    return {"Authorization": f"Bearer {token_data['access_token']}"}
+
+
+def _user(db, user_id):
+    # Сессия закрывается после каждого запроса клиента — перечитываем пользователя
+    return db.query(User).filter(User.id == user_id).one()
+
+
+def _user_selects(client, db, headers):
+    statements = []
+    bind = db.get_bind()
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(bind, "before_cursor_execute", listener)
+    try:
+        response = client.get("/api/auth/users/me", headers=headers)
+    finally:
+        event.remove(bind, "before_cursor_execute", listener)
+    return response, sum("FROM users" in s for s in statements)
+
+
+def test_repeated_requests_skip_user_query(client, db, test_user, test_user_token):
+    headers = _headers(test_user_token)
+    response, selects = _user_selects(client, db, headers)
+    assert response.status_code == 200
+    assert selects == 1
+
+    response, selects = _user_selects(client, db, headers)
+    assert response.status_code == 200
+    assert response.json()["email"] == test_user.email
+    assert selects == 0
+
+    # Правка профиля видна в следующем запросе
+    user = _user(db, test_user.id)
+    user.full_name = "Renamed"
+    db.commit()
+    response, selects = _user_selects(client, db, headers)
+    assert (response.json()["full_name"], selects) == ("Renamed", 1)
+
+
+def test_role_change_and_deactivation_invalidate(client, db, test_user, test_user_token):
+    headers = _headers(test_user_token)
+    assert client.get("/api/auth/users/me", headers=headers).json()["role"] == UserRole.CLIENT.value
+
+    user_id = test_user.id
+    user = _user(db, user_id)
+    user.role = UserRole.MASTER
+    db.commit()
+    assert client.get("/api/auth/users/me", headers=headers).json()["role"] == UserRole.MASTER.value
+
+    user = _user(db, user_id)
+    user.is_active = False
+    db.commit()
+    assert client.get("/api/auth/users/me", headers=headers).status_code == 401
+
+    user = _user(db, user_id)
+    user.is_active = True
+    db.commit()
+    assert client.get("/api/auth/users/me", headers=headers).status_code == 200
+    db.delete(_user(db, user_id))
+    db.commit()
+    assert client.get("/api/auth/users/me", headers=headers).status_code == 401
@@ -0,0 +1,29 @@
+"""
+Планы горячих запросов по броням (scripts/benchmark_booking_queries.py): ни один не должен
+становиться полным просмотром bookings.
+"""
+from models import Booking
+from scripts.benchmark_booking_queries import (
+    explain,
+    is_full_table_scan,
+    plan_regressions,
+    run_benchmark,
+    seed_dataset,
+)
+
+
+def test_hot_booking_queries_use_indexes(db):
+    ctx = seed_dataset(db.get_bind(), masters=20, history_cycles=2)
+
+    report = run_benchmark(db, ctx, repeat=0)
+
+    assert report["dataset"]["bookings"] > 0
+    assert plan_regressions(report) == [], {q["name"]: q["plan"] for q in report["queries"]}
+
+
+def test_full_table_scan_is_detected(db):
+    seed_dataset(db.get_bind(), masters=2, history_cycles=1)
+
+    plan = explain(db, db.query(Booking).filter(Booking.payment_amount > 0))
+
+    assert is_full_table_scan("sqlite", plan)
@@ -0,0 +1,141 @@
+"""Лимит активных записей Free: один GROUP BY по всем мастерам и сохранённый счётчик для эндпоинтов."""
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from models import (
+    Booking,
+    BookingStatus,
+    Master,
+    MasterActiveBookingCount,
+    Subscription,
+    SubscriptionPlan,
+    SubscriptionStatus,
+    SubscriptionType,
+    User,
+    UserRole,
+)
+from services.bookings_limit_monitor import check_masters_bookings_limits
+from utils.master_active_bookings import active_future_bookings_count
+
+
+def _free_master(db, plan, i, bookings):
+    now = datetime.utcnow()
+    user = User(email=f"free{i}@test.com", phone=f"+7900777000{i}", hashed_password="x", role=UserRole.MASTER)
+    db.add(user)
+    db.flush()
+    master = Master(user_id=user.id, bio="", experience_years=0, domain=f"free-master-{i}")
+    db.add(master)
+    db.add(
+        Subscription(
+            user_id=user.id,
+            plan_id=plan.id,
+            subscription_type=SubscriptionType.MASTER,
+            status=SubscriptionStatus.ACTIVE,
+            start_date=now - timedelta(days=1),
+            end_date=now + timedelta(days=30),
+            price=0,
+            daily_rate=0,
+        )
+    )
+    db.flush()
+    for status, hours in bookings:
+        start = now + timedelta(hours=hours)
+        db.add(Booking(master_id=master.id, start_time=start, end_time=start + timedelta(hours=1), status=status))
+    db.commit()
+    return master
+
+
+def _seed(db):
+    plan = SubscriptionPlan(
+        name="Free",
+        subscription_type=SubscriptionType.MASTER,
+        price_1month=0,
+        price_3months=0,
+        price_6months=0,
+        price_12months=0,
+        limits={"max_future_bookings": 2},
+    )
+    db.add(plan)
+    db.flush()
+    confirmed, cancelled = BookingStatus.CONFIRMED.value, BookingStatus.CANCELLED.value
+    masters = [
+        _free_master(db, plan, 0, [(confirmed, 5), (confirmed, 30), (confirmed, 50)]),
+        _free_master(db, plan, 1, [(confirmed, 5), (cancelled, 6), (confirmed, -3)]),
+        _free_master(db, plan, 2, []),
+    ]
+    return plan, masters
+
+
+def test_monitor_counts_all_free_masters_in_one_query(db):
+    _, masters = _seed(db)
+    statements = []
+    bind = db.get_bind()
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(bind, "before_cursor_execute", listener)
+    try:
+        result = check_masters_bookings_limits(db)
+    finally:
+        event.remove(bind, "before_cursor_execute", listener)
+
+    assert sum("count(bookings.id)" in s.lower() for s in statements) == 1
+    assert len(statements) <= 4  # план, GROUP BY, upsert счётчиков
+    assert (result["masters_checked"], result["masters_over_limit"], result["masters_under_limit"]) == (3, 1, 2)
+    assert result["masters_at_limit"] == 0
+    stored = {r.master_id: r.active_future_bookings for r in db.query(MasterActiveBookingCount)}
+    assert stored == {masters[0].id: 3, masters[1].id: 1, masters[2].id: 0}
+
+
+def test_domain_limit_reads_stored_count_until_bookings_change(client, db):
+    _, masters = _seed(db)
+    check_masters_bookings_limits(db)
+    master_id = masters[1].id
+    # Подменяем сохранённое значение: эндпоинт должен вернуть его, не пересчитывая записи
+    db.query(MasterActiveBookingCount).filter(MasterActiveBookingCount.master_id == master_id).update(
+        {"active_future_bookings": 2}
+    )
+    db.commit()
+
+    r = client.get("/api/domain/free-master-1/bookings-limit")
+    assert r.status_code == 200, r.text
+    assert (r.json()["current_active_bookings"], r.json()["is_limit_exceeded"]) == (2, True)
+
+    # Новая запись мастера удаляет строку после коммита — следующий запрос считает записи, ничего не сохраняя
+    start = datetime.utcnow() + timedelta(days=2)
+    db.add(Booking(master_id=master_id, start_time=start, end_time=start + timedelta(hours=1), status=BookingStatus.CONFIRMED.value))
+    db.commit()
+    assert db.query(MasterActiveBookingCount).filter(MasterActiveBookingCount.master_id == master_id).count() == 0
+
+    r = client.get("/api/domain/free-master-1/bookings-limit")
+    assert r.json()["current_active_bookings"] == 2
+    assert db.query(MasterActiveBookingCount).filter(MasterActiveBookingCount.master_id == master_id).count() == 0
+
+    # Массовая отмена тоже инвалидирует счётчик, заново сохранённый мониторингом
+    check_masters_bookings_limits(db)
+    db.query(Booking).filter(Booking.master_id == master_id).update(
+        {"status": BookingStatus.CANCELLED.value}, synchronize_session=False
+    )
+    assert db.query(MasterActiveBookingCount).filter(MasterActiveBookingCount.master_id == master_id).count() == 1
+    db.commit()
+    assert db.query(MasterActiveBookingCount).filter(MasterActiveBookingCount.master_id == master_id).count() == 0
+    r = client.get("/api/domain/free-master-1/bookings-limit")
+    assert (r.json()["current_active_bookings"], r.json()["is_limit_exceeded"]) == (0, False)
+
+
+def test_stale_count_is_read_without_writing(db):
+    _, masters = _seed(db)
+    check_masters_bookings_limits(db)
+    master = masters[0]
+    db.query(MasterActiveBookingCount).filter(MasterActiveBookingCount.master_id == master.id).update(
+        {"active_future_bookings": 99, "refreshed_at": datetime.utcnow() - timedelta(days=1)}
+    )
+    db.commit()
+
+    # Несохранённое изменение запроса не должно закоммититься чтением счётчика
+    master.bio = "черновик"
+    assert active_future_bookings_count(db, master) == 3
+    db.rollback()
+
+    db.expire_all()
+    assert db.get(Master, master.id).bio == ""
+    assert db.get(MasterActiveBookingCount, master.id).active_future_bookings == 99
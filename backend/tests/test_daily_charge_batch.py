@@ -0,0 +1,289 @@
+"""Пакетные ежедневные списания: тот же результат, что process_daily_charge по одной подписке."""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import func
+
+from database import Base
+from models import (
+    AdminOperation,
+    BalanceTransaction,
+    DailySubscriptionCharge,
+    Subscription,
+    SubscriptionFreeze,
+    SubscriptionReservation,
+    SubscriptionStatus,
+    SubscriptionType,
+    User,
+    UserBalance,
+    UserRole,
+)
+from services.daily_charge_batch import charge_subscriptions_batch
+from services.daily_charges import process_all_daily_charges
+from tests.conftest import engine
+from utils.balance_utils import process_daily_charge
+
+# Подписки должны быть действующими на «сейчас»: process_all помечает истёкшие по utcnow
+CHARGE_DATE = datetime.utcnow().date()
+START = datetime.combine(CHARGE_DATE - timedelta(days=9), datetime.min.time())
+
+
+def _user(db, phone, role=UserRole.MASTER, balance=None):
+    user = User(
+        email=f"{phone[1:]}@test.com",
+        hashed_password="x",
+        phone=phone,
+        full_name=f"User {phone}",
+        role=role,
+        is_active=True,
+        is_verified=True,
+    )
+    db.add(user)
+    db.flush()
+    if balance is not None:
+        db.add(UserBalance(user_id=user.id, balance=balance, currency="RUB"))
+    return user
+
+
+def _sub(db, user, price, reserved=None, start=START):
+    sub = Subscription(
+        user_id=user.id,
+        subscription_type=SubscriptionType.MASTER,
+        status=SubscriptionStatus.ACTIVE,
+        is_active=True,
+        start_date=start,
+        end_date=start + timedelta(days=30),
+        price=price,
+        daily_rate=price / 30,
+        auto_renewal=False,
+        salon_branches=0,
+        salon_employees=0,
+        master_bookings=0,
+    )
+    db.add(sub)
+    db.flush()
+    if reserved is not None:
+        db.add(SubscriptionReservation(user_id=user.id, subscription_id=sub.id, reserved_amount=reserved))
+    return sub
+
+
+def _scenario(db):
+    """Две подписки одного пользователя, резерв, нехватка средств, заморозка, 0 ₽, без баланса, уже списано."""
+    _user(db, "+79031078685", role=UserRole.ADMIN, balance=0.0)
+    shared = _user(db, "+79004440001", balance=1000.0)
+    _sub(db, shared, 900.0, reserved=900.0)
+    _sub(db, shared, 600.0)
+    _sub(db, _user(db, "+79004440002", balance=5.0), 900.0)
+    frozen = _sub(db, _user(db, "+79004440003", balance=100.0), 900.0)
+    db.add(
+        SubscriptionFreeze(
+            subscription_id=frozen.id,
+            start_date=START + timedelta(days=8),
+            end_date=START + timedelta(days=11, hours=23, minutes=59),
+            freeze_days=4,
+        )
+    )
+    _sub(db, _user(db, "+79004440004", balance=0.0), 0.0)
+    _sub(db, _user(db, "+79004440005"), 900.0)
+    charged = _sub(db, _user(db, "+79004440006", balance=500.0), 900.0)
+    db.add(
+        DailySubscriptionCharge(
+            subscription_id=charged.id,
+            charge_date=CHARGE_DATE,
+            amount=30.0,
+            daily_rate=30.0,
+            balance_before=530.0,
+            balance_after=500.0,
+        )
+    )
+    db.commit()
+    return [sid for (sid,) in db.query(Subscription.id).order_by(Subscription.id)]
+
+
+def _snapshot(db):
+    db.expire_all()
+    return {
+        "charges": sorted(
+            (c.subscription_id, c.charge_date, c.amount, c.balance_before, c.balance_after, c.status, c.reason)
+            for c in db.query(DailySubscriptionCharge)
+        ),
+        "transactions": sorted(
+            (t.user_id, t.amount, t.subscription_id, t.balance_before, t.balance_after, t.description)
+            for t in db.query(BalanceTransaction)
+        ),
+        "balances": sorted((b.user_id, b.balance) for b in db.query(UserBalance)),
+        "reserved": sorted((r.subscription_id, r.reserved_amount) for r in db.query(SubscriptionReservation)),
+        "active": sorted((s.id, s.is_active) for s in db.query(Subscription)),
+        "admin_ops": sorted((o.from_user_id, o.amount_rubles) for o in db.query(AdminOperation)),
+    }
+
+
+def test_batch_matches_per_subscription_charges(db):
+    ids = _scenario(db)
+    expected_results = {sid: process_daily_charge(db, sid, CHARGE_DATE) for sid in ids}
+    expected = _snapshot(db)
+
+    db.close()
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    assert _scenario(db) == ids
+
+    batch = charge_subscriptions_batch(db, ids, CHARGE_DATE, chunk_size=3)
+    assert _snapshot(db) == expected
+    assert [c["size"] for c in batch["chunks"]] == [3, 3, 1]
+    for sid in ids:
+        got, want = batch["results"][sid], expected_results[sid]
+        assert (got["success"], got.get("error"), got.get("skipped"), got.get("subscription_deactivated")) == (
+            want["success"],
+            want.get("error"),
+            want.get("skipped"),
+            want.get("subscription_deactivated"),
+        )
+        if "balance_after" in want:
+            assert got["balance_after"] == want["balance_after"]
+
+
+def test_process_all_is_idempotent_and_dry_run_writes_nothing(db):
+    ids = _scenario(db)
+    before = _snapshot(db)
+
+    dry = process_all_daily_charges(CHARGE_DATE, db=db, dry_run=True)
+    assert dry["throughput"]["dry_run"] is True
+    assert dry["successful_charges"] == 4
+    assert _snapshot(db) == before
+
+    first = process_all_daily_charges(CHARGE_DATE, db=db)
+    assert (first["successful_charges"], first["deactivated_subscriptions"]) == (dry["successful_charges"], 2)
+    assert sorted(first["affected_user_ids"]) == sorted(
+        {uid for (uid,) in db.query(Subscription.user_id).filter(Subscription.id.in_(ids))}
+    )
+    after_first = _snapshot(db)
+
+    process_all_daily_charges(CHARGE_DATE, db=db)
+    assert _snapshot(db) == after_first
+
+
+def test_parallel_catch_up_keeps_per_subscription_order_and_resumes(db):
+    from models import GlobalSettings
+    from services.daily_charge_catchup import CHECKPOINT_KEY, run_catch_up
+    from tests.conftest import TestingSessionLocal
+
+    _scenario(db)
+    up_to = CHARGE_DATE + timedelta(days=1)
+    # Первый чанк (админ и первый пользователь) уже пройден прошлым запуском
+    shared_user_id = db.query(User.id).filter(User.phone == "+79004440001").scalar()
+    db.add(
+        GlobalSettings(
+            key=CHECKPOINT_KEY,
+            value={"up_to_date": up_to.isoformat(), "done_user_ranges": [[0, shared_user_id]]},
+        )
+    )
+    db.commit()
+
+    result = run_catch_up(db, up_to, workers=2, chunk_size=2, session_factory=TestingSessionLocal)
+    assert result["resumed_from_checkpoint"] is True
+    assert all(c["seconds"] >= 0 for c in result["chunks"])
+    db.expire_all()
+    assert db.query(GlobalSettings).filter(GlobalSettings.key == CHECKPOINT_KEY).count() == 0
+    shared_charged = (
+        db.query(DailySubscriptionCharge)
+        .join(Subscription, Subscription.id == DailySubscriptionCharge.subscription_id)
+        .filter(Subscription.user_id == shared_user_id)
+        .count()
+    )
+    assert shared_charged == 0
+
+    # Без checkpoint — догоняем оставшихся; даты каждой подписки идут подряд
+    result = run_catch_up(db, up_to, workers=2, chunk_size=2, session_factory=TestingSessionLocal)
+    assert result["resumed_from_checkpoint"] is False
+    db.expire_all()
+    for (sid,) in db.query(Subscription.id).filter(Subscription.user_id == shared_user_id):
+        charges = (
+            db.query(DailySubscriptionCharge)
+            .filter(DailySubscriptionCharge.subscription_id == sid)
+            .order_by(DailySubscriptionCharge.id)
+            .all()
+        )
+        assert [c.charge_date for c in charges] == [START.date() + timedelta(days=i) for i in range(11)]
+    chain = (
+        db.query(BalanceTransaction)
+        .filter(BalanceTransaction.user_id == shared_user_id)
+        .order_by(BalanceTransaction.id)
+        .all()
+    )
+    assert all(a.balance_after == b.balance_before for a, b in zip(chain, chain[1:]))
+    balance = db.query(UserBalance.balance).filter(UserBalance.user_id == shared_user_id).scalar()
+    spent = db.query(func.sum(BalanceTransaction.amount)).filter(BalanceTransaction.user_id == shared_user_id).scalar()
+    assert balance == pytest.approx(1000.0 + spent)
+    admin_id = db.query(User.id).filter(User.phone == "+79031078685").scalar()
+    admin_balance = db.query(UserBalance.balance).filter(UserBalance.user_id == admin_id).scalar()
+    paid_by_users = (
+        db.query(func.sum(BalanceTransaction.amount)).filter(BalanceTransaction.user_id != admin_id).scalar()
+    )
+    # Параллельные чанки не теряют приращения общего баланса админа
+    assert admin_balance == pytest.approx(-paid_by_users)
+    # и не пересекаются в его транзакциях: balance_after одной — balance_before следующей
+    admin_chain = (
+        db.query(BalanceTransaction)
+        .filter(BalanceTransaction.user_id == admin_id)
+        .order_by(BalanceTransaction.id)
+        .all()
+    )
+    assert admin_chain[0].balance_before == 0.0
+    assert all(a.balance_after == b.balance_before for a, b in zip(admin_chain, admin_chain[1:]))
+    assert admin_chain[-1].balance_after == admin_balance
+
+    assert run_catch_up(db, up_to, workers=2, session_factory=TestingSessionLocal)["charges_applied"] == 0
+
+
+def test_parallel_chunks_keep_admin_transaction_chain(db, monkeypatch):
+    import threading
+
+    import services.daily_charge_batch as batch_module
+    from tests.conftest import TestingSessionLocal
+
+    _user(db, "+79031078685", role=UserRole.ADMIN, balance=100.0)
+    ids = [
+        _sub(db, _user(db, "+79004440011", balance=1000.0), 900.0).id,
+        _sub(db, _user(db, "+79004440012", balance=1000.0), 600.0).id,
+    ]
+    db.commit()
+
+    # Оба чанка прочитаны до записи любого из них — как у параллельных воркеров catch-up
+    both_loaded = threading.Barrier(2, timeout=10)
+    write_chunk = batch_module._write_chunk
+
+    def _write_after_both_loaded(*args, **kwargs):
+        both_loaded.wait()
+        write_chunk(*args, **kwargs)
+
+    monkeypatch.setattr(batch_module, "_write_chunk", _write_after_both_loaded)
+    batches = []
+
+    def _worker(sid):
+        session = TestingSessionLocal()
+        try:
+            batches.append(charge_subscriptions_batch(session, [sid], CHARGE_DATE))
+        finally:
+            session.close()
+
+    threads = [threading.Thread(target=_worker, args=(sid,)) for sid in ids]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert [c["fallback"] for b in batches for c in b["chunks"]] == [False, False]
+    db.expire_all()
+    admin_id = db.query(User.id).filter(User.phone == "+79031078685").scalar()
+    chain = (
+        db.query(BalanceTransaction)
+        .filter(BalanceTransaction.user_id == admin_id)
+        .order_by(BalanceTransaction.id)
+        .all()
+    )
+    assert len(chain) == 2
+    assert chain[0].balance_before == 100.0
+    assert chain[0].balance_after == chain[1].balance_before
+    admin_balance = db.query(UserBalance.balance).filter(UserBalance.user_id == admin_id).scalar()
+    assert chain[1].balance_after == admin_balance == 100.0 + chain[0].amount + chain[1].amount
@@ -0,0 +1,75 @@
+"""Пул соединений: настройки движка, pragma SQLite, метрики ожидания, отдельный фоновый пул."""
+import threading
+
+import pytest
+from sqlalchemy import create_engine, text
+from pydantic import ValidationError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+import database
+from database import create_app_engine
+from db_pool import MeteredQueuePool
+from settings import Settings
+
+
+def test_sqlite_file_engine_uses_metered_pool_and_wal(tmp_path):
+    engine = create_app_engine(f"sqlite:///{tmp_path / 'app.db'}", pool_size=2, max_overflow=1)
+    try:
+        assert isinstance(engine.pool, MeteredQueuePool)
+        with engine.connect() as conn:
+            assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+            assert conn.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+            assert conn.execute(text("PRAGMA busy_timeout")).scalar() == 5000
+        snapshot = engine.pool.snapshot()
+        assert (snapshot["size"], snapshot["max_overflow"], snapshot["checkouts"]) == (2, 1, 1)
+    finally:
+        engine.dispose()
+
+
+def test_checkout_wait_and_timeout_are_recorded(tmp_path):
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'wait.db'}",
+        poolclass=MeteredQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.2,
+    )
+    try:
+        held = engine.connect()
+        with pytest.raises(PoolTimeoutError):
+            engine.connect()
+
+        released = threading.Timer(0.05, held.close)
+        released.start()
+        with engine.connect():
+            pass
+        released.join()
+
+        metrics = engine.pool.snapshot()
+        assert metrics["timeouts"] == 1
+        assert metrics["checkouts"] == 2
+        assert metrics["waits"] == 2
+        assert metrics["wait_ms_max"] >= 150
+        assert metrics["checked_out"] == 0
+    finally:
+        engine.dispose()
+
+
+def test_background_jobs_use_separate_pool():
+    assert database.background_engine.pool is not database.engine.pool
+    assert set(database.pool_metrics()) == {"http", "background"}
+
+    from services.job_runner import JobRunner
+
+    assert JobRunner()._sessions() is database.BackgroundSessionLocal
+
+
+def test_background_pool_fits_catch_up_and_job_workers():
+    # catch-up: планировщик + 4 воркера; 2 потока job_runner: сессия задачи + сессия аренды
+    s = Settings(DAILY_CHARGE_CATCHUP_WORKERS=4, BACKGROUND_JOB_WORKERS=2)
+    assert s.background_pool_required() == 9
+    assert s.DB_BACKGROUND_POOL_SIZE == 9
+
+    Settings(DAILY_CHARGE_CATCHUP_WORKERS=4, BACKGROUND_JOB_WORKERS=2, DB_BACKGROUND_POOL_SIZE=7)
+    with pytest.raises(ValidationError, match="DB_BACKGROUND_POOL_SIZE"):
+        Settings(DAILY_CHARGE_CATCHUP_WORKERS=4, BACKGROUND_JOB_WORKERS=2, DB_BACKGROUND_POOL_SIZE=3)
@@ -0,0 +1,27 @@
+"""Общий кэш с поколениями: устаревший токен, вытеснение LRU и сбор владельцев до commit."""
+from models import UserRole
+from utils.auth_user_cache import auth_user_invalidation
+from utils.generational_cache import GenerationalCache
+
+
+def test_value_built_before_invalidation_is_not_stored():
+    cache = GenerationalCache("LOYALTY_RULE_CACHE_TTL_SECONDS", max_entries=2)
+    token = cache.generation(1)
+    cache.invalidate(1)
+    cache.put(1, "a", "stale", token)
+    assert cache.lookup(1, "a") == (False, None)
+
+    for owner in (1, 2, 3):
+        cache.put(owner, "a", owner, cache.generation(owner))
+    # Вытеснена самая давняя запись
+    assert [cache.lookup(owner, "a")[0] for owner in (1, 2, 3)] == [False, True, True]
+
+
+def test_pending_owners_survive_flush_and_are_discarded_on_rollback(db, test_user):
+    user_id = test_user.id
+    test_user.role = UserRole.MASTER
+    assert auth_user_invalidation.is_dirty(db, user_id)
+    db.flush()
+    assert auth_user_invalidation.is_dirty(db, user_id)
+    db.rollback()
+    assert not auth_user_invalidation.has_changes(db)
@@ -0,0 +1,75 @@
+"""Пул фоновых задач: event loop не блокируется, перекрытие и таймауты, аренда между процессами."""
+import asyncio
+import threading
+import time
+from datetime import datetime, timedelta
+
+from models import BackgroundJobLock
+from services.job_runner import JobRunner, acquire_job_lease
+from tests.conftest import TestingSessionLocal
+
+
+def test_job_runs_off_loop_with_timeout_and_overlap_guard(db):
+    runner = JobRunner(max_workers=2, session_factory=TestingSessionLocal)
+    release = threading.Event()
+
+    def slow_job():
+        release.wait(5)
+        return {"cleaned": 3}
+
+    async def scenario():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        tick_task = asyncio.create_task(ticker())
+        first = await runner.run("cleanup", slow_job, timeout=0.2, rows=lambda r: r["cleaned"])
+        # Поток ещё работает: повторный запуск не стартует
+        second = await runner.run("cleanup", slow_job, timeout=0.2)
+        tick_task.cancel()
+        return first, second, ticks
+
+    try:
+        first, second, ticks = asyncio.run(scenario())
+        assert (first, second) == (None, None)
+        assert ticks >= 10  # event loop продолжал работать, пока задача ждала в потоке
+        metrics = runner.metrics()["cleanup"]
+        assert (metrics["timeouts"], metrics["skipped"], metrics["running"]) == (1, 1, True)
+    finally:
+        release.set()
+
+    deadline = time.monotonic() + 5
+    while runner.metrics()["cleanup"]["running"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert runner.metrics()["cleanup"]["last_rows"] == 3
+
+    assert asyncio.run(runner.run("cleanup", lambda: {"cleaned": 1}, timeout=5)) == {"cleaned": 1}
+    metrics = runner.metrics()["cleanup"]
+    assert (metrics["last_status"], metrics["runs"]) == ("ok", 2)
+    assert metrics["last_duration_seconds"] >= 0
+    runner.shutdown()
+
+
+def test_job_skipped_while_another_process_holds_the_lease(db):
+    runner = JobRunner(max_workers=1, session_factory=TestingSessionLocal)
+    assert acquire_job_lease(db, "daily_charges", "other-host:1", timedelta(minutes=10))
+    calls = []
+
+    assert asyncio.run(runner.run("daily_charges", lambda: calls.append(1), timeout=5)) is None
+    assert calls == []
+    assert runner.metrics()["daily_charges"]["last_status"] == "skipped_locked"
+
+    # Аренда истекла (процесс-владелец упал) — задачу забирает этот процесс
+    db.query(BackgroundJobLock).update({"locked_until": datetime.utcnow() - timedelta(seconds=1)})
+    db.commit()
+    asyncio.run(runner.run("daily_charges", lambda: calls.append(1), timeout=5))
+    assert calls == [1]
+    db.expire_all()
+    lock = db.query(BackgroundJobLock).one()
+    assert lock.owner == runner.owner
+    assert lock.locked_until <= datetime.utcnow()  # освобождена после выполнения
+    runner.shutdown()
@@ -1341,3 +1341,111 @@ def test_calculate_discount_amount_max_limits():
     assert calculate_discount_amount(1000, 20, None) == 200
     assert calculate_discount_amount(1000, 20, 0) == 200
     assert calculate_discount_amount(1000, 20, 100) == 100
+
+
+def test_evaluate_for_services_shares_client_history(db, master, client_user, service, monkeypatch):
+    """История клиента запрашивается один раз на все правила и услуги; результат как у поштучного расчёта."""
+    from utils import loyalty_discounts
+
+    s2 = Service(name="S2", price=2000.0, duration=30, salon_id=None, indie_master_id=None)
+    db.add(s2)
+    db.commit()
+    for name, pct, cond in (
+        ("Первый визит", 5.0, {"condition_type": "first_visit", "parameters": {}}),
+        ("Возврат", 15.0, {"condition_type": "returning_client", "parameters": {"min_days_since_last_visit": 14}}),
+        ("Возврат 2", 10.0, {"condition_type": "returning_client", "parameters": {"min_days_since_last_visit": 30}}),
+        ("Услуга", 20.0, {"condition_type": "service_discount", "parameters": {"service_id": s2.id}}),
+    ):
+        db.add(LoyaltyDiscount(
+            master_id=master.id,
+            discount_type=LoyaltyDiscountType.QUICK,
+            name=name,
+            discount_percent=pct,
+            is_active=True,
+            priority=1,
+            conditions=cond,
+        ))
+    db.commit()
+
+    calls = {"last": 0, "prior": 0}
+
+    def _last(*args):
+        calls["last"] += 1
+        return datetime(2025, 1, 5, 9, 0)
+
+    def _prior(*args):
+        calls["prior"] += 1
+        return True
+
+    monkeypatch.setattr(loyalty_discounts, "_get_last_completed_visit", _last)
+    monkeypatch.setattr(loyalty_discounts, "_has_non_cancelled_booking_with_master", _prior)
+
+    start = datetime(2025, 2, 10, 12, 0)
+    batch = loyalty_discounts.evaluate_for_services(
+        master.id, client_user.id, None, [service.id, s2.id], start, db
+    )
+    assert calls == {"last": 1, "prior": 1}
+
+    assert batch[service.id][1]["condition_type"] == "returning_client"
+    assert batch[service.id][0] == pytest.approx(850.0)
+    assert batch[s2.id][1]["condition_type"] == "service_discount"
+    assert batch[s2.id][0] == pytest.approx(1600.0)
+    for sid in (service.id, s2.id):
+        assert loyalty_discounts.evaluate_and_prepare_applied_discount(
+            master.id, client_user.id, None, start, sid, db
+        ) == batch[sid]
+
+
+def test_compiled_rule_cache_reused_and_invalidated_on_commit(db, master, client_user, service):
+    """Правила мастера компилируются один раз; изменение правила или Service видно сразу после commit."""
+    from sqlalchemy import event
+
+    from utils.loyalty_discounts import evaluate_and_prepare_applied_discount
+    from utils.loyalty_rule_cache import compile_master_rules, loyalty_rule_cache
+
+    rule = LoyaltyDiscount(
+        master_id=master.id,
+        discount_type=LoyaltyDiscountType.QUICK,
+        name="SD cache",
+        discount_percent=10.0,
+        is_active=True,
+        priority=1,
+        conditions={"condition_type": "service_discount", "parameters": {"service_id": service.id}},
+    )
+    db.add(rule)
+    db.commit()
+    master_id, client_id, service_id = master.id, client_user.id, service.id
+    start = datetime(2030, 6, 15, 10, 0, 0)
+
+    def _price():
+        return evaluate_and_prepare_applied_discount(master_id, client_id, None, start, service_id, db)[0]
+
+    assert _price() == pytest.approx(900.0)
+    statements = []
+    listener = lambda conn, cursor, statement, *a: statements.append(statement)
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        assert _price() == pytest.approx(900.0)
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    assert not [s for s in statements if "loyalty_discounts" in s or "personal_discounts" in s]
+    assert loyalty_rule_cache.stats()["hits"] >= 1
+
+    # Незакоммиченное изменение видно своей сессии, кэш для неё не используется
+    rule.discount_percent = 20.0
+    db.flush()
+    assert _price() == pytest.approx(800.0)
+    db.commit()
+    assert _price() == pytest.approx(800.0)
+
+    # Переименование Service правила ломает совпадение по ключу — кэш сбрасывается целиком
+    alias = Service(name=service.name, price=service.price, duration=service.duration)
+    db.add(alias)
+    db.commit()
+    alias_id = alias.id
+    assert evaluate_and_prepare_applied_discount(master_id, client_id, None, start, alias_id, db)[0] == pytest.approx(800.0)
+    db.query(Service).filter(Service.id == alias_id).update({"name": "Другая"}, synchronize_session=False)
+    db.commit()
+    assert evaluate_and_prepare_applied_discount(master_id, client_id, None, start, alias_id, db)[0] is None
+
+    assert loyalty_rule_cache.get_or_compile(db, master_id) == compile_master_rules(db, master_id)
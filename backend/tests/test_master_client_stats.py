@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""master_client_stats: пересчёт в транзакции изменения брони и совпадение с полной пересборкой."""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import update
+
+from models import Booking, BookingStatus, Master, MasterClientStats, Service, User, UserRole
+from utils.booking_bulk_writes import BookingOwners, _handlers, on_bulk_booking_write
+from utils.client_restrictions import count_cancellations_by_reason
+from utils.loyalty_discounts import (
+    _count_completed_visits,
+    _get_last_completed_visit,
+    _has_non_cancelled_booking_with_master,
+)
+from utils.master_client_stats import rebuild_all
+
+
+def _user(db, phone, role=UserRole.CLIENT):
+    u = User(
+        email=f"{phone[1:]}@test.com",
+        hashed_password="x",
+        phone=phone,
+        full_name=f"User {phone}",
+        role=role,
+        is_active=True,
+        is_verified=True,
+    )
+    db.add(u)
+    db.flush()
+    return u
+
+
+@pytest.fixture
+def setup(db):
+    master_user = _user(db, "+79005550001", role=UserRole.MASTER)
+    master = Master(user_id=master_user.id, bio="", experience_years=1)
+    db.add(master)
+    db.flush()
+    service_a = Service(name="Стрижка", price=1000, duration=60)
+    service_b = Service(name="Окрашивание", price=3000, duration=120)
+    db.add_all([service_a, service_b])
+    client_1 = _user(db, "+79005550002")
+    client_2 = _user(db, "+79005550003")
+    db.commit()
+    return master, client_1, client_2, service_a, service_b
+
+
+def _booking(master, client, service, start, status, **kwargs):
+    return Booking(
+        master_id=master.id,
+        client_id=client.id,
+        service_id=service.id,
+        start_time=start,
+        end_time=start + timedelta(hours=1),
+        status=status.value,
+        **kwargs,
+    )
+
+
+def _snapshot(db):
+    rows = db.query(MasterClientStats).order_by(MasterClientStats.master_id, MasterClientStats.client_id).all()
+    return [
+        (
+            r.master_id,
+            r.client_id,
+            r.completed_count,
+            r.cancelled_count,
+            r.active_count,
+            round(r.total_revenue, 2),
+            r.last_visit_at,
+            r.service_counts or {},
+            r.cancellation_counts or {},
+        )
+        for r in rows
+    ]
+
+
+def _assert_matches_rebuild(db):
+    incremental = _snapshot(db)
+    rebuild_all(db)
+    db.flush()
+    db.expire_all()
+    assert _snapshot(db) == incremental
+
+
+def test_stats_follow_booking_lifecycle(db, setup):
+    master, client_1, client_2, service_a, service_b = setup
+    base = datetime(2026, 3, 2, 10, 0)
+
+    first = _booking(master, client_1, service_a, base, BookingStatus.CREATED, payment_amount=1000)
+    second = _booking(master, client_1, service_b, base + timedelta(days=7), BookingStatus.CONFIRMED,
+                      payment_amount=3000, loyalty_points_used=500)
+    other = _booking(master, client_2, service_a, base, BookingStatus.CREATED, payment_amount=1000)
+    db.add_all([first, second, other])
+    db.commit()
+
+    stats = db.query(MasterClientStats).filter_by(master_id=master.id, client_id=client_1.id).one()
+    assert (stats.completed_count, stats.active_count, stats.cancelled_count) == (0, 2, 0)
+    assert _has_non_cancelled_booking_with_master(db, master.id, client_1.id) is True
+
+    # Статусные переходы как в update-booking-status / confirm / cancel
+    first.status = BookingStatus.COMPLETED.value
+    second.status = BookingStatus.COMPLETED.value
+    other.status = BookingStatus.CANCELLED.value
+    other.cancellation_reason = "client_no_show"
+    db.commit()
+    db.expire_all()
+
+    stats = db.query(MasterClientStats).filter_by(master_id=master.id, client_id=client_1.id).one()
+    assert stats.completed_count == 2
+    assert stats.total_revenue == pytest.approx(1000 + 2500)
+    assert stats.last_visit_at == base + timedelta(days=7)
+    assert stats.service_counts == {str(service_a.id): 1, str(service_b.id): 1}
+    assert _get_last_completed_visit(db, master.id, client_1.id) == base + timedelta(days=7)
+    assert _count_completed_visits(db, master.id, client_1.id, base + timedelta(days=30), None) == 0
+    assert _count_completed_visits(db, master.id, client_1.id, base - timedelta(days=1), base + timedelta(days=1)) == 1
+
+    assert count_cancellations_by_reason(db, master.id, client_2.id, "client_no_show") == 1
+    assert _has_non_cancelled_booking_with_master(db, master.id, client_2.id) is False
+    _assert_matches_rebuild(db)
+
+    # Перенос брони другому клиенту и удаление — обе пары пересчитываются
+    second.client_id = client_2.id
+    db.commit()
+    db.delete(other)
+    db.commit()
+    db.expire_all()
+    stats_2 = db.query(MasterClientStats).filter_by(master_id=master.id, client_id=client_2.id).one()
+    assert (stats_2.completed_count, stats_2.cancelled_count) == (1, 0)
+    assert count_cancellations_by_reason(db, master.id, client_2.id, "client_no_show") == 0
+    _assert_matches_rebuild(db)
+
+    # Массовое удаление через Query.delete
+    db.query(Booking).filter(Booking.client_id == client_1.id).delete(synchronize_session=False)
+    db.commit()
+    assert db.query(MasterClientStats).filter_by(client_id=client_1.id).count() == 0
+    _assert_matches_rebuild(db)
+
+
+def test_rollback_leaves_stats_untouched(db, setup):
+    master, client_1, _, service_a, _ = setup
+    booking = _booking(master, client_1, service_a, datetime(2026, 3, 2, 10, 0), BookingStatus.COMPLETED, payment_amount=1000)
+    db.add(booking)
+    db.commit()
+
+    booking.status = BookingStatus.CANCELLED.value
+    db.flush()
+    db.rollback()
+
+    stats = db.query(MasterClientStats).filter_by(master_id=master.id, client_id=client_1.id).one()
+    assert (stats.completed_count, stats.cancelled_count) == (1, 0)
+
+
+def test_bulk_update_by_primary_key_refreshes_only_its_pairs(db, setup):
+    master, client_1, client_2, service_a, _ = setup
+    base = datetime(2026, 3, 2, 10, 0)
+    first = _booking(master, client_1, service_a, base, BookingStatus.CONFIRMED, payment_amount=1000)
+    other = _booking(master, client_2, service_a, base, BookingStatus.CONFIRMED, payment_amount=1000)
+    db.add_all([first, other])
+    db.commit()
+
+    seen = []
+    handler = on_bulk_booking_write(lambda session, owners: seen.append(owners))
+    try:
+        # ORM bulk UPDATE по первичному ключу: WHERE нет, пары берутся из строк параметров
+        db.execute(update(Booking), [{"id": first.id, "status": BookingStatus.COMPLETED.value}])
+        # Запрос по всей таблице: выборки нет, статистика очищается до пересборки
+        db.execute(update(Booking).values(notes="x"))
+    finally:
+        _handlers.remove(handler)
+    assert seen == [{BookingOwners(master.id, None, client_1.id)}, None]
+    assert db.query(MasterClientStats).count() == 0
+    db.rollback()
+
+    db.execute(update(Booking), [{"id": first.id, "status": BookingStatus.COMPLETED.value}])
+    db.commit()
+    stats = db.query(MasterClientStats).filter_by(master_id=master.id, client_id=client_1.id).one()
+    assert stats.completed_count == 1
+    _assert_matches_rebuild(db)
@@ -147,3 +147,88 @@ def test_search_finds_completed_client(client, master_user, master_record, maste
     assert r.status_code == 200
     rows = r.json()
     assert any(x.get("client_phone") == "+79993000004" for x in rows)
+
+
+def _add_client_with_visits(db, idx, master_id, service_id, salon_id, visits, loyalty_points=0):
+    u = User(
+        email=f"client_page_{idx}@test.com",
+        hashed_password="x",
+        phone=f"+7999400{idx:04d}",
+        full_name=f"Page Client {idx}",
+        role="client",
+        is_active=True,
+        is_verified=True,
+    )
+    db.add(u)
+    db.flush()
+    base = datetime(2026, 1, 1, 10, 0)
+    for v in range(visits):
+        start = base + timedelta(days=idx, hours=v)
+        db.add(Booking(
+            master_id=master_id,
+            client_id=u.id,
+            service_id=service_id,
+            salon_id=salon_id,
+            start_time=start,
+            end_time=start + timedelta(minutes=60),
+            status=BookingStatus.COMPLETED,
+            payment_amount=1000,
+            loyalty_points_used=loyalty_points,
+        ))
+    db.add(Booking(
+        master_id=master_id,
+        client_id=u.id,
+        service_id=service_id,
+        salon_id=salon_id,
+        start_time=base + timedelta(days=idx, hours=20),
+        end_time=base + timedelta(days=idx, hours=21),
+        status=BookingStatus.CANCELLED,
+    ))
+    return u
+
+
+def test_list_aggregates_sorts_and_paginates(db, client, master_user, master_record, master_with_clients_plan, service, salon, master_token):
+    """Агрегаты считаются в БД; keyset-страницы в сумме дают полный отсортированный список."""
+    from models import MasterClientMetadata
+
+    # Сессия закрывается после логина — берём id заново
+    master_id = db.query(Master.id).scalar()
+    service_id = db.query(Service.id).scalar()
+    salon_id = db.query(Salon.id).scalar()
+    for idx in range(1, 8):
+        _add_client_with_visits(db, idx, master_id, service_id, salon_id, visits=idx % 3 + 1, loyalty_points=100 * (idx % 2))
+    db.add(MasterClientMetadata(master_id=master_id, client_phone="+79994000003", alias_name="Постоянная Анна", note="VIP"))
+    db.commit()
+    headers = {"Authorization": f"Bearer {master_token}"}
+
+    full = client.get("/api/master/clients?sort_by=total_revenue&sort_dir=desc", headers=headers).json()
+    assert len(full) == 7
+    by_phone = {r["client_phone"]: r for r in full}
+    third = by_phone["+79994000003"]
+    assert third["completed_count"] == 1
+    assert third["cancelled_count"] == 1
+    assert third["total_revenue"] == 900.0
+    assert third["master_client_name"] == "Постоянная Анна"
+    assert third["has_note"] is True
+    assert third["last_visit_at"].startswith("2026-01-04T10:00")
+    revenues = [r["total_revenue"] for r in full]
+    assert revenues == sorted(revenues, reverse=True)
+
+    paged = []
+    cursor = None
+    for _ in range(10):
+        url = "/api/master/clients?sort_by=total_revenue&sort_dir=desc&limit=3"
+        if cursor:
+            url += f"&cursor={cursor}"
+        r = client.get(url, headers=headers)
+        assert r.status_code == 200
+        paged.extend(r.json())
+        cursor = r.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert [r["client_key"] for r in paged] == [r["client_key"] for r in full]
+
+    found = client.get("/api/master/clients?q=анна", headers=headers).json()
+    assert [r["client_phone"] for r in found] == ["+79994000003"]
+    found = client.get("/api/master/clients?q=page client 5", headers=headers).json()
+    assert [r["client_phone"] for r in found] == ["+79994000005"]
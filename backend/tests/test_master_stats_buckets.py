@@ -0,0 +1,86 @@
+"""Статистика мастера одним сгруппированным запросом: совпадение с поштучным подсчётом."""
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, case, event, func
+from sqlalchemy.orm import joinedload
+
+from models import Booking, BookingStatus, Master, Service
+from utils.booking_real_money import booking_gross_amount_sql
+from utils.master_stats_buckets import aggregate_status_buckets, count_of
+from utils.master_stats_summary import aggregate_extended_period_summary, extended_period_summary_from_totals
+
+
+def _seed(db, test_master):
+    master = Master(user_id=test_master.id, bio="", experience_years=0)
+    db.add(master)
+    service = Service(name="Стрижка", duration=60, price=1500.0)
+    db.add(service)
+    db.flush()
+    now = datetime.utcnow().replace(microsecond=0)
+    statuses = [
+        BookingStatus.COMPLETED.value,
+        BookingStatus.CONFIRMED.value,
+        BookingStatus.CREATED.value,
+        BookingStatus.CANCELLED.value,
+        BookingStatus.AWAITING_CONFIRMATION.value,
+    ]
+    for i in range(-12, 12):
+        start = now + timedelta(days=i, hours=i % 3)
+        db.add(
+            Booking(
+                master_id=master.id,
+                service_id=service.id,
+                start_time=start,
+                end_time=start + timedelta(hours=1),
+                status=statuses[i % len(statuses)],
+                payment_amount=0 if i % 2 else 900.0 + i,
+            )
+        )
+    db.commit()
+    return master.id, now
+
+
+def test_buckets_match_per_booking_summary_in_one_query(db, test_master):
+    master_id, now = _seed(db, test_master)
+    today = now.date()
+    # Перекрывающиеся диапазоны: неделя, её дни, соседние периоды
+    ranges = [
+        (today - timedelta(days=3), today + timedelta(days=3)),
+        (today - timedelta(days=10), today - timedelta(days=4)),
+        (today, today),
+        (today + timedelta(days=1), today + timedelta(days=1)),
+        (today - timedelta(days=20), today + timedelta(days=20)),
+    ]
+    booking_filter = Booking.master_id == master_id
+
+    statements = []
+    listener = lambda *args: statements.append(args[2])  # noqa: E731
+    bind = db.get_bind()
+    event.listen(bind, "before_cursor_execute", listener)
+    try:
+        totals, tail = aggregate_status_buckets(
+            db,
+            booking_filter,
+            ranges,
+            booking_gross_amount_sql(Booking, Service, func, case, and_),
+            now_utc=now,
+            tail_after=today + timedelta(days=20),
+        )
+    finally:
+        event.remove(bind, "before_cursor_execute", listener)
+    assert len(statements) == 1
+    assert tail == {}
+
+    for (start_d, end_d), got in zip(ranges, totals):
+        bookings = (
+            db.query(Booking)
+            .options(joinedload(Booking.service))
+            .filter(
+                booking_filter,
+                Booking.start_time >= datetime.combine(start_d, datetime.min.time()),
+                Booking.start_time <= datetime.combine(end_d, datetime.max.time()),
+            )
+            .all()
+        )
+        assert count_of(got) == len(bookings)
+        assert extended_period_summary_from_totals(got) == aggregate_extended_period_summary(bookings, now)
@@ -0,0 +1,69 @@
+"""Пул хэширования паролей: ограничение очереди, метрики, перехэширование при входе."""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from models import User, UserRole
+from utils.password_hashing import PasswordHasher, PasswordHashingBusy, build_crypt_context
+
+
+class _BlockingContext:
+    def __init__(self):
+        self.release = threading.Event()
+
+    def hash(self, password):
+        self.release.wait(5)
+        return f"hashed:{password}"
+
+
+def test_queue_is_bounded_and_reported():
+    context = _BlockingContext()
+    hasher = PasswordHasher(context=context, max_workers=1, max_queue=1)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(hasher.hash("pw"))) for _ in range(2)]
+    for t in threads:
+        t.start()
+    try:
+        # Ждём, пока поток пула возьмёт первый хэш, а второй встанет в очередь
+        deadline = time.monotonic() + 5
+        while (hasher.metrics()["running"], hasher.metrics()["queued"]) != (1, 1):
+            assert time.monotonic() < deadline
+            time.sleep(0.001)
+        with pytest.raises(PasswordHashingBusy):
+            hasher.hash("third")
+        metrics = hasher.metrics()
+        assert (metrics["running"], metrics["queued"], metrics["rejected"]) == (1, 1, 1)
+    finally:
+        context.release.set()
+        for t in threads:
+            t.join(5)
+    assert results == ["hashed:pw", "hashed:pw"]
+    assert hasher.metrics()["completed"] == 2
+    hasher.shutdown()
+
+
+def test_async_hash_runs_in_pool():
+    hasher = PasswordHasher(context=build_crypt_context(4), max_workers=1, max_queue=0)
+    hashed = asyncio.run(hasher.hash_async("secret"))
+    assert hasher.verify("secret", hashed)
+    assert not asyncio.run(hasher.verify_async("other", hashed))
+    hasher.shutdown()
+
+
+def test_login_rehashes_password_with_old_cost(client, db):
+    old_hash = build_crypt_context(4).hash("testpassword")
+    user = User(phone="+79001230000", email="rehash@example.com", hashed_password=old_hash, role=UserRole.CLIENT, is_active=True)
+    db.add(user)
+    db.commit()
+    user_id = user.id
+
+    r = client.post("/api/auth/login", json={"phone": "+79001230000", "password": "testpassword"})
+    assert r.status_code == 200, r.text
+    new_hash = db.query(User).filter(User.id == user_id).one().hashed_password
+    assert new_hash != old_hash and new_hash.startswith("$2b$12$")
+
+    r = client.post("/api/auth/login", json={"phone": "+79001230000", "password": "testpassword"})
+    assert r.status_code == 200
+    assert db.query(User).filter(User.id == user_id).one().hashed_password == new_hash
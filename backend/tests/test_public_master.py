@@ -357,3 +357,42 @@ def test_booking_price_preview_client_loyalty_cap_percent(
     assert d["final_price"] == 750.0
     assert d["use_loyalty_points"] is True
     assert d["points_payment_available"] is True
+
+
+def test_booking_price_previews_batch_matches_single_preview(client, db, public_master, public_master_service):
+    """booking-price-previews: по каждой услуге тот же результат, что и booking-price-preview."""
+    master_service_id = public_master_service.id
+    other = MasterService(master_id=public_master.id, category_id=None, name="Укладка", duration=30, price=800.0)
+    db.add(other)
+    s_canon = Service(name="Стрижка", duration=60, price=1500.0, salon_id=None, indie_master_id=None)
+    db.add(s_canon)
+    db.commit()
+    other_id = other.id
+    db.add(
+        LoyaltyDiscount(
+            master_id=public_master.id,
+            discount_type=LoyaltyDiscountType.QUICK,
+            name="SD batch",
+            discount_percent=10.0,
+            is_active=True,
+            priority=1,
+            conditions={"condition_type": "service_discount", "parameters": {"service_id": s_canon.id}},
+        )
+    )
+    db.commit()
+
+    start = "2030-06-15T10:00:00+03:00"
+    r = client.get("/api/public/masters/test-slug/booking-price-previews", params={"start_time": start})
+    assert r.status_code == 200, r.text
+    batch = {row["master_service_id"]: row for row in r.json()}
+    assert set(batch) == {master_service_id, other_id}
+
+    for ms_id in (master_service_id, other_id):
+        single = client.get(
+            "/api/public/masters/test-slug/booking-price-preview",
+            params={"service_id": ms_id, "start_time": start},
+        ).json()
+        for field in ("base_price", "discount_percent", "discount_amount", "discounted_price", "condition_type"):
+            assert batch[ms_id][field] == single[field], field
+    assert batch[master_service_id]["discount_percent"] == 10.0
+    assert batch[other_id]["discount_percent"] is None
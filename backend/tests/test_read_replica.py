@@ -0,0 +1,108 @@
+"""
+get_read_db: отчётные эндпоинты читают с реплики (DATABASE_READ_URL), без реплики или при её
+недоступности — с основной БД. Реплика в тесте — второй файл SQLite.
+"""
+from datetime import date
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+import database
+from auth import get_password_hash
+from database import Base, create_app_engine
+from models import Expense, ExpenseType, IndieMaster, Master, User, UserRole
+
+PHONE = "+79005550301"
+
+
+def _seed_indie_master(session):
+    user = User(
+        email="replica-master@example.com",
+        hashed_password=get_password_hash("testpassword"),
+        phone=PHONE,
+        full_name="Replica Master",
+        role=UserRole.INDIE,
+        is_active=True,
+        is_verified=True,
+    )
+    session.add(user)
+    session.flush()
+    master = Master(user_id=user.id, bio="", experience_years=1)
+    session.add(master)
+    session.flush()
+    indie = IndieMaster(user_id=user.id, master_id=master.id)
+    session.add(indie)
+    session.commit()
+    return indie.id
+
+
+@pytest.fixture
+def replica_sessions(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'replica.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    yield factory
+    engine.dispose()
+
+
+def _expense_stats(client):
+    token = client.post("/api/auth/login", json={"phone": PHONE, "password": "testpassword"}).json()["access_token"]
+    response = client.get("/api/expenses/master/stats", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_reporting_endpoint_reads_replica_when_configured(client, db, replica_sessions, monkeypatch):
+    _seed_indie_master(db)
+    replica = replica_sessions()
+    indie_id = _seed_indie_master(replica)
+    expense_type = ExpenseType(indie_master_id=indie_id, name="Аренда")
+    replica.add(expense_type)
+    replica.flush()
+    replica.add(Expense(
+        indie_master_id=indie_id,
+        name="Аренда кабинета",
+        expense_type_id=expense_type.id,
+        amount_without_vat=1000.0,
+        amount_with_vat=1200.0,
+        contractor="ООО Ромашка",
+        expense_month=date(2026, 9, 1),
+    ))
+    replica.commit()
+    replica.close()
+
+    # Без реплики — основная БД, где расходов нет
+    monkeypatch.setattr(database, "ReadSessionLocal", None)
+    assert _expense_stats(client)["expenses_count"] == 0
+
+    monkeypatch.setattr(database, "ReadSessionLocal", replica_sessions)
+    stats = _expense_stats(client)
+    assert stats["expenses_count"] == 1
+    assert stats["total_expenses"] == 1200.0
+
+
+def test_unreachable_replica_falls_back_to_primary(client, db, tmp_path, monkeypatch):
+    _seed_indie_master(db)
+    broken = create_engine(f"sqlite:///{tmp_path / 'missing' / 'replica.db'}")
+    monkeypatch.setattr(database, "ReadSessionLocal", sessionmaker(bind=broken))
+
+    assert _expense_stats(client)["expenses_count"] == 0
+
+
+def test_replica_engine_rejects_writes(tmp_path):
+    url = f"sqlite:///{tmp_path / 'ro.db'}"
+    writable = create_engine(url)
+    with writable.begin() as conn:
+        conn.execute(text("CREATE TABLE t (id INTEGER)"))
+    writable.dispose()
+
+    replica = create_app_engine(url, pool_size=1, max_overflow=0, read_only=True)
+    try:
+        with replica.connect() as conn:
+            assert conn.execute(text("SELECT COUNT(*) FROM t")).scalar() == 0
+            with pytest.raises(OperationalError):
+                conn.execute(text("INSERT INTO t (id) VALUES (1)"))
+    finally:
+        replica.dispose()
@@ -0,0 +1,79 @@
+"""Циклические расходы: выбор шаблонов одним запросом и не более одного расхода за период."""
+from datetime import date, datetime, timedelta
+
+from models import Booking, BookingStatus, Master, MasterExpense, MasterSchedule
+from services.recurring_expenses import create_recurring_expenses
+
+TODAY = date(2026, 3, 11)  # среда
+
+
+def _template(db, user_id, name, recurrence, condition=None, is_active=True):
+    db.add(
+        MasterExpense(
+            master_id=user_id,
+            name=name,
+            expense_type="recurring",
+            amount=100.0,
+            recurrence_type=recurrence,
+            condition_type=condition,
+            is_active=is_active,
+        )
+    )
+
+
+def _generated(db):
+    db.expire_all()
+    return sorted(
+        (e.name, e.period_key)
+        for e in db.query(MasterExpense).filter(MasterExpense.expense_type == "one_time")
+    )
+
+
+def test_due_templates_created_once_per_period(db, test_master):
+    master = Master(user_id=test_master.id, bio="", experience_years=0)
+    db.add(master)
+    db.flush()
+    _template(db, test_master.id, "Аренда день", "daily")
+    _template(db, test_master.id, "Реклама", "weekly")
+    _template(db, test_master.id, "Аренда", "monthly")
+    _template(db, test_master.id, "Расходники", "conditional", "has_bookings")
+    _template(db, test_master.id, "Кофе", "conditional", "schedule_open")
+    _template(db, test_master.id, "Отключён", "daily", is_active=False)
+    # Создан до появления template_id — на этой неделе повторно не создаётся
+    _template(db, test_master.id, "Уборка", "weekly")
+    db.add(
+        MasterExpense(
+            master_id=test_master.id,
+            name="Уборка",
+            expense_type="one_time",
+            amount=100.0,
+            expense_date=datetime.combine(TODAY - timedelta(days=1), datetime.min.time()),
+        )
+    )
+    start = datetime.combine(TODAY, datetime.min.time()) + timedelta(hours=10)
+    db.add(Booking(master_id=master.id, start_time=start, end_time=start + timedelta(hours=1), status=BookingStatus.CONFIRMED.value))
+    db.commit()
+
+    result = create_recurring_expenses(db, TODAY)
+    assert (result["due"], result["created"]) == (4, 4)
+    week_start, month_start = "2026-03-09", "2026-03-01"
+    assert _generated(db) == sorted(
+        [
+            ("Аренда день", "2026-03-11"),
+            ("Реклама", week_start),
+            ("Аренда", month_start),
+            ("Расходники", "2026-03-11"),
+            ("Уборка", None),
+        ]
+    )
+
+    # Повторный запуск в тот же день ничего не добавляет
+    assert create_recurring_expenses(db, TODAY)["created"] == 0
+
+    # Следующий день: daily снова, weekly/monthly — нет; открытое расписание включает «Кофе»
+    db.add(MasterSchedule(master_id=master.id, date=TODAY + timedelta(days=1), start_time=start.time(), end_time=(start + timedelta(hours=8)).time()))
+    db.commit()
+    result = create_recurring_expenses(db, TODAY + timedelta(days=1))
+    assert result["created"] == 2
+    assert ("Кофе", "2026-03-12") in _generated(db)
+    assert ("Аренда день", "2026-03-12") in _generated(db)
@@ -1,9 +1,17 @@
+import random
 from datetime import date, datetime, timedelta, time
 from zoneinfo import ZoneInfo
 
 from auth import get_password_hash
-from models import AvailabilitySlot, Master, MasterSchedule, OwnerType, Salon, User, UserRole
-from services.scheduling import check_booking_conflicts, check_master_working_hours, get_available_slots
+from models import AvailabilitySlot, Booking, Master, MasterSchedule, OwnerType, Salon, User, UserRole
+from services.scheduling import (
+    OccupiedIntervals,
+    _check_time_overlap,
+    check_booking_conflicts,
+    check_master_working_hours,
+    get_available_slots,
+    get_available_slots_for_range,
+)
 
 
 def test_check_booking_conflicts_no_conflicts(db, test_master):
@@ -255,3 +263,358 @@ def test_get_available_slots_with_bookings(db, test_master):
     # Слоты — стартовые окна длины service_duration; старты с шагом 30 мин могут пересекаться по времени (9:00 и 9:30 для 60 мин).
     for s in slots:
         assert s["end_time"] - s["start_time"] == timedelta(minutes=service_duration)
+
+
+def test_get_available_slots_for_range_matches_per_day(db):
+    """Диапазонный расчёт (один проход по расписанию и броням) совпадает с по-дневным get_available_slots."""
+    user_m = User(
+        email="range@example.com",
+        hashed_password=get_password_hash("x"),
+        phone="+79995554433",
+        full_name="Range Master",
+        role=UserRole.MASTER,
+        is_active=True,
+        is_verified=True,
+    )
+    db.add(user_m)
+    db.commit()
+    db.refresh(user_m)
+    master = Master(user_id=user_m.id, bio="", experience_years=0, domain="range-test")
+    db.add(master)
+    db.commit()
+    db.refresh(master)
+
+    first_day = date(2026, 5, 4)  # понедельник
+    # День 1: индивидуальное расписание 10:00–12:00 (4 строки по 30 мин)
+    for h, m in ((10, 0), (10, 30), (11, 0), (11, 30)):
+        st = time(h, m)
+        et = (datetime.combine(first_day, st) + timedelta(minutes=30)).time()
+        db.add(
+            MasterSchedule(
+                master_id=master.id,
+                salon_id=None,
+                date=first_day,
+                start_time=st,
+                end_time=et,
+                is_available=True,
+            )
+        )
+    # Остальные дни: базовые слоты по дню недели
+    for dow in range(1, 8):
+        db.add(
+            AvailabilitySlot(
+                owner_type=OwnerType.MASTER,
+                owner_id=master.id,
+                day_of_week=dow,
+                start_time=time(9, 0),
+                end_time=time(13, 0),
+            )
+        )
+    # Брони: в первый день, во второй день и отменённая — не должна блокировать
+    for d, h, status in (
+        (first_day, 10, "created"),
+        (first_day + timedelta(days=1), 9, "confirmed"),
+        (first_day + timedelta(days=2), 11, "cancelled"),
+    ):
+        st = datetime.combine(d, time(h, 0))
+        db.add(
+            Booking(
+                master_id=master.id,
+                start_time=st,
+                end_time=st + timedelta(hours=1),
+                status=status,
+                public_reference=f"RNG{d.day}{h}",
+            )
+        )
+    db.commit()
+
+    last_day = first_day + timedelta(days=3)
+    by_day = get_available_slots_for_range(
+        db, OwnerType.MASTER, master.id, first_day, last_day, 60
+    )
+    assert sorted(by_day) == [first_day + timedelta(days=i) for i in range(4)]
+    for d, slots in by_day.items():
+        expected = get_available_slots(
+            db, OwnerType.MASTER, master.id, datetime.combine(d, time.min), 60
+        )
+        assert slots == expected, d
+
+    first_starts = [s["start_time"].time() for s in by_day[first_day]]
+    assert first_starts == [time(11, 0)]
+    second_starts = [s["start_time"].time() for s in by_day[first_day + timedelta(days=1)]]
+    assert time(9, 0) not in second_starts and time(10, 0) in second_starts
+    assert time(11, 0) in [s["start_time"].time() for s in by_day[first_day + timedelta(days=2)]]
+
+
+def test_occupied_intervals_matches_pairwise_overlap():
+    """Индекс занятости даёт тот же ответ, что и попарная проверка _check_time_overlap."""
+    rng = random.Random(42)
+    base = datetime(2026, 3, 2, 8, 0)
+    intervals = []
+    for _ in range(60):
+        st = base + timedelta(minutes=15 * rng.randint(0, 60))
+        intervals.append((st, st + timedelta(minutes=15 * rng.randint(0, 8))))
+    occupied = OccupiedIntervals(intervals)
+    for _ in range(500):
+        st = base + timedelta(minutes=15 * rng.randint(-4, 64))
+        et = st + timedelta(minutes=15 * rng.randint(1, 8))
+        expected = any(_check_time_overlap(st, et, a, b) for a, b in intervals)
+        assert occupied.overlaps(st, et) is expected, (st, et)
+
+
+def test_check_booking_conflicts_detects_overlap_and_touching(db):
+    user_m = User(
+        email="conflict@example.com",
+        hashed_password=get_password_hash("x"),
+        phone="+79993332211",
+        full_name="Conflict Master",
+        role=UserRole.MASTER,
+        is_active=True,
+        is_verified=True,
+    )
+    db.add(user_m)
+    db.commit()
+    db.refresh(user_m)
+    master = Master(user_id=user_m.id, bio="", experience_years=0, domain="conflict-test")
+    db.add(master)
+    db.commit()
+    db.refresh(master)
+
+    st = datetime(2026, 6, 1, 12, 0)
+    booking = Booking(
+        master_id=master.id,
+        start_time=st,
+        end_time=st + timedelta(hours=1),
+        status="confirmed",
+        public_reference="CNFL1",
+    )
+    db.add(booking)
+    db.commit()
+
+    assert check_booking_conflicts(
+        db, st + timedelta(minutes=30), st + timedelta(minutes=90), OwnerType.MASTER, master.id
+    )
+    # Касание концами — не конфликт
+    assert not check_booking_conflicts(
+        db, st + timedelta(hours=1), st + timedelta(hours=2), OwnerType.MASTER, master.id
+    )
+    # Исключение самой брони (перенос)
+    assert not check_booking_conflicts(
+        db, st, st + timedelta(hours=1), OwnerType.MASTER, master.id, exclude_booking_id=booking.id
+    )
+    # Aware-время сравнивается как naive wall-clock
+    tz = ZoneInfo("Europe/Moscow")
+    assert check_booking_conflicts(
+        db, st.replace(tzinfo=tz), (st + timedelta(minutes=30)).replace(tzinfo=tz), OwnerType.MASTER, master.id
+    )
+
+
+def _make_cache_master(db, phone: str, domain: str) -> Master:
+    user_m = User(
+        email=f"{domain}@example.com",
+        hashed_password=get_password_hash("x"),
+        phone=phone,
+        full_name="Cache Master",
+        role=UserRole.MASTER,
+        is_active=True,
+        is_verified=True,
+    )
+    db.add(user_m)
+    db.commit()
+    db.refresh(user_m)
+    master = Master(user_id=user_m.id, bio="", experience_years=0, domain=domain)
+    db.add(master)
+    db.commit()
+    db.refresh(master)
+    return master
+
+
+def test_day_availability_matches_uncached_slots():
+    """Бит-скан по DayAvailability даёт те же слоты, что и полный расчёт (в т.ч. брони не по сетке 30 мин)."""
+    from services.availability_cache import DayAvailability
+    from services.scheduling import _collect_available_slots, _master_schedule_windows
+
+    class Row:
+        def __init__(self, st, et):
+            self.start_time = st
+            self.end_time = et
+
+    class B:
+        def __init__(self, st, et):
+            self.start_time = st
+            self.end_time = et
+
+    rng = random.Random(7)
+    day = date(2026, 7, 1)
+    base = datetime.combine(day, time.min)
+    for _ in range(40):
+        bookings = []
+        for _ in range(rng.randint(0, 6)):
+            st = base + timedelta(minutes=rng.randint(-120, 1400))
+            bookings.append(B(st, st + timedelta(minutes=rng.randint(1, 200))))
+        schedule = []
+        if rng.random() < 0.5:
+            h = rng.randint(8, 12)
+            for k in range(rng.randint(1, 12)):
+                if rng.random() < 0.15:
+                    continue
+                st = time(h + (k // 2), 30 * (k % 2))
+                et = (datetime.combine(day, st) + timedelta(minutes=30)).time()
+                schedule.append(Row(st, et))
+        base_slots = [Row(time(9, 15 * rng.randint(0, 3)), time(rng.randint(12, 20), 0))]
+        entry = DayAvailability.build(day, schedule, base_slots, bookings)
+        for duration in (20, 30, 45, 60, 90, 120):
+            windows = _master_schedule_windows(schedule, duration) if schedule else base_slots
+            expected = _collect_available_slots(base, windows, OccupiedIntervals.from_bookings(bookings), duration)
+            assert entry.free_slots(day, duration) == expected
+
+
+def test_availability_cache_invalidated_on_booking_and_schedule_writes(db):
+    from services.availability_cache import availability_cache
+
+    master = _make_cache_master(db, "+79990001122", "cache-inv")
+    target = date(2026, 8, 3)
+    for h in (10, 11):
+        for m in (0, 30):
+            st = time(h, m)
+            db.add(
+                MasterSchedule(
+                    master_id=master.id,
+                    salon_id=None,
+                    date=target,
+                    start_time=st,
+                    end_time=(datetime.combine(target, st) + timedelta(minutes=30)).time(),
+                    is_available=True,
+                )
+            )
+    db.commit()
+
+    day_dt = datetime.combine(target, time.min)
+    first = get_available_slots(db, OwnerType.MASTER, master.id, day_dt, 60)
+    assert [s["start_time"].time() for s in first] == [time(10, 0), time(10, 30), time(11, 0)]
+    assert availability_cache.get(master.id, target) is not None
+    # Повторный вызов обслуживается из кэша
+    assert get_available_slots(db, OwnerType.MASTER, master.id, day_dt, 60) == first
+
+    # Новая бронь — запись мастера сбрасывается после commit
+    st = datetime.combine(target, time(10, 30))
+    booking = Booking(
+        master_id=master.id,
+        start_time=st,
+        end_time=st + timedelta(hours=1),
+        status="created",
+        public_reference="CACHE1",
+    )
+    db.add(booking)
+    db.commit()
+    assert availability_cache.get(master.id, target) is None
+    after_booking = get_available_slots(db, OwnerType.MASTER, master.id, day_dt, 60)
+    assert after_booking == []
+
+    # Отмена брони возвращает слоты
+    booking.status = "cancelled"
+    db.commit()
+    assert get_available_slots(db, OwnerType.MASTER, master.id, day_dt, 60) == first
+
+    # Массовое удаление расписания через Query.delete() очищает кэш
+    db.query(MasterSchedule).filter(MasterSchedule.master_id == master.id).delete(synchronize_session=False)
+    db.commit()
+    assert availability_cache.get(master.id, target) is None
+    assert get_available_slots(db, OwnerType.MASTER, master.id, day_dt, 60) == []
+
+
+def test_any_master_slots_and_best_master_query_count_independent_of_masters(db):
+    """«Любой мастер»: число SQL-запросов не растёт с числом мастеров; лучший — свободный и наименее загруженный."""
+    from sqlalchemy import event
+
+    from models import Service, master_services, salon_masters
+    from services.scheduling import get_available_slots_any_master_logic, get_best_master_for_slot
+
+    user_s = User(
+        email="anysalon@example.com",
+        hashed_password=get_password_hash("x"),
+        phone="+79990003300",
+        full_name="Any Salon",
+        role=UserRole.SALON,
+        is_active=True,
+        is_verified=True,
+    )
+    db.add(user_s)
+    db.commit()
+    salon = Salon(user_id=user_s.id, name="Any", domain="any-salon", phone=user_s.phone, email=user_s.email)
+    db.add(salon)
+    db.commit()
+    service = Service(name="Cut", duration=60, price=1000, salon_id=salon.id)
+    db.add(service)
+    db.commit()
+
+    target = date(2026, 9, 7)
+    masters = []
+    for i in range(5):
+        master = _make_cache_master(db, f"+7999000331{i}", f"any-master-{i}")
+        db.execute(salon_masters.insert().values(salon_id=salon.id, master_id=master.id))
+        db.execute(master_services.insert().values(master_id=master.id, service_id=service.id))
+        db.add(
+            AvailabilitySlot(
+                owner_type=OwnerType.MASTER,
+                owner_id=master.id,
+                day_of_week=target.weekday() + 1,
+                start_time=time(10, 0),
+                end_time=time(12, 0),
+            )
+        )
+        masters.append(master)
+    db.commit()
+
+    # Мастера 2–4 заняты 10:00–11:00, мастер 0 — в 11:00, мастер 1 свободен весь день
+    def _book(master, h, m, ref):
+        st = datetime.combine(target, time(h, m))
+        db.add(
+            Booking(
+                master_id=master.id,
+                start_time=st,
+                end_time=st + timedelta(minutes=30),
+                status="confirmed",
+                public_reference=ref,
+            )
+        )
+
+    for i in range(2, 5):
+        _book(masters[i], 10, 0, f"ANY{i}A")
+        _book(masters[i], 10, 30, f"ANY{i}B")
+    _book(masters[0], 11, 0, "ANY0A")
+    db.commit()
+
+    salon_id, service_id = salon.id, service.id
+    free_master_id = masters[1].id
+    eng = db.get_bind()
+    statements = []
+
+    def before_cursor(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(eng, "before_cursor_execute", before_cursor)
+    try:
+        slots = get_available_slots_any_master_logic(
+            db, salon_id, service_id, datetime.combine(target, time.min), 60
+        )
+        slots_queries = len(statements)
+        statements.clear()
+        best = get_best_master_for_slot(
+            db,
+            salon_id,
+            service_id,
+            datetime.combine(target, time(10, 0)),
+            datetime.combine(target, time(11, 0)),
+        )
+        best_queries = len(statements)
+    finally:
+        event.remove(eng, "before_cursor_execute", before_cursor)
+
+    # Как и раньше, слоты «Любого мастера» не обрезаются по концу окна
+    assert [s["start_time"].time() for s in slots] == [time(10, 0), time(10, 30), time(11, 0), time(11, 30)]
+    # Услуга, мастера с именами, слоты доступности, брони — при любом числе мастеров
+    assert slots_queries == 4
+    assert best_queries == 4
+    assert best is not None and best["id"] == free_master_id
+    assert best["name"] == "Cache Master"
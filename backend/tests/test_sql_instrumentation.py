@@ -0,0 +1,68 @@
+"""SQL-инструментирование запросов: Server-Timing, лог медленных с повторами, p50/p95 по маршрутам."""
+import logging
+
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from sql_instrumentation import RouteSQLStats, SQLInstrumentationMiddleware, route_sql_stats
+
+
+def _app(route_stats):
+    engine = create_engine("sqlite://")
+    sessions = sessionmaker(bind=engine)
+
+    def get_session():
+        session = sessions()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    app = FastAPI()
+
+    @app.get("/items/{count}")
+    def items(count: int, session=Depends(get_session)):
+        # N+1: один и тот же запрос в цикле
+        return [session.execute(text("SELECT :i"), {"i": i}).scalar() for i in range(count)]
+
+    app.add_middleware(SQLInstrumentationMiddleware, slow_request_ms=0, many_queries=3, route_stats=route_stats)
+    return app
+
+
+def test_queries_are_counted_per_request_and_aggregated_per_route(caplog):
+    route_stats = RouteSQLStats(max_samples=10)
+    client = TestClient(_app(route_stats))
+
+    with caplog.at_level(logging.WARNING, logger="sql_instrumentation"):
+        assert client.get("/items/2").status_code == 200
+        response = client.get("/items/5")
+
+    assert response.json() == [0, 1, 2, 3, 4]
+    timing = response.headers["server-timing"]
+    assert 'desc="5 queries"' in timing and "app;dur=" in timing
+
+    # Предупреждение только для запроса сверх порога, с повторяющимся statement
+    warnings = [r.getMessage() for r in caplog.records]
+    assert len(warnings) == 1
+    assert "GET /items/{count}" in warnings[0] and "5 запросов" in warnings[0]
+    assert "'count': 5" in warnings[0] and "SELECT ?" in warnings[0]
+
+    [row] = route_stats.summary()
+    assert row["route"] == "GET /items/{count}"
+    assert (row["requests"], row["queries_p50"], row["queries_max"]) == (2, 2, 5)
+
+
+def test_admin_sql_stats_endpoint(client, admin_auth_headers):
+    # Агрегаты процессные: в общем прогоне там маршруты других тестов
+    route_sql_stats.clear()
+    response = client.get("/api/auth/users/me", headers=admin_auth_headers)
+    assert "db;dur=" in response.headers["server-timing"]
+
+    stats = client.get("/api/admin/sql-stats", headers=admin_auth_headers)
+
+    assert stats.status_code == 200, stats.text
+    routes = {row["route"]: row for row in stats.json()["routes"]}
+    assert routes["GET /api/auth/users/me"]["requests"] >= 1
+    assert {"duration_ms_p95", "queries_p95", "db_ms_p95"} <= set(routes["GET /api/auth/users/me"])
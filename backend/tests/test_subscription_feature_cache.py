@@ -0,0 +1,112 @@
+"""Проверки функций плана: мемо запроса, процессный кэш и инвалидация по изменениям подписки/плана."""
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from models import Subscription, SubscriptionPlan, SubscriptionStatus, SubscriptionType
+from tests.conftest import TestingSessionLocal
+from utils.subscription_features import (
+    get_master_features,
+    has_extended_stats,
+    has_finance_access,
+    has_loyalty_access,
+    has_unlimited_bookings,
+)
+
+
+def _subscribe(db, user, service_functions):
+    plan = SubscriptionPlan(
+        name="Standard",
+        subscription_type=SubscriptionType.MASTER,
+        price_1month=500,
+        price_3months=450,
+        price_6months=400,
+        price_12months=350,
+        features={"service_functions": service_functions},
+        limits={"max_future_bookings": 0},
+    )
+    db.add(plan)
+    db.flush()
+    now = datetime.utcnow()
+    subscription = Subscription(
+        user_id=user.id,
+        plan_id=plan.id,
+        subscription_type=SubscriptionType.MASTER,
+        status=SubscriptionStatus.ACTIVE,
+        is_active=True,
+        start_date=now - timedelta(days=1),
+        end_date=now + timedelta(days=30),
+        price=500,
+        daily_rate=16.6,
+    )
+    db.add(subscription)
+    db.commit()
+    return plan, subscription
+
+
+class _QueryCounter:
+    def __init__(self, bind):
+        self.bind = bind
+        self.count = 0
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self.bind, "before_cursor_execute", self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.bind, "before_cursor_execute", self._on_execute)
+
+
+def test_feature_checks_resolve_plan_once(db, test_master):
+    _subscribe(db, test_master, [2, 3])
+    user_id = test_master.id
+
+    with _QueryCounter(db.get_bind()) as counter:
+        assert has_extended_stats(db, user_id)
+    assert counter.count > 0
+
+    # Остальные проверки в том же запросе (сессии) и в следующем — без запросов к БД
+    other = TestingSessionLocal()
+    try:
+        with _QueryCounter(db.get_bind()) as counter:
+            assert has_loyalty_access(db, user_id)
+            assert not has_finance_access(db, user_id)
+            assert has_unlimited_bookings(db, user_id)
+            assert get_master_features(db, user_id)["plan_name"] == "Standard"
+            assert has_extended_stats(other, user_id)
+        assert counter.count == 0
+    finally:
+        other.close()
+
+
+def test_cache_invalidated_on_plan_edit_and_subscription_change(db, test_master):
+    plan, subscription = _subscribe(db, test_master, [2, 4])
+    user_id = test_master.id
+    assert has_finance_access(db, user_id)
+
+    # Правка плана (как в routers/subscription_plans.py) видна сразу после commit
+    plan.features = {"service_functions": [2]}
+    db.commit()
+    assert not has_finance_access(db, user_id)
+    assert has_extended_stats(db, user_id)
+
+    # Подписка отключена (неуспешное списание / заморозка) — доступ пропадает
+    subscription.is_active = False
+    db.commit()
+    assert not has_extended_stats(db, user_id)
+    assert get_master_features(db, user_id)["plan_id"] is None
+
+
+def test_cached_entry_expires_with_subscription_end(db, test_master):
+    _, subscription = _subscribe(db, test_master, [2])
+    subscription.end_date = datetime.utcnow() + timedelta(seconds=1)
+    db.commit()
+    assert has_extended_stats(db, test_master.id)
+    db.commit()  # новый «запрос»: мемо сессии сброшен
+
+    time.sleep(max(0.0, (subscription.end_date - datetime.utcnow()).total_seconds()) + 0.05)
+    assert not has_extended_stats(db, test_master.id)
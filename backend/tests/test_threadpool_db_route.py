@@ -0,0 +1,70 @@
+"""
+ThreadpoolDBRoute: async-эндпоинты с Depends(get_db) выполняются вне event loop.
+"""
+import threading
+
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Request
+from fastapi.testclient import TestClient
+
+from database import get_db
+from main import app as main_app
+from route_diagnostics import find_event_loop_db_routes
+from threadpool_db_route import ThreadpoolDBRoute, keep_on_event_loop
+
+
+def _app():
+    router = APIRouter(route_class=ThreadpoolDBRoute)
+
+    @router.get("/loop-thread")
+    async def loop_thread():
+        return {"thread": threading.get_ident()}
+
+    @router.get("/db-thread/{item_id}")
+    async def db_thread(item_id: int, db=Depends(get_db)):
+        if item_id == 0:
+            raise HTTPException(status_code=404, detail="not found")
+        return {"thread": threading.get_ident(), "item_id": item_id, "db": db}
+
+    @router.post("/db-form")
+    async def db_form(request: Request, db=Depends(get_db)):
+        form = await request.form()
+        return {"thread": threading.get_ident(), "name": form["name"]}
+
+    @router.get("/db-on-loop")
+    @keep_on_event_loop
+    async def db_on_loop(db=Depends(get_db)):
+        return {"thread": threading.get_ident()}
+
+    app = FastAPI()
+    app.include_router(router, prefix="/api")
+    app.dependency_overrides[get_db] = lambda: "session"
+    return app
+
+
+def test_async_db_endpoints_run_outside_event_loop_thread():
+    app = _app()
+    with TestClient(app) as client:
+        loop_thread = client.get("/api/loop-thread").json()["thread"]
+
+        response = client.get("/api/db-thread/7")
+        assert response.status_code == 200
+        assert response.json()["item_id"] == 7
+        assert response.json()["db"] == "session"
+        assert response.json()["thread"] != loop_thread
+
+        assert client.get("/api/db-thread/0").status_code == 404
+
+        # Тело запроса читается заранее в основном loop, request.form() работает в потоке
+        response = client.post("/api/db-form", data={"name": "Анна"})
+        assert response.status_code == 200
+        assert response.json()["name"] == "Анна"
+        assert response.json()["thread"] != loop_thread
+
+        assert client.get("/api/db-on-loop").json()["thread"] == loop_thread
+
+    flagged = find_event_loop_db_routes(app)
+    assert [path for path, _, _ in flagged] == ["/api/db-on-loop"]
+
+
+def test_application_has_no_async_db_routes_on_event_loop():
+    assert find_event_loop_db_routes(main_app) == []
@@ -0,0 +1,133 @@
+"""
+Кастомный APIRoute: async-эндпоинты с синхронной сессией БД выполняются в threadpool.
+
+Проблема: многие обработчики объявлены async def, но работают с синхронной Session из
+database.get_db. FastAPI вызывает async def прямо в event loop, поэтому каждый SQL-запрос такого
+обработчика блокирует loop: один медленный запрос останавливает все параллельные запросы воркера.
+
+ThreadpoolDBRoute при регистрации маршрута находит async-эндпоинты, которые напрямую получают
+сессию (Depends(get_db) / Depends(get_read_db)), и подменяет их синхронной обёрткой: FastAPI запускает её в threadpool,
+а обёртка выполняет корутину эндпоинта в собственном event loop рабочего потока (один loop на
+поток, переиспользуется). await внутри эндпоинта (почта, httpx, UploadFile.read, хэширование
+паролей) продолжают работать — уже в loop потока, не блокируя основной.
+
+Ограничения для таких эндпоинтов:
+- нельзя использовать объекты, привязанные к основному loop (общий httpx.AsyncClient,
+  asyncio.Lock/Queue уровня модуля, asyncio.create_task «в фоне»);
+- тело запроса для эндпоинтов с параметром Request читается заранее в основном loop —
+  request.body()/json()/form() внутри работают из кэша.
+Эндпоинт, которому нужен основной loop, помечается @keep_on_event_loop.
+
+Роутер подключает класс через APIRouter(route_class=ThreadpoolDBRoute).
+route_diagnostics.log_event_loop_db_routes при старте предупреждает об async-маршрутах с get_db,
+которые всё ещё выполняются в event loop.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import functools
+import inspect
+import threading
+import typing
+from typing import Any, Callable
+
+from fastapi.dependencies.utils import get_dependant
+from fastapi.routing import APIRoute
+from starlette.requests import Request
+from starlette.responses import Response
+
+from database import get_db, get_read_db
+
+# Зависимости, выдающие синхронную Session
+SYNC_DB_DEPENDENCIES = (get_db, get_read_db)
+
+_KEEP_ON_EVENT_LOOP_ATTR = "__keep_on_event_loop__"
+_WORKER_LOOP_WRAPPER_ATTR = "__runs_in_worker_loop__"
+_thread_state = threading.local()
+
+
+def keep_on_event_loop(endpoint: Callable) -> Callable:
+    """Оставить async-эндпоинт в основном event loop (нужны объекты, привязанные к нему)."""
+    setattr(endpoint, _KEEP_ON_EVENT_LOOP_ATTR, True)
+    return endpoint
+
+
+def depends_on_sync_db(path: str, endpoint: Callable) -> bool:
+    """Эндпоинт напрямую получает синхронную сессию (Depends(get_db) / Depends(get_read_db))."""
+    dependant = get_dependant(path=path, call=endpoint)
+    return any(dep.call in SYNC_DB_DEPENDENCIES for dep in dependant.dependencies)
+
+
+def needs_threadpool(path: str, endpoint: Callable) -> bool:
+    return (
+        asyncio.iscoroutinefunction(endpoint)
+        and not getattr(endpoint, _KEEP_ON_EVENT_LOOP_ATTR, False)
+        and depends_on_sync_db(path, endpoint)
+    )
+
+
+def _worker_loop() -> asyncio.AbstractEventLoop:
+    loop = getattr(_thread_state, "loop", None)
+    if loop is None or loop.is_closed():
+        loop = asyncio.new_event_loop()
+        _thread_state.loop = loop
+    return loop
+
+
+def _resolved_signature(endpoint: Callable) -> inspect.Signature:
+    """
+    Сигнатура с вычисленными аннотациями: FastAPI разрешает строковые аннотации в globals
+    вызываемого объекта, а у обёртки это globals этого модуля.
+    """
+    signature = inspect.signature(endpoint)
+    try:
+        hints = typing.get_type_hints(endpoint, include_extras=True)
+    except Exception:
+        return signature
+    parameters = [
+        param.replace(annotation=hints.get(name, param.annotation))
+        for name, param in signature.parameters.items()
+    ]
+    return signature.replace(
+        parameters=parameters,
+        return_annotation=hints.get("return", signature.return_annotation),
+    )
+
+
+def run_in_worker_loop(endpoint: Callable) -> Callable:
+    """Синхронная обёртка async-эндпоинта: корутина выполняется в event loop рабочего потока."""
+
+    def endpoint_in_threadpool(**kwargs: Any) -> Any:
+        return _worker_loop().run_until_complete(endpoint(**kwargs))
+
+    functools.update_wrapper(endpoint_in_threadpool, endpoint)
+    # Без __wrapped__: FastAPI не должен видеть исходную корутину
+    del endpoint_in_threadpool.__wrapped__
+    endpoint_in_threadpool.__signature__ = _resolved_signature(endpoint)
+    setattr(endpoint_in_threadpool, _WORKER_LOOP_WRAPPER_ATTR, True)
+    return endpoint_in_threadpool
+
+
+class ThreadpoolDBRoute(APIRoute):
+    """APIRoute, выполняющий async-эндпоинты с Depends(get_db) в threadpool."""
+
+    def __init__(self, path: str, endpoint: Callable[..., Any], **kwargs: Any) -> None:
+        # include_router пересоздаёт маршрут с уже обёрнутым эндпоинтом
+        self.runs_in_threadpool = getattr(endpoint, _WORKER_LOOP_WRAPPER_ATTR, False)
+        if not self.runs_in_threadpool and needs_threadpool(path, endpoint):
+            endpoint = run_in_worker_loop(endpoint)
+            self.runs_in_threadpool = True
+        super().__init__(path, endpoint, **kwargs)
+
+    def get_route_handler(self) -> Callable[[Request], typing.Coroutine[Any, Any, Response]]:
+        handler = super().get_route_handler()
+        if not (self.runs_in_threadpool and self.dependant.request_param_name):
+            return handler
+
+        async def read_body_then_handle(request: Request) -> Response:
+            # receive привязан к основному loop: тело читаем здесь, в потоке оно берётся из кэша
+            await request.body()
+            return await handler(request)
+
+        return read_body_then_handle
@@ -0,0 +1,145 @@
+"""
+Кэш резолва пользователя по JWT sub (auth.get_current_user): sub → снимок колонок User.
+
+Снимок — только значения колонок. На попадании из него собирается detached-экземпляр и
+присоединяется к сессии запроса через Session.merge(load=False) — без SELECT; эндпоинты
+получают обычный persistent User (ленивые связи, изменения и commit работают как раньше).
+
+Ключ — sub токена; запись помнит user_id и поколение («версию») пользователя. Инвалидация —
+после commit (utils.generational_cache.CommitInvalidation): любое изменение колонок User
+(деактивация, удаление аккаунта в services/account_deletion.py, смена роли, сброс пароля,
+правка профиля) или удаление строки сбрасывает все sub этого пользователя и увеличивает его поколение, так что
+снимок, прочитанный до инвалидации, не сохраняется. Массовые UPDATE/DELETE по User очищают
+кэш целиком. Кэш локален для процесса: чужие изменения видны не позже
+AUTH_USER_CACHE_TTL_SECONDS (0 — кэш выключен).
+"""
+from __future__ import annotations
+
+import copy
+import threading
+import time as time_module
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.session import make_transient_to_detached
+
+from models import User
+from settings import get_settings
+from utils.generational_cache import CommitInvalidation
+
+_USER_COLUMN_KEYS = tuple(attr.key for attr in inspect(User).column_attrs)
+
+
+def _snapshot(user: User) -> Dict[str, Any]:
+    return {key: copy.deepcopy(getattr(user, key)) for key in _USER_COLUMN_KEYS}
+
+
+def _attach(db: Session, values: Dict[str, Any]) -> User:
+    """Собрать User из снимка и присоединить к сессии без запроса к БД."""
+    instance = User.__mapper__.class_manager.new_instance()
+    for key, value in values.items():
+        set_committed_value(instance, key, copy.deepcopy(value))
+    make_transient_to_detached(instance)
+    return db.merge(instance, load=False)
+
+
+class AuthUserCache:
+    """LRU с TTL: sub → (срок, user_id, поколение пользователя, снимок колонок)."""
+
+    def __init__(self, max_entries: int = 10000):
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[float, int, int, Dict[str, Any]]]" = OrderedDict()
+        self._generations: Dict[int, int] = {}
+        # Растёт при любой инвалидации: снимок, прочитанный до неё, не сохраняется
+        self._version = 0
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _ttl_seconds() -> int:
+        return get_settings().AUTH_USER_CACHE_TTL_SECONDS
+
+    def enabled(self) -> bool:
+        return self._ttl_seconds() > 0
+
+    def get_or_resolve(self, db: Session, sub: str, resolve: Callable[[], Optional[User]]) -> Optional[User]:
+        # Пока в сессии есть незакоммиченные изменения пользователей, кэш для неё не используется
+        if not self.enabled() or auth_user_invalidation.has_changes(db):
+            return resolve()
+        now = time_module.monotonic()
+        with self._lock:
+            item = self._entries.get(sub)
+            if item is not None and item[0] > now and item[2] == self._generations.get(item[1], 0):
+                self._entries.move_to_end(sub)
+                self.hits += 1
+                values = item[3]
+            else:
+                values = None
+                self.misses += 1
+                version = self._version
+        if values is not None:
+            return _attach(db, values)
+
+        user = resolve()
+        if user is None or user.id is None:
+            return user
+        values = _snapshot(user)
+        with self._lock:
+            if version == self._version:
+                generation = self._generations.get(user.id, 0)
+                self._entries[sub] = (now + self._ttl_seconds(), user.id, generation, values)
+                self._entries.move_to_end(sub)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return user
+
+    def invalidate_user(self, user_id: int) -> None:
+        with self._lock:
+            self._version += 1
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            for sub in [s for s, item in self._entries.items() if item[1] == user_id]:
+                del self._entries[sub]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._version += 1
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+auth_user_cache = AuthUserCache()
+
+
+# --- Инвалидация по событиям сессии ---
+
+
+def _user_columns_changed(obj: User) -> bool:
+    state = inspect(obj)
+    return any(state.attrs[key].history.has_changes() for key in _USER_COLUMN_KEYS)
+
+
+def _collect_changes(session: Session) -> Tuple[Set[int], bool]:
+    users: Set[int] = set()
+    for obj in session.deleted:
+        if isinstance(obj, User):
+            users.add(obj.id)
+    for obj in session.dirty:
+        if isinstance(obj, User) and _user_columns_changed(obj):
+            users.add(obj.id)
+    return users, False
+
+
+auth_user_invalidation = CommitInvalidation(
+    "auth_user_cache",
+    _collect_changes,
+    auth_user_cache.invalidate_user,
+    auth_user_cache.clear,
+    clear_on_bulk=(User,),
+)
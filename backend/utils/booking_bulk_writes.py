@@ -0,0 +1,91 @@
+"""
+Владельцы броней, затронутых массовыми UPDATE/DELETE по Booking (Query.update/delete,
+Session.execute(update(Booking)/delete(Booking))).
+
+Один слушатель do_orm_execute на запрос: владельцы (master_id, indie_master_id, client_id)
+затронутых строк выбираются до выполнения и, если UPDATE меняет владельцев, — после; результат
+получают обработчики, зарегистрированные через on_bulk_booking_write
+(utils.master_client_stats, utils.master_active_bookings).
+
+Строки выбираются тем же WHERE; ORM bulk UPDATE по первичному ключу
+(session.execute(update(Booking), [{"id": ..., ...}])) — по id из строк параметров. Если нет
+ни WHERE, ни строк параметров (запрос по всей таблице), обработчик получает None — «затронуто
+всё», без выборки по таблице.
+"""
+from __future__ import annotations
+
+from typing import Any, Callable, List, NamedTuple, Optional, Set
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from models import Booking
+
+_booking_table = Booking.__table__
+
+# Колонки владельцев: UPDATE, который их не задаёт, повторно не выбирается
+_OWNER_KEYS = frozenset({"master_id", "indie_master_id", "client_id"})
+
+
+class BookingOwners(NamedTuple):
+    master_id: Optional[int]
+    indie_master_id: Optional[int]
+    client_id: Optional[int]
+
+
+# handler(session, owners): owners — None, если затронуты все брони
+BulkWriteHandler = Callable[[Session, Optional[Set[BookingOwners]]], None]
+
+_handlers: List[BulkWriteHandler] = []
+
+
+def on_bulk_booking_write(handler: BulkWriteHandler) -> BulkWriteHandler:
+    """Зарегистрировать обработчик (вызывается в транзакции запроса, после его выполнения)."""
+    _handlers.append(handler)
+    return handler
+
+
+def _affected_rows_clause(statement: Any, parameters: Any):
+    if statement.whereclause is not None:
+        return statement.whereclause
+    if isinstance(parameters, list) and parameters and all("id" in row for row in parameters):
+        return _booking_table.c.id.in_(sorted({row["id"] for row in parameters}))
+    return None
+
+
+def _may_change_owners(statement: Any, parameters: Any) -> bool:
+    """UPDATE задаёт колонки владельцев (или их нельзя определить)."""
+    keys = list(getattr(statement, "_values", None) or ())
+    keys += [key for key, _ in getattr(statement, "_ordered_values", None) or ()]
+    if isinstance(parameters, list):
+        for row in parameters:
+            keys += list(row)
+    if not keys:
+        return True
+    names = {key if isinstance(key, str) else getattr(key, "key", None) for key in keys}
+    return None in names or bool(names & _OWNER_KEYS)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _dispatch_bulk_write(orm_execute_state):
+    if not _handlers or not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return None
+    mapper = orm_execute_state.bind_mapper
+    if mapper is None or mapper.class_ is not Booking:
+        return None
+    statement = orm_execute_state.statement
+    parameters = orm_execute_state.parameters
+    session = orm_execute_state.session
+    clause = _affected_rows_clause(statement, parameters)
+    owners: Optional[Set[BookingOwners]] = None
+    if clause is not None:
+        owner_query = select(
+            _booking_table.c.master_id, _booking_table.c.indie_master_id, _booking_table.c.client_id
+        ).distinct().where(clause)
+        owners = {BookingOwners(*row) for row in session.connection().execute(owner_query)}
+    result = orm_execute_state.invoke_statement()
+    if owners is not None and orm_execute_state.is_update and _may_change_owners(statement, parameters):
+        owners |= {BookingOwners(*row) for row in session.connection().execute(owner_query)}
+    for handler in _handlers:
+        handler(session, owners)
+    return result
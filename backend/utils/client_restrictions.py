@@ -13,6 +13,7 @@ from models import (
     BookingStatus,
     MasterPaymentSettings
 )
+from utils.master_client_stats import cancellations_by_reason, get_client_stats
 
 
 def get_cancellation_reasons() -> dict[str, str]:
@@ -52,6 +53,12 @@ def count_cancellations_by_reason(
     Returns:
         Количество отмен
     """
+    if period_days is None and not indie_master_id:
+        # За всё время — из master_client_stats; строки нет — считаем по броням
+        stats = get_client_stats(db, master_id, client_id)
+        if stats is not None:
+            return cancellations_by_reason(stats, [BookingStatus.CANCELLED.value]).get(cancellation_reason, 0)
+
     # Формируем условие для поиска по master_id или indie_master_id
     master_condition = Booking.master_id == master_id
     if indie_master_id:
@@ -0,0 +1,227 @@
+"""
+Процессные кэши с поколениями и их инвалидация после commit.
+
+GenerationalCache — LRU + TTL; ключ записи — (владелец, подключ), владелец — сущность, по
+которой кэш сбрасывается (мастер, пользователь). Перед сборкой значения берётся токен
+поколения (generation), put сохраняет значение, только если токен не изменился: значение,
+собранное до инвалидации владельца или всего кэша, не сохраняется.
+
+CommitInvalidation — сбор id владельцев, затронутых транзакцией, через события сессии
+SQLAlchemy: before_flush передаёт изменённые объекты сессии в collect, массовые
+UPDATE/DELETE через Query по моделям clear_on_bulk помечают очистку целиком. После commit
+собранные владельцы сбрасываются, rollback сбор отменяет. Слушатели сессии общие для всех
+зарегистрированных кэшей.
+"""
+from __future__ import annotations
+
+import threading
+import time as time_module
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from settings import get_settings
+
+# Токен поколения: (поколение кэша, поколение владельца)
+GenerationToken = Tuple[int, int]
+
+
+class GenerationalCache:
+    """LRU + TTL с поколениями по владельцу. TTL — настройка ttl_setting (0 — кэш выключен)."""
+
+    def __init__(self, ttl_setting: str, max_entries: int):
+        self._ttl_setting = ttl_setting
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[Hashable, Hashable], Tuple[float, Any]]" = OrderedDict()
+        self._generations: Dict[Hashable, int] = {}
+        self._global_generation = 0
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    def ttl_seconds(self) -> int:
+        return getattr(get_settings(), self._ttl_setting)
+
+    def enabled(self) -> bool:
+        return self.ttl_seconds() > 0
+
+    def generation(self, owner: Hashable) -> GenerationToken:
+        with self._lock:
+            return self._global_generation, self._generations.get(owner, 0)
+
+    def lookup(self, owner: Hashable, key: Hashable = None) -> Tuple[bool, Any]:
+        """(найдено, значение); истёкшая запись удаляется."""
+        entry_key = (owner, key)
+        now = time_module.monotonic()
+        with self._lock:
+            item = self._entries.get(entry_key)
+            if item is None or item[0] <= now:
+                if item is not None:
+                    del self._entries[entry_key]
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(entry_key)
+            self.hits += 1
+            return True, item[1]
+
+    def put(
+        self,
+        owner: Hashable,
+        key: Hashable,
+        value: Any,
+        token: GenerationToken,
+        max_age: Optional[float] = None,
+    ) -> None:
+        """Сохранить значение, собранное при поколении token; max_age — срок короче TTL (секунды)."""
+        age = self.ttl_seconds()
+        if max_age is not None:
+            age = min(age, max_age)
+        if age <= 0:
+            return
+        entry_key = (owner, key)
+        with self._lock:
+            if token != (self._global_generation, self._generations.get(owner, 0)):
+                # Пока собирали значение, данные владельца поменялись
+                return
+            self._entries[entry_key] = (time_module.monotonic() + age, value)
+            self._entries.move_to_end(entry_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, owner: Hashable) -> None:
+        with self._lock:
+            self._generations[owner] = self._generations.get(owner, 0) + 1
+            for entry_key in [k for k in self._entries if k[0] == owner]:
+                del self._entries[entry_key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._global_generation += 1
+            self._generations.clear()
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+def attr_values(obj: Any, name: str) -> list:
+    """Текущее и прежнее (до изменения в этой транзакции) значения атрибута."""
+    values = [getattr(obj, name, None)]
+    state = inspect(obj)
+    if name in state.attrs:
+        values.extend(state.attrs[name].history.deleted or ())
+    return values
+
+
+# collect(session) → (id владельцев, очистить ли кэш целиком)
+Collect = Callable[[Session], Tuple[Set[Hashable], bool]]
+
+
+class CommitInvalidation:
+    """
+    Инвалидация кэша после commit: collect собирает id владельцев по объектам сессии,
+    invalidate/clear применяются после commit. session_keys — ключи session.info,
+    которые живут до конца транзакции (например, мемо запроса).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        collect: Collect,
+        invalidate: Callable[[Hashable], None],
+        clear: Callable[[], None],
+        clear_on_bulk: Iterable[type] = (),
+        session_keys: Iterable[str] = (),
+    ):
+        self.collect = collect
+        self.invalidate = invalidate
+        self.clear = clear
+        self.clear_on_bulk = tuple(clear_on_bulk)
+        self.session_keys = tuple(session_keys)
+        self._ids_key = f"{name}_pending_ids"
+        self._clear_key = f"{name}_pending_clear"
+        _invalidations.append(self)
+
+    def pending(self, session: Session) -> Tuple[Set[Hashable], bool]:
+        """Незакоммиченные изменения сессии, включая ещё не flush-нутые."""
+        ids, clear = self.collect(session)
+        ids |= session.info.get(self._ids_key, set())
+        ids.discard(None)
+        return ids, clear or bool(session.info.get(self._clear_key))
+
+    def has_changes(self, session: Session) -> bool:
+        ids, clear = self.pending(session)
+        return clear or bool(ids)
+
+    def is_dirty(self, session: Session, owner: Hashable) -> bool:
+        """В сессии есть незакоммиченные изменения владельца — кэш для неё не используется."""
+        ids, clear = self.pending(session)
+        return clear or owner in ids
+
+    def _before_flush(self, session: Session) -> None:
+        ids, clear = self.collect(session)
+        ids.discard(None)
+        if ids:
+            session.info.setdefault(self._ids_key, set()).update(ids)
+        if clear:
+            session.info[self._clear_key] = True
+
+    def _bulk_write(self, session: Session, model: type) -> None:
+        if model in self.clear_on_bulk:
+            session.info[self._clear_key] = True
+
+    def _after_commit(self, session: Session) -> None:
+        ids = session.info.pop(self._ids_key, None)
+        self._discard_session_keys(session)
+        if session.info.pop(self._clear_key, False):
+            self.clear()
+            return
+        for owner in ids or ():
+            self.invalidate(owner)
+
+    def _after_rollback(self, session: Session) -> None:
+        session.info.pop(self._ids_key, None)
+        session.info.pop(self._clear_key, None)
+        self._discard_session_keys(session)
+
+    def _discard_session_keys(self, session: Session) -> None:
+        for key in self.session_keys:
+            session.info.pop(key, None)
+
+
+_invalidations: List[CommitInvalidation] = []
+
+
+# --- События сессии: одни слушатели на все кэши ---
+
+
+@event.listens_for(Session, "before_flush")
+def _collect_before_flush(session, flush_context, instances):
+    for invalidation in _invalidations:
+        invalidation._before_flush(session)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _collect_bulk_writes(orm_execute_state):
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is None:
+        return
+    for invalidation in _invalidations:
+        invalidation._bulk_write(orm_execute_state.session, mapper.class_)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_after_commit(session):
+    for invalidation in _invalidations:
+        invalidation._after_commit(session)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session):
+    for invalidation in _invalidations:
+        invalidation._after_rollback(session)
@@ -11,9 +11,7 @@ from sqlalchemy.orm import Session
 from sqlalchemy import desc
 
 from models import (
-    LoyaltyDiscount,
     LoyaltyDiscountType,
-    PersonalDiscount,
     LoyaltyConditionType,
     Booking,
     BookingStatus,
@@ -23,7 +21,8 @@ from models import (
     Master,
     MasterService,
 )
-from utils.loyalty_params import normalize_parameters
+from utils.loyalty_rule_cache import CompiledRuleSet, get_compiled_rules, service_key
+from utils.master_client_stats import get_client_stats
 
 # Приоритет condition_type при ничьей по discount_percent (меньше = выше)
 CONDITION_TYPE_PRIORITY: Dict[str, int] = {
@@ -115,16 +114,8 @@ def _get_client_data(db: Session, client_id: Optional[int], client_phone: Option
     return None, client_phone, None
 
 
-def _get_service_context(
-    db: Session,
-    service_id: Optional[int],
-    category_id: Optional[int],
-) -> Tuple[Optional[int], Optional[float], Optional[int]]:
-    if service_id:
-        service = db.query(Service).filter(Service.id == service_id).first()
-        if service:
-            return service.id, service.price, category_id or service.category_id
-    return service_id, None, category_id
+# Маркер «Service не загружен заранее» для _evaluate_candidates
+_SERVICE_NOT_LOADED = object()
 
 
 # Статусы, при которых запись не считается «визитом» для first_visit (отмена / протухшая оплата).
@@ -144,6 +135,9 @@ def _has_non_cancelled_booking_with_master(db: Session, master_id: int, client_i
     Используется для first_visit: скидка «первый визит» не применяется повторно после первой
     реальной брони (created / future / completed и т.д.), а не только после completed.
     """
+    stats = get_client_stats(db, master_id, client_id)
+    if stats is not None:
+        return stats.active_count > 0
     q = (
         db.query(Booking.id)
         .filter(
@@ -162,6 +156,15 @@ def _count_completed_visits(
     start_dt: Optional[datetime],
     end_dt: Optional[datetime],
 ) -> int:
+    stats = get_client_stats(db, master_id, client_id)
+    if stats is not None:
+        if not stats.completed_count:
+            return 0
+        if not start_dt and not end_dt:
+            return stats.completed_count
+        if start_dt and stats.last_visit_at is not None and stats.last_visit_at.replace(tzinfo=None) < start_dt.replace(tzinfo=None):
+            # Последний визит раньше окна — в окне визитов нет
+            return 0
     query = db.query(Booking).filter(
         Booking.master_id == master_id,
         Booking.client_id == client_id,
@@ -174,33 +177,14 @@ def _count_completed_visits(
     return query.count()
 
 
-def _canonical_service_id_matches_rule_service_id(
-    db: Session,
-    booking_canonical_service_id: int,
-    rule_service_id: int,
-) -> bool:
-    """
-    Правило service_discount может ссылаться на другой Service.id (салонный/reseed),
-    а booking/preview передают канонический standalone Service.id — та же услуга по name/duration/price.
-    """
-    if int(booking_canonical_service_id) == int(rule_service_id):
-        return True
-    canon = db.query(Service).filter(Service.id == int(booking_canonical_service_id)).first()
-    alt = db.query(Service).filter(Service.id == int(rule_service_id)).first()
-    if not canon or not alt:
-        return False
-    return (
-        canon.name == alt.name
-        and (canon.duration or 0) == (alt.duration or 0)
-        and float(canon.price or 0) == float(alt.price or 0)
-    )
-
-
 def _get_last_completed_visit(
     db: Session,
     master_id: int,
     client_id: int,
 ) -> Optional[datetime]:
+    stats = get_client_stats(db, master_id, client_id)
+    if stats is not None:
+        return stats.last_visit_at
     last_booking = (
         db.query(Booking)
         .filter(
@@ -214,6 +198,45 @@ def _get_last_completed_visit(
     return last_booking.start_time if last_booking else None
 
 
+class ClientHistoryContext:
+    """
+    История клиента у мастера для условий скидок. Создаётся один раз на запрос и делится
+    между всеми правилами (и услугами в evaluate_for_services); каждое значение
+    запрашивается не более одного раза и только если его спросило правило.
+    """
+
+    _UNSET = object()
+
+    def __init__(self, db: Session, master_id: int, client_id: Optional[int], client_phone: Optional[str]):
+        self.db = db
+        self.master_id = master_id
+        self.client_id = client_id
+        _, self.phone, self.birth_date = _get_client_data(db, client_id, client_phone)
+        self._has_prior_booking: Any = self._UNSET
+        self._last_completed_visit: Any = self._UNSET
+        self._visits_in_window: Dict[Tuple[Optional[datetime], Optional[datetime]], int] = {}
+
+    def has_prior_booking(self) -> bool:
+        if self._has_prior_booking is self._UNSET:
+            self._has_prior_booking = _has_non_cancelled_booking_with_master(
+                self.db, self.master_id, int(self.client_id)
+            )
+        return self._has_prior_booking
+
+    def last_completed_visit(self) -> Optional[datetime]:
+        if self._last_completed_visit is self._UNSET:
+            self._last_completed_visit = _get_last_completed_visit(self.db, self.master_id, self.client_id)
+        return self._last_completed_visit
+
+    def count_completed_visits(self, start_dt: Optional[datetime], end_dt: Optional[datetime]) -> int:
+        key = (start_dt, end_dt)
+        if key not in self._visits_in_window:
+            self._visits_in_window[key] = _count_completed_visits(
+                self.db, self.master_id, self.client_id, start_dt, end_dt
+            )
+        return self._visits_in_window[key]
+
+
 def _ref_date_in_year(y: int, birth_date: date) -> date:
     try:
         return date(y, birth_date.month, birth_date.day)
@@ -268,39 +291,79 @@ def evaluate_and_prepare_applied_discount(
     """
     if not master_id or not service_id or not booking_start:
         return None, None
+    return evaluate_for_services(
+        master_id, client_id, client_phone, [service_id], booking_start, db, now=now
+    )[service_id]
 
-    service = db.query(Service).filter(Service.id == service_id).first()
-    if not service or not service.price or service.price <= 0:
-        return None, None
 
-    booking_payload = {
-        "start_time": booking_start,
-        "service_id": service_id,
-        "service_price": service.price,
-        "category_id": service.category_id,
+def evaluate_for_services(
+    master_id: int,
+    client_id: Optional[int],
+    client_phone: Optional[str],
+    service_ids: List[int],
+    booking_start: Optional[datetime],
+    db: Session,
+    now: Optional[datetime] = None,
+    history: Optional[ClientHistoryContext] = None,
+) -> Dict[int, Tuple[Optional[float], Optional[Dict[str, Any]]]]:
+    """
+    evaluate_and_prepare_applied_discount для списка услуг за один вызов: правила мастера,
+    история клиента и услуги загружаются один раз. {service_id: (цена со скидкой, данные скидки)},
+    (None, None) — скидки нет или услуга без цены.
+    """
+    results: Dict[int, Tuple[Optional[float], Optional[Dict[str, Any]]]] = {
+        sid: (None, None) for sid in service_ids
     }
+    if not master_id or not booking_start or not service_ids:
+        return results
+
+    services = {s.id: s for s in db.query(Service).filter(Service.id.in_(list(results))).all()}
+    priced = [sid for sid in results if services.get(sid) is not None and services[sid].price and services[sid].price > 0]
+    if not priced:
+        return results
+
+    if history is None:
+        history = ClientHistoryContext(db, master_id, client_id, client_phone)
+    compiled = get_compiled_rules(db, master_id)
+
+    for sid in priced:
+        service = services[sid]
+        booking_payload = {
+            "start_time": booking_start,
+            "service_id": sid,
+            "service_price": service.price,
+            "category_id": service.category_id,
+        }
+        _, best_candidate = _evaluate_candidates(
+            master_id,
+            client_id,
+            booking_payload,
+            db,
+            now,
+            history,
+            compiled,
+            service=service,
+        )
+        results[sid] = _prepare_applied_discount(float(service.price), best_candidate)
+    return results
 
-    candidates, best_candidate = evaluate_discount_candidates(
-        master_id=master_id,
-        client_id=client_id,
-        client_phone=client_phone,
-        booking_payload=booking_payload,
-        db=db,
-        now=now,
-    )
 
+def _prepare_applied_discount(
+    base_price: float,
+    best_candidate: Optional[Dict[str, Any]],
+) -> Tuple[Optional[float], Optional[Dict[str, Any]]]:
     if not best_candidate:
         return None, None
 
     discount_amount = calculate_discount_amount(
-        base_price=float(service.price),
+        base_price=base_price,
         discount_percent=float(best_candidate["discount_percent"]),
         max_discount_amount=best_candidate.get("max_discount_amount"),
     )
     if discount_amount <= 0:
         return None, None
 
-    discounted_payment_amount = max(float(service.price) - discount_amount, 0.0)
+    discounted_payment_amount = max(base_price - discount_amount, 0.0)
     applied_discount_data = {
         "rule_type": best_candidate["rule_type"],
         "rule_id": best_candidate["rule_id"],
@@ -360,12 +423,31 @@ def evaluate_discount_candidates(
     booking_payload: Dict[str, Any],
     db: Session,
     now: Optional[datetime] = None,
+    history: Optional[ClientHistoryContext] = None,
 ) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
     """
     Возвращает список кандидатов + лучший кандидат (deterministic).
     Не использует salon_id, только master_id.
     now: опционально для тестов; иначе datetime.utcnow().
+    history: история клиента, если уже загружена вызывающим (иначе создаётся здесь).
     """
+    if history is None:
+        history = ClientHistoryContext(db, master_id, client_id, client_phone)
+    compiled = get_compiled_rules(db, master_id)
+    return _evaluate_candidates(master_id, client_id, booking_payload, db, now, history, compiled)
+
+
+def _evaluate_candidates(
+    master_id: int,
+    client_id: Optional[int],
+    booking_payload: Dict[str, Any],
+    db: Session,
+    now: Optional[datetime],
+    history: ClientHistoryContext,
+    compiled: CompiledRuleSet,
+    service: Any = _SERVICE_NOT_LOADED,
+) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """Оценка скомпилированных правил; service — заранее загруженный Service (или None), иначе читается по service_id."""
     if now is None:
         now = datetime.utcnow()
     booking_start: Optional[datetime] = booking_payload.get("start_time")
@@ -376,40 +458,27 @@ def evaluate_discount_candidates(
         booking_start = _coerce_booking_start_utc_naive(booking_start)
         booking_payload["start_time"] = booking_start
 
-    _, resolved_phone, birth_date = _get_client_data(db, client_id, client_phone)
-    _, resolved_price, resolved_category_id = _get_service_context(
-        db, service_id, category_id
-    )
+    resolved_phone, birth_date = history.phone, history.birth_date
+    if service is _SERVICE_NOT_LOADED:
+        service = db.query(Service).filter(Service.id == service_id).first() if service_id else None
+    if service is not None:
+        resolved_category_id = category_id or service.category_id
+        booking_service_key = service_key(service)
+    else:
+        resolved_category_id, booking_service_key = category_id, None
 
     candidates: List[Dict[str, Any]] = []
 
-    loyalty_rules = (
-        db.query(LoyaltyDiscount)
-        .filter(LoyaltyDiscount.master_id == master_id)
-        .all()
-    )
-    personal_rules = (
-        db.query(PersonalDiscount)
-        .filter(PersonalDiscount.master_id == master_id)
-        .all()
-    )
-
-    for rule in loyalty_rules:
-        condition = rule.conditions or {}
-        condition_type = condition.get("condition_type")
-        raw_params = condition.get("parameters", {}) if isinstance(condition, dict) else {}
-        parameters = normalize_parameters(
-            condition_type or "",
-            raw_params,
-            rule_discount_percent=float(rule.discount_percent) if rule.discount_percent is not None else None,
-        )
+    for rule in compiled.rules:
+        condition_type = rule.condition_type
+        parameters = rule.parameters
 
         candidate = {
-            "rule_id": rule.id,
-            "rule_type": rule.discount_type,
+            "rule_id": rule.rule_id,
+            "rule_type": rule.rule_type,
             "name": rule.name,
             "condition_type": condition_type,
-            "parameters": parameters,
+            "parameters": rule.fresh_parameters(),
             "priority": rule.priority,
             "is_active": rule.is_active,
             "match": False,
@@ -432,7 +501,7 @@ def evaluate_discount_candidates(
             if not client_id:
                 candidate["reason"] = "insufficient_data"
             else:
-                has_prior = _has_non_cancelled_booking_with_master(db, master_id, int(client_id))
+                has_prior = history.has_prior_booking()
                 candidate["match"] = not has_prior
                 candidate["reason"] = "matched" if candidate["match"] else "has_previous_booking"
 
@@ -442,7 +511,7 @@ def evaluate_discount_candidates(
             else:
                 min_days = parameters.get("min_days_since_last_visit")
                 max_days = parameters.get("max_days_since_last_visit")
-                last_visit = _get_last_completed_visit(db, master_id, client_id)
+                last_visit = history.last_completed_visit()
                 if not last_visit or not isinstance(min_days, (int, float)):
                     candidate["reason"] = "insufficient_data"
                 else:
@@ -471,7 +540,7 @@ def evaluate_discount_candidates(
                     window_start_local = now_local - timedelta(days=int(period_days))
                     start_utc = _master_local_to_utc(window_start_local, master_id, db)
                     end_utc = _master_local_to_utc(window_end_local, master_id, db)
-                    visits = _count_completed_visits(db, master_id, client_id, start_utc, end_utc)
+                    visits = history.count_completed_visits(start_utc, end_utc)
                     candidate["match"] = visits >= int(visits_count)
                     candidate["reason"] = "matched" if candidate["match"] else "not_enough_visits"
 
@@ -496,23 +565,14 @@ def evaluate_discount_candidates(
             if not booking_start:
                 candidate["reason"] = "insufficient_data"
             else:
-                days_list = parameters.get("days") or []
-                intervals = parameters.get("intervals") or []
-                if not isinstance(days_list, list) or not isinstance(intervals, list) or len(intervals) == 0:
+                if not rule.hh_has_intervals:
                     candidate["reason"] = "insufficient_data"
                 else:
                     booking_local = to_master_local(booking_start, master_id, db)
                     booking_time = booking_local.time()
-                    booking_day = booking_local.isoweekday()
-                    in_day = booking_day in days_list
-                    in_any = False
-                    for iv in intervals:
-                        st = _parse_time(iv.get("start"))
-                        et = _parse_time(iv.get("end"))
-                        # B4: start включительно, end исключительно
-                        if st and et and st <= booking_time < et:
-                            in_any = True
-                            break
+                    in_day = booking_local.isoweekday() in rule.hh_days
+                    # B4: start включительно, end исключительно
+                    in_any = any(st <= booking_time < et for st, et in rule.hh_windows)
                     candidate["match"] = in_day and in_any
                     candidate["reason"] = "matched" if candidate["match"] else "outside_happy_hours"
 
@@ -523,13 +583,9 @@ def evaluate_discount_candidates(
             elif not service_id and not resolved_category_id:
                 candidate["reason"] = "insufficient_data"
             else:
-                sid = parameters.get("service_id")
-                cid = parameters.get("category_id")
-                matched = False
-                if sid is not None and service_id is not None:
-                    if _canonical_service_id_matches_rule_service_id(db, int(service_id), int(sid)):
-                        matched = True
-                if not matched and cid is not None and resolved_category_id is not None and int(cid) == int(resolved_category_id):
+                cid = rule.category_id
+                matched = service_id is not None and rule.matches_service(int(service_id), booking_service_key)
+                if not matched and cid is not None and resolved_category_id is not None and cid == int(resolved_category_id):
                     matched = True
                 candidate["match"] = matched
                 candidate["reason"] = "matched" if matched else "service_not_matched"
@@ -541,9 +597,9 @@ def evaluate_discount_candidates(
 
         candidates.append(candidate)
 
-    for rule in personal_rules:
+    for rule in compiled.personal:
         candidate = {
-            "rule_id": rule.id,
+            "rule_id": rule.rule_id,
             "rule_type": "personal",
             "name": "Персональная скидка",
             "condition_type": "personal",
@@ -590,40 +646,6 @@ def _public_pct_label(pct: float) -> str:
     return f"\u2212{x:g}%"
 
 
-def _canonical_service_for_master_service_row(db: Session, ms: MasterService) -> Optional[Service]:
-    """Тот же резолв канонического Service, что в публичной записи (по имени/длительности/цене)."""
-    return (
-        db.query(Service)
-        .filter(
-            Service.salon_id.is_(None),
-            Service.indie_master_id.is_(None),
-            Service.name == ms.name,
-            Service.duration == ms.duration,
-            Service.price == ms.price,
-        )
-        .first()
-    )
-
-
-def _master_service_matches_rule_service_id(db: Session, ms: MasterService, sid: int) -> bool:
-    """
-    service_discount в правиле может хранить:
-    - id канонического Service (как в preview), или
-    - id салонного/другого Service из reseed (create_service_and_link_master), совпадающего по услуге с MasterService.
-    """
-    canon = _canonical_service_for_master_service_row(db, ms)
-    if canon is not None and int(canon.id) == int(sid):
-        return True
-    row = db.query(Service).filter(Service.id == int(sid)).first()
-    if not row:
-        return False
-    return (
-        row.name == ms.name
-        and (row.duration or 0) == (ms.duration or 0)
-        and float(row.price or 0) == float(ms.price or 0)
-    )
-
-
 def build_public_loyalty_visual_hints(db: Session, master: Master) -> Dict[str, Any]:
     """
     Подсказки для публичного UI (без расчёта персональных/исторических скидок).
@@ -632,28 +654,17 @@ def build_public_loyalty_visual_hints(db: Session, master: Master) -> Dict[str,
     hh_best: Dict[Tuple[int, str, str], float] = {}
     sd_best: Dict[int, float] = {}
 
-    rules = (
-        db.query(LoyaltyDiscount)
-        .filter(
-            LoyaltyDiscount.master_id == master.id,
-            LoyaltyDiscount.discount_type == LoyaltyDiscountType.QUICK,
-            LoyaltyDiscount.is_active.is_(True),
-        )
-        .all()
-    )
+    rules = [
+        r
+        for r in get_compiled_rules(db, master.id).rules
+        if r.is_active and r.rule_type == LoyaltyDiscountType.QUICK
+    ]
+    master_svcs: Optional[List[MasterService]] = None
 
     for rule in rules:
-        cond = rule.conditions or {}
-        if not isinstance(cond, dict):
-            continue
-        condition_type = cond.get("condition_type")
-        raw_params = cond.get("parameters", {}) if isinstance(cond.get("parameters"), dict) else {}
+        condition_type = rule.condition_type
+        parameters = rule.parameters
         pct = float(rule.discount_percent or 0)
-        parameters = normalize_parameters(
-            condition_type or "",
-            raw_params,
-            rule_discount_percent=float(rule.discount_percent) if rule.discount_percent is not None else None,
-        )
 
         if condition_type == LoyaltyConditionType.HAPPY_HOURS.value:
             days_list = parameters.get("days") or []
@@ -681,18 +692,16 @@ def build_public_loyalty_visual_hints(db: Session, master: Master) -> Dict[str,
         elif condition_type == LoyaltyConditionType.SERVICE_DISCOUNT.value:
             if parameters.get("_invalid"):
                 continue
-            sid = parameters.get("service_id")
-            cid = parameters.get("category_id")
-            master_svcs = db.query(MasterService).filter(MasterService.master_id == master.id).all()
+            if master_svcs is None:
+                master_svcs = db.query(MasterService).filter(MasterService.master_id == master.id).all()
             for ms in master_svcs:
-                matched = False
-                if sid is not None and _master_service_matches_rule_service_id(db, ms, int(sid)):
-                    matched = True
+                # Правило может ссылаться на канонический или салонный Service — сравниваем по name/duration/price
+                matched = rule.service_key is not None and rule.service_key == service_key(ms)
                 if (
                     not matched
-                    and cid is not None
+                    and rule.category_id is not None
                     and ms.category_id is not None
-                    and int(cid) == int(ms.category_id)
+                    and rule.category_id == int(ms.category_id)
                 ):
                     matched = True
                 if matched:
@@ -0,0 +1,224 @@
+"""
+Скомпилированные правила скидок мастера: master_id → CompiledRuleSet.
+
+Компиляция делает один раз то, что раньше повторялось на каждый расчёт цены:
+чтение LoyaltyDiscount/PersonalDiscount, normalize_parameters по JSON conditions,
+разбор окон happy_hours (_parse_time) и загрузку Service правила service_discount
+(ключ name/duration/price: правило может ссылаться на салонный Service,
+а бронь — на канонический; это одна услуга, если ключи совпадают).
+
+Инвалидация — после commit (utils.generational_cache.CommitInvalidation): изменения
+LoyaltyDiscount/PersonalDiscount (CRUD quick/complex/personal в routers/loyalty.py и любые
+другие записи) сбрасывают набор мастера; изменение/удаление Service очищает кэш целиком.
+Пока в сессии есть незакоммиченные изменения правил мастера, кэш для неё не используется.
+Кэш локален для процесса: чужие изменения видны не позже LOYALTY_RULE_CACHE_TTL_SECONDS
+(0 — кэш выключен).
+"""
+from __future__ import annotations
+
+import copy
+from dataclasses import dataclass
+from datetime import time
+from typing import Any, Dict, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from models import LoyaltyConditionType, LoyaltyDiscount, PersonalDiscount, Service
+from utils.generational_cache import CommitInvalidation, GenerationalCache, attr_values
+from utils.loyalty_params import normalize_parameters
+
+# Ключ услуги для сравнения «та же услуга»: (name, duration, price)
+ServiceKey = Tuple[Optional[str], int, float]
+
+
+def service_key(service: Any) -> ServiceKey:
+    return (service.name, int(service.duration or 0), float(service.price or 0))
+
+
+@dataclass(frozen=True)
+class CompiledRule:
+    """LoyaltyDiscount с разобранными условиями."""
+
+    rule_id: int
+    rule_type: Any
+    name: Optional[str]
+    priority: Optional[int]
+    is_active: bool
+    discount_percent: Optional[float]
+    max_discount_amount: Optional[float]
+    condition_type: Optional[str]
+    parameters: Dict[str, Any]
+    # happy_hours: дни недели (isoweekday) и окна [start, end)
+    hh_days: Tuple[Any, ...] = ()
+    hh_windows: Tuple[Tuple[time, time], ...] = ()
+    hh_has_intervals: bool = False
+    # service_discount: Service правила и его ключ (None — Service не найден)
+    service_id: Optional[int] = None
+    service_key: Optional[ServiceKey] = None
+    category_id: Optional[int] = None
+
+    def fresh_parameters(self) -> Dict[str, Any]:
+        """Копия parameters для ответа API (кэшированный dict не отдаём наружу)."""
+        return copy.deepcopy(self.parameters)
+
+    def matches_service(self, booking_service_id: int, booking_service_key: Optional[ServiceKey]) -> bool:
+        """Совпадение по id или по ключу name/duration/price."""
+        if self.service_id is None:
+            return False
+        if int(booking_service_id) == int(self.service_id):
+            return True
+        return (
+            booking_service_key is not None
+            and self.service_key is not None
+            and booking_service_key == self.service_key
+        )
+
+
+@dataclass(frozen=True)
+class CompiledPersonal:
+    rule_id: int
+    is_active: bool
+    client_phone: Optional[str]
+    discount_percent: Optional[float]
+    max_discount_amount: Optional[float]
+
+
+@dataclass(frozen=True)
+class CompiledRuleSet:
+    master_id: int
+    rules: Tuple[CompiledRule, ...]
+    personal: Tuple[CompiledPersonal, ...]
+
+
+def _normalized(rule: LoyaltyDiscount) -> Tuple[Optional[str], Dict[str, Any]]:
+    condition = rule.conditions or {}
+    condition_type = condition.get("condition_type") if isinstance(condition, dict) else None
+    raw_params = condition.get("parameters", {}) if isinstance(condition, dict) else {}
+    parameters = normalize_parameters(
+        condition_type or "",
+        raw_params,
+        rule_discount_percent=float(rule.discount_percent) if rule.discount_percent is not None else None,
+    )
+    return condition_type, parameters
+
+
+def _compile_rule(
+    rule: LoyaltyDiscount,
+    condition_type: Optional[str],
+    parameters: Dict[str, Any],
+    services: Dict[int, Service],
+) -> CompiledRule:
+    from utils.loyalty_discounts import _parse_time
+
+    extra: Dict[str, Any] = {}
+    if condition_type == LoyaltyConditionType.HAPPY_HOURS.value:
+        days_list = parameters.get("days") or []
+        intervals = parameters.get("intervals") or []
+        if isinstance(days_list, list) and isinstance(intervals, list):
+            windows = []
+            for iv in intervals:
+                st = _parse_time(iv.get("start"))
+                et = _parse_time(iv.get("end"))
+                if st and et:
+                    windows.append((st, et))
+            extra.update(hh_days=tuple(days_list), hh_windows=tuple(windows), hh_has_intervals=len(intervals) > 0)
+    elif condition_type == LoyaltyConditionType.SERVICE_DISCOUNT.value and not parameters.get("_invalid"):
+        sid = parameters.get("service_id")
+        cid = parameters.get("category_id")
+        if sid is not None:
+            svc = services.get(int(sid))
+            extra.update(service_id=int(sid), service_key=service_key(svc) if svc is not None else None)
+        if cid is not None:
+            extra["category_id"] = int(cid)
+    return CompiledRule(
+        rule_id=rule.id,
+        rule_type=rule.discount_type,
+        name=rule.name,
+        priority=rule.priority,
+        is_active=bool(rule.is_active),
+        discount_percent=rule.discount_percent,
+        max_discount_amount=rule.max_discount_amount,
+        condition_type=condition_type,
+        parameters=parameters,
+        **extra,
+    )
+
+
+def compile_master_rules(db: Session, master_id: int) -> CompiledRuleSet:
+    """Загрузить и разобрать правила мастера (без кэша)."""
+    loyalty_rules = db.query(LoyaltyDiscount).filter(LoyaltyDiscount.master_id == master_id).all()
+    personal_rules = db.query(PersonalDiscount).filter(PersonalDiscount.master_id == master_id).all()
+    normalized = [(rule, *_normalized(rule)) for rule in loyalty_rules]
+
+    # Service всех правил service_discount — одним запросом
+    service_ids = set()
+    for _, condition_type, parameters in normalized:
+        if condition_type == LoyaltyConditionType.SERVICE_DISCOUNT.value and parameters.get("service_id") is not None:
+            service_ids.add(int(parameters["service_id"]))
+    services = (
+        {s.id: s for s in db.query(Service).filter(Service.id.in_(service_ids)).all()} if service_ids else {}
+    )
+
+    return CompiledRuleSet(
+        master_id=master_id,
+        rules=tuple(_compile_rule(rule, ct, params, services) for rule, ct, params in normalized),
+        personal=tuple(
+            CompiledPersonal(
+                rule_id=p.id,
+                is_active=bool(p.is_active),
+                client_phone=p.client_phone,
+                discount_percent=p.discount_percent,
+                max_discount_amount=p.max_discount_amount,
+            )
+            for p in personal_rules
+        ),
+    )
+
+
+class LoyaltyRuleCache(GenerationalCache):
+    """Скомпилированные наборы правил по мастеру."""
+
+    def __init__(self, max_entries: int = 5000):
+        super().__init__("LOYALTY_RULE_CACHE_TTL_SECONDS", max_entries)
+
+    def get_or_compile(self, db: Session, master_id: int) -> CompiledRuleSet:
+        if not self.enabled() or loyalty_rule_invalidation.is_dirty(db, master_id):
+            return compile_master_rules(db, master_id)
+        found, compiled = self.lookup(master_id)
+        if found:
+            return compiled
+        token = self.generation(master_id)
+        compiled = compile_master_rules(db, master_id)
+        self.put(master_id, None, compiled, token)
+        return compiled
+
+
+loyalty_rule_cache = LoyaltyRuleCache()
+
+
+def get_compiled_rules(db: Session, master_id: int) -> CompiledRuleSet:
+    return loyalty_rule_cache.get_or_compile(db, master_id)
+
+
+# --- Инвалидация по событиям сессии ---
+
+
+def _collect_changes(session: Session) -> Tuple[Set[int], bool]:
+    masters: Set[int] = set()
+    clear = False
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, (LoyaltyDiscount, PersonalDiscount)):
+            masters.update(attr_values(obj, "master_id"))
+        elif isinstance(obj, Service) and obj not in session.new:
+            # Правила service_discount сравнивают услуги по name/duration/price
+            clear = True
+    return masters, clear
+
+
+loyalty_rule_invalidation = CommitInvalidation(
+    "loyalty_rule_cache",
+    _collect_changes,
+    loyalty_rule_cache.invalidate,
+    loyalty_rule_cache.clear,
+    clear_on_bulk=(LoyaltyDiscount, PersonalDiscount, Service),
+)
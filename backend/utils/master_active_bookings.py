@@ -0,0 +1,242 @@
+"""
+Счётчик активных будущих записей мастера для лимита плана (Free: max_future_bookings):
+строка master_active_booking_counts на Master.id.
+
+Семантика «активных будущих» — utils.master_future_bookings_query.active_future_bookings_sql_filter
+(бронь мастера по master_id или indie_master_id, start_time > now, без отменённых/completed/
+payment_expired). Все мастера считаются одним GROUP BY (grouped_active_future_counts) —
+так работает ежедневный мониторинг лимитов, он же единственный пишет таблицу (store_counts).
+
+Изменение брони мастера (события сессии, массовые UPDATE/DELETE — через
+utils.booking_bulk_writes) удаляет его строку после коммита, отдельной короткой транзакцией:
+транзакция брони строку счётчика не блокирует. Без изменений счётчик может только уменьшиться — когда наступает ближайшая запись
+(next_start_time); такая строка, как и строка старше BOOKING_LIMIT_COUNT_MAX_AGE_SECONDS,
+считается устаревшей. Читатель (active_future_bookings_count) ничего не пишет: при отсутствии
+или устаревании строки считает записи одного мастера.
+"""
+from __future__ import annotations
+
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Iterable, List, Optional, Set
+
+from sqlalchemy import and_, delete, event, func, inspect, or_, select
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session, object_session
+
+from models import Booking, Master, MasterActiveBookingCount
+from settings import get_settings
+from utils.booking_bulk_writes import on_bulk_booking_write
+from utils.master_future_bookings_query import active_future_core
+
+logger = logging.getLogger(__name__)
+
+_booking_table = Booking.__table__
+_counts_table = MasterActiveBookingCount.__table__
+
+# Поля брони, от которых зависит счётчик
+_BOOKING_COUNT_FIELDS = ("master_id", "indie_master_id", "status", "start_time")
+
+_CHUNK_SIZE = 500
+
+
+@dataclass(frozen=True)
+class ActiveCountRow:
+    master_id: int
+    user_id: Optional[int]
+    active_future_bookings: int
+    next_start_time: Optional[datetime]
+
+
+def grouped_active_future_counts(
+    db: Session,
+    now_utc: Optional[datetime] = None,
+    master_filter: Any = None,
+) -> List[ActiveCountRow]:
+    """
+    Активные будущие записи по мастерам одним запросом (мастера без записей — с нулём).
+    master_filter — условие на Master (например, Master.user_id.in_(подзапрос подписок)).
+    """
+    now = now_utc or datetime.utcnow()
+    owner = or_(Booking.master_id == Master.id, Booking.indie_master_id == Master.id)
+    query = (
+        db.query(
+            Master.id,
+            Master.user_id,
+            func.count(Booking.id),
+            func.min(Booking.start_time),
+        )
+        .outerjoin(Booking, and_(owner, active_future_core(now)))
+        .group_by(Master.id, Master.user_id)
+    )
+    if master_filter is not None:
+        query = query.filter(master_filter)
+    return [
+        ActiveCountRow(master_id, user_id, int(count or 0), next_start)
+        for master_id, user_id, count, next_start in query.all()
+    ]
+
+
+def store_counts(db: Session, rows: Iterable[ActiveCountRow], now_utc: Optional[datetime] = None) -> int:
+    """Записать счётчики (upsert по master_id; пишет только мониторинг лимитов). Коммит — на вызывающем."""
+    refreshed_at = now_utc or datetime.utcnow()
+    values = [
+        {
+            "master_id": row.master_id,
+            "active_future_bookings": row.active_future_bookings,
+            "next_start_time": row.next_start_time,
+            "refreshed_at": refreshed_at,
+        }
+        for row in rows
+    ]
+    connection = db.connection()
+    dialect = connection.dialect.name
+    for start in range(0, len(values), _CHUNK_SIZE):
+        chunk = values[start:start + _CHUNK_SIZE]
+        if dialect in ("postgresql", "sqlite"):
+            if dialect == "postgresql":
+                from sqlalchemy.dialects.postgresql import insert as dialect_insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert as dialect_insert
+            stmt = dialect_insert(_counts_table).values(chunk)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[_counts_table.c.master_id],
+                set_={k: stmt.excluded[k] for k in chunk[0] if k != "master_id"},
+            )
+            connection.execute(stmt)
+        else:
+            connection.execute(
+                delete(_counts_table).where(_counts_table.c.master_id.in_([v["master_id"] for v in chunk]))
+            )
+            connection.execute(_counts_table.insert(), chunk)
+    return len(values)
+
+
+def _is_fresh(row: Any, now: datetime) -> bool:
+    max_age = timedelta(seconds=get_settings().BOOKING_LIMIT_COUNT_MAX_AGE_SECONDS)
+    if row.refreshed_at is None or row.refreshed_at < now - max_age:
+        return False
+    return row.next_start_time is None or row.next_start_time > now
+
+
+def active_future_bookings_count(db: Session, master: Any, now_utc: Optional[datetime] = None) -> int:
+    """
+    Активные будущие записи мастера: из таблицы, если строка актуальна, иначе подсчёт одного
+    мастера. Только чтение — сессия запроса не пишется и не коммитится.
+    """
+    now = now_utc or datetime.utcnow()
+    row = db.execute(
+        select(
+            _counts_table.c.active_future_bookings,
+            _counts_table.c.next_start_time,
+            _counts_table.c.refreshed_at,
+        ).where(_counts_table.c.master_id == master.id)
+    ).first()
+    if row is not None and _is_fresh(row, now):
+        return int(row.active_future_bookings)
+    counted = grouped_active_future_counts(db, now, Master.id == master.id)
+    return counted[0].active_future_bookings if counted else 0
+
+
+def invalidate_masters(connection, master_ids: Iterable[Optional[int]]) -> None:
+    ids = sorted({m for m in master_ids if m is not None})
+    if ids:
+        connection.execute(delete(_counts_table).where(_counts_table.c.master_id.in_(ids)))
+
+
+def _invalidate_committed(bind: Any, master_ids: Optional[Set[int]]) -> None:
+    """
+    Удалить строки мастеров после коммита брони — своей транзакцией на отдельном соединении.
+    master_ids=None — изменены все брони, удаляются все строки.
+    """
+    engine = bind.engine if isinstance(bind, Connection) else bind
+    try:
+        with engine.begin() as connection:
+            if master_ids is None:
+                connection.execute(delete(_counts_table))
+            else:
+                invalidate_masters(connection, master_ids)
+    except SQLAlchemyError as e:
+        # Строка устареет сама по BOOKING_LIMIT_COUNT_MAX_AGE_SECONDS
+        logger.warning("Не удалось сбросить счётчики активных записей мастеров %s: %s", master_ids, e)
+
+
+# --- Инвалидация по событиям сессии ---
+
+
+_PENDING_MASTERS_KEY = "master_active_bookings_pending_masters"
+# Мастера, чьи брони изменила открытая транзакция: строки сбрасываются после её коммита
+_CHANGED_MASTERS_KEY = "master_active_bookings_changed_masters"
+_CHANGED_ALL_KEY = "master_active_bookings_changed_all"
+
+
+def _count_fields_changed(obj) -> bool:
+    state = inspect(obj)
+    return any(state.attrs[name].history.has_changes() for name in _BOOKING_COUNT_FIELDS)
+
+
+def _masters_of(obj, with_previous: bool) -> Set[int]:
+    masters = {obj.master_id, obj.indie_master_id}
+    if with_previous:
+        state = inspect(obj)
+        for name in ("master_id", "indie_master_id"):
+            hist = state.attrs[name].history
+            masters.update(hist.deleted or ())
+            if hist.has_changes() and not hist.deleted and state.identity:
+                # Значение меняли у выгруженного (expired) атрибута — прежнее берём из БД
+                previous = object_session(obj).connection().execute(
+                    select(_booking_table.c[name]).where(_booking_table.c.id == state.identity[0])
+                ).scalar()
+                masters.add(previous)
+    return {m for m in masters if m is not None}
+
+
+@event.listens_for(Session, "before_flush")
+def _collect_before_flush(session, flush_context, instances):
+    masters: Set[int] = set()
+    for obj in session.deleted:
+        if isinstance(obj, Booking):
+            masters |= _masters_of(obj, with_previous=True)
+    for obj in session.dirty:
+        if isinstance(obj, Booking) and _count_fields_changed(obj):
+            masters |= _masters_of(obj, with_previous=True)
+    if masters:
+        session.info.setdefault(_PENDING_MASTERS_KEY, set()).update(masters)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_after_flush(session, flush_context):
+    masters = session.info.pop(_PENDING_MASTERS_KEY, set())
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Booking) and (obj in session.new or _count_fields_changed(obj)):
+            masters |= _masters_of(obj, with_previous=False)
+    if masters:
+        session.info.setdefault(_CHANGED_MASTERS_KEY, set()).update(masters)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session):
+    masters = session.info.pop(_CHANGED_MASTERS_KEY, None)
+    if session.info.pop(_CHANGED_ALL_KEY, False):
+        _invalidate_committed(session.get_bind(), None)
+    elif masters:
+        _invalidate_committed(session.get_bind(), masters)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session):
+    session.info.pop(_PENDING_MASTERS_KEY, None)
+    session.info.pop(_CHANGED_MASTERS_KEY, None)
+    session.info.pop(_CHANGED_ALL_KEY, None)
+
+
+@on_bulk_booking_write
+def _collect_bulk_write(session, owners):
+    if owners is None:
+        session.info[_CHANGED_ALL_KEY] = True
+        return
+    masters = {m for owner in owners for m in (owner.master_id, owner.indie_master_id) if m is not None}
+    if masters:
+        session.info.setdefault(_CHANGED_MASTERS_KEY, set()).update(masters)
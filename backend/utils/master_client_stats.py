@@ -0,0 +1,333 @@
+"""
+Материализованные агрегаты броней клиента у мастера: строка master_client_stats на пару
+(Booking.master_id, Booking.client_id).
+
+Строка пересчитывается целиком по броням пары в той же транзакции, что и изменение брони:
+события сессии SQLAlchemy ловят создание/удаление брони и смену статуса, времени, услуги,
+суммы, мастера или клиента (accounting update-booking-status, confirm/cancel, финализация
+визита и т.д.). Массовые UPDATE/DELETE через Query/Session.execute тоже учитываются:
+затронутые пары выбирает utils.booking_bulk_writes; запрос по всей таблице броней очищает
+таблицу до пересборки.
+
+Отсутствие строки означает «нет данных» (пара без броней или ещё не заполнена) — читатели
+в этом случае считают по броням. Полное заполнение/пересборка:
+scripts/rebuild_master_client_stats.py.
+Брони только с indie_master_id (legacy) в таблицу не попадают.
+"""
+from __future__ import annotations
+
+import logging
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import delete, event, inspect, select, tuple_, update
+from sqlalchemy.orm import Session, object_session
+
+from models import Booking, BookingStatus, MasterClientStats
+from utils.booking_bulk_writes import on_bulk_booking_write
+
+logger = logging.getLogger(__name__)
+
+CANCELLED_STATUS_VALUES = frozenset(
+    {
+        BookingStatus.CANCELLED.value,
+        BookingStatus.CANCELLED_BY_CLIENT_EARLY.value,
+        BookingStatus.CANCELLED_BY_CLIENT_LATE.value,
+    }
+)
+# Не считаются «записью к мастеру» для first_visit (как в utils.loyalty_discounts)
+INACTIVE_STATUS_VALUES = CANCELLED_STATUS_VALUES | {BookingStatus.PAYMENT_EXPIRED.value}
+
+# Поля брони, от которых зависят агрегаты
+_BOOKING_STATS_FIELDS = (
+    "master_id",
+    "client_id",
+    "status",
+    "service_id",
+    "start_time",
+    "payment_amount",
+    "loyalty_points_used",
+    "cancellation_reason",
+)
+
+_booking_table = Booking.__table__
+_stats_table = MasterClientStats.__table__
+_BOOKING_COLUMNS = (
+    _booking_table.c.master_id,
+    _booking_table.c.client_id,
+    _booking_table.c.status,
+    _booking_table.c.service_id,
+    _booking_table.c.start_time,
+    _booking_table.c.payment_amount,
+    _booking_table.c.loyalty_points_used,
+    _booking_table.c.cancellation_reason,
+)
+
+
+def _status_value(status: Any) -> Optional[str]:
+    return getattr(status, "value", status)
+
+
+def _amount_to_pay(payment_amount: Optional[float], loyalty_points_used: Optional[int]) -> float:
+    """Как booking_amount_to_pay(payment_amount, loyalty_points_used) без цены услуги."""
+    gross = float(payment_amount) if payment_amount is not None and float(payment_amount) > 0 else 0.0
+    return max(0.0, gross - float(loyalty_points_used or 0))
+
+
+class _PairAccumulator:
+    """Свёртка броней одной пары в значения строки master_client_stats."""
+
+    __slots__ = (
+        "completed_count",
+        "cancelled_count",
+        "active_count",
+        "total_revenue",
+        "last_visit_at",
+        "service_counts",
+        "cancellation_counts",
+    )
+
+    def __init__(self) -> None:
+        self.completed_count = 0
+        self.cancelled_count = 0
+        self.active_count = 0
+        self.total_revenue = 0.0
+        self.last_visit_at: Optional[datetime] = None
+        self.service_counts: Dict[str, int] = defaultdict(int)
+        self.cancellation_counts: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+
+    def add(self, row) -> None:
+        status = _status_value(row.status)
+        if status not in INACTIVE_STATUS_VALUES:
+            self.active_count += 1
+        if status == BookingStatus.COMPLETED.value:
+            self.completed_count += 1
+            self.total_revenue += _amount_to_pay(row.payment_amount, row.loyalty_points_used)
+            if row.start_time and (self.last_visit_at is None or row.start_time > self.last_visit_at):
+                self.last_visit_at = row.start_time
+            if row.service_id is not None:
+                self.service_counts[str(row.service_id)] += 1
+        elif status in CANCELLED_STATUS_VALUES:
+            self.cancelled_count += 1
+            if row.cancellation_reason is not None:
+                self.cancellation_counts[status][row.cancellation_reason] += 1
+
+    def values(self, master_id: int, client_id: int, now: datetime) -> Dict[str, Any]:
+        return {
+            "master_id": master_id,
+            "client_id": client_id,
+            "completed_count": self.completed_count,
+            "cancelled_count": self.cancelled_count,
+            "active_count": self.active_count,
+            "total_revenue": self.total_revenue,
+            "last_visit_at": self.last_visit_at,
+            "service_counts": dict(self.service_counts),
+            "cancellation_counts": {k: dict(v) for k, v in self.cancellation_counts.items()},
+            "updated_at": now,
+        }
+
+
+def refresh_pairs(connection, pairs: Iterable[Tuple[int, int]]) -> int:
+    """
+    Пересчитать строки для пар (master_id, client_id) по текущим броням на connection
+    (та же транзакция, что и изменения). Возвращает число пересчитанных пар.
+    """
+    pairs = sorted({(m, c) for m, c in pairs if m is not None and c is not None})
+    if not pairs:
+        return 0
+    accumulators: Dict[Tuple[int, int], _PairAccumulator] = {}
+    rows = connection.execute(
+        select(*_BOOKING_COLUMNS).where(
+            tuple_(_booking_table.c.master_id, _booking_table.c.client_id).in_(pairs)
+        )
+    )
+    for row in rows:
+        key = (row.master_id, row.client_id)
+        acc = accumulators.get(key)
+        if acc is None:
+            acc = accumulators[key] = _PairAccumulator()
+        acc.add(row)
+
+    now = datetime.utcnow()
+    empty = [p for p in pairs if p not in accumulators]
+    if empty:
+        connection.execute(
+            delete(_stats_table).where(
+                tuple_(_stats_table.c.master_id, _stats_table.c.client_id).in_(empty)
+            )
+        )
+    for (master_id, client_id), acc in accumulators.items():
+        _upsert(connection, acc.values(master_id, client_id, now))
+    return len(pairs)
+
+
+def _upsert(connection, values: Dict[str, Any]) -> None:
+    dialect = connection.dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        stmt = dialect_insert(_stats_table).values(**values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[_stats_table.c.master_id, _stats_table.c.client_id],
+            set_={k: stmt.excluded[k] for k in values if k not in ("master_id", "client_id")},
+        )
+        connection.execute(stmt)
+        return
+    result = connection.execute(
+        update(_stats_table)
+        .where(
+            _stats_table.c.master_id == values["master_id"],
+            _stats_table.c.client_id == values["client_id"],
+        )
+        .values(**values)
+    )
+    if not result.rowcount:
+        connection.execute(_stats_table.insert().values(**values))
+
+
+def rebuild_all(db: Session, master_id: Optional[int] = None, chunk_size: int = 1000) -> Dict[str, int]:
+    """
+    Пересобрать таблицу (или строки одного мастера) по всем броням. Коммит — на вызывающем.
+    Брони читаются потоком в порядке (master_id, client_id), строки пишутся пачками.
+    """
+    connection = db.connection()
+    stats_delete = delete(_stats_table)
+    query = select(*_BOOKING_COLUMNS).where(
+        _booking_table.c.master_id.isnot(None),
+        _booking_table.c.client_id.isnot(None),
+    )
+    if master_id is not None:
+        stats_delete = stats_delete.where(_stats_table.c.master_id == master_id)
+        query = query.where(_booking_table.c.master_id == master_id)
+    connection.execute(stats_delete)
+
+    now = datetime.utcnow()
+    batch: List[Dict[str, Any]] = []
+    result = {"pairs": 0, "bookings": 0}
+    current_key: Optional[Tuple[int, int]] = None
+    acc: Optional[_PairAccumulator] = None
+
+    def _flush_batch() -> None:
+        if batch:
+            connection.execute(_stats_table.insert(), batch)
+            batch.clear()
+
+    rows = connection.execution_options(yield_per=chunk_size).execute(
+        query.order_by(_booking_table.c.master_id, _booking_table.c.client_id)
+    )
+    for row in rows:
+        key = (row.master_id, row.client_id)
+        if key != current_key:
+            if acc is not None:
+                batch.append(acc.values(current_key[0], current_key[1], now))
+                result["pairs"] += 1
+                if len(batch) >= chunk_size:
+                    _flush_batch()
+            current_key, acc = key, _PairAccumulator()
+        acc.add(row)
+        result["bookings"] += 1
+    if acc is not None:
+        batch.append(acc.values(current_key[0], current_key[1], now))
+        result["pairs"] += 1
+    _flush_batch()
+    return result
+
+
+def get_client_stats(db: Session, master_id: int, client_id: Optional[int]) -> Optional[MasterClientStats]:
+    """Строка агрегатов пары; None — строки нет (читатель считает по броням)."""
+    if not master_id or not client_id:
+        return None
+    return (
+        db.query(MasterClientStats)
+        .filter(MasterClientStats.master_id == master_id, MasterClientStats.client_id == client_id)
+        .first()
+    )
+
+
+def cancellations_by_reason(stats: MasterClientStats, statuses: Iterable[str]) -> Dict[str, int]:
+    """Отмены с указанной причиной по статусам отмены: {reason: count}."""
+    counts: Dict[str, int] = defaultdict(int)
+    for status in statuses:
+        for reason, cnt in ((stats.cancellation_counts or {}).get(_status_value(status)) or {}).items():
+            counts[reason] += int(cnt)
+    return dict(counts)
+
+
+# --- Поддержание по событиям сессии ---
+
+
+_PENDING_PAIRS_KEY = "master_client_stats_pending_pairs"
+
+
+def _booking_stats_changed(obj) -> bool:
+    state = inspect(obj)
+    return any(state.attrs[name].history.has_changes() for name in _BOOKING_STATS_FIELDS)
+
+
+def _pairs_of(obj, with_previous: bool) -> Set[Tuple[int, int]]:
+    masters = {obj.master_id}
+    clients = {obj.client_id}
+    if with_previous:
+        state = inspect(obj)
+        master_hist = state.attrs["master_id"].history
+        client_hist = state.attrs["client_id"].history
+        masters.update(master_hist.deleted or ())
+        clients.update(client_hist.deleted or ())
+        if (master_hist.has_changes() and not master_hist.deleted) or (
+            client_hist.has_changes() and not client_hist.deleted
+        ):
+            # Значение меняли у выгруженного (expired) атрибута — прежнее берём из БД
+            previous = object_session(obj).connection().execute(
+                select(_booking_table.c.master_id, _booking_table.c.client_id).where(
+                    _booking_table.c.id == state.identity[0]
+                )
+            ).first() if state.identity else None
+            if previous is not None:
+                masters.add(previous.master_id)
+                clients.add(previous.client_id)
+    return {(m, c) for m in masters for c in clients if m is not None and c is not None}
+
+
+@event.listens_for(Session, "before_flush")
+def _collect_before_flush(session, flush_context, instances):
+    # Удаляемые и изменённые брони: прежние пары (строка ещё в БД, атрибуты можно догрузить)
+    pairs: Set[Tuple[int, int]] = set()
+    for obj in session.deleted:
+        if isinstance(obj, Booking):
+            pairs |= _pairs_of(obj, with_previous=True)
+    for obj in session.dirty:
+        if isinstance(obj, Booking) and _booking_stats_changed(obj):
+            pairs |= _pairs_of(obj, with_previous=True)
+    if pairs:
+        session.info.setdefault(_PENDING_PAIRS_KEY, set()).update(pairs)
+
+
+@event.listens_for(Session, "after_flush")
+def _refresh_after_flush(session, flush_context):
+    # Новые и изменённые брони: после flush внешние ключи уже проставлены (в т.ч. через relationship)
+    pairs = session.info.pop(_PENDING_PAIRS_KEY, set())
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Booking) and (obj in session.new or _booking_stats_changed(obj)):
+            pairs |= _pairs_of(obj, with_previous=False)
+    if pairs:
+        refresh_pairs(session.connection(), pairs)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session):
+    session.info.pop(_PENDING_PAIRS_KEY, None)
+
+
+@on_bulk_booking_write
+def _refresh_after_bulk_write(session, owners):
+    connection = session.connection()
+    if owners is None:
+        # Изменены все брони: пересчёт каждой пары здесь не делаем — строки удаляются
+        # (читатели считают по броням) до пересборки scripts/rebuild_master_client_stats.py
+        connection.execute(delete(_stats_table))
+        logger.warning("Массовое изменение всех броней: master_client_stats очищена, нужна пересборка")
+        return
+    refresh_pairs(connection, {(o.master_id, o.client_id) for o in owners})
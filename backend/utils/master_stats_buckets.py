@@ -0,0 +1,153 @@
+"""
+Агрегация броней по календарным bucket'ам статистики одним SQL-запросом.
+
+Диапазоны (start_date, end_date включительно) — те же, что строит master_stats_periods:
+столбики графика, текущий/предыдущий период, тренды, детализация по дням/неделям.
+Диапазоны могут перекрываться (неделя и её дни), поэтому границы всех диапазонов
+режутся на непересекающиеся элементарные интервалы; SQL группирует по
+(интервал через CASE, статус, start_time >= now), а итог каждого диапазона собирается
+в Python суммой его интервалов. Один round-trip на весь экран вместо запроса на bucket.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, case, func, literal, or_
+from sqlalchemy.orm import Session
+
+from models import Booking, Service
+
+# Бронь после последнего диапазона (KPI «будущие записи»)
+TAIL_BUCKET = -1
+
+
+@dataclass
+class StatusTotals:
+    """Количество и сумма по одному статусу; future_* — только start_time >= now."""
+
+    count: int = 0
+    amount: float = 0.0
+    future_count: int = 0
+    future_amount: float = 0.0
+
+    @property
+    def past_count(self) -> int:
+        return self.count - self.future_count
+
+    @property
+    def past_amount(self) -> float:
+        return self.amount - self.future_amount
+
+
+BucketTotals = Dict[str, StatusTotals]
+
+
+def _day_start(d: date) -> datetime:
+    return datetime.combine(d, datetime.min.time())
+
+
+def _elementary_intervals(ranges: Sequence[Tuple[date, date]]) -> List[Tuple[datetime, datetime]]:
+    """Непересекающиеся [start, end) из всех границ; только покрытые хотя бы одним диапазоном."""
+    cuts = sorted({_day_start(s) for s, _ in ranges} | {_day_start(e + timedelta(days=1)) for _, e in ranges})
+    covered = [(_day_start(s), _day_start(e + timedelta(days=1))) for s, e in ranges]
+    return [
+        (lo, hi)
+        for lo, hi in zip(cuts, cuts[1:])
+        if any(rs <= lo and hi <= re for rs, re in covered)
+    ]
+
+
+def sum_totals(parts: Iterable[BucketTotals]) -> BucketTotals:
+    out: BucketTotals = {}
+    for part in parts:
+        for status, t in part.items():
+            acc = out.setdefault(status, StatusTotals())
+            acc.count += t.count
+            acc.amount += t.amount
+            acc.future_count += t.future_count
+            acc.future_amount += t.future_amount
+    return out
+
+
+def aggregate_status_buckets(
+    db: Session,
+    booking_filter: Any,
+    ranges: Sequence[Tuple[date, date]],
+    amount_expr: Any,
+    *,
+    now_utc: Optional[datetime] = None,
+    tail_after: Optional[date] = None,
+) -> Tuple[List[BucketTotals], BucketTotals]:
+    """
+    Итоги по статусам для каждого диапазона ranges (в том же порядке) и для «хвоста» —
+    броней после конца дня tail_after (если задан; не раньше конца последнего диапазона).
+
+    amount_expr — SQL-сумма строки брони (Service присоединён outer join'ом), например
+    booking_real_money_sql. now_utc задаёт разбиение на прошлое/будущее в StatusTotals.
+    """
+    intervals = _elementary_intervals(ranges) if ranges else []
+    whens = [
+        (and_(Booking.start_time >= lo, Booking.start_time < hi), idx)
+        for idx, (lo, hi) in enumerate(intervals)
+    ]
+    window = [and_(Booking.start_time >= lo, Booking.start_time < hi) for lo, hi in intervals]
+    if tail_after is not None:
+        if ranges and tail_after < max(e for _, e in ranges):
+            raise ValueError("tail_after must not precede the end of the last range")
+        tail_start = _day_start(tail_after + timedelta(days=1))
+        whens.append((Booking.start_time >= tail_start, TAIL_BUCKET))
+        window.append(Booking.start_time >= tail_start)
+
+    per_interval: List[BucketTotals] = [{} for _ in intervals]
+    tail: BucketTotals = {}
+    if not whens:
+        return [{} for _ in ranges], tail
+
+    bucket_col = case(*whens, else_=None).label("bucket")
+    future_col = (
+        case((Booking.start_time >= now_utc, 1), else_=0) if now_utc is not None else literal(0)
+    ).label("is_future")
+    rows = (
+        db.query(
+            bucket_col,
+            Booking.status,
+            future_col,
+            func.count(Booking.id),
+            func.coalesce(func.sum(amount_expr), 0),
+        )
+        .outerjoin(Service, Booking.service_id == Service.id)
+        .filter(booking_filter, or_(*window))
+        .group_by(bucket_col, Booking.status, future_col)
+        .all()
+    )
+    for bucket, status, is_future, count, amount in rows:
+        if bucket is None:
+            continue
+        target = tail if int(bucket) == TAIL_BUCKET else per_interval[int(bucket)]
+        key = status.value if hasattr(status, "value") else str(status)
+        acc = target.setdefault(key, StatusTotals())
+        acc.count += int(count or 0)
+        acc.amount += float(amount or 0)
+        if is_future:
+            acc.future_count += int(count or 0)
+            acc.future_amount += float(amount or 0)
+
+    results: List[BucketTotals] = []
+    for s, e in ranges:
+        rs, re = _day_start(s), _day_start(e + timedelta(days=1))
+        results.append(
+            sum_totals(per_interval[i] for i, (lo, hi) in enumerate(intervals) if rs <= lo and hi <= re)
+        )
+    return results, tail
+
+
+def count_of(totals: BucketTotals, statuses: Optional[Iterable[str]] = None) -> int:
+    if statuses is None:
+        return sum(t.count for t in totals.values())
+    return sum(totals[s].count for s in statuses if s in totals)
+
+
+def amount_of(totals: BucketTotals, statuses: Iterable[str]) -> float:
+    return sum(totals[s].amount for s in statuses if s in totals)
@@ -16,10 +16,13 @@
 from __future__ import annotations
 
 from datetime import datetime
-from typing import Any, Dict, List
+from typing import TYPE_CHECKING, Any, Dict, List
 
 from models import Booking, BookingStatus
 
+if TYPE_CHECKING:
+    from utils.master_stats_buckets import BucketTotals
+
 
 def _dash_excluded_status_values() -> frozenset:
     return frozenset(
@@ -93,3 +96,33 @@ def aggregate_extended_period_summary(bookings: List[Booking], now_utc: datetime
         "upcoming": {"revenue": upcoming_rub, "bookings_count": upcoming_n},
         "period_total": {"revenue": total_rub, "bookings_count": total_n},
     }
+
+
+def extended_period_summary_from_totals(totals: "BucketTotals") -> Dict[str, Any]:
+    """
+    То же, что aggregate_extended_period_summary, но из SQL-итогов по статусам
+    (utils.master_stats_buckets) — без загрузки броней. Сумма строки — booking_gross_amount_sql.
+    """
+    excluded = _dash_excluded_status_values()
+    factual_ok = _factual_status_values()
+    out = {
+        "factual": {"revenue": 0.0, "bookings_count": 0},
+        "plan": {"revenue": 0.0, "bookings_count": 0},
+        "upcoming": {"revenue": 0.0, "bookings_count": 0},
+        "period_total": {"revenue": 0.0, "bookings_count": 0},
+    }
+
+    def _add(key: str, revenue: float, count: int) -> None:
+        out[key]["revenue"] += revenue
+        out[key]["bookings_count"] += count
+
+    for sv, t in totals.items():
+        if sv in excluded:
+            continue
+        _add("period_total", t.amount, t.count)
+        _add("plan", t.future_amount, t.future_count)
+        if sv == BookingStatus.CONFIRMED.value:
+            _add("upcoming", t.future_amount, t.future_count)
+        if sv in factual_ok:
+            _add("factual", t.past_amount, t.past_count)
+    return out
@@ -0,0 +1,146 @@
+"""
+Хэширование и проверка паролей (bcrypt через passlib) в отдельном ограниченном пуле.
+
+bcrypt занимает поток на 100–300 мс. Без ограничения всплеск входов занимает все потоки
+threadpool FastAPI (sync-эндпоинты) или блокирует event loop (async-эндпоинты), и остальные
+запросы API ждут. PasswordHasher:
+
+- выполняет bcrypt в своём пуле на PASSWORD_HASH_WORKERS потоков — одновременно не больше
+  стольких хэшей, остальные ждут в очереди;
+- ограничивает очередь (PASSWORD_HASH_MAX_QUEUE): при переполнении сразу бросает
+  PasswordHashingBusy (auth превращает в 503), а не держит поток запроса;
+- для async-эндпоинтов — hash_async/verify_async: ожидание без блокировки event loop;
+- метрики (в работе, в очереди, пик очереди, отказы, среднее ожидание) — metrics(),
+  отдаются в GET /api/admin/password-hashing.
+
+Стоимость bcrypt — PASSWORD_BCRYPT_ROUNDS. verify_and_update возвращает новый хэш, если
+сохранённый посчитан с другой стоимостью: вход прозрачно перехэширует пароль.
+"""
+from __future__ import annotations
+
+import asyncio
+import threading
+import time as time_module
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from passlib.context import CryptContext
+
+from settings import get_settings
+
+
+class PasswordHashingBusy(Exception):
+    """Очередь хэширования переполнена."""
+
+
+def build_crypt_context(rounds: Optional[int] = None) -> CryptContext:
+    return CryptContext(
+        schemes=["bcrypt"],
+        deprecated="auto",
+        bcrypt__rounds=rounds or get_settings().PASSWORD_BCRYPT_ROUNDS,
+    )
+
+
+class PasswordHasher:
+    def __init__(
+        self,
+        context: Optional[CryptContext] = None,
+        max_workers: Optional[int] = None,
+        max_queue: Optional[int] = None,
+    ) -> None:
+        self.context = context or build_crypt_context()
+        self._max_workers = max_workers
+        self._max_queue = max_queue
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._in_flight = 0  # в работе + в очереди
+        self._running = 0
+        self._peak_queued = 0
+        self._completed = 0
+        self._rejected = 0
+        self._wait_seconds_total = 0.0
+
+    def _limits(self) -> Tuple[int, int]:
+        settings = get_settings()
+        workers = self._max_workers or max(1, settings.PASSWORD_HASH_WORKERS)
+        max_queue = self._max_queue if self._max_queue is not None else max(0, settings.PASSWORD_HASH_MAX_QUEUE)
+        return workers, max_queue
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                workers, _ = self._limits()
+                self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pwd-hash")
+            return self._executor
+
+    def _submit(self, fn: Callable[..., Any], *args: Any) -> Future:
+        workers, max_queue = self._limits()
+        with self._lock:
+            if self._in_flight >= workers + max_queue:
+                self._rejected += 1
+                raise PasswordHashingBusy("password hashing queue is full")
+            self._in_flight += 1
+            self._peak_queued = max(self._peak_queued, self._in_flight - workers)
+        submitted = time_module.monotonic()
+
+        def _run() -> Any:
+            with self._lock:
+                self._running += 1
+                self._wait_seconds_total += time_module.monotonic() - submitted
+            try:
+                return fn(*args)
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._in_flight -= 1
+                    self._completed += 1
+
+        try:
+            return self._pool().submit(_run)
+        except Exception:
+            with self._lock:
+                self._in_flight -= 1
+            raise
+
+    # --- sync (вызов из sync-эндпоинтов и скриптов) ---
+
+    def hash(self, password: str) -> str:
+        return self._submit(self.context.hash, password).result()
+
+    def verify(self, password: str, hashed: str) -> bool:
+        return self._submit(self.context.verify, password, hashed).result()
+
+    def verify_and_update(self, password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+        """(пароль верен, новый хэш или None, если перехэширование не нужно)."""
+        return self._submit(self.context.verify_and_update, password, hashed).result()
+
+    # --- async (event loop не блокируется) ---
+
+    async def hash_async(self, password: str) -> str:
+        return await asyncio.wrap_future(self._submit(self.context.hash, password))
+
+    async def verify_async(self, password: str, hashed: str) -> bool:
+        return await asyncio.wrap_future(self._submit(self.context.verify, password, hashed))
+
+    def metrics(self) -> Dict[str, Any]:
+        workers, max_queue = self._limits()
+        with self._lock:
+            return {
+                "workers": workers,
+                "max_queue": max_queue,
+                "running": self._running,
+                "queued": max(0, self._in_flight - self._running),
+                "peak_queued": self._peak_queued,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "avg_wait_ms": round(self._wait_seconds_total / self._completed * 1000, 2) if self._completed else 0.0,
+            }
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+password_hasher = PasswordHasher()
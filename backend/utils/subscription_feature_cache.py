@@ -0,0 +1,99 @@
+"""
+Кэш разрешённого плана пользователя для feature gating: (user_id, subscription_type) → ResolvedPlan
+(utils.subscription_features.resolve_plan_access).
+
+Два уровня:
+- мемо запроса — session.info сессии (get_db: одна сессия на запрос); несколько проверок
+  функций в одном запросе разрешают план один раз. Сбрасывается на commit/rollback сессии;
+- процессный TTL-кэш (PLAN_FEATURE_CACHE_TTL_SECONDS, 0 — выключен). Запись живёт не дольше
+  end_date найденной подписки — истечение по времени видно сразу.
+
+Инвалидация — после commit (utils.generational_cache.CommitInvalidation): запись/удаление Subscription
+(оформление, апгрейд, заморозка, истечение, списания) сбрасывает пользователя; изменение
+User.is_always_free — тоже; изменение SubscriptionPlan (routers/subscription_plans.py) и
+массовые UPDATE/DELETE по Subscription/SubscriptionPlan очищают кэш целиком.
+Пока в сессии есть незакоммиченные изменения подписок пользователя, кэш для неё не используется.
+"""
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Any, Callable, Hashable, Optional, Set, Tuple
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import Session
+
+from models import Subscription, SubscriptionPlan, User
+from utils.generational_cache import CommitInvalidation, GenerationalCache, attr_values
+
+_MEMO_KEY = "subscription_feature_cache_memo"
+
+
+class PlanFeatureCache(GenerationalCache):
+    """Разрешённые планы по пользователю (владелец — user_id, подключ — тип подписки)."""
+
+    def __init__(self, max_entries: int = 10000):
+        super().__init__("PLAN_FEATURE_CACHE_TTL_SECONDS", max_entries)
+
+    def get_or_resolve(
+        self,
+        db: Session,
+        user_id: int,
+        key: Hashable,
+        resolve: Callable[[], Any],
+        valid_until: Callable[[Any], Optional[datetime]],
+    ) -> Any:
+        """
+        Значение для (user_id, key): мемо сессии → процессный кэш → resolve().
+        valid_until(value) — момент (UTC), после которого значение устаревает независимо от TTL.
+        """
+        if plan_feature_invalidation.is_dirty(db, user_id):
+            return resolve()
+        memo_key = (user_id, key)
+        memo = db.info.setdefault(_MEMO_KEY, {})
+        if memo_key in memo:
+            return memo[memo_key]
+        if not self.enabled():
+            value = memo[memo_key] = resolve()
+            return value
+
+        found, value = self.lookup(user_id, key)
+        if found:
+            memo[memo_key] = value
+            return value
+        token = self.generation(user_id)
+        value = memo[memo_key] = resolve()
+        until = valid_until(value)
+        max_age = (until - datetime.utcnow()).total_seconds() if until is not None else None
+        self.put(user_id, key, value, token, max_age=max_age)
+        return value
+
+
+plan_feature_cache = PlanFeatureCache()
+
+
+# --- Инвалидация по событиям сессии ---
+
+
+def _collect_changes(session: Session) -> Tuple[Set[int], bool]:
+    users: Set[int] = set()
+    clear = False
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Subscription):
+            users.update(attr_values(obj, "user_id"))
+        elif isinstance(obj, User) and obj not in session.new:
+            if obj in session.deleted or inspect(obj).attrs["is_always_free"].history.has_changes():
+                users.add(obj.id)
+        elif isinstance(obj, SubscriptionPlan) and obj not in session.new:
+            clear = True
+    return users, clear
+
+
+plan_feature_invalidation = CommitInvalidation(
+    "subscription_feature_cache",
+    _collect_changes,
+    plan_feature_cache.invalidate,
+    plan_feature_cache.clear,
+    clear_on_bulk=(Subscription, SubscriptionPlan, User),
+    # Мемо запроса живёт до конца транзакции
+    session_keys=(_MEMO_KEY,),
+)
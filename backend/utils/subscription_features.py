@@ -1,10 +1,13 @@
+import copy
 import logging
+from dataclasses import dataclass
 from typing import Optional, Dict, Any
 from sqlalchemy.orm import Session
 from sqlalchemy import and_
 
 from models import User, Subscription, SubscriptionPlan, SubscriptionType, SubscriptionStatus
 from datetime import datetime
+from utils.subscription_feature_cache import plan_feature_cache
 
 logger = logging.getLogger(__name__)
 
@@ -170,6 +173,72 @@ def get_subscription_plan(db: Session, plan_id: Optional[int]) -> Optional[Subsc
     return db.query(SubscriptionPlan).filter(SubscriptionPlan.id == plan_id).first()
 
 
+@dataclass(frozen=True)
+class PlanSnapshot:
+    id: int
+    name: str
+    features: Dict[str, Any]
+    limits: Dict[str, Any]
+
+    @classmethod
+    def of(cls, plan: SubscriptionPlan) -> "PlanSnapshot":
+        return cls(plan.id, plan.name, copy.deepcopy(plan.features or {}), copy.deepcopy(plan.limits or {}))
+
+    def service_function_ids(self) -> list:
+        return self.features.get("service_functions", []) or []
+
+
+@dataclass(frozen=True)
+class ResolvedPlan:
+    """Итог разрешения подписки и плана пользователя — всё, что нужно проверкам функций."""
+
+    has_subscription: bool
+    subscription_plan_id: Optional[int]
+    subscription_end_date: Optional[datetime]
+    is_always_free: bool
+    plan: Optional[PlanSnapshot]
+    # План AlwaysFree — только для is_always_free без плана подписки
+    always_free_plan: Optional[PlanSnapshot] = None
+
+
+def _resolve_plan_uncached(db: Session, user_id: int, subscription_type: SubscriptionType) -> ResolvedPlan:
+    subscription = get_user_subscription_with_plan(db, user_id, subscription_type)
+    is_always_free = bool(db.query(User.is_always_free).filter(User.id == user_id).scalar())
+    plan = get_subscription_plan(db, subscription.plan_id) if subscription else None
+    always_free_plan = None
+    if plan is None and is_always_free:
+        always_free_plan = db.query(SubscriptionPlan).filter(
+            SubscriptionPlan.name == 'AlwaysFree',
+            SubscriptionPlan.subscription_type == subscription_type
+        ).first()
+    return ResolvedPlan(
+        has_subscription=subscription is not None,
+        subscription_plan_id=subscription.plan_id if subscription else None,
+        subscription_end_date=subscription.end_date if subscription else None,
+        is_always_free=is_always_free,
+        plan=PlanSnapshot.of(plan) if plan else None,
+        always_free_plan=PlanSnapshot.of(always_free_plan) if always_free_plan else None,
+    )
+
+
+def resolve_plan_access(
+    db: Session,
+    user_id: int,
+    subscription_type: SubscriptionType = SubscriptionType.MASTER,
+) -> ResolvedPlan:
+    """
+    Подписка и план пользователя для проверок функций: мемо запроса и процессный TTL-кэш
+    (utils.subscription_feature_cache), без запросов к БД при повторных проверках.
+    """
+    return plan_feature_cache.get_or_resolve(
+        db,
+        user_id,
+        subscription_type,
+        lambda: _resolve_plan_uncached(db, user_id, subscription_type),
+        lambda resolved: resolved.subscription_end_date,
+    )
+
+
 def check_feature_access(db: Session, user_id: int, feature_key: str, subscription_type: SubscriptionType = SubscriptionType.MASTER) -> bool:
     """
     Проверить доступ к конкретной функции.
@@ -183,23 +252,20 @@ def check_feature_access(db: Session, user_id: int, feature_key: str, subscripti
     Returns:
         True если функция доступна, False иначе
     """
-    subscription = get_user_subscription_with_plan(db, user_id, subscription_type)
-    if not subscription:
+    resolved = resolve_plan_access(db, user_id, subscription_type)
+    if not resolved.has_subscription:
         return False
     
     # Всегда бесплатные пользователи имеют доступ ко всем функциям
-    user = db.query(User).filter(User.id == user_id).first()
-    if user and user.is_always_free:
+    if resolved.is_always_free:
         return True
     
-    # Получаем план подписки
-    plan = get_subscription_plan(db, subscription.plan_id)
-    if not plan:
+    # План подписки
+    if not resolved.plan:
         return False
     
     # Проверяем функцию через service_functions
-    features = plan.features or {}
-    service_function_ids = features.get("service_functions", [])
+    service_function_ids = resolved.plan.service_function_ids()
     
     # Если есть service_functions, проверяем через них
     if service_function_ids and feature_key in FEATURE_TO_SERVICE_FUNCTION:
@@ -210,6 +276,40 @@ def check_feature_access(db: Session, user_id: int, feature_key: str, subscripti
     return False
 
 
+def _plan_features(plan: PlanSnapshot) -> Dict[str, Any]:
+    features = plan.features
+    limits = plan.limits
+    
+    # Получаем список service_functions из плана
+    service_function_ids = plan.service_function_ids()
+    
+    # Проверяем безлимитные записи через limits
+    max_future_bookings = limits.get("max_future_bookings")
+    has_unlimited_bookings = max_future_bookings is None or max_future_bookings == 0
+    
+    # stats_retention_days: 0 или None означает бесконечное хранение
+    retention_days = features.get("stats_retention_days")
+    if retention_days is None or retention_days == 0:
+        retention_days = 0  # 0 = бесконечное хранение
+    else:
+        retention_days = int(retention_days)
+    
+    return {
+        "has_booking_page": 1 in service_function_ids,
+        "has_unlimited_bookings": has_unlimited_bookings,
+        "has_extended_stats": 2 in service_function_ids,
+        "has_loyalty_access": 3 in service_function_ids,
+        "has_finance_access": 4 in service_function_ids,
+        "has_client_restrictions": 5 in service_function_ids,
+        "can_customize_domain": 6 in service_function_ids,
+        "has_clients_access": 7 in service_function_ids,
+        "max_page_modules": features.get("max_page_modules", 0),
+        "stats_retention_days": retention_days,
+        "plan_name": plan.name,
+        "plan_id": plan.id
+    }
+
+
 def get_master_features(db: Session, user_id: int) -> Dict[str, Any]:
     """
     Получить все доступные функции мастера.
@@ -217,99 +317,16 @@ def get_master_features(db: Session, user_id: int) -> Dict[str, Any]:
     Returns:
         Словарь с информацией о функциях и их доступности
     """
-    subscription = get_user_subscription_with_plan(db, user_id, SubscriptionType.MASTER)
-    user = db.query(User).filter(User.id == user_id).first()
+    resolved = resolve_plan_access(db, user_id, SubscriptionType.MASTER)
     
     # Если есть подписка, используем её (включая подписки для is_always_free)
-    if subscription and subscription.plan_id:
-        plan = get_subscription_plan(db, subscription.plan_id)
-        if plan:
-            features = plan.features or {}
-            limits = plan.limits or {}
-            
-            # Получаем список service_functions из плана
-            service_function_ids = features.get("service_functions", [])
-            
-            # Проверяем наличие service_functions
-            has_booking_page = 1 in service_function_ids
-            has_extended_stats = 2 in service_function_ids
-            has_loyalty_access = 3 in service_function_ids
-            has_finance_access = 4 in service_function_ids
-            has_client_restrictions = 5 in service_function_ids
-            can_customize_domain = 6 in service_function_ids
-            has_clients_access = 7 in service_function_ids
-            
-            # Проверяем безлимитные записи через limits
-            max_future_bookings = limits.get("max_future_bookings")
-            has_unlimited_bookings = max_future_bookings is None or max_future_bookings == 0
-            
-            # stats_retention_days: 0 или None означает бесконечное хранение
-            retention_days = features.get("stats_retention_days")
-            if retention_days is None or retention_days == 0:
-                retention_days = 0  # 0 = бесконечное хранение
-            else:
-                retention_days = int(retention_days)
-            
-            return {
-                "has_booking_page": has_booking_page,
-                "has_unlimited_bookings": has_unlimited_bookings,
-                "has_extended_stats": has_extended_stats,
-                "has_loyalty_access": has_loyalty_access,
-                "has_finance_access": has_finance_access,
-                "has_client_restrictions": has_client_restrictions,
-                "can_customize_domain": can_customize_domain,
-                "has_clients_access": has_clients_access,
-                "max_page_modules": features.get("max_page_modules", 0),
-                "stats_retention_days": retention_days,
-                "plan_name": plan.name,
-                "plan_id": plan.id
-            }
+    if resolved.subscription_plan_id and resolved.plan:
+        return _plan_features(resolved.plan)
     
     # Если подписки нет, но пользователь is_always_free, возвращаем функции плана AlwaysFree
-    if user and user.is_always_free:
-        # Пытаемся найти план AlwaysFree
-        from models import SubscriptionPlan
-        always_free_plan = db.query(SubscriptionPlan).filter(
-            SubscriptionPlan.name == 'AlwaysFree',
-            SubscriptionPlan.subscription_type == SubscriptionType.MASTER
-        ).first()
-        
-        if always_free_plan:
-            features = always_free_plan.features or {}
-            limits = always_free_plan.limits or {}
-            service_function_ids = features.get("service_functions", [])
-            
-            has_booking_page = 1 in service_function_ids
-            has_extended_stats = 2 in service_function_ids
-            has_loyalty_access = 3 in service_function_ids
-            has_finance_access = 4 in service_function_ids
-            has_client_restrictions = 5 in service_function_ids
-            can_customize_domain = 6 in service_function_ids
-            has_clients_access = 7 in service_function_ids
-            
-            max_future_bookings = limits.get("max_future_bookings")
-            has_unlimited_bookings = max_future_bookings is None or max_future_bookings == 0
-            
-            retention_days = features.get("stats_retention_days")
-            if retention_days is None or retention_days == 0:
-                retention_days = 0
-            else:
-                retention_days = int(retention_days)
-            
-            return {
-                "has_booking_page": has_booking_page,
-                "has_unlimited_bookings": has_unlimited_bookings,
-                "has_extended_stats": has_extended_stats,
-                "has_loyalty_access": has_loyalty_access,
-                "has_finance_access": has_finance_access,
-                "has_client_restrictions": has_client_restrictions,
-                "can_customize_domain": can_customize_domain,
-                "has_clients_access": has_clients_access,
-                "max_page_modules": features.get("max_page_modules", 0),
-                "stats_retention_days": retention_days,
-                "plan_name": always_free_plan.name,
-                "plan_id": always_free_plan.id
-            }
+    if resolved.is_always_free:
+        if resolved.always_free_plan:
+            return _plan_features(resolved.always_free_plan)
         
         # Fallback: если план AlwaysFree не найден, возвращаем максимальные функции
         return {
@@ -357,20 +374,17 @@ def has_unlimited_bookings(db: Session, user_id: int) -> bool:
     Проверить доступ к безлимитным записям.
     Проверяется через limits.max_future_bookings (null или 0 = безлимит).
     """
-    subscription = get_user_subscription_with_plan(db, user_id, SubscriptionType.MASTER)
-    if not subscription or not subscription.plan_id:
+    resolved = resolve_plan_access(db, user_id, SubscriptionType.MASTER)
+    if not resolved.has_subscription or not resolved.subscription_plan_id:
         return False
     
-    user = db.query(User).filter(User.id == user_id).first()
-    if user and user.is_always_free:
+    if resolved.is_always_free:
         return True
     
-    plan = get_subscription_plan(db, subscription.plan_id)
-    if not plan:
+    if not resolved.plan:
         return False
     
-    limits = plan.limits or {}
-    max_future_bookings = limits.get("max_future_bookings")
+    max_future_bookings = resolved.plan.limits.get("max_future_bookings")
     return max_future_bookings is None or max_future_bookings == 0
 
 